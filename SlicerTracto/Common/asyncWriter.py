@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+DEFAULT_WRITER_THREADS = 2
+
+
+class AsyncWriter:
+    """
+    Write outputs on background threads while the caller keeps computing.
+
+    Compressing a `.nii.gz` is mostly zlib work, which runs without the GIL,
+    so writes overlap with the next processing step. Arrays handed to the
+    writer must not be modified afterwards. `wait()` blocks until everything
+    submitted so far is on disk and re-raises the first error.
+
+    Use as a context manager to wait for (and close) the writer on exit.
+    """
+
+    def __init__(self, nbThreads=DEFAULT_WRITER_THREADS):
+        self._executor = ThreadPoolExecutor(nbThreads, thread_name_prefix="SlicerTractoWriter")
+        self._futures = []
+
+    def submit(self, function, *args, **kwargs):
+        future = self._executor.submit(function, *args, **kwargs)
+        self._futures.append(future)
+        return future
+
+    def saveNifti(self, data, affine, outputPath, dtype=None, header=None):
+        """Save an array as a NIfTI image (cast to `dtype` on the writer thread)."""
+        def _save():
+            array = data if dtype is None else np.asarray(data).astype(dtype)
+            nib.save(nib.Nifti1Image(array, affine, header), outputPath)
+            print(f"[SLICER TRACTO]Wrote {outputPath}")
+        return self.submit(_save)
+
+    def saveText(self, array, outputPath, fmt="%.18e"):
+        return self.submit(np.savetxt, outputPath, array, fmt=fmt)
+
+    def wait(self):
+        futures, self._futures = self._futures, []
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            # Do not hide the original error behind a write error
+            try:
+                self.close()
+            except Exception as error:
+                print(f"[SLICER TRACTO][ERROR]Could not write an output: {error}")
+        return False
@@ -0,0 +1,131 @@
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+
+DEFAULT_VOXELS_PER_CHUNK = 4_096
+# Coefficients of SH orders 0 to 4, used for the first (smooth) estimate
+LOW_ORDER_COEFFS = 15
+CHOLESKY_MU = 1e-5
+
+
+def batchedCsdeconv(signals, X, B_reg, tau=0.1, convergence=50, P=None):
+    """
+    Constrained spherical deconvolution of many voxels at once.
+
+    Same iterations as dipy's `csdeconv`, run on a `(N, directions)` matrix
+    instead of one voxel: the unconstrained solution of every voxel comes
+    from one Cholesky factorization of `P`, and each iteration builds the
+    systems `P + H^T H` of all unconverged voxels with one matrix product
+    (the rows of `H` are the negative directions of the voxel, so `H^T H`
+    is a sum of precomputed outer products of rows of `B_reg`) and solves
+    them in one batched call. Voxels leave the batch as soon as their set
+    of negative directions stops changing.
+
+    Parameters
+    ----------
+    signals : (N, D) ndarray
+        Diffusion-weighted signal of the voxels (b0 volumes removed).
+    X : (D, C) ndarray
+        Prediction matrix (`model._X`).
+    B_reg : (V, C) ndarray
+        SH basis on the regularization sphere, scaled by lambda.
+    tau : float
+        Threshold on the fODF amplitude, relative to its mean.
+    convergence : int
+        Maximum number of iterations.
+    P : (C, C) ndarray, optional
+        `X.T @ X`.
+
+    Returns
+    -------
+    shm_coeff : (N, C) ndarray
+    nbIterations : (N,) int ndarray
+    """
+    X = np.asarray(X, dtype=np.float64)
+    B_reg = np.asarray(B_reg, dtype=np.float64)
+    if P is None:
+        P = np.dot(X.T, X)
+    nbCoeffs = P.shape[0]
+    z = np.dot(np.asarray(signals, dtype=np.float64), X)
+
+    try:
+        factor = cho_factor(P, lower=False)
+    except LinAlgError:
+        P = P + CHOLESKY_MU * np.eye(nbCoeffs)
+        factor = cho_factor(P, lower=False)
+    fodf_sh = cho_solve(factor, z.T).T
+    nbIterations = np.zeros(len(z), dtype=int)
+
+    # Smooth first estimate from the orders up to 4, then the full order
+    # for the voxels without any amplitude below the threshold
+    threshold = (B_reg[0, 0] * tau * fodf_sh[:, 0])[:, None]
+    small = np.dot(fodf_sh[:, :LOW_ORDER_COEFFS], B_reg[:, :LOW_ORDER_COEFFS].T) < threshold
+    noneSmall = np.flatnonzero(~small.any(axis=1))
+    if len(noneSmall):
+        small[noneSmall] = np.dot(fodf_sh[noneSmall], B_reg.T) < threshold[noneSmall]
+
+    active = np.flatnonzero(small.any(axis=1))
+    if len(active) == 0:
+        return fodf_sh, nbIterations
+
+    # H^T H = sum over the small directions v of outer(B_reg[v], B_reg[v])
+    outerProducts = (B_reg[:, :, None] * B_reg[:, None, :]).reshape(len(B_reg), -1)
+    for iteration in range(1, convergence + 1):
+        Q = P.ravel() + np.dot(small[active].astype(np.float64), outerProducts)
+        Q = Q.reshape(-1, nbCoeffs, nbCoeffs)
+        fodf_sh[active] = np.linalg.solve(Q, z[active][:, :, None])[:, :, 0]
+        nbIterations[active] = iteration
+
+        newSmall = np.dot(fodf_sh[active], B_reg.T) < threshold[active]
+        changed = np.any(newSmall != small[active], axis=1)
+        small[active] = newSmall
+        active = active[changed]
+        if len(active) == 0:
+            break
+    else:
+        warnings.warn(f"maximum number of iterations exceeded - {len(active)} voxels failed to converge",
+                      stacklevel=2)
+    return fodf_sh, nbIterations
+
+
+def fitCsd(model, data, voxelsPerChunk=DEFAULT_VOXELS_PER_CHUNK, nbThreads=None):
+    """
+    SH coefficients of a `ConstrainedSphericalDeconvModel` for `(N, volumes)` voxels.
+
+    Replacement for `fit_from_model(model, data).shm_coeff` on gathered
+    voxels (see `maskedVoxels.MaskedVoxels`). The response, the matrices and
+    the regularization sphere are taken from the model, so they are built
+    once; chunks of voxels go through `batchedCsdeconv` on a thread pool
+    (numpy and LAPACK release the GIL).
+
+    On one core against dipy 1.12 it is only about 1.2x faster at SH order
+    6 and about as fast at order 8 on real data (`benchmarkFodfEngines.py`):
+    building `H^T H` costs `C^2` per direction, so the gain of batching
+    shrinks as the order grows.
+
+    Returns
+    -------
+    (N, C) ndarray
+    """
+    data = np.asarray(data)
+    signals = data[:, model._where_dwi]
+    shm_coeff = np.zeros((len(data), model._X.shape[1]))
+
+    def processChunk(start):
+        chunk = slice(start, start + voxelsPerChunk)
+        shm_coeff[chunk], _ = batchedCsdeconv(signals[chunk], model._X, model.B_reg, tau=model.tau,
+                                              convergence=model.convergence, P=model._P)
+
+    starts = range(0, len(data), voxelsPerChunk)
+    nbThreads = nbThreads or os.cpu_count() or 1
+    if nbThreads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(min(nbThreads, len(starts))) as executor:
+            # Consume the results to re-raise errors from the workers
+            list(executor.map(processChunk, starts))
+    else:
+        for start in starts:
+            processChunk(start)
+    return shm_coeff
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import tempfile
+
+HASH_BLOCK_SIZE = 1 << 20
+HASH_INDEX_FILE_NAME = "hashes.json"
+
+
+def fileContentHash(path, blockSize=HASH_BLOCK_SIZE):
+    """SHA-256 of the bytes of a file, read block by block."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blockSize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class HashIndex:
+    """
+    Content hashes of files, remembered per (path, size, mtime) in a JSON file.
+
+    Unchanged files are therefore only hashed once, even across sessions.
+    The index file is replaced atomically, so several processes can share it
+    (at worst a hash is computed twice).
+    """
+
+    def __init__(self, folder, fileName=HASH_INDEX_FILE_NAME):
+        self.folder = folder
+        self.indexPath = os.path.join(folder, fileName)
+        self._hashes = None
+
+    def contentHash(self, path):
+        stat = os.stat(path)
+        fileId = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        hashes = self._load()
+        if fileId not in hashes:
+            hashes[fileId] = fileContentHash(path)
+            self._save()
+        return hashes[fileId]
+
+    def clear(self):
+        if os.path.exists(self.indexPath):
+            os.remove(self.indexPath)
+        self._hashes = None
+
+    def _load(self):
+        if self._hashes is None:
+            try:
+                with open(self.indexPath) as f:
+                    self._hashes = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self._hashes = {}
+        return self._hashes
+
+    def _save(self):
+        fd, tmpPath = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._hashes, f)
+        os.replace(tmpPath, self.indexPath)
@@ -0,0 +1,239 @@
+"""
+A local stand-in for SLURM and PBS, to test the batch job backends without a cluster.
+
+`install` writes `sbatch`, `squeue`, `sacct`, `scancel`, `qsub`, `qstat` and
+`qdel` executables to a folder. With that folder first on the PATH of the
+SSH account (e.g. an SSH server on localhost), `jobSchedulers.SlurmBackend`
+and `jobSchedulers.PbsBackend` run their jobs as local background processes:
+
+    python fakeScheduler.py install ~/fake-scheduler/bin
+    export PATH=~/fake-scheduler/bin:$PATH
+
+Only what the backends use is implemented: the directives for the output
+file are honoured, resource requests are ignored, and jobs start right away
+unless `FAKE_SCHEDULER_PENDING_S` holds them as pending for a few seconds.
+Job records are kept in `FAKE_SCHEDULER_STATE` (default `~/.fake_scheduler`).
+"""
+import argparse
+import fcntl
+import os
+import re
+import signal
+import stat
+import subprocess
+import sys
+import time
+
+STATE_FOLDER = os.environ.get("FAKE_SCHEDULER_STATE", os.path.join(os.path.expanduser("~"), ".fake_scheduler"))
+PENDING_S = float(os.environ.get("FAKE_SCHEDULER_PENDING_S", "0"))
+COMMANDS = ("sbatch", "squeue", "sacct", "scancel", "qsub", "qstat", "qdel")
+CANCELLED_EXIT_CODE = 143
+
+
+# -----------------------------------------------------------------------------
+# Job records
+# -----------------------------------------------------------------------------
+def _recordPath(jobId, suffix):
+    return os.path.join(STATE_FOLDER, f"{jobId}.{suffix}")
+
+
+def _nextJobId():
+    os.makedirs(STATE_FOLDER, exist_ok=True)
+    with open(os.path.join(STATE_FOLDER, "counter"), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        jobId = int(f.read() or 1000) + 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(jobId))
+    return str(jobId)
+
+
+def _read(jobId, suffix):
+    try:
+        with open(_recordPath(jobId, suffix)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _write(jobId, suffix, value):
+    with open(_recordPath(jobId, suffix), "w") as f:
+        f.write(str(value))
+
+
+def _isAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # A finished child of nobody is a zombie until reaped; not running
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except OSError:
+        return True
+
+
+def _state(jobId):
+    """`PENDING`, `RUNNING`, `COMPLETED`, `FAILED`, `CANCELLED`, or None for an unknown job."""
+    pid = _read(jobId, "pid")
+    if pid is None:
+        return None
+    exitCode = _read(jobId, "exit")
+    if exitCode is None:
+        if not _isAlive(int(pid)):
+            return "FAILED"
+        started = _read(jobId, "start")
+        return "RUNNING" if started is None or time.time() >= float(started) else "PENDING"
+    if _read(jobId, "cancelled") is not None:
+        return "CANCELLED"
+    return "COMPLETED" if int(exitCode) == 0 else "FAILED"
+
+
+def _submit(scriptPath, outputPath):
+    """Run the script detached in its own session; returns the job id."""
+    jobId = _nextJobId()
+    outputPath = (outputPath or "fake-%j.out").replace("%j", jobId)
+    exitPath = _recordPath(jobId, "exit")
+    wrapper = f"sleep {PENDING_S}; bash {scriptPath}; echo $? > {exitPath}"
+    with open(outputPath, "ab") as output:
+        process = subprocess.Popen(["bash", "-c", wrapper], stdout=output, stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL, start_new_session=True)
+    _write(jobId, "pid", process.pid)
+    _write(jobId, "start", time.time() + PENDING_S)
+    return jobId
+
+
+def _cancel(jobId):
+    pid = _read(jobId, "pid")
+    if pid is None or _read(jobId, "exit") is not None:
+        return
+    _write(jobId, "cancelled", 1)
+    _write(jobId, "exit", CANCELLED_EXIT_CODE)
+    try:
+        os.killpg(int(pid), signal.SIGTERM)
+    except OSError:
+        pass
+
+
+def _directive(scriptPath, prefix, pattern):
+    with open(scriptPath) as f:
+        for line in f:
+            if line.startswith(prefix):
+                match = re.search(pattern, line)
+                if match:
+                    return match.group(1)
+    return None
+
+
+# -----------------------------------------------------------------------------
+# SLURM
+# -----------------------------------------------------------------------------
+def sbatch(args):
+    parser = argparse.ArgumentParser(prog="sbatch", add_help=False)
+    parser.add_argument("--parsable", action="store_true")
+    parser.add_argument("script")
+    options, _ = parser.parse_known_args(args)
+    outputPath = _directive(options.script, "#SBATCH", r"--output[= ](\S+)")
+    jobId = _submit(os.path.abspath(options.script), outputPath)
+    print(jobId if options.parsable else f"Submitted batch job {jobId}")
+    return 0
+
+
+def squeue(args):
+    parser = argparse.ArgumentParser(prog="squeue", add_help=False)
+    parser.add_argument("-j", "--jobs", required=True)
+    options, _ = parser.parse_known_args(args)
+    state = _state(options.jobs)
+    if state is None:
+        print("slurm_load_jobs error: Invalid job id specified", file=sys.stderr)
+        return 1
+    if state in ("PENDING", "RUNNING"):
+        print(state)
+    return 0
+
+
+def sacct(args):
+    parser = argparse.ArgumentParser(prog="sacct", add_help=False)
+    parser.add_argument("-j", "--jobs", required=True)
+    parser.add_argument("-P", "--parsable2", action="store_true")
+    options, _ = parser.parse_known_args(args)
+    state = _state(options.jobs)
+    if state is not None:
+        exitCode = _read(options.jobs, "exit") or "0"
+        print(("|" if options.parsable2 else " ").join([state, f"{exitCode}:0"]))
+    return 0
+
+
+def scancel(args):
+    for jobId in args:
+        _cancel(jobId)
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# PBS
+# -----------------------------------------------------------------------------
+PBS_STATES = {"PENDING": "Q", "RUNNING": "R", "COMPLETED": "F", "FAILED": "F", "CANCELLED": "F"}
+
+
+def qsub(args):
+    scriptPath = args[-1]
+    outputPath = _directive(scriptPath, "#PBS", r"-o\s+(\S+)")
+    print(f"{_submit(os.path.abspath(scriptPath), outputPath)}.fake")
+    return 0
+
+
+def qstat(args):
+    jobId = args[-1].split(".")[0]
+    history = "-x" in args or "-xf" in args
+    state = _state(jobId)
+    if state is None:
+        print(f"qstat: Unknown Job Id {args[-1]}", file=sys.stderr)
+        return 153
+    pbsState = PBS_STATES[state]
+    if pbsState == "F" and not history:
+        print(f"qstat: {args[-1]} Job has finished, use -x or -H to obtain historical job information",
+              file=sys.stderr)
+        return 35
+    print(f"Job Id: {jobId}.fake\n    job_state = {pbsState}")
+    if pbsState == "F":
+        print(f"    Exit_status = {_read(jobId, 'exit')}")
+    return 0
+
+
+def qdel(args):
+    for jobId in args:
+        _cancel(jobId.split(".")[0])
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# Installation
+# -----------------------------------------------------------------------------
+def install(folder):
+    """Write the scheduler commands to `folder` (put it first on the PATH)."""
+    os.makedirs(folder, exist_ok=True)
+    for command in COMMANDS:
+        path = os.path.join(folder, command)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" {command} "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    print(f"Installed {', '.join(COMMANDS)} in {folder}")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS + ("install",):
+        print(f"usage: {os.path.basename(__file__)} install FOLDER | {{{','.join(COMMANDS)}}} ARGS...",
+              file=sys.stderr)
+        return 2
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == "install":
+        install(args[0])
+        return 0
+    return globals()[command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
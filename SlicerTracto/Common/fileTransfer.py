@@ -0,0 +1,336 @@
+import hashlib
+import os
+import shlex
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1 << 20
+DEFAULT_CHANNELS = 4
+# Fast level: the network, not the CPU, is the bottleneck
+COMPRESSION_LEVEL = 1
+# Files sent through gzip; NIfTI compresses well, .nii.gz/.trk/scripts gain little
+COMPRESSED_EXTENSIONS = (".nii",)
+PART_SUFFIX = ".part"
+MIB = 1024 * 1024
+# Checksum of a transferred file: retried, a failed remote command is not a mismatch
+CHECKSUM_ATTEMPTS = 3
+CHECKSUM_RETRY_DELAY_S = 1.
+
+
+def localChecksum(path, length=None):
+    """SHA-256 of a local file, or of its first `length` bytes."""
+    sha = hashlib.sha256()
+    remaining = os.path.getsize(path) if length is None else length
+    with open(path, "rb") as f:
+        while remaining > 0:
+            block = f.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                break
+            sha.update(block)
+            remaining -= len(block)
+    return sha.hexdigest()
+
+
+class TransferResult:
+    """What happened to one file: bytes moved, bytes on the wire, time and resume offset."""
+
+    def __init__(self, direction, source, destination, size):
+        self.direction: str = direction
+        self.source: str = source
+        self.destination: str = destination
+        self.size: int = size
+        self.resumedFrom: int = 0
+        self.wireBytes: int = 0
+        self.seconds: float = 0.
+        self.skipped: bool = False
+
+    @property
+    def throughputMBs(self):
+        """Throughput in MB/s of file data (not of compressed bytes)."""
+        return (self.size - self.resumedFrom) / MIB / max(self.seconds, 1e-6)
+
+    def __str__(self):
+        name = os.path.basename(self.source)
+        if self.skipped:
+            return f"{name}: already {self.direction}ed ({self.size / MIB:.1f} MB, checksum match)"
+        text = (f"{name}: {(self.size - self.resumedFrom) / MIB:.1f} MB {self.direction}ed in "
+                f"{self.seconds:.2f}s ({self.throughputMBs:.1f} MB/s")
+        if self.wireBytes != self.size - self.resumedFrom:
+            text += f", {self.wireBytes / MIB:.1f} MB on the wire"
+        if self.resumedFrom:
+            text += f", resumed at {self.resumedFrom / MIB:.1f} MB"
+        return text + ")"
+
+
+class FileTransfer:
+    """
+    Upload and download files over one SSH connection.
+
+    - Several files move at the same time, each on its own SFTP or exec
+      channel multiplexed on the session's transport.
+    - Uncompressed NIfTI files are gzipped on the fly: the sender streams
+      the compressed bytes through `gzip` on the other side, so the file
+      lands uncompressed where the scripts expect it.
+    - Files are written to `<destination>.part` and renamed when complete.
+      A destination that already has the same size and SHA-256 is skipped,
+      and a `.part` left by an interrupted transfer is continued from its
+      end when its bytes match the start of the source.
+    - Every file's time and throughput are reported.
+
+    The remote side needs a POSIX shell with `sha256sum`, `head`, `tail`
+    and `gzip`. Without them, nothing is resumed or skipped and files are
+    sent uncompressed.
+
+    Parameters
+    ----------
+    client : paramiko.SSHClient
+        Connected client (see `sshSessionPool`).
+    nbChannels : int
+        Files transferred concurrently.
+    compress : bool
+        Gzip `COMPRESSED_EXTENSIONS` files on the wire.
+    """
+
+    def __init__(self, client, nbChannels=DEFAULT_CHANNELS, compress=True):
+        self.client = client
+        self.nbChannels: int = nbChannels
+        self.compress: bool = compress
+        self._remoteTools = None
+
+    # -------------------------------------------------------------------------
+    # Remote commands
+    # -------------------------------------------------------------------------
+    def _exec(self, command, send=None, receive=None):
+        """
+        Run a remote command and return `(exit status, stdout, stderr)`.
+
+        `send` yields bytes written to the command's stdin; `receive` is
+        called with each block of stdout instead of collecting it. stderr is
+        read on its own thread: stdout and stderr share the channel's window,
+        so a command filling stderr would otherwise stall stdout.
+        """
+        channel = self.client.get_transport().open_session()
+        errors = []
+
+        def readErrors():
+            for block in iter(lambda: channel.recv_stderr(CHUNK_SIZE), b""):
+                errors.append(block)
+
+        errorReader = threading.Thread(target=readErrors, daemon=True)
+        try:
+            channel.exec_command(command)
+            errorReader.start()
+            if send is not None:
+                for block in send:
+                    channel.sendall(block)
+                channel.shutdown_write()
+            output = []
+            while True:
+                block = channel.recv(CHUNK_SIZE)
+                if not block:
+                    break
+                if receive is None:
+                    output.append(block)
+                else:
+                    receive(block)
+            status = channel.recv_exit_status()
+            errorReader.join()
+            return status, b"".join(output), b"".join(errors)
+        finally:
+            channel.close()
+
+    def remoteToolsAvailable(self):
+        if self._remoteTools is None:
+            status, _, _ = self._exec("command -v sha256sum head tail gzip > /dev/null")
+            self._remoteTools = status == 0
+        return self._remoteTools
+
+    def remoteChecksum(self, path, length=None):
+        """SHA-256 of a remote file (or of its first `length` bytes), None if unavailable."""
+        if not self.remoteToolsAvailable():
+            return None
+        quoted = shlex.quote(path)
+        if length is None:
+            command = f"sha256sum {quoted}"
+        else:
+            command = f"head -c {int(length)} {quoted} | sha256sum"
+        status, output, _ = self._exec(command)
+        if status != 0 or not output:
+            return None
+        return output.split()[0].decode()
+
+    def _completeChecksum(self, path):
+        """
+        `remoteChecksum` of a whole file, retried when the command fails.
+
+        Raises `IOError` when it never answers: the file is then unverified,
+        which must not be mistaken for a mismatch.
+        """
+        for attempt in range(CHECKSUM_ATTEMPTS):
+            checksum = self.remoteChecksum(path)
+            if checksum is not None:
+                return checksum
+            if attempt + 1 < CHECKSUM_ATTEMPTS:
+                time.sleep(CHECKSUM_RETRY_DELAY_S * (attempt + 1))
+        raise IOError(f"Could not checksum {path} on the remote side")
+
+    @staticmethod
+    def _remoteSize(sftp, path):
+        try:
+            return sftp.stat(path).st_size
+        except IOError:
+            return None
+
+    def _useCompression(self, path):
+        return self.compress and path.endswith(COMPRESSED_EXTENSIONS) and self.remoteToolsAvailable()
+
+    # -------------------------------------------------------------------------
+    # Single files
+    # -------------------------------------------------------------------------
+    def upload(self, localPath, remotePath):
+        """Send one file; returns a `TransferResult`."""
+        result = TransferResult("upload", localPath, remotePath, os.path.getsize(localPath))
+        start = time.perf_counter()
+        sftp = self.client.open_sftp()
+        try:
+            checksum = localChecksum(localPath) if self.remoteToolsAvailable() else None
+            if (checksum is not None and self._remoteSize(sftp, remotePath) == result.size
+                    and self.remoteChecksum(remotePath) == checksum):
+                result.skipped = True
+                return result
+
+            partPath = remotePath + PART_SUFFIX
+            offset = self._remoteSize(sftp, partPath) or 0
+            if offset and (offset > result.size
+                           or self.remoteChecksum(partPath, offset) != localChecksum(localPath, offset)):
+                offset = 0
+            result.resumedFrom = offset
+
+            with open(localPath, "rb") as source:
+                source.seek(offset)
+                if self._useCompression(localPath):
+                    redirect = ">>" if offset else ">"
+                    command = f"gzip -dc {redirect} {shlex.quote(partPath)}"
+                    status, _, errors = self._exec(command, send=self._compressedBlocks(source, result))
+                    if status != 0:
+                        raise IOError(f"Remote gzip failed for {remotePath}: {errors.decode(errors='replace')}")
+                else:
+                    with sftp.open(partPath, "ab" if offset else "wb") as destination:
+                        destination.set_pipelined(True)
+                        for block in iter(lambda: source.read(CHUNK_SIZE), b""):
+                            destination.write(block)
+                            result.wireBytes += len(block)
+
+            # Kept when it cannot be checksummed: the next upload resumes or verifies it
+            if checksum is not None and self._completeChecksum(partPath) != checksum:
+                sftp.remove(partPath)
+                raise IOError(f"Checksum mismatch after uploading {localPath}")
+            sftp.posix_rename(partPath, remotePath)
+            return result
+        finally:
+            sftp.close()
+            result.seconds = time.perf_counter() - start
+
+    def download(self, remotePath, localPath):
+        """Fetch one file; returns a `TransferResult`."""
+        result = TransferResult("download", remotePath, localPath, 0)
+        start = time.perf_counter()
+        sftp = self.client.open_sftp()
+        try:
+            result.size = size = sftp.stat(remotePath).st_size
+            checksum = self._completeChecksum(remotePath) if self.remoteToolsAvailable() else None
+            if (checksum is not None and os.path.exists(localPath) and os.path.getsize(localPath) == size
+                    and localChecksum(localPath) == checksum):
+                result.skipped = True
+                return result
+
+            partPath = localPath + PART_SUFFIX
+            offset = os.path.getsize(partPath) if os.path.exists(partPath) else 0
+            if offset and (offset > size or checksum is None
+                           or self.remoteChecksum(remotePath, offset) != localChecksum(partPath, offset)):
+                offset = 0
+            result.resumedFrom = offset
+
+            os.makedirs(os.path.dirname(os.path.abspath(localPath)), exist_ok=True)
+            with open(partPath, "ab" if offset else "wb") as destination:
+                if self._useCompression(remotePath):
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+                    def receive(block):
+                        result.wireBytes += len(block)
+                        destination.write(decompressor.decompress(block))
+
+                    command = f"tail -c +{offset + 1} {shlex.quote(remotePath)} | gzip -{COMPRESSION_LEVEL} -c"
+                    status, _, errors = self._exec(command, receive=receive)
+                    if status != 0:
+                        raise IOError(f"Remote gzip failed for {remotePath}: {errors.decode(errors='replace')}")
+                    destination.write(decompressor.flush())
+                else:
+                    with sftp.open(remotePath, "rb") as source:
+                        source.seek(offset)
+                        source.prefetch(size - offset)
+                        for block in iter(lambda: source.read(CHUNK_SIZE), b""):
+                            destination.write(block)
+                            result.wireBytes += len(block)
+
+            if checksum is not None and localChecksum(partPath) != checksum:
+                os.remove(partPath)
+                raise IOError(f"Checksum mismatch after downloading {remotePath}")
+            os.replace(partPath, localPath)
+            return result
+        finally:
+            sftp.close()
+            result.seconds = time.perf_counter() - start
+
+    @staticmethod
+    def _compressedBlocks(source, result):
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        for block in iter(lambda: source.read(CHUNK_SIZE), b""):
+            compressed = compressor.compress(block)
+            if compressed:
+                result.wireBytes += len(compressed)
+                yield compressed
+        compressed = compressor.flush()
+        result.wireBytes += len(compressed)
+        yield compressed
+
+    # -------------------------------------------------------------------------
+    # Several files
+    # -------------------------------------------------------------------------
+    def uploadMany(self, pairs):
+        """Upload `(local path, remote path)` pairs concurrently; see `transferMany`."""
+        return self.transferMany(self.upload, pairs)
+
+    def downloadMany(self, pairs):
+        """Download `(remote path, local path)` pairs concurrently; see `transferMany`."""
+        return self.transferMany(self.download, pairs)
+
+    def transferMany(self, transfer, pairs):
+        """
+        Run `transfer(source, destination)` for every pair on `nbChannels` threads.
+
+        Each file is reported as it completes. Returns the `TransferResult`s in
+        the order of `pairs`, and raises the first error once every other file
+        is done.
+        """
+        pairs = [(source, destination) for source, destination in pairs if source]
+
+        def run(pair):
+            transferResult = transfer(*pair)
+            print(f"[SLICER TRACTO]{transferResult}")
+            return transferResult
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max(1, min(self.nbChannels, len(pairs)))) as executor:
+            futures = [executor.submit(run, pair) for pair in pairs]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise errors[0]
+        results = [future.result() for future in futures]
+        total = sum(result.size - result.resumedFrom for result in results if not result.skipped)
+        seconds = time.perf_counter() - start
+        print(f"[SLICER TRACTO]{len(results)} files, {total / MIB:.1f} MB in {seconds:.2f}s "
+              f"({total / MIB / max(seconds, 1e-6):.1f} MB/s)")
+        return results
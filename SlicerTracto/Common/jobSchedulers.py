@@ -0,0 +1,266 @@
+import abc
+import math
+import os
+import re
+import shlex
+
+import numpy as np
+import nibabel as nib
+
+from remoteJobs import JOB_LOG_NAME, JOB_STATUS_NAME, NohupBackend, PollAgainError, runRemoteCommand
+
+JOB_BACKENDS = ("nohup", "slurm", "pbs")
+SCHEDULER_LOG_NAME = "scheduler.log"
+SCRIPT_END_MARKER = "SLICER_TRACTO_JOB_SCRIPT"
+
+# Interpreter with numpy, dipy and scilpy loaded, before any data
+BASE_MEMORY_MB = 1024
+# Peak memory of a run relative to the size of its inputs once loaded
+DEFAULT_MEMORY_FACTOR = 4.
+# Wall time: a fixed part (queueing in the job, imports, writing) plus a part per GB of loaded input
+BASE_MINUTES = 15
+DEFAULT_MINUTES_PER_GB = 30
+MAX_MINUTES = 24 * 60
+# Loaded size of non-NIfTI files relative to their size on disk (gzipped trk, text)
+COMPRESSED_EXPANSION = 3.
+MIB = 1024 * 1024
+
+
+def loadedSizeBytes(path):
+    """Size of a file once loaded: the voxel array of a NIfTI image, otherwise estimated from disk."""
+    if path.endswith((".nii", ".nii.gz")):
+        try:
+            header = nib.load(path).header
+            return int(np.prod(header.get_data_shape(), dtype=np.int64)) * header.get_data_dtype().itemsize
+        except Exception:
+            pass
+    size = os.path.getsize(path)
+    return int(size * COMPRESSED_EXPANSION) if path.endswith(".gz") else size
+
+
+class JobResources:
+    """CPUs, memory (MB) and wall time (minutes) requested for a batch job."""
+
+    def __init__(self, cpus=1, memoryMB=BASE_MEMORY_MB, minutes=BASE_MINUTES):
+        self.cpus: int = cpus
+        self.memoryMB: int = memoryMB
+        self.minutes: int = minutes
+
+    @property
+    def walltime(self):
+        """`HH:MM:SS`, as both SLURM and PBS accept it."""
+        return f"{self.minutes // 60:02d}:{self.minutes % 60:02d}:00"
+
+    def __str__(self):
+        return f"{self.cpus} CPU, {self.memoryMB} MB, {self.walltime}"
+
+
+def estimateResources(inputPaths, cpus=1, memoryFactor=DEFAULT_MEMORY_FACTOR,
+                      minutesPerGB=DEFAULT_MINUTES_PER_GB, baseMinutes=BASE_MINUTES):
+    """
+    Size a batch job from its local input files.
+
+    Memory is `BASE_MEMORY_MB` plus `memoryFactor` times the loaded size of
+    the inputs, rounded up to 256 MB. Wall time grows with the loaded size
+    (`minutesPerGB` for one CPU, divided among `cpus`), capped at
+    `MAX_MINUTES`.
+    """
+    loadedBytes = sum(loadedSizeBytes(path) for path in inputPaths if path and os.path.exists(path))
+    memoryMB = BASE_MEMORY_MB + memoryFactor * loadedBytes / MIB
+    memoryMB = int(math.ceil(memoryMB / 256.) * 256)
+    minutes = baseMinutes + minutesPerGB * loadedBytes / 1024 ** 3 / max(1, cpus)
+    minutes = int(min(MAX_MINUTES, math.ceil(minutes)))
+    return JobResources(cpus=cpus, memoryMB=memoryMB, minutes=minutes)
+
+
+class BatchBackend(abc.ABC):
+    """
+    Run a job through a batch scheduler of an HPC cluster.
+
+    `submit` writes a job script to the job folder (scheduler directives,
+    then the command), submits it and returns the scheduler's job id.
+    The command's output goes to `job.log` and its exit status to
+    `job.status`, as with `NohupBackend`; the scheduler's own messages
+    (time limit, out of memory) go to `scheduler.log`. `status` asks the
+    scheduler whether the job is still pending or running, then reads the
+    exit status, falling back to the scheduler's accounting for jobs killed
+    before they could write it.
+
+    Parameters
+    ----------
+    queue : str
+        Partition (SLURM) or queue (PBS); the scheduler's default if None.
+    account : str
+        Account charged for the job, if the cluster requires one.
+    """
+
+    name = None
+    scriptName = None
+    submitCommand = None
+    cancelCommand = None
+    activeStates = ()
+
+    def __init__(self, queue=None, account=None):
+        self.queue = queue
+        self.account = account
+
+    @abc.abstractmethod
+    def directives(self, job, resources):
+        """Scheduler directive lines of the job script (name, output file, resources, queue)."""
+
+    def script(self, job):
+        resources = job.resources or JobResources()
+        lines = ["#!/bin/bash"] + self.directives(job, resources) + [
+            f"cd {shlex.quote(job.folder)}",
+            f"exec >> {JOB_LOG_NAME} 2>&1",
+            # A subshell, so that a command ending with `exit` still records its status
+            f"({job.command}); echo $? > {JOB_STATUS_NAME}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def submit(self, client, job):
+        folder = shlex.quote(job.folder)
+        runRemoteCommand(client, f"mkdir -p {folder} && cd {folder} && "
+                                 f"rm -f {JOB_STATUS_NAME} {JOB_LOG_NAME} {SCHEDULER_LOG_NAME} && "
+                                 f"cat > {self.scriptName} << '{SCRIPT_END_MARKER}'\n"
+                                 f"{self.script(job)}{SCRIPT_END_MARKER}\n")
+        output = runRemoteCommand(client, f"cd {folder} && {self.submitCommand} {self.scriptName}")
+        return self.parseJobId(output)
+
+    def parseJobId(self, output):
+        return output.strip()
+
+    @abc.abstractmethod
+    def state(self, client, job):
+        """The scheduler's state of the job, or None once it has left the queue."""
+
+    def accountingExitCode(self, client, job):
+        """Exit code from the scheduler's records (-1 when unknown)."""
+        return -1
+
+    def status(self, client, job):
+        """`None` while the job is pending or running, otherwise its exit code."""
+        state = self.state(client, job)
+        if state in self.activeStates:
+            return None
+        statusPath = shlex.quote(job.remotePath(JOB_STATUS_NAME))
+        output = runRemoteCommand(client, f"cat {statusPath} 2>/dev/null || true").strip()
+        if output:
+            return int(output)
+        print(f"[SLICER TRACTO][ERROR]Job {job.name} ended without an exit status, "
+              f"see {job.remotePath(SCHEDULER_LOG_NAME)}")
+        return self.accountingExitCode(client, job)
+
+    def cancel(self, client, job):
+        runRemoteCommand(client, f"{self.cancelCommand} {shlex.quote(job.remoteId)} || true")
+
+
+class SlurmBackend(BatchBackend):
+    """`sbatch` / `squeue` / `sacct` / `scancel`."""
+
+    name = "slurm"
+    scriptName = "job.sbatch"
+    submitCommand = "sbatch --parsable"
+    cancelCommand = "scancel"
+    activeStates = ("PENDING", "CONFIGURING", "RUNNING", "COMPLETING", "REQUEUED", "RESIZING", "SUSPENDED")
+
+    def directives(self, job, resources):
+        directives = [
+            f"#SBATCH --job-name={re.sub(r'[^A-Za-z0-9_.-]', '_', job.name)}",
+            f"#SBATCH --output={job.remotePath(SCHEDULER_LOG_NAME)}",
+            "#SBATCH --nodes=1",
+            "#SBATCH --ntasks=1",
+            f"#SBATCH --cpus-per-task={resources.cpus}",
+            f"#SBATCH --mem={resources.memoryMB}M",
+            f"#SBATCH --time={resources.walltime}",
+        ]
+        if self.queue:
+            directives.append(f"#SBATCH --partition={self.queue}")
+        if self.account:
+            directives.append(f"#SBATCH --account={self.account}")
+        return directives
+
+    def parseJobId(self, output):
+        # `--parsable` prints `<id>` or `<id>;<cluster>`
+        return output.strip().split(";")[0]
+
+    def state(self, client, job):
+        output = runRemoteCommand(client, f"squeue -h -j {shlex.quote(job.remoteId)} -o %T 2>&1 || true").strip()
+        if not output or "Invalid job id" in output:
+            return None
+        if "error" in output.lower():
+            # The controller did not answer: not a sign that the job ended, poll again later
+            raise PollAgainError(output)
+        return output
+
+    def accountingExitCode(self, client, job):
+        output = runRemoteCommand(client, f"sacct -j {shlex.quote(job.remoteId)} -n -X -P -o State,ExitCode "
+                                          f"2>/dev/null || true").strip()
+        if not output:
+            return -1
+        state, exitCode = output.splitlines()[0].split("|")[:2]
+        print(f"[SLICER TRACTO]Job {job.name}: SLURM state {state}")
+        return int(exitCode.split(":")[0]) or -1
+
+
+class PbsBackend(BatchBackend):
+    """`qsub` / `qstat` / `qdel` (PBS Pro `select` syntax)."""
+
+    name = "pbs"
+    scriptName = "job.pbs"
+    submitCommand = "qsub"
+    cancelCommand = "qdel"
+    # Queued, running, held, waiting, exiting, transiting, suspended, array begun
+    activeStates = ("Q", "R", "H", "W", "E", "T", "S", "B")
+
+    def directives(self, job, resources):
+        directives = [
+            # PBS job names: at most 15 characters, starting with a letter
+            f"#PBS -N {('j' + re.sub(r'[^A-Za-z0-9_]', '_', job.name))[:15]}",
+            f"#PBS -o {job.remotePath(SCHEDULER_LOG_NAME)}",
+            "#PBS -j oe",
+            f"#PBS -l select=1:ncpus={resources.cpus}:mem={resources.memoryMB}mb",
+            f"#PBS -l walltime={resources.walltime}",
+        ]
+        if self.queue:
+            directives.append(f"#PBS -q {self.queue}")
+        if self.account:
+            directives.append(f"#PBS -A {self.account}")
+        return directives
+
+    def _fullStatus(self, client, job, history=False):
+        """`qstat -f` output, or None when the job is no longer listed."""
+        flags = "-xf" if history else "-f"
+        output = runRemoteCommand(client, f"qstat {flags} {shlex.quote(job.remoteId)} 2>&1 || true")
+        if "Unknown Job Id" in output or "has finished" in output:
+            return None
+        if "job_state" not in output:
+            # The server did not answer: not a sign that the job ended, poll again later
+            raise PollAgainError(output.strip())
+        return output
+
+    @staticmethod
+    def _attribute(fullStatus, name):
+        match = re.search(rf"^\s*{name}\s*=\s*(\S+)", fullStatus or "", re.MULTILINE)
+        return match.group(1) if match else None
+
+    def state(self, client, job):
+        return self._attribute(self._fullStatus(client, job), "job_state")
+
+    def accountingExitCode(self, client, job):
+        try:
+            exitCode = self._attribute(self._fullStatus(client, job, history=True), "Exit_status")
+        except PollAgainError:
+            exitCode = None
+        return int(exitCode) if exitCode is not None else -1
+
+
+def jobBackend(name, queue=None, account=None):
+    """The backend called `name` in `JOB_BACKENDS`."""
+    if name == "nohup":
+        return NohupBackend()
+    if name == "slurm":
+        return SlurmBackend(queue=queue, account=account)
+    if name == "pbs":
+        return PbsBackend(queue=queue, account=account)
+    raise ValueError(f"Unknown job backend {name!r}, expected one of {JOB_BACKENDS}")
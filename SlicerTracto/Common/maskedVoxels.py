@@ -0,0 +1,74 @@
+import numpy as np
+
+
+def boundingBox(mask):
+    """
+    Slices of the smallest box holding every voxel of `mask`.
+
+    An empty mask gives empty slices.
+    """
+    slices = []
+    for axis in range(mask.ndim):
+        other_axes = tuple(i for i in range(mask.ndim) if i != axis)
+        indices = np.flatnonzero(np.any(mask, axis=other_axes))
+        if len(indices) == 0:
+            return tuple(slice(0, 0) for _ in range(mask.ndim))
+        slices.append(slice(int(indices[0]), int(indices[-1]) + 1))
+    return tuple(slices)
+
+
+class MaskedVoxels:
+    """
+    In-mask voxels of a volume, gathered as a compact `(N, ...)` array.
+
+    The mask is cropped to its bounding box once; `gather` then only reads
+    that box of a volume and `scatter` writes per-voxel results back into a
+    full-size volume that is zero outside the mask. Fits that treat voxels
+    independently can therefore run on the N in-mask voxels only, with
+    memory and time in proportion to the mask instead of the field of view.
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        3D boolean mask.
+    """
+
+    def __init__(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        self.shape: tuple = mask.shape
+        self.box: tuple = boundingBox(mask)
+        self.croppedMask: np.ndarray = mask[self.box]
+        self.nbVoxels: int = int(np.count_nonzero(self.croppedMask))
+
+    @classmethod
+    def fromSignal(cls, data, mask=None):
+        """
+        Voxels of `data` (4D) with a non-zero signal, within `mask` if given.
+
+        This is the voxel selection of scilpy's `fit_from_model`, so a fit on
+        the gathered voxels matches a fit on the whole volume.
+        """
+        if mask is None:
+            return cls(np.any(data, axis=-1))
+        box = boundingBox(mask)
+        nonzero = np.zeros(mask.shape, dtype=bool)
+        nonzero[box] = np.logical_and(mask[box], np.any(data[box], axis=-1))
+        return cls(nonzero)
+
+    @property
+    def fraction(self):
+        """Share of the volume's voxels in the mask."""
+        return self.nbVoxels / max(1, int(np.prod(self.shape)))
+
+    def gather(self, volume, dtype=None):
+        """`(N, ...)` values of the in-mask voxels of a volume with the mask's shape first."""
+        values = volume[self.box][self.croppedMask]
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def scatter(self, values, dtype=np.float32):
+        """Full-size volume holding the `(N, ...)` values in the mask and zeros elsewhere."""
+        values = np.asarray(values)
+        volume = np.zeros(self.shape + values.shape[1:], dtype=dtype)
+        # Basic slicing gives a view, so this writes into `volume`
+        volume[self.box][self.croppedMask] = values
+        return volume
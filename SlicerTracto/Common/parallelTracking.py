@@ -0,0 +1,512 @@
+import collections
+import os
+import shutil
+import tempfile
+import time
+import multiprocessing
+
+import numpy as np
+import nibabel as nib
+from nibabel.streamlines.tractogram import LazyTractogram
+from dipy.direction import (DeterministicMaximumDirectionGetter,
+                            ProbabilisticDirectionGetter)
+from dipy.direction.peaks import PeaksAndMetrics
+from dipy.io.utils import get_reference_info, create_tractogram_header
+from dipy.tracking.local_tracking import LocalTracking, ParticleFilteringTracking
+from dipy.tracking.stopping_criterion import BinaryStoppingCriterion, CmcStoppingCriterion
+from dipy.tracking.streamlinespeed import length, compress_streamlines
+
+from pmfCache import pmfVolumePath, trackingSphere
+from resourcePlanner import MIB, availableCores
+from seedGenerator import SEED_BYTES, SeedChunks
+
+TRACKING_ALGOS = ["det", "prob", "eudx"]
+DEFAULT_SEEDS_PER_CHUNK = 2_000
+EUDX_ARRAY_NAMES = ["peak_dirs", "peak_values", "peak_indices"]
+PFT_ARRAY_NAMES = ["odf", "pve_wm", "pve_gm", "pve_csf"]
+# PFT costs a lot more per seed than LocalTracking: smaller chunks balance the workers
+DEFAULT_PFT_SEEDS_PER_CHUNK = 250
+# RAM-backed file system: memory-mapped arrays in it are plain shared memory pages
+SHARED_MEMORY_FOLDER = "/dev/shm"
+# Free space of SHARED_MEMORY_FOLDER needed per byte of shared arrays; it is often small
+# (64 MB in Docker, a job-limited tmpfs on cluster nodes)
+SHARED_MEMORY_MARGIN = 1.5
+# Chunks submitted to the pool ahead of the one being written, per process
+CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+# Seeds tracked by a dry run, taken from up to DRY_RUN_PROBE_CHUNKS chunks spread over the mask
+DRY_RUN_PROBE_SEEDS = 200
+DRY_RUN_PROBE_CHUNKS = 10
+# Bytes per point of a streamline in a .trk (3 float32)
+TRK_POINT_BYTES = 3 * 4
+
+# State of a tracking worker process, set once by `_initWorker`
+_WORKER = {}
+
+
+def sharedFolder(prefix, nbBytes=0):
+    """
+    Temporary folder for `shareArrays` of `nbBytes`, in `SHARED_MEMORY_FOLDER`
+    when the system has one with room for them, so that the workers map the
+    arrays from memory rather than from disk. Otherwise in the temporary
+    folder of the system.
+    """
+    folder = None
+    if os.access(SHARED_MEMORY_FOLDER, os.W_OK):
+        freeBytes = shutil.disk_usage(SHARED_MEMORY_FOLDER).free
+        if freeBytes > nbBytes * SHARED_MEMORY_MARGIN:
+            folder = SHARED_MEMORY_FOLDER
+        else:
+            print(f"[SLICER TRACTO]{SHARED_MEMORY_FOLDER} has {freeBytes / MIB:.0f} MiB free for "
+                  f"{nbBytes / MIB:.0f} MiB of arrays, sharing them from {tempfile.gettempdir()}")
+    return tempfile.mkdtemp(prefix=prefix, dir=folder)
+
+
+def sharedArraysBytes(arrays):
+    """Bytes `shareArrays` writes for `arrays` (float arrays as float64)."""
+    nbBytes = 0
+    for array in arrays.values():
+        array = np.asarray(array)
+        nbBytes += array.size * (np.dtype(np.float64).itemsize if array.dtype.kind == "f" else array.itemsize)
+    return nbBytes
+
+
+def shareArrays(arrays, folder):
+    """
+    Write arrays to `.npy` files so that worker processes can memory-map them.
+
+    Float arrays are stored as float64, the type dipy's direction getters
+    work with, so that mapping them does not trigger a per-process copy.
+    Returns a `{name: path}` dict for `openSharedArrays`.
+    """
+    paths = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        if array.dtype.kind == "f":
+            array = array.astype(np.float64, copy=False)
+        paths[name] = os.path.join(folder, f"{name}.npy")
+        np.save(paths[name], array)
+    return paths
+
+
+def openSharedArrays(paths):
+    """
+    Memory-map arrays written by `shareArrays`.
+
+    Copy-on-write mode gives the writable buffers Cython code expects while
+    every process reads the same pages of the file.
+    """
+    return {name: np.load(path, mmap_mode="c") for name, path in paths.items()}
+
+
+def buildDirectionGetter(algo, arrays, theta, sfThreshold, shBasis, sphereName="symmetric724"):
+    """
+    Direction getter for LocalTracking from shared arrays.
+
+    det/prob use the PMF volume in `arrays["pmf"]` when there is one (see
+    `pmfCache`), the SH coefficients in `arrays["odf"]` otherwise; eudx uses
+    the precomputed `peak_dirs`, `peak_values` and `peak_indices`.
+    """
+    sphere = trackingSphere(sphereName)
+    if algo in ["det", "prob"]:
+        dg_class = DeterministicMaximumDirectionGetter if algo == "det" else ProbabilisticDirectionGetter
+        if "pmf" in arrays:
+            return dg_class.from_pmf(arrays["pmf"], max_angle=theta, sphere=sphere,
+                                     relative_peak_threshold=sfThreshold)
+        return dg_class.from_shcoeff(shcoeff=arrays["odf"], max_angle=theta, sphere=sphere,
+                                     basis_type=shBasis, relative_peak_threshold=sfThreshold)
+    if algo == "eudx":
+        dg = PeaksAndMetrics()
+        dg.sphere = sphere
+        dg.ang_thr = theta
+        dg.qa_thr = sfThreshold
+        dg.peak_dirs = arrays["peak_dirs"]
+        dg.peak_values = arrays["peak_values"]
+        dg.peak_indices = arrays["peak_indices"]
+        return dg
+    raise ValueError(f"Invalid tracking algorithm: {algo}. Expected one of {TRACKING_ALGOS}")
+
+
+def _initWorker(arrayPaths, params):
+    arrays = openSharedArrays(arrayPaths)
+    _WORKER["params"] = params
+    _WORKER["directionGetter"] = buildDirectionGetter(params["algo"], arrays, params["theta"],
+                                                      params["sfThreshold"], params["shBasis"],
+                                                      params["sphere"])
+    _WORKER["stoppingCriterion"] = BinaryStoppingCriterion(arrays["mask"])
+
+
+def _trackChunk(seeds):
+    """Track one chunk of seeds; returns the kept streamlines (float32) and their seeds."""
+    params = _WORKER["params"]
+    generator = LocalTracking(
+        _WORKER["directionGetter"], _WORKER["stoppingCriterion"],
+        seeds, np.eye(4),
+        step_size=params["stepSize"], max_cross=1,
+        maxlen=params["maxSteps"],
+        fixedstep=True, return_all=True,
+        random_seed=params["randomSeed"],
+        save_seeds=True)
+
+    streamlines = []
+    kept_seeds = []
+    for streamline, seed in generator:
+        if params["minLength"] <= length(streamline) <= params["maxLength"]:
+            if params["compress"]:
+                streamline = compress_streamlines(streamline, params["compress"])
+            streamlines.append(np.asarray(streamline, dtype=np.float32))
+            kept_seeds.append(np.asarray(seed, dtype=np.float32))
+    return streamlines, kept_seeds
+
+
+def _initPftWorker(arrayPaths, params):
+    arrays = openSharedArrays(arrayPaths)
+    _WORKER["params"] = params
+    sphere = trackingSphere(params["sphere"])
+    if "pmf" in arrays:
+        _WORKER["directionGetter"] = ProbabilisticDirectionGetter.from_pmf(
+            arrays["pmf"], max_angle=params["maxAngle"], sphere=sphere)
+    else:
+        _WORKER["directionGetter"] = ProbabilisticDirectionGetter.from_shcoeff(
+            arrays["odf"], max_angle=params["maxAngle"], sphere=sphere, basis_type=params["shBasis"])
+    _WORKER["stoppingCriterion"] = CmcStoppingCriterion.from_pve(
+        arrays["pve_wm"], arrays["pve_gm"], arrays["pve_csf"],
+        step_size=params["stepSize"], average_voxel_size=params["voxelSize"])
+
+
+def _trackPftChunk(seeds):
+    """Particle filtering tracking of one chunk of seeds; returns the streamlines (float32, RAS mm) and their seeds."""
+    params = _WORKER["params"]
+    generator = ParticleFilteringTracking(
+        _WORKER["directionGetter"], _WORKER["stoppingCriterion"],
+        seeds, params["affine"],
+        step_size=params["stepSize"], max_cross=1,
+        maxlen=params["maxLen"],
+        pft_back_tracking_dist=params["backTrackingDist"],
+        pft_front_tracking_dist=params["frontTrackingDist"],
+        particle_count=params["particleCount"],
+        return_all=False,
+        random_seed=params["randomSeed"],
+        save_seeds=True)
+
+    streamlines = []
+    kept_seeds = []
+    for streamline, seed in generator:
+        streamlines.append(np.asarray(streamline, dtype=np.float32))
+        kept_seeds.append(np.asarray(seed, dtype=np.float32))
+    return streamlines, kept_seeds
+
+
+def chunkSeeds(seeds, seedsPerChunk=DEFAULT_SEEDS_PER_CHUNK):
+    """
+    Split seeds in fixed-size chunks (independent of the number of processes).
+
+    A `seedGenerator.SeedChunks` is returned as is: its chunks are generated
+    when the pool submits them.
+    """
+    if isinstance(seeds, SeedChunks):
+        return seeds
+    seeds = np.asarray(seeds, dtype=float)
+    return [seeds[i:i + seedsPerChunk] for i in range(0, len(seeds), seedsPerChunk)]
+
+
+class TrackingEstimate:
+    """Seed count, memory and time of a tracking run, extrapolated from a dry run on a few seeds."""
+
+    def __init__(self, nbSeeds, nbChunks, nbProcesses, sharedBytes, inFlightBytes, allSeedsBytes,
+                 probeSeeds, probeSeconds, probeStreamlines, probePoints):
+        self.nbSeeds: int = nbSeeds
+        self.nbChunks: int = nbChunks
+        self.nbProcesses: int = nbProcesses
+        self.sharedBytes: int = sharedBytes
+        self.inFlightBytes: int = inFlightBytes
+        self.allSeedsBytes: int = allSeedsBytes
+        self.probeSeeds: int = probeSeeds
+        self.probeSeconds: float = probeSeconds
+        self.probeStreamlines: int = probeStreamlines
+        self.probePoints: int = probePoints
+
+    @property
+    def estimatedSeconds(self):
+        """Wall time with the work spread evenly over the processes."""
+        if not self.probeSeeds:
+            return 0.
+        return self.probeSeconds / self.probeSeeds * self.nbSeeds / self.nbProcesses
+
+    @property
+    def estimatedStreamlines(self):
+        return round(self.probeStreamlines / self.probeSeeds * self.nbSeeds) if self.probeSeeds else 0
+
+    @property
+    def estimatedOutputBytes(self):
+        return round(self.probePoints / self.probeSeeds * self.nbSeeds) * TRK_POINT_BYTES if self.probeSeeds else 0
+
+    def toDict(self):
+        return {"nbSeeds": self.nbSeeds, "nbChunks": self.nbChunks, "nbProcesses": self.nbProcesses,
+                "sharedMB": round(self.sharedBytes / MIB), "inFlightMB": round(self.inFlightBytes / MIB),
+                "allSeedsMB": round(self.allSeedsBytes / MIB), "estimatedSeconds": round(self.estimatedSeconds),
+                "estimatedStreamlines": self.estimatedStreamlines,
+                "estimatedOutputMB": round(self.estimatedOutputBytes / MIB)}
+
+    def __str__(self):
+        return (f"{self.nbSeeds} seeds in {self.nbChunks} chunks on {self.nbProcesses} processes: "
+                f"~{self.estimatedSeconds:.0f}s, ~{self.estimatedStreamlines} streamlines "
+                f"(~{self.estimatedOutputBytes / MIB:.0f} MB), {self.sharedBytes / MIB:.0f} MB shared maps, "
+                f"{self.inFlightBytes / MIB:.1f} MB of seeds in flight instead of "
+                f"{self.allSeedsBytes / MIB:.0f} MB for all of them "
+                f"(from {self.probeSeeds} seeds tracked in {self.probeSeconds:.2f}s)")
+
+
+def trackToTrk(outputPath, referenceImg, directionArrays, mask, seeds, algo, theta, stepSize,
+               maxSteps, minLength, maxLength, sfThreshold=0.1, shBasis="tournier07",
+               sphere="symmetric724", randomSeed=None, saveSeeds=False, compress=0.0,
+               nbProcesses=None, seedsPerChunk=DEFAULT_SEEDS_PER_CHUNK, fileType=nib.streamlines.TrkFile,
+               shToPmf=False, pmfCacheDir=None, dryRun=False):
+    """
+    Run LocalTracking on chunks of seeds in a process pool and stream the result to one file.
+
+    The direction data and the tracking mask are written once to memory-mapped
+    `.npy` files shared by all workers (see `sharedFolder`). Seeds are split
+    into fixed-size chunks and the results are written in chunk order, so for
+    a given `randomSeed` the output does not depend on the number of
+    processes (dipy reseeds its generators per seed point).
+
+    Parameters
+    ----------
+    outputPath : str
+        Output tractogram file.
+    referenceImg : nib.Nifti1Image
+        Image whose affine maps the voxel coordinates of `seeds` to RAS mm.
+    directionArrays : dict
+        `{"odf": sh}` for det/prob, the peak arrays (`EUDX_ARRAY_NAMES`) for eudx.
+    mask : ndarray
+        Binary tracking mask.
+    seeds : (N, 3) ndarray or SeedChunks
+        Seeds in voxel coordinates. A `seedGenerator.SeedChunks` (which
+        has its own chunk size) is generated chunk by chunk while tracking.
+    stepSize, maxSteps, minLength, maxLength
+        Step size and length bounds, in voxels; `maxSteps` as for LocalTracking's `maxlen`.
+    nbProcesses : int, optional
+        Number of worker processes, all available CPUs when None. With 1,
+        tracking runs in the calling process.
+    shToPmf : bool
+        For det/prob, track on the SH evaluated once on the sphere inside the
+        tracking mask (a cached, memory-mapped PMF volume, see `pmfCache`)
+        instead of evaluating them at every step. Falls back to the SH when
+        the volume does not fit in memory.
+    pmfCacheDir : str, optional
+        Folder of the PMF cache, `pmfCache.DEFAULT_CACHE_DIR` when None.
+    dryRun : bool
+        Track a few seeds only and return the `TrackingEstimate` of the run
+        instead of writing `outputPath`.
+
+    Returns
+    -------
+    int or TrackingEstimate
+        Number of streamlines written.
+    """
+    if algo not in TRACKING_ALGOS:
+        raise ValueError(f"Invalid tracking algorithm: {algo}. Expected one of {TRACKING_ALGOS}")
+    params = {"algo": algo, "theta": theta, "sfThreshold": sfThreshold, "shBasis": shBasis,
+              "sphere": sphere, "stepSize": stepSize, "maxSteps": maxSteps, "minLength": minLength,
+              "maxLength": maxLength, "randomSeed": randomSeed, "compress": compress}
+    arrays = dict(directionArrays)
+    arrays["mask"] = np.asarray(mask).astype(np.uint8)
+    mappedPaths = {}
+    if shToPmf and algo in ["det", "prob"]:
+        pmfPath = pmfVolumePath(arrays["odf"], arrays["mask"], sphereName=sphere, shBasis=shBasis,
+                                cacheDir=pmfCacheDir)
+        if pmfPath is not None:
+            mappedPaths["pmf"] = pmfPath
+            del arrays["odf"]
+    return _trackInPool(outputPath, referenceImg, referenceImg.affine, arrays, seeds, params,
+                        _initWorker, _trackChunk, saveSeeds, nbProcesses, seedsPerChunk, fileType,
+                        mappedPaths, dryRun)
+
+
+def pftToTrk(outputPath, referenceImg, shCoeffs, pveWm, pveGm, pveCsf, seeds, voxelSize,
+             stepSize=0.375, maxAngle=20., maxLen=1000, backTrackingDist=2, frontTrackingDist=1,
+             particleCount=15, shBasis=None, sphere="repulsion724", randomSeed=None,
+             saveSeeds=False, nbProcesses=None, seedsPerChunk=DEFAULT_PFT_SEEDS_PER_CHUNK,
+             fileType=nib.streamlines.TrkFile, shToPmf=False, pmfCacheDir=None, dryRun=False):
+    """
+    Run ParticleFilteringTracking on chunks of seeds in a process pool and stream the result to one file.
+
+    Same scheme as `trackToTrk`: the SH coefficients and the WM/GM/CSF
+    partial volume maps are written once to memory-mapped `.npy` files, in
+    shared memory when available, and every worker builds its direction
+    getter and CMC stopping criterion from them. Chunks are written in seed
+    order, so for a given `randomSeed` the output does not depend on the
+    number of processes.
+
+    Parameters
+    ----------
+    outputPath : str
+        Output tractogram file.
+    referenceImg : nib.Nifti1Image
+        Image the maps are defined on (its affine maps voxels to RAS mm).
+    shCoeffs : ndarray
+        SH coefficients of the fODF (e.g. `csd_fit.shm_coeff`), in `shBasis`
+        (dipy's default basis, descoteaux07, when None). The directions are
+        sampled on the hemisphere of `sphere` (dipy's `default_sphere` with
+        the default).
+    pveWm, pveGm, pveCsf : ndarray
+        Partial volume maps for the CMC stopping criterion.
+    seeds : (N, 3) ndarray or SeedChunks
+        Seeds in RAS mm (e.g. `seeds_from_mask(mask, affine)`, or
+        `SeedChunks.grid(mask, affine, ...)` to generate them chunk by chunk).
+    voxelSize : float
+        Average voxel size (mm), for the CMC stopping criterion.
+    stepSize : float
+        Step size in mm.
+    maxLen, backTrackingDist, frontTrackingDist, particleCount
+        As for ParticleFilteringTracking's `maxlen`, `pft_back_tracking_dist`,
+        `pft_front_tracking_dist` and `particle_count`.
+    nbProcesses : int, optional
+        Number of worker processes, all available CPUs when None. With 1,
+        tracking runs in the calling process.
+    shToPmf : bool
+        Track on the SH evaluated once on the sphere in white and grey matter
+        (a cached, memory-mapped PMF volume, see `pmfCache`) instead of
+        evaluating them at every step. Falls back to the SH when the volume
+        does not fit in memory.
+    pmfCacheDir : str, optional
+        Folder of the PMF cache, `pmfCache.DEFAULT_CACHE_DIR` when None.
+    dryRun : bool
+        Track a few seeds only and return the `TrackingEstimate` of the run
+        instead of writing `outputPath`.
+
+    Returns
+    -------
+    int or TrackingEstimate
+        Number of streamlines written.
+    """
+    params = {"affine": np.asarray(referenceImg.affine, dtype=float), "stepSize": stepSize,
+              "maxAngle": maxAngle, "maxLen": maxLen, "backTrackingDist": backTrackingDist,
+              "frontTrackingDist": frontTrackingDist, "particleCount": particleCount,
+              "shBasis": shBasis, "sphere": sphere, "voxelSize": voxelSize, "randomSeed": randomSeed}
+    arrays = dict(zip(PFT_ARRAY_NAMES, [shCoeffs, pveWm, pveGm, pveCsf]))
+    mappedPaths = {}
+    if shToPmf:
+        # The particles explore white and grey matter; CMC stops them in CSF
+        pmfPath = pmfVolumePath(np.asarray(shCoeffs), (np.asarray(pveWm) > 0) | (np.asarray(pveGm) > 0),
+                                sphereName=sphere, shBasis=shBasis, cacheDir=pmfCacheDir)
+        if pmfPath is not None:
+            mappedPaths["pmf"] = pmfPath
+            del arrays["odf"]
+    # Streamlines come out in RAS mm: the tracking is given the image affine
+    return _trackInPool(outputPath, referenceImg, np.eye(4), arrays, seeds, params,
+                        _initPftWorker, _trackPftChunk, saveSeeds, nbProcesses, seedsPerChunk, fileType,
+                        mappedPaths, dryRun)
+
+
+def _trackInPool(outputPath, referenceImg, affineToRasmm, arrays, seeds, params, initWorker, trackChunk,
+                 saveSeeds, nbProcesses, seedsPerChunk, fileType, mappedPaths=None, dryRun=False):
+    """
+    Share `arrays`, track the seed chunks with `trackChunk` in a pool, and write them in order.
+
+    `mappedPaths` are `.npy` files already on disk (e.g. a cached PMF
+    volume), mapped by the workers in place.
+    """
+    nbProcesses = nbProcesses or availableCores()
+    chunks = chunkSeeds(seeds, seedsPerChunk)
+    folder = sharedFolder("slicertracto_tracking_", sharedArraysBytes(arrays))
+    nbWritten = 0
+    pool = None
+    try:
+        arrayPaths = shareArrays(arrays, folder)
+        arrayPaths.update(mappedPaths or {})
+
+        if dryRun:
+            initWorker(arrayPaths, params)
+            estimate = _dryRun(chunks, trackChunk, nbProcesses, arrayPaths)
+            print(f"[SLICER TRACTO]Dry run: {estimate}")
+            return estimate
+
+        if nbProcesses > 1 and len(chunks) > 1:
+            # spawn rather than fork: the workers must not inherit the Qt application state
+            context = multiprocessing.get_context("spawn")
+            nbProcesses = min(nbProcesses, len(chunks))
+            pool = context.Pool(nbProcesses, initializer=initWorker, initargs=(arrayPaths, params))
+            results = _orderedResults(pool, trackChunk, chunks, nbProcesses * CHUNKS_IN_FLIGHT_PER_PROCESS)
+        else:
+            initWorker(arrayPaths, params)
+            results = map(trackChunk, chunks)
+
+        pendingSeeds = collections.deque()
+
+        def iterStreamlines():
+            nonlocal nbWritten
+            for i, (streamlines, chunk_seeds) in enumerate(results):
+                for streamline, seed in zip(streamlines, chunk_seeds):
+                    if saveSeeds:
+                        pendingSeeds.append(seed)
+                    yield streamline
+                nbWritten += len(streamlines)
+                print(f"[SLICER TRACTO]Tracked seed chunk {i + 1}/{len(chunks)} ({nbWritten} streamlines)")
+
+        def iterSeeds():
+            # Read in lockstep with iterStreamlines: the seed of the streamline just written
+            while pendingSeeds:
+                yield pendingSeeds.popleft()
+
+        # Generator functions for the streamlines (not `from_data_func`, whose items skip
+        # the affines the writer applies), called once while the file is written
+        dps = {"seeds": iterSeeds} if saveSeeds else {}
+        tractogram = LazyTractogram(iterStreamlines, dps, affine_to_rasmm=affineToRasmm)
+        header = create_tractogram_header(fileType, *get_reference_info(referenceImg))
+        nib.streamlines.save(tractogram, outputPath, header=header)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        _WORKER.clear()
+        shutil.rmtree(folder, ignore_errors=True)
+    return nbWritten
+
+
+def _orderedResults(pool, trackChunk, chunks, maxInFlight):
+    """
+    Results of `trackChunk` on the chunks, in order.
+
+    Unlike `pool.imap`, which queues every chunk at once, at most
+    `maxInFlight` chunks are submitted ahead of the one being written, so
+    lazily generated seeds are only materialized a few chunks at a time.
+    """
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(trackChunk, (chunk,)))
+        if len(pending) >= maxInFlight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _dryRun(chunks, trackChunk, nbProcesses, arrayPaths):
+    """Track seeds of chunks spread over the mask in this process and extrapolate to the whole run."""
+    nbChunks = len(chunks)
+    nbSeeds = chunks.nbSeeds if isinstance(chunks, SeedChunks) else sum(len(chunk) for chunk in chunks)
+    chunkSeedCount = chunks.chunkSeedCount if isinstance(chunks, SeedChunks) else max(map(len, chunks), default=0)
+    nbProcesses = max(1, min(nbProcesses, nbChunks))
+
+    probeIndices = np.unique(np.linspace(0, nbChunks - 1, min(nbChunks, DRY_RUN_PROBE_CHUNKS)).astype(int))
+    perChunk = -(-DRY_RUN_PROBE_SEEDS // max(1, len(probeIndices)))
+    probe = [chunks[i][:perChunk] for i in probeIndices]
+    probe = np.concatenate(probe) if probe else np.zeros((0, 3))
+
+    start = time.perf_counter()
+    streamlines, _ = trackChunk(probe) if len(probe) else ([], [])
+    seconds = time.perf_counter() - start
+
+    # Mapped files count once: the processes share their pages
+    sharedBytes = sum(_allocatedBytes(path) for path in arrayPaths.values())
+    inFlightBytes = nbProcesses * CHUNKS_IN_FLIGHT_PER_PROCESS * chunkSeedCount * SEED_BYTES
+    if isinstance(chunks, SeedChunks):
+        inFlightBytes += chunks.indexBytes
+    return TrackingEstimate(nbSeeds, nbChunks, nbProcesses, sharedBytes, inFlightBytes, nbSeeds * SEED_BYTES,
+                            len(probe), seconds, len(streamlines), sum(len(s) for s in streamlines))
+
+
+def _allocatedBytes(path):
+    """Disk (or shared memory) space of a file; less than its size for a sparse PMF volume."""
+    stat = os.stat(path)
+    return stat.st_blocks * 512 if hasattr(stat, "st_blocks") else stat.st_size
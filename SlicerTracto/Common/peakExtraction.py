@@ -0,0 +1,222 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dipy.core.sphere import HemiSphere
+
+DEFAULT_NPEAKS = 5
+DEFAULT_MIN_SEPARATION_ANGLE = 25
+DEFAULT_VOXELS_PER_CHUNK = 4_096
+
+
+def neighborTable(edges, nbVertices):
+    """
+    Neighbors of every vertex of a sphere as a `(nbVertices, maxDegree)` array.
+
+    Rows are padded with the vertex itself, which is neutral for the
+    comparisons done in `localMaxima`.
+    """
+    edges = np.asarray(edges, dtype=np.intp)
+    pairs = np.concatenate([edges, edges[:, ::-1]])
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    degree = np.bincount(pairs[:, 0], minlength=nbVertices)
+    table = np.repeat(np.arange(nbVertices)[:, None], max(degree.max(), 1), axis=1)
+    rank = np.arange(len(pairs)) - np.repeat(np.cumsum(degree) - degree, degree)
+    table[pairs[:, 0], rank] = pairs[:, 1]
+    return table
+
+
+def localMaxima(sf, neighbors, candidates=None):
+    """
+    Local maxima of spherical functions, for many voxels at once.
+
+    Same definition as dipy's `peak_directions`: a vertex is a maximum if it
+    is >= all its neighbors and > at least one of them (so a constant
+    function has none).
+
+    Parameters
+    ----------
+    sf : (N, V) ndarray
+        One spherical function per row.
+    neighbors : (V, D) ndarray
+        Output of `neighborTable`.
+    candidates : (N, V) bool ndarray, optional
+        Only test these vertices, e.g. the ones above a peak threshold.
+
+    Returns
+    -------
+    rows, vertexIndices : ndarray
+        Positions of the maxima, sorted by row then vertex.
+    """
+    nbVertices = sf.shape[1]
+    if candidates is None:
+        rows, vertexIndices = np.divmod(np.arange(sf.size), nbVertices)
+    else:
+        rows, vertexIndices = np.nonzero(candidates)
+
+    # Compare the candidates with one neighbor at a time, dropping the ones
+    # already below a neighbor: only a shrinking subset of the SF is read
+    flatSf = sf.ravel()
+    remaining = np.arange(len(rows))
+    rowOffsets = rows * nbVertices
+    remainingVertices = vertexIndices
+    values = flatSf[rowOffsets + vertexIndices]
+    higher = np.zeros(len(rows), dtype=bool)
+    for d in range(neighbors.shape[1]):
+        neighborValues = flatSf[rowOffsets + neighbors[remainingVertices, d]]
+        # The padding (the vertex itself) never changes these comparisons
+        higher |= values > neighborValues
+        notLower = values >= neighborValues
+        remaining, rowOffsets, remainingVertices, values, higher = (
+            remaining[notLower], rowOffsets[notLower], remainingVertices[notLower],
+            values[notLower], higher[notLower])
+    isMaximum = np.zeros(len(rows), dtype=bool)
+    isMaximum[remaining[higher]] = True
+
+    return rows[isMaximum], vertexIndices[isMaximum]
+
+
+def _peaksFromSf(sf, vertices, neighbors, relativeThreshold, minSeparationAngle, npeaks):
+    """
+    Vectorized equivalent of `dipy.direction.peak_directions` on rows of `sf`.
+
+    Returns the first `npeaks` directions, values and vertex indices of every
+    row, padded with 0 / 0 / -1.
+    """
+    nbVoxels = len(sf)
+    peakDirs = np.zeros((nbVoxels, npeaks, 3))
+    peakValues = np.zeros((nbVoxels, npeaks))
+    peakIndices = np.full((nbVoxels, npeaks), -1, dtype=int)
+
+    # The largest local maximum is the maximum of the SF, so the relative
+    # threshold (on values above max(0, min(sf))) is known beforehand and
+    # only the vertices above it need to be tested
+    sfMax = sf.max(axis=1, keepdims=True)
+    sfMin = np.maximum(sf.min(axis=1, keepdims=True), 0)
+    candidates = sf - sfMin >= relativeThreshold * (sfMax - sfMin)
+    # No peak at all when the SF is negative everywhere
+    candidates &= sfMax >= 0
+    rows, vertexIndices = localMaxima(sf, neighbors, candidates)
+    if not len(rows):
+        return peakDirs, peakValues, peakIndices
+
+    # Candidates of every row by decreasing value, packed in (N, K) arrays
+    values = sf[rows, vertexIndices]
+    order = np.lexsort((vertexIndices, -values, rows))
+    rows, vertexIndices, values = rows[order], vertexIndices[order], values[order]
+    counts = np.bincount(rows, minlength=nbVoxels)
+    ranks = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    nbCandidates = int(counts.max())
+    candidateIndices = np.zeros((nbVoxels, nbCandidates), dtype=int)
+    candidateValues = np.zeros((nbVoxels, nbCandidates))
+    valid = np.zeros((nbVoxels, nbCandidates), dtype=bool)
+    candidateIndices[rows, ranks] = vertexIndices
+    candidateValues[rows, ranks] = values
+    valid[rows, ranks] = True
+
+    # Greedy removal of peaks closer than the separation angle to a larger kept peak
+    directions = vertices[candidateIndices]
+    cosSimilarity = np.cos(np.deg2rad(minSeparationAngle))
+    kept = np.zeros_like(valid)
+    for k in range(nbCandidates):
+        similar = np.abs(np.einsum("nkj,nj->nk", directions[:, :k], directions[:, k])) > cosSimilarity
+        kept[:, k] = valid[:, k] & ~(similar & kept[:, :k]).any(axis=1)
+
+    # Keep the first npeaks, in order
+    slot = np.cumsum(kept, axis=1) - 1
+    rows, columns = np.nonzero(kept & (slot < npeaks))
+    slot = slot[rows, columns]
+    peakDirs[rows, slot] = directions[rows, columns]
+    peakValues[rows, slot] = candidateValues[rows, columns]
+    peakIndices[rows, slot] = candidateIndices[rows, columns]
+    return peakDirs, peakValues, peakIndices
+
+
+def shToPeaks(shData, sphere, bMatrix, relativeThreshold, absoluteThreshold=0.,
+              npeaks=DEFAULT_NPEAKS, minSeparationAngle=DEFAULT_MIN_SEPARATION_ANGLE,
+              voxelsPerChunk=DEFAULT_VOXELS_PER_CHUNK, nbThreads=None):
+    """
+    Peaks of every non-empty voxel of an SH volume, filled in bulk.
+
+    Gives the same peaks as calling scilpy's `get_maximas` voxel per voxel:
+    for each chunk of voxels the SF is one matrix product with `bMatrix`,
+    values below `absoluteThreshold` are set to 0 and the maxima are found on
+    the sphere's neighbor graph for all voxels at once. Chunks are processed
+    by a thread pool; numpy releases the GIL in the heavy operations.
+
+    Parameters
+    ----------
+    shData : (X, Y, Z, C) ndarray
+        SH coefficients.
+    sphere : Sphere
+        Sphere used for the SF, with `edges`.
+    bMatrix : (V, C) ndarray
+        SH basis evaluated on the sphere vertices.
+    relativeThreshold : float
+        Relative peak threshold (as `sf_threshold`).
+    nbThreads : int, optional
+        Number of threads, all cores when None.
+
+    Returns
+    -------
+    peakDirs : (X, Y, Z, npeaks, 3) ndarray
+    peakValues : (X, Y, Z, npeaks) ndarray
+    peakIndices : (X, Y, Z, npeaks) int ndarray, -1 where there is no peak
+    """
+    shape3d = shData.shape[:-1]
+    peakDirs = np.zeros(shape3d + (npeaks, 3))
+    peakValues = np.zeros(shape3d + (npeaks,))
+    peakIndices = np.full(shape3d + (npeaks,), -1, dtype=int)
+
+    voxels = np.flatnonzero(np.sum(shData, axis=-1))
+    flatSh = shData.reshape(-1, shData.shape[-1])
+    bMatrixT = np.ascontiguousarray(np.asarray(bMatrix, dtype=np.float64).T)
+    vertices = np.asarray(sphere.vertices, dtype=np.float64)
+    neighbors = neighborTable(sphere.edges, len(vertices))
+
+    flatDirs = peakDirs.reshape(-1, npeaks, 3)
+    flatValues = peakValues.reshape(-1, npeaks)
+    flatIndices = peakIndices.reshape(-1, npeaks)
+
+    def processChunk(chunk):
+        sf = np.dot(flatSh[chunk].astype(np.float64), bMatrixT)
+        sf[sf < absoluteThreshold] = 0.
+        dirs, values, indices = _peaksFromSf(sf, vertices, neighbors, relativeThreshold,
+                                             minSeparationAngle, npeaks)
+        flatDirs[chunk] = dirs
+        flatValues[chunk] = values
+        flatIndices[chunk] = indices
+
+    chunks = [voxels[i:i + voxelsPerChunk] for i in range(0, len(voxels), voxelsPerChunk)]
+    nbThreads = nbThreads or os.cpu_count() or 1
+    if nbThreads > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(min(nbThreads, len(chunks))) as executor:
+            # Consume the results to re-raise errors from the workers
+            list(executor.map(processChunk, chunks))
+    else:
+        for chunk in chunks:
+            processChunk(chunk)
+    return peakDirs, peakValues, peakIndices
+
+
+def peaksToIndices(peakData, sphere):
+    """
+    Norms and closest sphere vertices of a peaks volume (`(X, Y, Z, 3 * npeaks)`).
+
+    Vectorized equivalent of `np.linalg.norm` and `sphere.find_closest` per
+    peak of every non-empty voxel; empty voxels are left at 0.
+    """
+    shape3d = peakData.shape[:-1]
+    npeaks = peakData.shape[-1] // 3
+    peakValues = np.zeros(shape3d + (npeaks,))
+    peakIndices = np.zeros(shape3d + (npeaks,))
+
+    voxels = np.flatnonzero(np.sum(peakData, axis=-1))
+    peaks = peakData.reshape(-1, npeaks, 3)[voxels].astype(np.float64)
+    cosSimilarity = np.dot(peaks, np.asarray(sphere.vertices, dtype=np.float64).T)
+    if isinstance(sphere, HemiSphere):
+        cosSimilarity = np.abs(cosSimilarity)
+
+    peakValues.reshape(-1, npeaks)[voxels] = np.linalg.norm(peaks, axis=-1)
+    peakIndices.reshape(-1, npeaks)[voxels] = np.argmax(cosSimilarity, axis=-1)
+    return peakValues, peakIndices
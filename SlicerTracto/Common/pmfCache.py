@@ -0,0 +1,197 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from dipy.core.sphere import HemiSphere
+from dipy.data import get_sphere
+from dipy.reconst.shm import order_from_ncoef, sh_to_sf_matrix
+from scipy.ndimage import binary_dilation
+
+from resourcePlanner import MIB, availableMemoryBytes
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".slicertracto", "pmf_cache")
+DEFAULT_MAX_SIZE_MB = 16384
+# Share of the free memory a PMF volume may take; above it tracking evaluates the SH instead
+PMF_MEMORY_FRACTION = 0.5
+# dipy's PMF direction getters only read double buffers: a float32 volume would be
+# copied in every worker, which defeats mapping it
+PMF_DTYPE = np.float64
+# Voxels converted per matrix product, bounding the temporary memory of the conversion
+CONVERSION_CHUNK_VOXELS = 20_000
+# Part of the keys: bump when the conversion changes
+PMF_VERSION = 2
+
+
+def pmfVolumeBytes(nbVoxels, nbDirections):
+    """Memory the PMF of `nbVoxels` voxels sampled on `nbDirections` directions takes once mapped."""
+    return int(nbVoxels) * int(nbDirections) * np.dtype(PMF_DTYPE).itemsize
+
+
+def trackingSphere(sphereName):
+    """
+    Hemisphere the direction getters sample, as built from the SH coefficients.
+
+    With `repulsion724`, the same vertices as dipy's `default_sphere`.
+    """
+    return HemiSphere.from_sphere(get_sphere(name=sphereName))
+
+
+class PmfCache:
+    """
+    On-disk LRU cache of fODF PMF volumes (SH coefficients evaluated on a sphere).
+
+    Tracking from the SH evaluates the fODF at every step; a precomputed PMF
+    volume replaces that with a lookup. Entries are `.npy` files of shape
+    `sh.shape[:3] + (nbDirections,)`, memory-mapped by the tracking workers.
+    Only the voxels of the tracking mask are converted and written: the rest
+    of the file is a hole (zeros) taking neither disk nor memory.
+
+    Entries are keyed by the bytes of the SH coefficients and of the mask,
+    the sphere and the basis, so repeated runs on the same FODF pay the
+    conversion once. Reading an entry refreshes its modification time; when
+    the cache grows above `maxSizeMB`, the least recently used entries are
+    removed. Entries are written to a temporary file and renamed, so several
+    processes can share the cache. The cache is in `DEFAULT_CACHE_DIR` unless
+    `cacheDir` is given.
+    """
+
+    def __init__(self, cacheDir=None, maxSizeMB=DEFAULT_MAX_SIZE_MB):
+        self.cacheDir = cacheDir or DEFAULT_CACHE_DIR
+        self.maxSizeBytes = int(maxSizeMB * MIB)
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def key(self, shCoeffs, mask, sphereName, shBasis):
+        """Cache key of the PMF of SH coefficients restricted to a mask."""
+        sha = hashlib.sha256()
+        for array in (np.ascontiguousarray(shCoeffs), np.ascontiguousarray(mask, dtype=bool)):
+            sha.update(str(array.dtype).encode())
+            sha.update(np.asarray(array.shape, dtype=np.int64).tobytes())
+            sha.update(array.tobytes())
+        sha.update(f"{sphereName}|{shBasis}|{PMF_VERSION}".encode())
+        return sha.hexdigest()
+
+    def _entryPath(self, key):
+        return os.path.join(self.cacheDir, f"{key}.npy")
+
+    def get(self, key):
+        """Path of the cached PMF volume, or None on a miss."""
+        path = self._entryPath(key)
+        try:
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            return None
+        return path
+
+    def getOrCompute(self, shCoeffs, mask, sphereName="repulsion724", shBasis=None):
+        """
+        Path of the PMF volume of `shCoeffs` inside `mask`, converting it on a miss only.
+
+        The fODF is stored as evaluated, negative values included: the
+        direction getters interpolate it as they interpolate the SH (the
+        evaluation is linear), so both track along the same directions.
+        Clipping it first would change the interpolated values wherever a
+        voxel next to the current point has negative lobes. Returns None
+        when the volume does not fit on the cache's disk.
+        """
+        key = self.key(shCoeffs, mask, sphereName, shBasis)
+        path = self.get(key)
+        if path is not None:
+            print(f"[SLICER TRACTO]PMF cache hit: {path}")
+            return path
+
+        sphere = trackingSphere(sphereName)
+        voxels = np.flatnonzero(np.asarray(mask, dtype=bool))
+        if pmfVolumeBytes(len(voxels), sphere.vertices.shape[0]) > shutil.disk_usage(self.cacheDir).free:
+            print(f"[SLICER TRACTO]PMF volume does not fit in {self.cacheDir}")
+            return None
+        shFlat = np.asarray(shCoeffs).reshape(-1, shCoeffs.shape[-1])
+        B = sh_to_sf_matrix(sphere, sh_order_max=order_from_ncoef(shFlat.shape[1]), basis_type=shBasis,
+                            return_inv=False)
+
+        fd, tmpPath = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        os.close(fd)
+        try:
+            pmf = np.lib.format.open_memmap(tmpPath, mode="w+", dtype=PMF_DTYPE,
+                                            shape=shCoeffs.shape[:3] + (sphere.vertices.shape[0],))
+            pmfFlat = pmf.reshape(-1, pmf.shape[-1])
+            for start in range(0, len(voxels), CONVERSION_CHUNK_VOXELS):
+                chunk = voxels[start:start + CONVERSION_CHUNK_VOXELS]
+                pmfFlat[chunk] = shFlat[chunk] @ B
+            pmf.flush()
+            del pmf, pmfFlat
+            os.replace(tmpPath, self._entryPath(key))
+        except BaseException:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+            raise
+        print(f"[SLICER TRACTO]Converted the SH of {len(voxels)} voxels to a PMF volume "
+              f"({pmfVolumeBytes(len(voxels), sphere.vertices.shape[0]) / MIB:.0f} MiB)")
+        self.evict()
+        return self._entryPath(key)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cacheDir, name))
+            except FileNotFoundError:
+                continue
+            # Allocated size: the volumes are sparse files
+            size = stat.st_blocks * 512 if hasattr(stat, "st_blocks") else stat.st_size
+            entries.append((stat.st_mtime_ns, size, name))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in its size cap."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.maxSizeBytes:
+                break
+            try:
+                os.remove(os.path.join(self.cacheDir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(".npy"):
+                os.remove(os.path.join(self.cacheDir, name))
+
+
+def pmfVolumePath(shCoeffs, mask, sphereName="repulsion724", shBasis=None, cache=None, cacheDir=None,
+                  memoryFraction=PMF_MEMORY_FRACTION):
+    """
+    Cached PMF volume of `shCoeffs` inside `mask` to track on, or None to track on the SH.
+
+    The volume is used when its in-mask part fits in `memoryFraction` of the
+    free memory (the workers share its pages) and on the cache's disk;
+    otherwise tracking falls back to evaluating the SH coefficients, which
+    costs more per step but only the coefficients in memory.
+
+    The mask is dilated by one voxel, so that the interpolation of the PMF
+    inside the mask only reads converted voxels. The volume is kept in
+    `cache`, or in a `PmfCache` of `cacheDir` (the default cache when None).
+    """
+    mask = binary_dilation(np.asarray(mask, dtype=bool))
+    nbVoxels = int(np.count_nonzero(mask))
+    nbDirections = trackingSphere(sphereName).vertices.shape[0]
+    pmfBytes = pmfVolumeBytes(nbVoxels, nbDirections)
+    shBytes = int(np.prod(shCoeffs.shape)) * np.dtype(PMF_DTYPE).itemsize
+    print(f"[SLICER TRACTO]PMF volume: {nbVoxels} voxels x {nbDirections} directions = "
+          f"{pmfBytes / MIB:.0f} MiB (SH coefficients: {shBytes / MIB:.0f} MiB)")
+
+    freeBytes = availableMemoryBytes()
+    if freeBytes is not None and pmfBytes > freeBytes * memoryFraction:
+        print(f"[SLICER TRACTO]PMF volume does not fit in memory ({freeBytes / MIB:.0f} MiB free), "
+              f"tracking on the SH coefficients")
+        return None
+    path = (cache or PmfCache(cacheDir)).getOrCompute(shCoeffs, mask, sphereName=sphereName, shBasis=shBasis)
+    if path is None:
+        print("[SLICER TRACTO]Tracking on the SH coefficients")
+    return path
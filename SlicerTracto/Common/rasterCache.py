@@ -0,0 +1,134 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from contentHash import HashIndex
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".slicertracto", "raster_cache")
+DEFAULT_MAX_SIZE_MB = 2048
+
+
+class RasterCache:
+    """
+    On-disk LRU cache of voxelized tractograms (streamline counts per voxel).
+
+    Entries are keyed by the content hash of the tractogram file plus the
+    reference geometry (affine and dimensions) it is rasterized on, and the
+    kind of map. Each entry is a compressed `.npz` holding the flat indices
+    of the touched voxels, their counts, the affine and the dimensions.
+    Reading an entry refreshes its modification time; when the cache grows
+    above `maxSizeMB`, the least recently used entries are removed.
+
+    The cache can be shared by several processes: entries are written to a
+    temporary file and renamed, and missing files are treated as misses.
+    """
+
+    def __init__(self, cacheDir=DEFAULT_CACHE_DIR, maxSizeMB=DEFAULT_MAX_SIZE_MB):
+        self.cacheDir = cacheDir
+        self.maxSizeBytes = int(maxSizeMB * 1024 * 1024)
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self._hashIndex = HashIndex(self.cacheDir)
+
+    # -------------------------------------------------------------------------
+    # Keys
+    # -------------------------------------------------------------------------
+    def contentHash(self, tractogramPath):
+        """Content hash of a tractogram, remembered per (path, size, mtime) (see `HashIndex`)."""
+        return self._hashIndex.contentHash(tractogramPath)
+
+    def key(self, tractogramPath, affine, dimensions, kind="tract_counts"):
+        """Cache key of a tractogram rasterized on a given grid."""
+        sha = hashlib.sha256()
+        sha.update(self.contentHash(tractogramPath).encode())
+        sha.update(np.round(np.asarray(affine, dtype=np.float64), 6).tobytes())
+        sha.update(np.asarray(dimensions, dtype=np.int64).tobytes())
+        sha.update(kind.encode())
+        return sha.hexdigest()
+
+    # -------------------------------------------------------------------------
+    # Entries
+    # -------------------------------------------------------------------------
+    def _entryPath(self, key):
+        return os.path.join(self.cacheDir, f"{key}.npz")
+
+    def get(self, key):
+        """Return `(indices, counts, affine, dimensions)` or None on a miss."""
+        path = self._entryPath(key)
+        try:
+            with np.load(path) as entry:
+                result = (entry["indices"].astype(np.int64), entry["counts"].astype(np.int64),
+                          entry["affine"], entry["dimensions"])
+            os.utime(path)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+        return result
+
+    def put(self, key, indices, counts, affine, dimensions):
+        """Store a sparse map, then evict old entries if the cache is over its size cap."""
+        fd, tmpPath = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, indices=np.asarray(indices, dtype=np.int64),
+                                counts=np.asarray(counts, dtype=np.int32),
+                                affine=np.asarray(affine, dtype=np.float64),
+                                dimensions=np.asarray(dimensions, dtype=np.int64))
+        os.replace(tmpPath, self._entryPath(key))
+        self.evict()
+
+    def getOrCompute(self, tractogramPath, affine, dimensions, compute, kind="tract_counts"):
+        """
+        Return the sparse `(indices, counts)` of a tractogram, rasterizing it on a miss only.
+
+        `compute()` must return the sorted flat voxel indices and counts.
+        """
+        key = self.key(tractogramPath, affine, dimensions, kind)
+        entry = self.get(key)
+        if entry is not None:
+            print(f"[SLICER TRACTO]Raster cache hit: {tractogramPath}")
+            return entry[0], entry[1]
+        indices, counts = compute()
+        self.put(key, indices, counts, affine, dimensions)
+        return indices, counts
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in its size cap."""
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cacheDir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.maxSizeBytes:
+                break
+            try:
+                os.remove(os.path.join(self.cacheDir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cacheDir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cacheDir, name))
+        self._hashIndex.clear()
+
+
+def sparseToDense(indices, counts, dimensions, dtype=np.int32):
+    """Dense volume from sparse flat (C order) voxel indices and counts."""
+    dense = np.zeros(int(np.prod(dimensions)), dtype=dtype)
+    dense[indices] = counts
+    return dense.reshape(tuple(int(d) for d in dimensions))
+
+
+def denseToSparse(volume):
+    """Sorted flat voxel indices and values of the non-zero voxels of a volume."""
+    flat = np.asarray(volume).ravel()
+    indices = np.flatnonzero(flat)
+    return indices.astype(np.int64), flat[indices].astype(np.int64)
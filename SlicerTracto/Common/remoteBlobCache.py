@@ -0,0 +1,158 @@
+import os
+import posixpath
+import re
+import shlex
+
+from contentHash import HashIndex
+from fileTransfer import FileTransfer
+
+LOCAL_INDEX_FOLDER = os.path.join(os.path.expanduser("~"), ".slicertracto")
+LOCAL_INDEX_FILE_NAME = "upload_hashes.json"
+DEFAULT_MAX_AGE_DAYS = 14
+DEFAULT_MAX_SIZE_GB = 50
+# Names of the blobs: anything else in the cache folder (e.g. the `.part` of an upload) is not evicted
+BLOB_NAME = re.compile(r"[0-9a-f]{64}")
+
+
+class RemoteBlobCache:
+    """
+    Content-addressed store of uploaded files on the remote server.
+
+    Each file is uploaded once to `<cacheFolder>/<sha256>`. `stage` hashes
+    the local files (hashes are remembered per path, size and mtime, see
+    `contentHash.HashIndex`), asks the server in one command which blobs
+    it already has, uploads only the missing ones and symlinks every
+    destination path (e.g. a job's `Input/sample_dwi.nii`) to its blob.
+    Re-running the same subject therefore uploads nothing.
+
+    Using a blob refreshes its modification time; `evict` removes the blobs
+    unused for `maxAgeDays`, then the least recently used ones until the
+    cache fits in `maxSizeGB`. Blobs still linked from `linkFolders` are
+    kept: the job whose workspace links them may be queued or running.
+    Removing a workspace (see `evictWorkspaces`) only removes symlinks,
+    which releases their blobs.
+
+    Parameters
+    ----------
+    client : paramiko.SSHClient
+        Connected client (see `sshSessionPool`).
+    cacheFolder : str
+        Absolute remote folder of the blobs (symlink targets must be absolute).
+    linkFolders : list of str, optional
+        Remote folders searched for symlinks to the blobs; by default the
+        folder holding `cacheFolder`, under which the job workspaces of
+        every module are.
+    """
+
+    def __init__(self, client, cacheFolder, maxAgeDays=DEFAULT_MAX_AGE_DAYS, maxSizeGB=DEFAULT_MAX_SIZE_GB,
+                 hashIndex=None, transfer=None, linkFolders=None):
+        self.client = client
+        self.cacheFolder: str = cacheFolder.rstrip("/")
+        self.linkFolders: list = list(linkFolders or [posixpath.dirname(self.cacheFolder)])
+        self.maxAgeDays: float = maxAgeDays
+        self.maxSizeGB: float = maxSizeGB
+        if hashIndex is None:
+            os.makedirs(LOCAL_INDEX_FOLDER, exist_ok=True)
+            hashIndex = HashIndex(LOCAL_INDEX_FOLDER, LOCAL_INDEX_FILE_NAME)
+        self.hashIndex = hashIndex
+        self.transfer = transfer or FileTransfer(client)
+
+    def _run(self, command):
+        """Run a remote shell command; raises with its stderr on failure."""
+        stdin, stdout, stderr = self.client.exec_command(command)
+        output = stdout.read().decode()
+        if stdout.channel.recv_exit_status() != 0:
+            raise RuntimeError(f"Remote command failed: {command}\n{stderr.read().decode()}")
+        return output
+
+    def blobPath(self, contentHash):
+        return f"{self.cacheFolder}/{contentHash}"
+
+    def missing(self, hashes):
+        """The hashes among `hashes` without a blob on the server (one round trip)."""
+        if not hashes:
+            return set()
+        names = " ".join(shlex.quote(contentHash) for contentHash in sorted(set(hashes)))
+        output = self._run(f"mkdir -p {shlex.quote(self.cacheFolder)} && cd {shlex.quote(self.cacheFolder)} && "
+                           f"for blob in {names}; do [ -f \"$blob\" ] || echo \"$blob\"; done")
+        return set(output.split())
+
+    def stage(self, pairs):
+        """
+        Make every remote path of `(local path, remote path)` pairs a symlink to its blob.
+
+        Pairs with an empty local path are ignored. Returns `{remote path: hash}`.
+        """
+        pairs = [(localPath, remotePath) for localPath, remotePath in pairs if localPath]
+        hashes = {remotePath: self.hashIndex.contentHash(localPath) for localPath, remotePath in pairs}
+
+        toUpload = self.missing(hashes.values())
+        uploads, seen = [], set()
+        for localPath, remotePath in pairs:
+            contentHash = hashes[remotePath]
+            if contentHash in toUpload and contentHash not in seen:
+                seen.add(contentHash)
+                uploads.append((localPath, self.blobPath(contentHash)))
+        print(f"[SLICER TRACTO]{len(pairs) - len(uploads)} of {len(pairs)} inputs already on the server")
+        if uploads:
+            self.transfer.uploadMany(uploads)
+
+        commands = []
+        for remotePath, contentHash in hashes.items():
+            blob = shlex.quote(self.blobPath(contentHash))
+            target = shlex.quote(remotePath)
+            commands.append(f"mkdir -p {shlex.quote(posixpath.dirname(remotePath))} && "
+                            f"rm -f {target} && ln -s {blob} {target} && touch {blob}")
+        if commands:
+            self._run(" && ".join(commands))
+        return hashes
+
+    def evict(self):
+        """
+        Remove blobs unused for `maxAgeDays`, then the oldest until under `maxSizeGB`.
+
+        Only files named as blobs are considered, and blobs linked from
+        `linkFolders` are never removed (they still count in the size).
+        A blob used again since it was listed is kept. Returns the names of
+        the blobs selected for removal.
+        """
+        folder = shlex.quote(self.cacheFolder)
+        links = " ".join(shlex.quote(linkFolder) for linkFolder in self.linkFolders)
+        output = self._run(f"mkdir -p {folder} && cd {folder} && date +%s && "
+                           f"find . -maxdepth 1 -type f -printf '%T@ %s %f\\n' && echo && "
+                           f"{{ find {links} -type l -lname {shlex.quote(self.cacheFolder + '/*')} "
+                           f"-printf '%l\\n' 2>/dev/null || true; }}")
+        header, _, linked = output.partition("\n\n")
+        lines = header.splitlines()
+        now = int(lines[0])
+        blobs = {}
+        for line in lines[1:]:
+            mtime, size, name = line.split(" ", 2)
+            if BLOB_NAME.fullmatch(name):
+                blobs[name] = (int(mtime.split(".")[0]), int(size))
+        inUse = {posixpath.basename(target) for target in linked.split()}
+
+        maxAge = self.maxAgeDays * 24 * 3600
+        toRemove = [name for name, (mtime, _) in blobs.items() if now - mtime > maxAge and name not in inUse]
+        total = sum(size for name, (_, size) in blobs.items() if name not in toRemove)
+        maxBytes = int(self.maxSizeGB * 1024 ** 3)
+        for name in sorted(blobs, key=blobs.get):
+            if total <= maxBytes:
+                break
+            if name not in inUse and name not in toRemove:
+                toRemove.append(name)
+                total -= blobs[name][1]
+        if not toRemove:
+            return []
+
+        # Removed only if unchanged: `stage` touches a blob when a new job links it
+        self._run(f"cd {folder} && " + " ".join(f"[ \"$(stat -c %Y {name} 2>/dev/null)\" = {blobs[name][0]} ] && "
+                                                f"rm -f {name};" for name in toRemove) + " true")
+        return toRemove
+
+    def evictWorkspaces(self, workspacesFolder):
+        """Remove job workspaces (folders of symlinks and outputs) older than `maxAgeDays`."""
+        folder = shlex.quote(workspacesFolder)
+        self._run(f"mkdir -p {folder} && "
+                  f"find {folder} -mindepth 1 -maxdepth 1 -type d -mtime +{int(self.maxAgeDays)} "
+                  f"-exec rm -rf {{}} +")
@@ -0,0 +1,352 @@
+import collections
+import shlex
+import threading
+import time
+import uuid
+
+try:
+    import qt
+except ImportError:
+    qt = None
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+POLL_INTERVAL_S = 5.
+DELIVERY_INTERVAL_MS = 500
+JOB_LOG_NAME = "job.log"
+JOB_STATUS_NAME = "job.status"
+JOB_STATES = ("queued", "running", "finished", "failed", "cancelled")
+
+
+class PollAgainError(RuntimeError):
+    """The remote side could not tell the state of a job this round (e.g. a batch scheduler busy)."""
+
+
+# Errors of a poll that say nothing about the job itself: it keeps running, polled again next round
+RETRY_ERRORS = (OSError, EOFError, PollAgainError) + ((paramiko.SSHException,) if paramiko is not None else ())
+
+
+def runRemoteCommand(client, command):
+    """Run a shell command over SSH and return its stdout; raises with its stderr on failure."""
+    stdin, stdout, stderr = client.exec_command(command)
+    output = stdout.read().decode()
+    if stdout.channel.recv_exit_status() != 0:
+        raise RuntimeError(f"Remote command failed: {command}\n{stderr.read().decode()}")
+    return output
+
+
+class NohupBackend:
+    """
+    Run a job as a detached process on the host the client is connected to.
+
+    The command runs under `nohup` in the job folder with its output in
+    `job.log`; its exit status is written to `job.status` when it ends, so
+    the process survives a dropped connection and is polled by reading files.
+    """
+
+    name = "nohup"
+
+    def submit(self, client, job):
+        """Start the job in its own process group; returns its remote id (the group's process id)."""
+        # A subshell, so that a command ending with `exit` still records its status
+        script = f"({job.command}); echo $? > {JOB_STATUS_NAME}"
+        folder = shlex.quote(job.folder)
+        output = runRemoteCommand(client, f"mkdir -p {folder} && cd {folder} && rm -f {JOB_STATUS_NAME} && "
+                                         f"{{ setsid nohup bash -c {shlex.quote(script)} > {JOB_LOG_NAME} 2>&1 < /dev/null & "
+                                         f"echo $!; }}")
+        return output.strip()
+
+    def status(self, client, job):
+        """`None` while the job runs, otherwise its exit code (-1 if it died without one)."""
+        statusPath = shlex.quote(job.remotePath(JOB_STATUS_NAME))
+        output = runRemoteCommand(client, f"if kill -0 {int(job.remoteId)} 2>/dev/null; then echo running; "
+                                         f"else cat {statusPath} 2>/dev/null || echo -1; fi").strip()
+        return None if output == "running" else int(output)
+
+    def cancel(self, client, job):
+        runRemoteCommand(client, f"kill -TERM -- -{int(job.remoteId)} 2>/dev/null || true")
+
+
+class RemoteJob:
+    """
+    A script run on the remote server without blocking Slicer.
+
+    The callables run on the queue's worker thread, in this order:
+    `connect()` returns a connected client, `prepare(client)` stages the
+    inputs, the backend starts `command` in `folder`, and once it exits
+    successfully `collect(client)` fetches the outputs. `onFinished(job)`
+    is then called on the Slicer main thread, whatever the outcome.
+
+    Parameters
+    ----------
+    name : str
+        Shown in the log lines and job listings (e.g. the subject name).
+    exclusiveKey : str
+        Jobs with the same key run one at a time, in submission order (for
+        scripts that read and write fixed remote paths).
+    backend : object
+        How the command is started and polled (`NohupBackend`, or a batch
+        scheduler from `jobSchedulers`); defaults to the queue's backend.
+    resources : jobSchedulers.JobResources
+        CPU, memory and time requested from a batch scheduler.
+    """
+
+    def __init__(self, name, command, folder, connect, prepare=None, collect=None, onFinished=None,
+                 exclusiveKey=None, backend=None, resources=None):
+        self.jobId: str = uuid.uuid4().hex[:8]
+        self.name: str = name
+        self.command: str = command
+        self.folder: str = folder.rstrip("/")
+        self.connect = connect
+        self.prepare = prepare
+        self.collect = collect
+        self.onFinished = onFinished
+        self.exclusiveKey = exclusiveKey
+        self.backend = backend
+        self.resources = resources
+
+        self.state: str = "queued"
+        self.remoteId: str = None
+        self.exitCode: int = None
+        self.error: str = None
+        self.logOffset: int = 0
+        self.submitTime: float = time.time()
+        self.startTime: float = None
+        self.endTime: float = None
+
+    def remotePath(self, fileName):
+        return f"{self.folder}/{fileName}"
+
+    @property
+    def done(self):
+        return self.state in ("finished", "failed", "cancelled")
+
+    def __str__(self):
+        text = f"{self.name} [{self.jobId}] {self.state}"
+        if self.startTime is not None:
+            text += f" ({(self.endTime or time.time()) - self.startTime:.0f}s)"
+        if self.error:
+            text += f": {self.error}"
+        return text
+
+
+class RemoteJobQueue:
+    """
+    Submit remote jobs and follow them from a background thread.
+
+    `submit` returns a job id right away. The worker thread starts queued
+    jobs, prints the new lines of every running job's log, and collects the
+    outputs of the jobs that ended. Finished jobs are handed to their
+    `onFinished` callback on the main thread through a Qt timer (directly on
+    the worker thread outside Slicer).
+    """
+
+    def __init__(self, backend=None, pollInterval=POLL_INTERVAL_S):
+        self.backend = backend or NohupBackend()
+        self.pollInterval: float = pollInterval
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._finished = collections.deque()
+        self._thread = None
+        self._timer = None
+        if qt is not None:
+            self._timer = qt.QTimer()
+            self._timer.setInterval(DELIVERY_INTERVAL_MS)
+            self._timer.connect("timeout()", self.deliverFinished)
+            self._timer.start()
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+    def submit(self, job):
+        """Queue a `RemoteJob`; returns its id."""
+        with self._lock:
+            self._jobs[job.jobId] = job
+            self._ensureWorker()
+        print(f"[SLICER TRACTO]Submitted job {job}")
+        self._wake.set()
+        return job.jobId
+
+    def job(self, jobId):
+        return self._jobs.get(jobId)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, jobId):
+        """Cancel a queued or running job (its outputs are not collected)."""
+        job = self._jobs[jobId]
+        with self._lock:
+            if job.done:
+                return
+            wasRunning = job.state == "running"
+            job.state = "cancelled"
+        if wasRunning:
+            try:
+                self._backend(job).cancel(job.connect(), job)
+            except Exception as e:
+                print(f"[SLICER TRACTO][ERROR]Could not cancel job {job}: {e}")
+        self._finish(job)
+
+    def wait(self, jobId, timeout=None):
+        """Block until a job is done (for scripts and tests, not the UI)."""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._jobs[jobId].done:
+            if deadline is not None and time.time() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(min(0.1, self.pollInterval))
+        self.deliverFinished()
+        return True
+
+    def deliverFinished(self):
+        """Call `onFinished` for the jobs that ended since the last call."""
+        while self._finished:
+            job = self._finished.popleft()
+            if job.onFinished is not None:
+                try:
+                    job.onFinished(job)
+                except Exception as e:
+                    print(f"[SLICER TRACTO][ERROR]Job {job.name} callback failed: {e}")
+
+    def shutdown(self):
+        """Stop following jobs; the remote processes keep running."""
+        self._stop.set()
+        self._wake.set()
+        if self._timer is not None:
+            self._timer.stop()
+
+    # -------------------------------------------------------------------------
+    # Worker thread
+    # -------------------------------------------------------------------------
+    def _ensureWorker(self):
+        """Start the worker thread if it is not running (called with the lock held)."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._work, name="SlicerTractoJobs", daemon=True)
+            self._thread.start()
+
+    def _work(self):
+        """Follow the jobs until none is pending; `submit` starts a new worker after that."""
+        while not self._stop.is_set():
+            self.poll()
+            with self._lock:
+                if all(job.done for job in self._jobs.values()):
+                    self._thread = None
+                    return
+            self._wake.wait(self.pollInterval)
+            self._wake.clear()
+        with self._lock:
+            self._thread = None
+
+    def poll(self):
+        """One round: start the jobs that can start, then follow the running ones."""
+        for job in self.jobs():
+            if job.state == "queued" and self._canStart(job):
+                self._start(job)
+            elif job.state == "running":
+                self._follow(job)
+
+    def _backend(self, job):
+        return job.backend or self.backend
+
+    def _canStart(self, job):
+        if job.exclusiveKey is None:
+            return True
+        for other in self.jobs():
+            if other is job:
+                return True
+            if other.exclusiveKey == job.exclusiveKey and not other.done:
+                return False
+        return True
+
+    def _start(self, job):
+        try:
+            client = job.connect()
+            if job.prepare is not None:
+                job.prepare(client)
+            with self._lock:
+                if job.state != "queued":
+                    return
+                job.startTime = time.time()
+                job.remoteId = self._backend(job).submit(client, job)
+                job.state = "running"
+            print(f"[SLICER TRACTO]Started job {job} ({self._backend(job).name} id {job.remoteId})")
+        except Exception as e:
+            self._fail(job, f"submission failed: {e}")
+
+    def _follow(self, job):
+        try:
+            client = job.connect()
+            self._printLog(client, job)
+            exitCode = self._backend(job).status(client, job)
+            if exitCode is None:
+                return
+            self._printLog(client, job)
+        except RETRY_ERRORS as e:
+            # A dropped connection: the job keeps running, try again next round
+            print(f"[SLICER TRACTO][ERROR]Could not poll job {job}: {e}")
+            return
+        except Exception as e:
+            self._fail(job, f"polling failed: {e}")
+            return
+        job.exitCode = exitCode
+        if exitCode != 0:
+            self._fail(job, f"exit status {exitCode}")
+            return
+        if job.collect is not None:
+            try:
+                job.collect(client)
+            except Exception as e:
+                self._fail(job, f"collecting outputs failed: {e}")
+                return
+        with self._lock:
+            if job.state != "running":
+                return
+            job.state = "finished"
+        self._finish(job)
+
+    def _printLog(self, client, job):
+        logPath = shlex.quote(job.remotePath(JOB_LOG_NAME))
+        stdin, stdout, stderr = client.exec_command(f"tail -c +{job.logOffset + 1} {logPath} 2>/dev/null")
+        output = stdout.read()
+        stdout.channel.recv_exit_status()
+        # Only complete lines; a partial last line is printed next round
+        complete = output[:output.rfind(b"\n") + 1]
+        job.logOffset += len(complete)
+        for line in complete.decode(errors="replace").splitlines():
+            print(f"[SLICER TRACTO][{job.name}]{line}")
+
+    def _fail(self, job, error):
+        with self._lock:
+            if job.done:
+                return
+            job.state = "failed"
+            job.error = error
+        self._finish(job)
+
+    def _finish(self, job):
+        job.endTime = time.time()
+        print(f"[SLICER TRACTO]Job {job}")
+        self._finished.append(job)
+        if self._timer is None:
+            self.deliverFinished()
+
+
+_jobQueue = None
+_jobQueueLock = threading.Lock()
+
+
+def remoteJobQueue():
+    """Process-wide job queue, shared by the SSH managers (create it from the main thread)."""
+    global _jobQueue
+    with _jobQueueLock:
+        if _jobQueue is None:
+            _jobQueue = RemoteJobQueue()
+        return _jobQueue
@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Memory of a worker process before it gets any data (interpreter, numpy, dipy, scilpy)
+WORKER_BASELINE_MB = 300
+# Share of the free memory the planner allows itself to use
+MEMORY_FRACTION = 0.8
+# Cores left to Slicer (UI, writers) on machines with enough of them
+RESERVED_CORES = 1
+MIB = 1024 * 1024
+
+
+def availableCores():
+    """Cores this process may run on (CPU affinity aware where the OS reports it)."""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def availableMemoryBytes():
+    """
+    Memory available for new allocations, or None when it cannot be read.
+
+    Uses psutil when installed, otherwise `/proc/meminfo` (Linux) or sysconf.
+    """
+    if psutil is not None:
+        return int(psutil.virtual_memory().available)
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def nbShCoeffs(shOrder):
+    return (shOrder + 1) * (shOrder + 2) // 2
+
+
+class ResourcePlan:
+    """Number of processes chosen for a step, with the figures it was derived from."""
+
+    def __init__(self, step, nbProcesses, nbCores, freeBytes, sharedBytes, perChunkBytes, limitedBy):
+        self.step: str = step
+        self.nbProcesses: int = nbProcesses
+        self.nbCores: int = nbCores
+        self.freeBytes = freeBytes
+        self.sharedBytes: int = sharedBytes
+        self.perChunkBytes: int = perChunkBytes
+        self.limitedBy: str = limitedBy
+
+    @property
+    def estimatedBytes(self):
+        return self.sharedBytes + self.nbProcesses * (self.perChunkBytes + WORKER_BASELINE_MB * MIB)
+
+    def toDict(self):
+        return {"step": self.step, "nbProcesses": self.nbProcesses, "nbCores": self.nbCores,
+                "freeMB": None if self.freeBytes is None else round(self.freeBytes / MIB),
+                "estimatedMB": round(self.estimatedBytes / MIB),
+                "perChunkMB": round(self.perChunkBytes / MIB), "limitedBy": self.limitedBy}
+
+    def __str__(self):
+        free = "unknown" if self.freeBytes is None else f"{self.freeBytes / MIB:.0f} MB"
+        return (f"{self.step}: {self.nbProcesses} processes ({self.limitedBy}; "
+                f"{self.nbCores} cores, {free} free, ~{self.perChunkBytes / MIB:.0f} MB per chunk, "
+                f"~{self.estimatedBytes / MIB:.0f} MB estimated)")
+
+
+def planProcesses(step, sharedBytes, chunkedBytes, maxProcesses=None, nbCores=None, freeBytes=None):
+    """
+    Pick a number of worker processes from the cores and the free memory.
+
+    The memory model follows scilpy's `nbr_processes` helpers: the parent
+    holds `sharedBytes`, and `chunkedBytes` of voxel data are split in one
+    chunk per process (so the total does not grow with the number of
+    processes) on top of a fixed baseline per worker process.
+
+    Parameters
+    ----------
+    step : str
+        Name of the step, for the log.
+    sharedBytes : int
+        Memory held by the parent while the workers run.
+    chunkedBytes : int
+        Memory split across the workers.
+    maxProcesses : int, optional
+        Upper bound (e.g. a user setting).
+    nbCores, freeBytes : optional
+        Override the detected values (tests, remote nodes).
+
+    Returns
+    -------
+    ResourcePlan
+    """
+    nbCores = nbCores or availableCores()
+    if freeBytes is None:
+        freeBytes = availableMemoryBytes()
+
+    nbProcesses = nbCores - RESERVED_CORES if nbCores > 2 else nbCores
+    limitedBy = "cores"
+    if maxProcesses and maxProcesses < nbProcesses:
+        nbProcesses, limitedBy = maxProcesses, "maximum"
+
+    if freeBytes is not None:
+        budget = freeBytes * MEMORY_FRACTION - sharedBytes - chunkedBytes
+        memoryLimit = int(budget // (WORKER_BASELINE_MB * MIB))
+        if memoryLimit < nbProcesses:
+            nbProcesses, limitedBy = memoryLimit, "memory"
+    if nbProcesses < 1:
+        nbProcesses, limitedBy = 1, "memory (below one worker)"
+
+    return ResourcePlan(step, nbProcesses, nbCores, freeBytes, int(sharedBytes),
+                        int(np.ceil(chunkedBytes / nbProcesses)), limitedBy)
+
+
+def planFodfProcesses(dwiShape, shOrder, maxProcesses=None, nbCores=None, freeBytes=None):
+    """
+    Plan `nbr_processes` for the CSD fit, the SH basis conversion and the fODF metrics.
+
+    The estimate comes from the DWI shape: the float32 DWI and the float64
+    SH coefficients stay in the parent, while `fit_from_model` sends each
+    worker a copy of its chunk of voxels (data in flight to the worker plus
+    the copy it unpickles) and gets its coefficients back.
+    """
+    nbVoxels = int(np.prod(dwiShape[:3]))
+    dwiBytes = nbVoxels * int(dwiShape[3]) * np.dtype(np.float32).itemsize
+    shBytes = nbVoxels * nbShCoeffs(shOrder) * np.dtype(np.float64).itemsize
+    return planProcesses("fodf", sharedBytes=dwiBytes + shBytes, chunkedBytes=2 * dwiBytes + shBytes,
+                         maxProcesses=maxProcesses, nbCores=nbCores, freeBytes=freeBytes)
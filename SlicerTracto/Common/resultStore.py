@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from contentHash import HashIndex
+
+DEFAULT_STORE_DIR = os.path.join(os.path.expanduser("~"), ".slicertracto", "result_store")
+DEFAULT_MAX_SIZE_MB = 10240
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class ResultStore:
+    """
+    On-disk LRU store of pipeline outputs, keyed by their inputs and parameters.
+
+    The key is a hash of the content of the input files (not their paths)
+    and of the parameters, so an unchanged subject processed with the same
+    settings maps to the same entry wherever its files live. An entry is a
+    folder holding copies of the output files and a `manifest.json`
+    describing them; reading an entry refreshes its manifest's modification
+    time and the least recently used entries are removed when the store
+    grows above `maxSizeMB`.
+
+    Entries are assembled in a temporary folder and renamed into place, so
+    the store can be shared by several Slicer sessions.
+    """
+
+    def __init__(self, storeDir=DEFAULT_STORE_DIR, maxSizeMB=DEFAULT_MAX_SIZE_MB):
+        self.storeDir = storeDir
+        self.maxSizeBytes = int(maxSizeMB * 1024 * 1024)
+        os.makedirs(self.storeDir, exist_ok=True)
+        self._hashIndex = HashIndex(self.storeDir)
+
+    # -------------------------------------------------------------------------
+    # Keys
+    # -------------------------------------------------------------------------
+    def inputHashes(self, inputPaths):
+        """`{name: content hash}` of the given input files (None values are kept as None)."""
+        return {name: None if path is None else self._hashIndex.contentHash(path)
+                for name, path in inputPaths.items()}
+
+    def key(self, inputPaths, params):
+        """
+        Key of the outputs computed from `inputPaths` (`{name: path}`) with `params`.
+
+        `params` must be JSON serializable; the order of the entries does not matter.
+        """
+        description = {"inputs": self.inputHashes(inputPaths), "params": params}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    # -------------------------------------------------------------------------
+    # Entries
+    # -------------------------------------------------------------------------
+    def _entryDir(self, key):
+        return os.path.join(self.storeDir, key)
+
+    def _readManifest(self, entryDir):
+        try:
+            with open(os.path.join(entryDir, MANIFEST_FILE_NAME)) as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError, ValueError):
+            return None
+
+    def get(self, key):
+        """Return `{output name: stored path}` or None on a miss."""
+        entryDir = self._entryDir(key)
+        manifest = self._readManifest(entryDir)
+        if manifest is None:
+            return None
+        paths = {name: os.path.join(entryDir, fileName) for name, fileName in manifest["outputs"].items()}
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        try:
+            os.utime(os.path.join(entryDir, MANIFEST_FILE_NAME))
+        except FileNotFoundError:
+            return None
+        return paths
+
+    def put(self, key, outputPaths, inputPaths=None, params=None):
+        """
+        Copy output files (`{name: path}`) into the store, then evict old entries if needed.
+
+        Returns `{name: stored path}`.
+        """
+        tmpDir = tempfile.mkdtemp(dir=self.storeDir, suffix=".tmp")
+        try:
+            outputs = {}
+            for name, path in outputPaths.items():
+                fileName = f"{name}{_extension(path)}"
+                shutil.copy2(path, os.path.join(tmpDir, fileName))
+                outputs[name] = fileName
+            manifest = {"key": key, "outputs": outputs, "params": params,
+                        "inputs": self.inputHashes(inputPaths or {}),
+                        "inputPaths": {name: None if path is None else os.path.abspath(path)
+                                       for name, path in (inputPaths or {}).items()}}
+            with open(os.path.join(tmpDir, MANIFEST_FILE_NAME), "w") as f:
+                json.dump(manifest, f, indent=2)
+
+            entryDir = self._entryDir(key)
+            if os.path.isdir(entryDir):
+                shutil.rmtree(entryDir, ignore_errors=True)
+            try:
+                os.replace(tmpDir, entryDir)
+            except OSError:
+                # Another process stored the same entry in the meantime
+                pass
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+        self.evict()
+        return self.get(key) or {}
+
+    def restore(self, key, destinationPaths):
+        """
+        Copy the outputs of an entry to `{name: destination path}`.
+
+        Returns False (and copies nothing) on a miss or when an output is missing.
+        """
+        stored = self.get(key)
+        if stored is None or not all(name in stored for name in destinationPaths):
+            return False
+        for name, destination in destinationPaths.items():
+            os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+            shutil.copy2(stored[name], destination)
+        return True
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+    def entries(self):
+        """Manifests of all entries, most recently used first."""
+        manifests = []
+        for name in os.listdir(self.storeDir):
+            entryDir = self._entryDir(name)
+            manifest = self._readManifest(entryDir)
+            if manifest is None:
+                continue
+            try:
+                manifest["lastUsed"] = os.stat(os.path.join(entryDir, MANIFEST_FILE_NAME)).st_mtime
+            except FileNotFoundError:
+                continue
+            manifests.append(manifest)
+        return sorted(manifests, key=lambda manifest: manifest["lastUsed"], reverse=True)
+
+    def findOutput(self, outputName, inputPaths=None, params=None):
+        """
+        Stored path of `outputName` computed from the given inputs, or None.
+
+        Unlike `get`, the lookup does not need every parameter: entries match
+        when their input hashes equal those of `inputPaths` and their
+        parameters contain `params`. The most recently used match wins.
+        """
+        inputs = self.inputHashes(inputPaths or {})
+        for manifest in self.entries():
+            if outputName not in manifest["outputs"]:
+                continue
+            if any(manifest["inputs"].get(name) != value for name, value in inputs.items()):
+                continue
+            if any((manifest["params"] or {}).get(name) != value for name, value in (params or {}).items()):
+                continue
+            stored = self.get(manifest["key"])
+            if stored is not None and outputName in stored:
+                return stored[outputName]
+        return None
+
+    # -------------------------------------------------------------------------
+    # Size
+    # -------------------------------------------------------------------------
+    def evict(self):
+        """Remove the least recently used entries until the store fits in its size cap."""
+        entries = []
+        for name in os.listdir(self.storeDir):
+            entryDir = self._entryDir(name)
+            manifestPath = os.path.join(entryDir, MANIFEST_FILE_NAME)
+            try:
+                lastUsed = os.stat(manifestPath).st_mtime_ns
+                size = sum(entry.stat().st_size for entry in os.scandir(entryDir))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            entries.append((lastUsed, size, entryDir))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entryDir in sorted(entries):
+            if total <= self.maxSizeBytes:
+                break
+            shutil.rmtree(entryDir, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.storeDir):
+            entryDir = self._entryDir(name)
+            if os.path.isdir(entryDir):
+                shutil.rmtree(entryDir, ignore_errors=True)
+        self._hashIndex.clear()
+
+
+def _extension(path):
+    """File extension, keeping double extensions such as `.nii.gz`."""
+    name = os.path.basename(path)
+    if name.endswith(".gz"):
+        return os.path.splitext(name[:-3])[1] + ".gz"
+    return os.path.splitext(name)[1]
@@ -0,0 +1,108 @@
+import numpy as np
+
+# Bytes of one seed once materialized (3 float64 coordinates)
+SEED_BYTES = 3 * 8
+
+
+class SeedChunks:
+    """
+    Seeds of a mask generated lazily, one chunk per block of mask voxels.
+
+    `track_utils.seeds_from_mask` and `random_seeds_from_mask` build every
+    seed before tracking starts (24 bytes each: gigabytes for a whole-brain
+    mask with 10-20 seeds per voxel). Here only the flat indices of the mask
+    voxels are kept; the seeds of chunk `i` are computed when it is
+    requested, from `i` and the base random seed only. Chunks are therefore
+    the same whatever order or process they are generated in, and the
+    tracking pool generates them as it submits them (see
+    `parallelTracking._trackInPool`).
+
+    Build with `SeedChunks.grid` (as `seeds_from_mask`) or
+    `SeedChunks.random` (as `random_seeds_from_mask`). Supports `len`,
+    indexing and iteration, like the list of `parallelTracking.chunkSeeds`.
+    """
+
+    def __init__(self, mask, affine, seedsPerChunk, density=None, nbSeeds=None, perVoxel=True,
+                 randomSeed=None):
+        mask = np.asarray(mask, dtype=bool)
+        if mask.ndim != 3:
+            raise ValueError("mask must be 3d")
+        self.shape = mask.shape
+        self.affine = np.asarray(affine, dtype=float)
+        self.voxels = np.flatnonzero(mask)
+        self.seedsPerChunk = int(seedsPerChunk)
+        self.randomSeed = np.random.SeedSequence().entropy if randomSeed is None else int(randomSeed)
+        self._permutation = None
+
+        if density is not None:
+            # Grid of points between -.5 and .5 in each voxel, ordered as in seeds_from_mask
+            density = np.broadcast_to(np.asarray(density, dtype=int), (3,))
+            grid = np.mgrid[0:density[0], 0:density[1], 0:density[2]].T.reshape((-1, 3))
+            self._grid = grid / density + 0.5 / density - 0.5
+            self.seedsPerVoxel = len(self._grid)
+        else:
+            self._grid = None
+            self.seedsPerVoxel = int(nbSeeds) if perVoxel else None
+
+        if self.seedsPerVoxel is not None:
+            self.voxelsPerChunk = max(1, self.seedsPerChunk // self.seedsPerVoxel)
+            self.nbSeeds = len(self.voxels) * self.seedsPerVoxel
+            self.nbChunks = -(-len(self.voxels) // self.voxelsPerChunk)
+        else:
+            # A total count: rounds over all the voxels in a random order, the last one truncated
+            self.nbSeeds = int(nbSeeds) if len(self.voxels) else 0
+            self.nbChunks = -(-self.nbSeeds // self.seedsPerChunk)
+            self._permutation = np.random.default_rng(self.randomSeed).permutation(len(self.voxels))
+
+    @classmethod
+    def grid(cls, mask, affine, seedsPerChunk, density=1):
+        """`density`^3 seeds on a regular grid in each voxel, the seeds of `seeds_from_mask` in its order."""
+        return cls(mask, affine, seedsPerChunk, density=density)
+
+    @classmethod
+    def random(cls, mask, affine, seedsPerChunk, nbSeeds=1, perVoxel=True, randomSeed=None):
+        """
+        Seeds uniformly distributed in the voxels: `nbSeeds` per voxel, or
+        `nbSeeds` in total when `perVoxel` is False (as the `seeds_count` and
+        `seed_count_per_voxel` of `random_seeds_from_mask`).
+        """
+        return cls(mask, affine, seedsPerChunk, nbSeeds=nbSeeds, perVoxel=perVoxel, randomSeed=randomSeed)
+
+    def __len__(self):
+        return self.nbChunks
+
+    def __iter__(self):
+        for i in range(self.nbChunks):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.nbChunks:
+            raise IndexError(f"Seed chunk {i} out of range ({self.nbChunks} chunks)")
+        rng = np.random.default_rng([self.randomSeed, i])
+        if self.seedsPerVoxel is not None:
+            voxels = self.voxels[i * self.voxelsPerChunk:(i + 1) * self.voxelsPerChunk]
+            centers = np.stack(np.unravel_index(voxels, self.shape), axis=-1)
+            if self._grid is not None:
+                offsets = self._grid[np.newaxis]
+            else:
+                offsets = rng.random((len(voxels), self.seedsPerVoxel, 3)) - 0.5
+            seeds = (centers[:, np.newaxis, :] + offsets).reshape((-1, 3))
+        else:
+            indices = np.arange(i * self.seedsPerChunk, min((i + 1) * self.seedsPerChunk, self.nbSeeds))
+            voxels = self.voxels[self._permutation[indices % len(self.voxels)]]
+            centers = np.stack(np.unravel_index(voxels, self.shape), axis=-1)
+            seeds = centers + rng.random((len(voxels), 3)) - 0.5
+        return seeds @ self.affine[:3, :3].T + self.affine[:3, 3]
+
+    @property
+    def chunkSeedCount(self):
+        """Seeds in a full chunk."""
+        if self.seedsPerVoxel is not None:
+            return self.voxelsPerChunk * self.seedsPerVoxel
+        return self.seedsPerChunk
+
+    @property
+    def indexBytes(self):
+        """Memory held for the whole run: the voxel indices (and their random order)."""
+        permutationBytes = 0 if self._permutation is None else self._permutation.nbytes
+        return self.voxels.nbytes + permutationBytes
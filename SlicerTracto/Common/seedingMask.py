@@ -0,0 +1,23 @@
+import numpy as np
+import nibabel as nib
+
+SEEDING_MASK_THRESHOLD = 0.5
+
+
+def thresholdMask(img, threshold=SEEDING_MASK_THRESHOLD):
+    """
+    Binary mask of the voxels of `img` above `threshold`, and a uint8 image of it.
+
+    The image wraps the mask's own memory and keeps the header of `img`, so
+    the seeds, the stopping criterion and an optional saved copy all use the
+    one array, without a round trip through a file.
+
+    Returns
+    -------
+    mask : ndarray of bool
+    maskImg : nib.Nifti1Image
+    """
+    mask = np.asarray(img.dataobj) > threshold
+    maskImg = nib.Nifti1Image(mask.view(np.uint8), img.affine, img.header)
+    maskImg.set_data_dtype(np.uint8)
+    return mask, maskImg
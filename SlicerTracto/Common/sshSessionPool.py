@@ -0,0 +1,137 @@
+import atexit
+import logging
+import os
+import threading
+
+import paramiko
+
+# Seconds between keepalive packets, so idle sessions survive firewalls/NAT
+KEEPALIVE_INTERVAL = 30
+CONNECT_TIMEOUT = 30
+# Key formats tried, in order, when loading a private key file
+KEY_CLASSES = (paramiko.Ed25519Key, paramiko.RSAKey, paramiko.ECDSAKey)
+
+
+def loadPrivateKey(keyPath):
+    """Load a private key file whatever its type (Ed25519, RSA or ECDSA)."""
+    errors = []
+    for keyClass in KEY_CLASSES:
+        try:
+            return keyClass.from_private_key_file(keyPath)
+        except paramiko.SSHException as error:
+            errors.append(f"{keyClass.__name__}: {error}")
+    raise paramiko.SSHException(f"Could not load the private key {keyPath} ({'; '.join(errors)})")
+
+
+def isAlive(client):
+    """Whether the transport of an `SSHClient` is still usable."""
+    transport = client.get_transport() if client is not None else None
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        # A dropped connection is often only noticed on the next write
+        transport.send_ignore()
+    except (EOFError, OSError, paramiko.SSHException):
+        return False
+    return True
+
+
+class SSHSessionPool:
+    """
+    Open SSH sessions shared by the SSH managers and the remote runners.
+
+    Sessions are keyed by (hostname, port, username, key path) and kept open
+    between requests with keepalive packets, so a run only pays the TCP and
+    SSH handshakes the first time a host is used. `get` checks that the
+    borrowed session is still alive and transparently reconnects when the
+    transport died (server restart, network drop, sleep).
+
+    Borrowers must not close the clients they get; `close` and `closeAll`
+    do that, and every session is closed when Slicer exits.
+
+    Connections are made under a lock of their session key only: a host
+    that takes `timeout` seconds to fail does not hold up the borrowers of
+    the other hosts.
+    """
+
+    def __init__(self, keepAliveInterval=KEEPALIVE_INTERVAL):
+        self.keepAliveInterval = keepAliveInterval
+        self._clients = {}
+        # One lock per session key, so that a host is only connected once at a time
+        self._keyLocks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def sessionKey(hostname, port=22, username=None, keyPath=None):
+        return (hostname, int(port), username, os.path.expanduser(keyPath) if keyPath else None)
+
+    def get(self, hostname, port=22, username=None, keyPath=None, timeout=CONNECT_TIMEOUT):
+        """
+        Open `SSHClient` for the host, connecting (again) when needed.
+
+        Raises the connection error when the host cannot be reached.
+        """
+        key = self.sessionKey(hostname, port, username, keyPath)
+        with self._lock:
+            keyLock = self._keyLocks.setdefault(key, threading.Lock())
+        with keyLock:
+            with self._lock:
+                client = self._clients.get(key)
+            if client is not None:
+                if isAlive(client):
+                    return client
+                logging.warning(f"SSH session to {hostname} is dead, reconnecting")
+                print(f"[SLICER TRACTO]SSH session to {hostname} lost, reconnecting")
+                with self._lock:
+                    if self._clients.get(key) is client:
+                        del self._clients[key]
+                self._closeClient(client)
+
+            client = self._connect(*key, timeout=timeout)
+            with self._lock:
+                self._clients[key] = client
+            return client
+
+    def _connect(self, hostname, port, username, keyPath, timeout):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # Automatically accept unknown host keys
+        pkey = loadPrivateKey(keyPath) if keyPath else None
+        client.connect(hostname, port=port, username=username, pkey=pkey, timeout=timeout)
+        client.get_transport().set_keepalive(self.keepAliveInterval)
+        logging.info(f"SSH connection established to {hostname}")
+        print(f"[SLICER TRACTO]SSH connection established to {hostname}")
+        return client
+
+    def close(self, hostname, port=22, username=None, keyPath=None):
+        """Close the session of a host, if open."""
+        with self._lock:
+            client = self._clients.pop(self.sessionKey(hostname, port, username, keyPath), None)
+        if client is not None:
+            self._closeClient(client)
+
+    def closeAll(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            self._closeClient(client)
+
+    @staticmethod
+    def _closeClient(client):
+        try:
+            client.close()
+        except Exception as e:
+            logging.error(f"Failed to close an SSH session: {e}")
+
+
+_sessionPool = None
+_sessionPoolLock = threading.Lock()
+
+
+def sshSessionPool():
+    """Process-wide pool, created on first use and closed at exit."""
+    global _sessionPool
+    with _sessionPoolLock:
+        if _sessionPool is None:
+            _sessionPool = SSHSessionPool()
+            atexit.register(_sessionPool.closeAll)
+        return _sessionPool
@@ -0,0 +1,193 @@
+import time
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+from nibabel.streamlines.array_sequence import ArraySequence
+
+
+def _asArraySequence(streamlines):
+    """
+    Return `streamlines` as an ArraySequence, packing lists of arrays.
+
+    Empty streamlines are kept (the ArraySequence constructor drops them), so
+    that cell i of the polydata is always streamline i.
+    """
+    if isinstance(streamlines, ArraySequence):
+        return streamlines
+    arrays = [np.asarray(streamline).reshape(-1, 3) for streamline in streamlines]
+    lengths = np.array([len(array) for array in arrays], dtype=np.int64)
+    packed = ArraySequence()
+    packed._data = np.concatenate(arrays) if arrays else np.zeros((0, 3), dtype=np.float32)
+    packed._lengths = lengths
+    packed._offsets = np.cumsum(lengths) - lengths
+    return packed
+
+
+def _packedPoints(streamlines):
+    """
+    Return the (N, 3) point buffer of an ArraySequence in streamline order.
+
+    When the sequence owns a contiguous buffer (the usual case right after
+    loading a tractogram) the underlying `_data` array is returned as is.
+    Views produced by fancy indexing (e.g. `streamlines[cluster.indices]`)
+    are gathered with a single vectorized take.
+    """
+    data = streamlines._data
+    offsets = np.asarray(streamlines._offsets, dtype=np.int64)
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    nbPoints = int(lengths.sum())
+
+    if len(lengths) == 0:
+        return np.zeros((0, 3), dtype=np.float32)
+
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    if np.array_equal(offsets, starts) and len(data) == nbPoints:
+        points = data
+    else:
+        shift = np.repeat(offsets - starts, lengths)
+        points = data[np.arange(nbPoints, dtype=np.int64) + shift]
+
+    if points.dtype not in (np.float32, np.float64):
+        points = points.astype(np.float32)
+    return np.ascontiguousarray(points)
+
+
+def streamlinesToPolyData(streamlines, pointIndexScalarName=None):
+    """
+    Build a vtkPolyData with one polyline cell per streamline.
+
+    Points and cell connectivity are created straight from the ArraySequence
+    `_data` / `_offsets` / `_lengths` buffers through `numpy_support`, without
+    any per-point Python work. The point array shares memory with the
+    streamline buffer whenever it is contiguous.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence or list of (N, 3) arrays
+        Streamlines, already in the space they should be displayed in.
+    pointIndexScalarName : str, optional
+        If given, add a point scalar array of that name holding the index of
+        each point along its streamline (used for per-cluster coloring).
+
+    Returns
+    -------
+    vtk.vtkPolyData
+    """
+    streamlines = _asArraySequence(streamlines)
+    lengths = np.asarray(streamlines._lengths, dtype=np.int64)
+    points = _packedPoints(streamlines)
+    nbPoints = len(points)
+
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_support.numpy_to_vtk(points, deep=False))
+
+    cellOffsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=cellOffsets[1:])
+    connectivity = np.arange(nbPoints, dtype=np.int64)
+
+    lines = vtk.vtkCellArray()
+    if hasattr(lines, "SetData"):
+        lines.SetData(numpy_support.numpy_to_vtkIdTypeArray(cellOffsets, deep=True),
+                      numpy_support.numpy_to_vtkIdTypeArray(connectivity, deep=True))
+    else:
+        # Legacy (VTK < 9) layout: [n0, id, id, ..., n1, id, ...]
+        legacy = np.insert(connectivity, cellOffsets[:-1], lengths)
+        lines.SetCells(len(lengths), numpy_support.numpy_to_vtkIdTypeArray(legacy, deep=True))
+
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(vtkPoints)
+    polydata.SetLines(lines)
+
+    if pointIndexScalarName:
+        pointIndex = (connectivity - np.repeat(cellOffsets[:-1], lengths)).astype(np.float32)
+        scalars = numpy_support.numpy_to_vtk(pointIndex, deep=True)
+        scalars.SetName(pointIndexScalarName)
+        polydata.GetPointData().SetScalars(scalars)
+
+    return polydata
+
+
+def savePolyData(polydata, outputPath):
+    """Write a polydata to a legacy `.vtk` file."""
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetFileName(outputPath)
+    writer.SetInputData(polydata)
+    writer.Write()
+    print(f"[SLICER TRACTO]Wrote streamlines to {outputPath}")
+
+
+def saveStreamlinesVTK(streamlines, outputPath):
+    """Convert streamlines to polydata and write them to a legacy `.vtk` file."""
+    savePolyData(streamlinesToPolyData(streamlines), outputPath)
+
+
+def _legacyStreamlinesToPolyData(streamlines):
+    """Per-point conversion loop formerly copied into every module (benchmark reference)."""
+    polydata = vtk.vtkPolyData()
+    lines = vtk.vtkCellArray()
+    points = vtk.vtkPoints()
+
+    ptCtr = 0
+    for streamline in streamlines:
+        line = vtk.vtkLine()
+        line.GetPointIds().SetNumberOfIds(len(streamline))
+        for j, point in enumerate(streamline):
+            points.InsertNextPoint(point)
+            line.GetPointIds().SetId(j, ptCtr)
+            ptCtr += 1
+        lines.InsertNextCell(line)
+
+    polydata.SetLines(lines)
+    polydata.SetPoints(points)
+    return polydata
+
+
+def _syntheticStreamlines(count, meanLength=60, seed=0):
+    """Random-walk streamlines with variable lengths, stored in one ArraySequence."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(meanLength // 2, meanLength * 3 // 2, size=count)
+    steps = rng.normal(scale=0.5, size=(int(lengths.sum()), 3)).astype(np.float32)
+    streamlines = ArraySequence()
+    streamlines._data = np.cumsum(steps, axis=0, dtype=np.float32)
+    streamlines._lengths = lengths.astype(np.int64)
+    streamlines._offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    return streamlines
+
+
+def benchmarkStreamlinesToPolyData(counts=(10_000, 100_000, 1_000_000), meanLength=60,
+                                   legacyMaxCount=None):
+    """
+    Time the vectorized converter against the legacy per-point loop.
+
+    The legacy loop is skipped for counts above `legacyMaxCount` (all counts
+    are run when it is None). Returns a list of
+    `(count, nbPoints, vectorizedSeconds, legacySeconds or None)`.
+    """
+    results = []
+    for count in counts:
+        streamlines = _syntheticStreamlines(count, meanLength)
+
+        start = time.perf_counter()
+        polydata = streamlinesToPolyData(streamlines)
+        vectorized = time.perf_counter() - start
+
+        legacy = None
+        if legacyMaxCount is None or count <= legacyMaxCount:
+            start = time.perf_counter()
+            reference = _legacyStreamlinesToPolyData(streamlines)
+            legacy = time.perf_counter() - start
+            assert reference.GetNumberOfPoints() == polydata.GetNumberOfPoints()
+            assert reference.GetNumberOfCells() == polydata.GetNumberOfCells()
+
+        nbPoints = polydata.GetNumberOfPoints()
+        legacyText = f"{legacy:.2f}s" if legacy is not None else "skipped"
+        print(f"[SLICER TRACTO]{count} streamlines / {nbPoints} points: "
+              f"vectorized {vectorized:.3f}s, legacy {legacyText}")
+        results.append((count, nbPoints, vectorized, legacy))
+    return results
+
+
+if __name__ == "__main__":
+    benchmarkStreamlinesToPolyData()
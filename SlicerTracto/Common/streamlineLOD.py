@@ -0,0 +1,274 @@
+import numpy as np
+import vtk
+import qt
+import slicer
+from nibabel.streamlines.array_sequence import ArraySequence
+
+from streamlineConversion import streamlinesToPolyData
+from streamlineModels import addPolyDataModelNode
+
+LOD_MODES = ["random", "centroids"]
+DEFAULT_LOD_LEVELS = (0.01, 0.1, 1.0)
+DEFAULT_POINT_BUDGET = 2_000_000
+DEFAULT_SETTLE_DELAY_MS = 400
+CLUSTER_SAMPLE_SIZE = 20_000
+CLUSTER_THRESHOLD = 10.0
+
+
+def randomOrder(nbStreamlines, seed=0):
+    """Random streamline order; every prefix is a uniform random subset."""
+    return np.random.default_rng(seed).permutation(nbStreamlines)
+
+
+def centroidOrder(streamlines, seed=0, sampleSize=CLUSTER_SAMPLE_SIZE, threshold=CLUSTER_THRESHOLD):
+    """
+    Streamline order stratified by QuickBundles clusters.
+
+    QuickBundles runs on a random sample of at most `sampleSize` streamlines.
+    The sampled streamlines are then visited round-robin over the clusters
+    (the one closest to its centroid first), so that every prefix of the
+    order covers all bundles found in the sample. The remaining streamlines
+    follow in random order.
+    """
+    from dipy.segment.clustering import QuickBundles
+
+    order = randomOrder(len(streamlines), seed)
+    sample = order[:sampleSize]
+    clusters = QuickBundles(threshold=threshold).cluster(streamlines[sample])
+
+    ranked = []
+    for cluster in clusters:
+        indices = np.asarray(cluster.indices)
+        # Rank members by their distance to the cluster centroid (start and end points)
+        members = streamlines[sample[indices]]
+        centroid = cluster.centroid
+        distances = np.array([min(np.linalg.norm(s[0] - centroid[0]) + np.linalg.norm(s[-1] - centroid[-1]),
+                                  np.linalg.norm(s[0] - centroid[-1]) + np.linalg.norm(s[-1] - centroid[0]))
+                              for s in members])
+        members_order = sample[indices[np.argsort(distances, kind="stable")]]
+        ranked.append(members_order)
+
+    # Round-robin: rank 0 of every cluster, then rank 1, ...
+    rank = np.concatenate([np.arange(len(members)) for members in ranked]) if ranked else np.zeros(0, dtype=int)
+    flat = np.concatenate(ranked) if ranked else np.zeros(0, dtype=int)
+    stratified = flat[np.argsort(rank, kind="stable")]
+    return np.concatenate([stratified, order[sampleSize:]])
+
+
+class ViewPointBudget:
+    """
+    Point budget of one 3D view, shared by the LOD tractograms shown in it.
+
+    Every `StreamlineLOD` started in the view registers here; automatic
+    refinement of each one is clipped to an equal share of the budget, so
+    loading several tractograms in a view does not multiply the points it
+    renders. Shares are recomputed (and the levels re-uploaded) when a
+    tractogram is added or removed, or when the budget changes.
+    """
+
+    _views = {}
+
+    def __init__(self, viewNodeId, pointBudget=DEFAULT_POINT_BUDGET):
+        self.viewNodeId = viewNodeId
+        self.pointBudget = pointBudget
+        self.controllers = []
+
+    @classmethod
+    def of(cls, viewNode):
+        """Budget of a view node, created on first use."""
+        viewNodeId = viewNode.GetID()
+        if viewNodeId not in cls._views:
+            cls._views[viewNodeId] = cls(viewNodeId)
+        return cls._views[viewNodeId]
+
+    def share(self):
+        """Points each tractogram of the view may show (0 means no limit)."""
+        if not self.pointBudget:
+            return 0
+        return max(1, self.pointBudget // max(1, len(self.controllers)))
+
+    def add(self, controller):
+        if controller not in self.controllers:
+            self.controllers.append(controller)
+        self.rebalance(exclude=controller)
+
+    def remove(self, controller):
+        if controller in self.controllers:
+            self.controllers.remove(controller)
+        if self.controllers:
+            self.rebalance()
+        else:
+            ViewPointBudget._views.pop(self.viewNodeId, None)
+
+    def setPointBudget(self, pointBudget):
+        self.pointBudget = pointBudget
+        self.rebalance()
+
+    def rebalance(self, exclude=None):
+        for controller in self.controllers:
+            if controller is not exclude:
+                controller.applyBudget()
+
+
+class StreamlineLOD:
+    """
+    Level-of-detail display of a large tractogram in one 3D view.
+
+    The tractogram is shown as a growing subset of its streamlines: the first
+    level is uploaded right away, and one more level is uploaded each time
+    the camera of the view has been still for `settleDelayMs`. Automatic
+    refinement never exceeds the tractogram's share of the view's
+    `pointBudget` (see `ViewPointBudget`) and never uploads the full
+    tractogram; `showFull()` does that on request.
+
+    With `viewNode`, the tractogram is only displayed in that view; without
+    it, the budget is the one of the first 3D view.
+    """
+
+    def __init__(self, streamlines, name=None, mode="random", levels=DEFAULT_LOD_LEVELS,
+                 pointBudget=DEFAULT_POINT_BUDGET, viewNode=None, color=(0, 1, 0),
+                 settleDelayMs=DEFAULT_SETTLE_DELAY_MS, seed=0):
+        if mode not in LOD_MODES:
+            raise ValueError(f"Invalid LOD mode: {mode}. Expected one of {LOD_MODES}")
+        if not isinstance(streamlines, ArraySequence):
+            streamlines = ArraySequence(streamlines)
+
+        self.streamlines = streamlines
+        self.name = name
+        self.mode = mode
+        self.levels = sorted(levels)
+        self.pointBudget = pointBudget
+        self.viewNode = viewNode
+        self.color = color
+        self.seed = seed
+
+        self.modelNode = None
+        self.displayNode = None
+        self.budget = None
+        self.levelIndex = -1
+        self.nbShown = 0
+
+        self._order = None
+        self._cumulativePoints = None
+        self._cameraNode = None
+        self._cameraObserver = None
+        self._settleTimer = qt.QTimer()
+        self._settleTimer.setSingleShot(True)
+        self._settleTimer.setInterval(settleDelayMs)
+        self._settleTimer.connect("timeout()", self.refine)
+
+    # -------------------------------------------------------------------------
+    # Level bookkeeping
+    # -------------------------------------------------------------------------
+    def _computeOrder(self):
+        if self.mode == "centroids":
+            self._order = centroidOrder(self.streamlines, seed=self.seed)
+        else:
+            self._order = randomOrder(len(self.streamlines), seed=self.seed)
+        lengths = np.asarray(self.streamlines._lengths, dtype=np.int64)
+        self._cumulativePoints = np.cumsum(lengths[self._order])
+
+    def levelCount(self, levelIndex):
+        """Number of streamlines shown at a level, clipped to the point budget except for the full level."""
+        fraction = self.levels[levelIndex]
+        nbStreamlines = len(self.streamlines)
+        count = max(1, int(np.ceil(fraction * nbStreamlines))) if nbStreamlines else 0
+        pointBudget = self.budget.share() if self.budget is not None else self.pointBudget
+        if fraction >= 1.0 or not pointBudget:
+            return count
+        withinBudget = int(np.searchsorted(self._cumulativePoints, pointBudget, side="right"))
+        return max(1, min(count, withinBudget)) if nbStreamlines else 0
+
+    def _lastAutomaticLevel(self):
+        automatic = [i for i, fraction in enumerate(self.levels) if fraction < 1.0]
+        return automatic[-1] if automatic else 0
+
+    def _upload(self, count):
+        polydata = streamlinesToPolyData(self.streamlines[self._order[:count]])
+        if self.modelNode is None:
+            self.modelNode, self.displayNode = addPolyDataModelNode(polydata, self.name, self.color)
+            if self.viewNode is not None:
+                self.displayNode.SetViewNodeIDs([self.viewNode.GetID()])
+        else:
+            self.modelNode.SetAndObservePolyData(polydata)
+        self.nbShown = count
+        print(f"[SLICER TRACTO]LOD: showing {count}/{len(self.streamlines)} streamlines "
+              f"({polydata.GetNumberOfPoints()} points)")
+
+    def setLevel(self, levelIndex):
+        """Upload the subset of a given level (no-op if it shows the same streamlines)."""
+        if self._order is None:
+            self._computeOrder()
+        levelIndex = int(np.clip(levelIndex, 0, len(self.levels) - 1))
+        count = self.levelCount(levelIndex)
+        self.levelIndex = levelIndex
+        if count != self.nbShown:
+            self._upload(count)
+
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+    def start(self):
+        """Show the coarsest level and start refining when the camera settles."""
+        self.budget = ViewPointBudget.of(self._budgetViewNode())
+        self.budget.pointBudget = self.pointBudget
+        self.budget.add(self)
+        self.setLevel(0)
+        self._observeCamera()
+        self._settleTimer.start()
+        return self.modelNode, self.displayNode
+
+    def refine(self):
+        """Go one level up, stopping before the full tractogram."""
+        if self.levelIndex < self._lastAutomaticLevel():
+            self.setLevel(self.levelIndex + 1)
+            if self.levelIndex < self._lastAutomaticLevel():
+                self._settleTimer.start()
+
+    def showFull(self):
+        """Upload the full geometry, ignoring the point budget."""
+        self._settleTimer.stop()
+        self.setLevel(len(self.levels) - 1)
+        if self.levels[-1] < 1.0:
+            self._upload(len(self.streamlines))
+
+    def setPointBudget(self, pointBudget):
+        """Set the budget of the view, shared with the other tractograms shown in it."""
+        self.pointBudget = pointBudget
+        if self.budget is not None:
+            self.budget.setPointBudget(pointBudget)
+        else:
+            self.applyBudget()
+
+    def applyBudget(self):
+        """Re-upload the current automatic level after the budget or its share changed."""
+        if self.levelIndex >= 0 and self.nbShown < len(self.streamlines):
+            self.setLevel(min(self.levelIndex, self._lastAutomaticLevel()))
+
+    def cleanup(self):
+        self._settleTimer.stop()
+        if self.budget is not None:
+            self.budget.remove(self)
+            self.budget = None
+        if self._cameraNode is not None and self._cameraObserver is not None:
+            self._cameraNode.RemoveObserver(self._cameraObserver)
+        self._cameraNode = None
+        self._cameraObserver = None
+
+    # -------------------------------------------------------------------------
+    # Camera observation
+    # -------------------------------------------------------------------------
+    def _budgetViewNode(self):
+        if self.viewNode is not None:
+            return self.viewNode
+        return slicer.app.layoutManager().threeDWidget(0).mrmlViewNode()
+
+    def _observeCamera(self):
+        self._cameraNode = slicer.modules.cameras.logic().GetViewActiveCameraNode(self._budgetViewNode())
+        if self._cameraNode is not None:
+            self._cameraObserver = self._cameraNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self._onCameraModified)
+
+    def _onCameraModified(self, caller, event):
+        # Restart the timer on every camera change: refinement resumes once the camera is still
+        if self.levelIndex < self._lastAutomaticLevel():
+            self._settleTimer.start()
@@ -0,0 +1,119 @@
+import os
+import threading
+
+import vtk
+import slicer
+
+from streamlineConversion import streamlinesToPolyData
+from tractogramStreaming import loadStreamlinesChunked, DEFAULT_CHUNK_SIZE
+
+
+def addPolyDataModelNode(polydata, name=None, color=(0, 1, 0), opacity=1.0):
+    """
+    Add a model node observing `polydata` to the scene, with its own display node.
+
+    Returns the `(modelNode, displayNode)` pair.
+    """
+    modelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", name or "")
+    modelNode.SetAndObservePolyData(polydata)
+
+    displayNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode")
+    modelNode.SetAndObserveDisplayNodeID(displayNode.GetID())
+    displayNode.SetColor(*color)
+    displayNode.SetOpacity(opacity)
+    return modelNode, displayNode
+
+
+def addStreamlinesModelNode(streamlines, name=None, color=(0, 1, 0), opacity=1.0):
+    """Convert streamlines in memory and show them as a model node (no file round trip)."""
+    polydata = streamlinesToPolyData(streamlines)
+    modelNode, displayNode = addPolyDataModelNode(polydata, name, color, opacity)
+    return modelNode, displayNode, polydata
+
+
+def createProgressCallback(labelText):
+    """Return a progress dialog and a `(nbRead, nbTotal)` callback updating it."""
+    dialog = slicer.util.createProgressDialog(labelText=labelText, maximum=0)
+
+    def callback(nbRead, nbTotal):
+        if nbTotal:
+            dialog.maximum = nbTotal
+            dialog.value = nbRead
+        dialog.labelText = f"{labelText} ({nbRead} streamlines)"
+        slicer.app.processEvents()
+
+    return dialog, callback
+
+
+def loadTrkAsModelNode(trkPath, name=None, color=(0, 1, 0), opacity=1.0, exportPath=None,
+                       progressCallback=None, chunkSize=DEFAULT_CHUNK_SIZE):
+    """
+    Load a tractogram and display it as a model node straight from memory.
+
+    Parameters
+    ----------
+    trkPath : str
+        Tractogram file readable by dipy (`.trk`, `.tck`, ...).
+    name : str, optional
+        Model node name, defaults to the tractogram file name.
+    exportPath : str, optional
+        If given, the polydata is additionally written to this `.vtk`/`.vtp`
+        file in a background thread (see `exportPolyDataAsync`).
+    progressCallback : callable, optional
+        Called as `progressCallback(nbRead, nbTotal)` while the file is read
+        in batches of `chunkSize` streamlines.
+
+    Returns
+    -------
+    modelNode, displayNode, exportThread (None when nothing is exported)
+    """
+    streamlines = loadStreamlinesChunked(trkPath, chunkSize, progressCallback)
+    if name is None:
+        name = os.path.splitext(os.path.basename(trkPath))[0]
+
+    modelNode, displayNode, polydata = addStreamlinesModelNode(streamlines, name, color, opacity)
+
+    exportThread = None
+    if exportPath:
+        exportThread = exportPolyDataAsync(polydata, exportPath)
+    return modelNode, displayNode, exportThread
+
+
+def _polyDataWriter(outputPath):
+    """Return a writer matching the extension of `outputPath` (.vtp or legacy .vtk)."""
+    if outputPath.lower().endswith(".vtp"):
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetDataModeToBinary()
+        writer.SetCompressorTypeToZLib()
+    else:
+        writer = vtk.vtkPolyDataWriter()
+        writer.SetFileTypeToBinary()
+    writer.SetFileName(outputPath)
+    return writer
+
+
+def exportPolyData(polydata, outputPath):
+    """Write a polydata to `.vtp` (XML, compressed) or `.vtk` (legacy binary)."""
+    os.makedirs(os.path.dirname(os.path.abspath(outputPath)), exist_ok=True)
+    writer = _polyDataWriter(outputPath)
+    writer.SetInputData(polydata)
+    if not writer.Write():
+        print(f"[SLICER TRACTO][ERROR]Could not write {outputPath}")
+        return False
+    print(f"[SLICER TRACTO]Wrote streamlines to {outputPath}")
+    return True
+
+
+def exportPolyDataAsync(polydata, outputPath):
+    """
+    Export a polydata on a background thread so the scene is usable right away.
+
+    The writer works on a shallow copy: the arrays are shared with the model
+    node (no extra memory) but later changes to the displayed polydata
+    structure do not affect the file being written.
+    """
+    snapshot = vtk.vtkPolyData()
+    snapshot.ShallowCopy(polydata)
+    thread = threading.Thread(target=exportPolyData, args=(snapshot, outputPath), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules of Common are imported by name, as the Slicer modules and the
+# scripts do once they have added the folder to the path
+common_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if common_path not in sys.path:
+    sys.path.insert(0, common_path)
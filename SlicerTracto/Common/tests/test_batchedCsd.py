@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from dipy.core.gradients import gradient_table
+from dipy.data import get_sphere
+from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
+from dipy.sims.voxel import multi_tensor
+
+from batchedCsd import fitCsd
+
+NB_VOXELS = 300
+FIBER_EVALS = np.array([0.0015, 0.0003, 0.0003])
+
+
+@pytest.fixture(scope="module")
+def crossings():
+    """Single-shell signal (b=1000, 64 directions) of two crossing fibers per voxel, with noise."""
+    rng = np.random.default_rng(0)
+    bvecs = np.vstack([[0., 0., 0.], get_sphere(name="repulsion100").vertices[:64]])
+    gtab = gradient_table(np.r_[0., np.full(64, 1000.)], bvecs=bvecs)
+    data = np.empty((NB_VOXELS, len(bvecs)))
+    for i in range(NB_VOXELS):
+        angles = [tuple(rng.uniform(0, 180, 2)) for _ in range(2)]
+        fraction = rng.uniform(30, 70)
+        data[i], _ = multi_tensor(gtab, np.array([FIBER_EVALS] * 2), S0=100, angles=angles,
+                                  fractions=[fraction, 100 - fraction], snr=30, rng=rng)
+    return gtab, data
+
+
+@pytest.mark.parametrize("shOrder", [6, 8])
+@pytest.mark.parametrize("nbThreads", [1, 2])
+def test_fitCsd_matches_dipy(crossings, shOrder, nbThreads):
+    gtab, data = crossings
+    model = ConstrainedSphericalDeconvModel(gtab, (FIBER_EVALS, 100.), sh_order_max=shOrder)
+    reference = model.fit(data).shm_coeff
+
+    shm_coeff = fitCsd(model, data, voxelsPerChunk=64, nbThreads=nbThreads)
+
+    np.testing.assert_allclose(shm_coeff, reference, rtol=1e-7, atol=1e-9 * np.abs(reference).max())
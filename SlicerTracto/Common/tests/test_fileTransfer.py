@@ -0,0 +1,271 @@
+import gzip
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+import fileTransfer
+from fileTransfer import PART_SUFFIX, FileTransfer, localChecksum
+
+SIZE = 3 * fileTransfer.CHUNK_SIZE + 12345
+# Found before the PATH of the remote side is set
+BASH = shutil.which("bash")
+
+
+class _LocalFile:
+    """File of `_LocalSftp.open`, with the paramiko methods the transfers call."""
+
+    def __init__(self, path, mode):
+        self.file = open(path, mode)
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def prefetch(self, size):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+class _LocalSftp:
+    """SFTP client stand-in on the local file system."""
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode):
+        return _LocalFile(path, mode)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def posix_rename(self, source, destination):
+        os.replace(source, destination)
+
+    def close(self):
+        pass
+
+
+class _LocalChannel:
+    """Exec channel stand-in running the command with `bash -c`."""
+
+    def __init__(self, env):
+        self.env = env
+        self.process = None
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen([BASH, "-c", command], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, env=self.env)
+
+    def sendall(self, data):
+        self.process.stdin.write(data)
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv(self, size):
+        return self.process.stdout.read1(size)
+
+    def recv_stderr(self, size):
+        return self.process.stderr.read1(size)
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        if self.process is not None:
+            for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+                pipe.close()
+            self.process.wait()
+
+
+class _LocalClient:
+    """SSH client stand-in: SFTP on the local file system, commands in a local shell."""
+
+    def __init__(self, env):
+        self.env = env
+
+    def open_sftp(self):
+        return _LocalSftp()
+
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return _LocalChannel(self.env)
+
+
+@pytest.fixture
+def transfer():
+    return FileTransfer(_LocalClient(dict(os.environ)))
+
+
+@pytest.fixture
+def noToolsTransfer(tmp_path):
+    # A PATH without sha256sum, head, tail nor gzip
+    binFolder = tmp_path / "bin"
+    binFolder.mkdir()
+    return FileTransfer(_LocalClient(dict(os.environ, PATH=str(binFolder))))
+
+
+def _writeNifti(path, compressed=False):
+    """Compressible data (a smooth volume), gzipped for a .nii.gz."""
+    data = (np.sin(np.arange(SIZE) / 1000.) * 100).astype(np.int8).tobytes()
+    with (gzip.open if compressed else open)(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name, compressedOnTheWire", [("dwi.nii", True), ("dwi.nii.gz", False)])
+def test_upload_and_download(tmp_path, transfer, name, compressedOnTheWire):
+    local = _writeNifti(str(tmp_path / name), compressed=name.endswith(".gz"))
+    remote = str(tmp_path / "remote" / name)
+    os.makedirs(os.path.dirname(remote))
+
+    uploaded = transfer.upload(local, remote)
+    downloaded = transfer.download(remote, str(tmp_path / "back" / name))
+
+    assert _read(remote) == _read(local) == _read(str(tmp_path / "back" / name))
+    for result in (uploaded, downloaded):
+        assert not result.skipped and result.resumedFrom == 0
+        assert result.size == os.path.getsize(local)
+        assert (result.wireBytes < result.size) == compressedOnTheWire
+    assert not os.path.exists(remote + PART_SUFFIX)
+    assert not os.path.exists(str(tmp_path / "back" / name) + PART_SUFFIX)
+
+
+@pytest.mark.parametrize("name", ["dwi.nii", "dwi.nii.gz"])
+def test_upload_resumes_a_valid_part(tmp_path, transfer, name):
+    local = _writeNifti(str(tmp_path / name), compressed=name.endswith(".gz"))
+    remote = str(tmp_path / f"remote_{name}")
+    data = _read(local)
+    with open(remote + PART_SUFFIX, "wb") as f:
+        f.write(data[:len(data) // 2])
+
+    result = transfer.upload(local, remote)
+
+    assert result.resumedFrom == len(data) // 2
+    assert _read(remote) == data
+
+
+def test_download_resumes_a_valid_part(tmp_path, transfer):
+    remote = _writeNifti(str(tmp_path / "remote.nii"))
+    local = str(tmp_path / "local.nii")
+    data = _read(remote)
+    with open(local + PART_SUFFIX, "wb") as f:
+        f.write(data[:len(data) // 3])
+
+    result = transfer.download(remote, local)
+
+    assert result.resumedFrom == len(data) // 3
+    assert _read(local) == data
+
+
+def test_corrupt_part_is_restarted(tmp_path, transfer):
+    local = _writeNifti(str(tmp_path / "dwi.nii"))
+    remote = str(tmp_path / "remote.nii")
+    with open(remote + PART_SUFFIX, "wb") as f:
+        f.write(b"not the start of the file")
+    with open(local + ".copy" + PART_SUFFIX, "wb") as f:
+        f.write(b"not the start of the file either")
+
+    uploaded = transfer.upload(local, remote)
+    downloaded = transfer.download(remote, local + ".copy")
+
+    assert uploaded.resumedFrom == downloaded.resumedFrom == 0
+    assert _read(remote) == _read(local + ".copy") == _read(local)
+
+
+def test_checksum_match_is_skipped(tmp_path, transfer):
+    local = _writeNifti(str(tmp_path / "dwi.nii"))
+    remote = str(tmp_path / "remote.nii")
+    shutil.copy(local, remote)
+
+    uploaded = transfer.upload(local, remote)
+    downloaded = transfer.download(remote, local)
+
+    assert uploaded.skipped and downloaded.skipped
+    assert uploaded.wireBytes == downloaded.wireBytes == 0
+
+
+def test_without_remote_tools_files_are_sent_as_they_are(tmp_path, noToolsTransfer):
+    local = _writeNifti(str(tmp_path / "dwi.nii"))
+    remote = str(tmp_path / "remote.nii")
+    with open(remote + PART_SUFFIX, "wb") as f:
+        f.write(_read(local)[:100])
+
+    uploaded = noToolsTransfer.upload(local, remote)
+    again = noToolsTransfer.upload(local, remote)
+    downloaded = noToolsTransfer.download(remote, str(tmp_path / "back.nii"))
+
+    assert not noToolsTransfer.remoteToolsAvailable()
+    # Neither resumed, skipped nor compressed: nothing can be checked on the remote side
+    for result in (uploaded, again, downloaded):
+        assert not result.skipped and result.resumedFrom == 0
+        assert result.wireBytes == result.size
+    assert _read(remote) == _read(str(tmp_path / "back.nii")) == _read(local)
+
+
+def test_command_filling_stderr_does_not_stall(transfer):
+    status, output, errors = transfer._exec("head -c 4000000 /dev/zero >&2; echo done")
+
+    assert status == 0
+    assert output == b"done\n"
+    assert len(errors) == 4000000
+
+
+def test_failed_checksum_command_is_retried(tmp_path, transfer, monkeypatch):
+    monkeypatch.setattr(fileTransfer, "CHECKSUM_RETRY_DELAY_S", 0.)
+    local = _writeNifti(str(tmp_path / "dwi.nii"))
+    remote = str(tmp_path / "remote.nii")
+    remoteChecksum = transfer.remoteChecksum
+    failures = {"count": 0}
+
+    def flakyChecksum(path, length=None):
+        # The command fails once on the complete .part
+        if path.endswith(PART_SUFFIX) and length is None and not failures["count"]:
+            failures["count"] += 1
+            return None
+        return remoteChecksum(path, length)
+
+    monkeypatch.setattr(transfer, "remoteChecksum", flakyChecksum)
+    transfer.upload(local, remote)
+
+    assert failures["count"] == 1
+    assert _read(remote) == _read(local)
+
+
+def test_unverified_upload_keeps_its_part(tmp_path, transfer, monkeypatch):
+    monkeypatch.setattr(fileTransfer, "CHECKSUM_RETRY_DELAY_S", 0.)
+    local = _writeNifti(str(tmp_path / "dwi.nii"))
+    remote = str(tmp_path / "remote.nii")
+    remoteChecksum = transfer.remoteChecksum
+    monkeypatch.setattr(transfer, "remoteChecksum",
+                        lambda path, length=None: None if path.endswith(PART_SUFFIX) and length is None
+                        else remoteChecksum(path, length))
+
+    with pytest.raises(IOError, match="Could not checksum"):
+        transfer.upload(local, remote)
+
+    # Not a mismatch: the complete .part stays for the next upload to verify
+    assert not os.path.exists(remote)
+    assert _read(remote + PART_SUFFIX) == _read(local)
+    monkeypatch.undo()
+    result = transfer.upload(local, remote)
+    assert result.resumedFrom == os.path.getsize(local)
+    assert _read(remote) == _read(local)
+    assert localChecksum(remote) == localChecksum(local)
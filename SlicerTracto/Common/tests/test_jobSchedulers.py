@@ -0,0 +1,96 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+import fakeScheduler
+from jobSchedulers import JOB_BACKENDS, BatchBackend, jobBackend
+from remoteJobs import JOB_LOG_NAME, RemoteJob, RemoteJobQueue
+
+TIMEOUT_S = 30
+
+
+class _Output:
+    """The stdout or stderr of `_LocalClient.exec_command`, as paramiko returns them."""
+
+    def __init__(self, data, exitCode):
+        self.data = data
+        self.exitCode = exitCode
+        self.channel = self
+
+    def read(self):
+        return self.data
+
+    def recv_exit_status(self):
+        return self.exitCode
+
+
+class _LocalClient:
+    """SSH client stand-in running the commands in a local shell, with the fake scheduler on the PATH."""
+
+    def __init__(self, env):
+        self.env = env
+
+    def exec_command(self, command):
+        result = subprocess.run(["bash", "-c", command], capture_output=True, env=self.env,
+                                stdin=subprocess.DEVNULL)
+        return None, _Output(result.stdout, result.returncode), _Output(result.stderr, result.returncode)
+
+
+@pytest.fixture
+def client(tmp_path):
+    binFolder = str(tmp_path / "bin")
+    fakeScheduler.install(binFolder)
+    env = dict(os.environ, PATH=binFolder + os.pathsep + os.environ["PATH"],
+               FAKE_SCHEDULER_STATE=str(tmp_path / "state"))
+    return _LocalClient(env)
+
+
+def _submit(client, tmp_path, backendName, command):
+    queue = RemoteJobQueue(backend=jobBackend(backendName), pollInterval=0.05)
+    job = RemoteJob(backendName, command, str(tmp_path / "job"), connect=lambda: client)
+    queue.submit(job)
+    return queue, job
+
+
+@pytest.mark.parametrize("backendName", JOB_BACKENDS)
+def test_job_succeeds(client, tmp_path, backendName):
+    queue, job = _submit(client, tmp_path, backendName, "echo tracked")
+    assert queue.wait(job.jobId, timeout=TIMEOUT_S)
+    assert job.state == "finished"
+    assert job.exitCode == 0
+    with open(job.remotePath(JOB_LOG_NAME)) as f:
+        assert f.read() == "tracked\n"
+
+
+@pytest.mark.parametrize("backendName", JOB_BACKENDS)
+def test_job_exit_status_fails_it(client, tmp_path, backendName):
+    queue, job = _submit(client, tmp_path, backendName, "exit 3")
+    assert queue.wait(job.jobId, timeout=TIMEOUT_S)
+    assert job.state == "failed"
+    assert job.exitCode == 3
+    assert job.error == "exit status 3"
+
+
+@pytest.mark.parametrize("backendName", JOB_BACKENDS)
+def test_job_cancel_stops_it(client, tmp_path, backendName):
+    queue, job = _submit(client, tmp_path, backendName, f"sleep {TIMEOUT_S}; touch not_cancelled")
+    deadline = time.time() + TIMEOUT_S
+    while job.state == "queued" and time.time() < deadline:
+        time.sleep(0.05)
+    assert job.state == "running"
+
+    queue.cancel(job.jobId)
+    assert job.state == "cancelled"
+    # The remote process is stopped: the backend reports an exit status well before the sleep ends
+    backend = jobBackend(backendName)
+    while backend.status(client, job) is None:
+        assert time.time() < deadline
+        time.sleep(0.05)
+    assert not os.path.exists(job.remotePath("not_cancelled"))
+
+
+def test_batch_backend_needs_directives_and_state():
+    with pytest.raises(TypeError):
+        BatchBackend()
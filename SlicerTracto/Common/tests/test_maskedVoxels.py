@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from dipy.core.gradients import gradient_table
+from dipy.data import get_sphere
+from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
+from dipy.sims.voxel import single_tensor
+
+from maskedVoxels import MaskedVoxels, boundingBox
+
+SHAPE = (9, 8, 7)
+FIBER_EVALS = np.array([0.0015, 0.0003, 0.0003])
+
+
+def _brainMask():
+    """An off-center ball, so that its bounding box is smaller than the volume on every axis."""
+    grid = np.indices(SHAPE)
+    return ((grid[0] - 4) ** 2 + (grid[1] - 3) ** 2 + (grid[2] - 4) ** 2) <= 6
+
+
+@pytest.fixture(scope="module")
+def dwi():
+    """Single-shell DWI of a fiber along x with noise, zero outside a slab (as around a skull-stripped brain)."""
+    rng = np.random.default_rng(0)
+    bvecs = np.vstack([[0., 0., 0.], get_sphere(name="repulsion100").vertices[:64]])
+    gtab = gradient_table(np.r_[0., np.full(64, 1000.)], bvecs=bvecs)
+    signal = single_tensor(gtab, S0=100, evals=FIBER_EVALS)
+    data = signal + rng.normal(scale=3., size=SHAPE + (len(signal),))
+    data[:, :, :3] = 0
+    return gtab, data.astype(np.float32)
+
+
+def test_boundingBox():
+    mask = _brainMask()
+    box = boundingBox(mask)
+    assert np.count_nonzero(mask[box]) == np.count_nonzero(mask)
+    assert all(s.stop - s.start < n for s, n in zip(box, SHAPE))
+    assert boundingBox(np.zeros(SHAPE, dtype=bool)) == (slice(0, 0),) * 3
+
+
+@pytest.mark.parametrize("mask", [_brainMask(), np.ones(SHAPE, dtype=bool), np.zeros(SHAPE, dtype=bool)])
+def test_gather_scatter_round_trip(mask):
+    volume = np.random.default_rng(1).normal(size=SHAPE + (5,)).astype(np.float32)
+    voxels = MaskedVoxels(mask)
+
+    values = voxels.gather(volume)
+
+    assert values.shape == (np.count_nonzero(mask), 5)
+    # In the order of the voxels of the mask
+    np.testing.assert_array_equal(values, volume[mask])
+    scattered = voxels.scatter(values)
+    np.testing.assert_array_equal(scattered[mask], volume[mask])
+    assert not scattered[~mask].any()
+    assert voxels.fraction == np.count_nonzero(mask) / mask.size
+
+
+def test_fromSignal_keeps_the_voxels_with_a_signal_in_the_mask(dwi):
+    _, data = dwi
+    mask = _brainMask()
+
+    signal = np.any(data, axis=-1)
+
+    everywhere = MaskedVoxels.fromSignal(data)
+    inMask = MaskedVoxels.fromSignal(data, mask)
+
+    np.testing.assert_array_equal(everywhere.scatter(np.ones(everywhere.nbVoxels), dtype=bool), signal)
+    np.testing.assert_array_equal(inMask.scatter(np.ones(inMask.nbVoxels), dtype=bool), mask & signal)
+    assert 0 < inMask.nbVoxels < np.count_nonzero(mask)
+
+
+def test_fit_on_gathered_voxels_matches_the_full_volume_fit(dwi):
+    gtab, data = dwi
+    mask = _brainMask()
+    model = ConstrainedSphericalDeconvModel(gtab, (FIBER_EVALS, 100.), sh_order_max=6)
+    reference = model.fit(data, mask=mask).shm_coeff
+
+    voxels = MaskedVoxels.fromSignal(data, mask)
+    shm_coeff = voxels.scatter(model.fit(voxels.gather(data)).shm_coeff, dtype=np.float64)
+
+    np.testing.assert_allclose(shm_coeff, reference, rtol=1e-6, atol=1e-9)
+
+
+def test_fit_from_model_on_gathered_voxels_matches_the_full_volume_fit(dwi):
+    # The fit of FodfPipeline.computeFodf with its default engine
+    fodf = pytest.importorskip("scilpy.reconst.fodf")
+    gtab, data = dwi
+    mask = _brainMask()
+    model = ConstrainedSphericalDeconvModel(gtab, (FIBER_EVALS, 100.), sh_order_max=6)
+    reference = fodf.fit_from_model(model, data, mask=mask, nbr_processes=1).shm_coeff
+
+    voxels = MaskedVoxels.fromSignal(data, mask)
+    shm_coeff = fodf.fit_from_model(model, voxels.gather(data)[:, None, None], mask=None,
+                                    nbr_processes=1).shm_coeff
+    shm_coeff = voxels.scatter(shm_coeff[:, 0, 0], dtype=np.float64)
+
+    np.testing.assert_allclose(shm_coeff, reference, rtol=1e-6, atol=1e-9)
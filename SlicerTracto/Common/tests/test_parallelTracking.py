@@ -0,0 +1,186 @@
+import os
+import tempfile
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from dipy.core.sphere import HemiSphere
+from dipy.data import default_sphere, get_sphere
+from dipy.direction import DeterministicMaximumDirectionGetter, ProbabilisticDirectionGetter
+from dipy.reconst.shm import sf_to_sh
+from dipy.tracking import utils
+from dipy.tracking.local_tracking import LocalTracking, ParticleFilteringTracking
+from dipy.tracking.stopping_criterion import BinaryStoppingCriterion, CmcStoppingCriterion
+from dipy.tracking.streamlinespeed import length
+
+import parallelTracking
+from parallelTracking import TrackingEstimate, pftToTrk, trackToTrk
+from resourcePlanner import MIB
+from seedGenerator import SeedChunks
+
+SHAPE = (24, 10, 10)
+AFFINE = np.array([[2., 0., 0., -7.],
+                   [0., 2., 0., 3.],
+                   [0., 0., 2., -5.],
+                   [0., 0., 0., 1.]])
+SPHERE = "symmetric724"
+SH_BASIS = "descoteaux07"
+THETA = 30.
+STEP_SIZE = 0.5
+MAX_STEPS = 200
+MIN_LENGTH = 2.
+MAX_LENGTH = 100.
+
+
+def _phantom():
+    """SH of one lobe along x everywhere, a box mask and its grid seeds (voxel coordinates)."""
+    sf = np.exp(-20. * (1. - default_sphere.x ** 2))
+    sh = np.broadcast_to(sf_to_sh(sf, default_sphere, sh_order_max=6), SHAPE + (28,)).copy()
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[2:-2, 2:-2, 2:-2] = True
+    seeds = utils.seeds_from_mask(mask, np.eye(4), density=2)
+    return sh, mask, seeds
+
+
+def _serialStreamlines(sh, mask, seeds):
+    dg = DeterministicMaximumDirectionGetter.from_shcoeff(
+        sh, max_angle=THETA, sphere=HemiSphere.from_sphere(get_sphere(name=SPHERE)),
+        basis_type=SH_BASIS, relative_peak_threshold=0.1)
+    generator = LocalTracking(dg, BinaryStoppingCriterion(mask), seeds, np.eye(4), step_size=STEP_SIZE,
+                              max_cross=1, maxlen=MAX_STEPS, fixedstep=True, return_all=True)
+    return [s for s in generator if MIN_LENGTH <= length(s) <= MAX_LENGTH]
+
+
+@pytest.mark.parametrize("nbProcesses", [1, 2])
+def test_trackToTrk_matches_serial_tracking(tmp_path, nbProcesses):
+    sh, mask, seeds = _phantom()
+    reference = _serialStreamlines(sh, mask, seeds)
+    outputPath = os.path.join(tmp_path, "tracking.trk")
+    referenceImg = nib.Nifti1Image(mask.astype(np.uint8), AFFINE)
+
+    # Several chunks, so that the first one being dropped would show
+    nbWritten = trackToTrk(outputPath, referenceImg, {"odf": sh}, mask, seeds, "det", THETA, STEP_SIZE,
+                           MAX_STEPS, MIN_LENGTH, MAX_LENGTH, shBasis=SH_BASIS, sphere=SPHERE,
+                           saveSeeds=True, nbProcesses=nbProcesses, seedsPerChunk=100)
+
+    tractogram = nib.streamlines.load(outputPath).tractogram
+    assert nbWritten == len(reference) == len(tractogram)
+    assert len(tractogram.data_per_streamline["seeds"]) == len(reference)
+
+    # Written in RAS mm, inside the bounding box of the mask
+    points = np.concatenate(list(tractogram.streamlines))
+    corners = np.array([np.argwhere(mask).min(axis=0) - 0.5, np.argwhere(mask).max(axis=0) + 0.5])
+    corners = nib.affines.apply_affine(AFFINE, corners)
+    assert np.all(points >= corners.min(axis=0) - 1e-3)
+    assert np.all(points <= corners.max(axis=0) + 1e-3)
+    for written, streamline in zip(tractogram.streamlines, reference):
+        np.testing.assert_allclose(written, nib.affines.apply_affine(AFFINE, streamline), atol=1e-4)
+
+
+def _pftPhantom():
+    """PVE maps of the phantom, with grey matter capping the box at both ends along x, and a seeding mask."""
+    sh, mask, _ = _phantom()
+    pveGm = np.zeros(SHAPE)
+    pveGm[2:4][mask[2:4]] = 1.
+    pveGm[-4:-2][mask[-4:-2]] = 1.
+    pveWm = mask - pveGm
+    pveCsf = 1. - mask
+    seedMask = np.zeros(SHAPE, dtype=bool)
+    seedMask[4:-4, 4:-4, 4:-4] = True
+    return sh, pveWm, pveGm, pveCsf, seedMask
+
+
+@pytest.mark.parametrize("nbProcesses", [1, 2])
+def test_pftToTrk_matches_serial_pft_on_default_sphere(tmp_path, nbProcesses):
+    # pftAlgo.py tracked on dipy's default_sphere before the pool: the default sphere of pftToTrk is the same
+    sh, pveWm, pveGm, pveCsf, seedMask = _pftPhantom()
+    seeds = utils.seeds_from_mask(seedMask, AFFINE, density=1)
+    voxelSize = 2.
+
+    dg = ProbabilisticDirectionGetter.from_shcoeff(sh, max_angle=20., sphere=default_sphere)
+    cmc = CmcStoppingCriterion.from_pve(pveWm, pveGm, pveCsf, step_size=0.375, average_voxel_size=voxelSize)
+    reference = list(ParticleFilteringTracking(dg, cmc, seeds, AFFINE, step_size=0.375, max_cross=1,
+                                               maxlen=1000, pft_back_tracking_dist=2,
+                                               pft_front_tracking_dist=1, particle_count=15,
+                                               return_all=False, random_seed=1))
+
+    outputPath = os.path.join(tmp_path, "pft.trk")
+    nbWritten = pftToTrk(outputPath, nib.Nifti1Image(pveWm, AFFINE), sh, pveWm, pveGm, pveCsf, seeds,
+                         voxelSize, randomSeed=1, nbProcesses=nbProcesses, seedsPerChunk=10)
+
+    streamlines = nib.streamlines.load(outputPath).streamlines
+    assert 0 < nbWritten == len(reference) == len(streamlines)
+    for written, streamline in zip(streamlines, reference):
+        np.testing.assert_allclose(written, streamline, atol=1e-4)
+
+
+def test_pftToTrk_on_seed_chunks_does_not_depend_on_the_processes(tmp_path):
+    sh, pveWm, pveGm, pveCsf, seedMask = _pftPhantom()
+    written = []
+    for nbProcesses in [1, 2]:
+        seeds = SeedChunks.random(seedMask, AFFINE, seedsPerChunk=20, nbSeeds=2, randomSeed=3)
+        outputPath = os.path.join(tmp_path, f"pft_{nbProcesses}.trk")
+        nbWritten = pftToTrk(outputPath, nib.Nifti1Image(pveWm, AFFINE), sh, pveWm, pveGm, pveCsf, seeds, 2.,
+                             randomSeed=1, saveSeeds=True, nbProcesses=nbProcesses)
+        assert nbWritten > 0
+        with open(outputPath, "rb") as f:
+            written.append(f.read())
+    assert written[0] == written[1]
+
+
+def test_dry_run_estimates_without_writing(tmp_path):
+    sh, mask, _ = _phantom()
+    seeds = SeedChunks.grid(mask, np.eye(4), seedsPerChunk=100, density=2)
+    outputPath = os.path.join(tmp_path, "tracking.trk")
+
+    estimate = trackToTrk(outputPath, nib.Nifti1Image(mask.astype(np.uint8), AFFINE), {"odf": sh}, mask, seeds,
+                          "det", THETA, STEP_SIZE, MAX_STEPS, MIN_LENGTH, MAX_LENGTH, shBasis=SH_BASIS,
+                          sphere=SPHERE, nbProcesses=2, dryRun=True)
+
+    assert isinstance(estimate, TrackingEstimate)
+    assert estimate.nbSeeds == seeds.nbSeeds == 8 * np.count_nonzero(mask)
+    assert estimate.nbChunks == len(seeds)
+    assert 0 < estimate.probeSeeds <= estimate.nbSeeds
+    assert 0 < estimate.estimatedStreamlines <= estimate.nbSeeds
+    assert not os.path.exists(outputPath)
+
+
+def test_pft_dry_run_estimates_without_writing(tmp_path):
+    sh, pveWm, pveGm, pveCsf, seedMask = _pftPhantom()
+    seeds = utils.seeds_from_mask(seedMask, AFFINE, density=2)
+    outputPath = os.path.join(tmp_path, "pft.trk")
+
+    estimate = pftToTrk(outputPath, nib.Nifti1Image(pveWm, AFFINE), sh, pveWm, pveGm, pveCsf, seeds, 2.,
+                        seedsPerChunk=10, dryRun=True)
+
+    assert isinstance(estimate, TrackingEstimate)
+    assert estimate.nbSeeds == len(seeds)
+    assert estimate.nbChunks == -(-len(seeds) // 10)
+    assert not os.path.exists(outputPath)
+
+
+def test_arrays_are_shared_from_disk_when_shared_memory_is_small(tmp_path, monkeypatch):
+    shm = tmp_path / "shm"
+    shm.mkdir()
+    monkeypatch.setattr(parallelTracking, "SHARED_MEMORY_FOLDER", str(shm))
+    monkeypatch.setattr(parallelTracking.shutil, "disk_usage", lambda path: type("Usage", (), {"free": 64 * MIB})())
+    sh, mask, seeds = _phantom()
+    arrays = {"odf": sh, "mask": mask.astype(np.uint8)}
+    assert parallelTracking.sharedArraysBytes(arrays) == sh.size * 8 + mask.size
+
+    shmFolder = parallelTracking.sharedFolder("small_", 16 * MIB)
+    assert os.path.dirname(shmFolder) == str(shm)
+    os.rmdir(shmFolder)
+    tmpFolder = parallelTracking.sharedFolder("large_", 1024 * MIB)
+    assert os.path.dirname(tmpFolder) == tempfile.gettempdir()
+    os.rmdir(tmpFolder)
+
+    # A run whose arrays do not fit tracks all the same
+    monkeypatch.setattr(parallelTracking, "SHARED_MEMORY_MARGIN", 1e6)
+    outputPath = os.path.join(tmp_path, "tracking.trk")
+    nbWritten = trackToTrk(outputPath, nib.Nifti1Image(mask.astype(np.uint8), AFFINE), {"odf": sh}, mask, seeds,
+                           "det", THETA, STEP_SIZE, MAX_STEPS, MIN_LENGTH, MAX_LENGTH, shBasis=SH_BASIS,
+                           sphere=SPHERE, nbProcesses=1)
+    assert nbWritten == len(_serialStreamlines(sh, mask, seeds))
+    assert os.listdir(shm) == []
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from dipy.core.sphere import HemiSphere
+from dipy.data import get_sphere
+from dipy.direction.peaks import peak_directions
+from dipy.reconst.shm import real_sh_descoteaux, sf_to_sh
+
+from peakExtraction import DEFAULT_MIN_SEPARATION_ANGLE, peaksToIndices, shToPeaks
+
+SHAPE = (6, 5, 4)
+SH_ORDER = 8
+NPEAKS = 5
+SF_THRESHOLD = 0.1
+
+
+def _crossingFodf(seed=0):
+    """SH of one to three lobes of random directions and weights per voxel, with a few empty voxels."""
+    rng = np.random.default_rng(seed)
+    sphere = get_sphere(name="symmetric724")
+    nbVoxels = int(np.prod(SHAPE))
+    sf = np.zeros((nbVoxels, len(sphere.vertices)))
+    for voxel in range(nbVoxels):
+        for _ in range(rng.integers(1, 4)):
+            direction = rng.normal(size=3)
+            direction /= np.linalg.norm(direction)
+            sf[voxel] += rng.uniform(0.3, 1.) * np.exp(-30. * (1. - np.dot(sphere.vertices, direction) ** 2))
+    sh = sf_to_sh(sf, sphere, sh_order_max=SH_ORDER).reshape(SHAPE + (-1,))
+    sh[0, 0, :2] = 0
+    return sh
+
+
+@pytest.fixture(scope="module")
+def tracking():
+    sphere = HemiSphere.from_sphere(get_sphere(name="symmetric724"))
+    bMatrix, _, _ = real_sh_descoteaux(SH_ORDER, sphere.theta, sphere.phi)
+    return _crossingFodf(), sphere, bMatrix
+
+
+@pytest.mark.parametrize("nbThreads", [1, 2])
+def test_shToPeaks_matches_peak_directions(tracking, nbThreads):
+    sh, sphere, bMatrix = tracking
+    peakDirs, peakValues, peakIndices = shToPeaks(sh, sphere, bMatrix, SF_THRESHOLD, 0., npeaks=NPEAKS,
+                                                  voxelsPerChunk=16, nbThreads=nbThreads)
+
+    nbCrossings = 0
+    for idx in np.ndindex(SHAPE):
+        if not np.sum(sh[idx]):
+            assert np.all(peakIndices[idx] == -1) and not np.any(peakValues[idx])
+            continue
+        # As scilpy's get_maximas, voxel per voxel
+        sf = np.dot(sh[idx], bMatrix.T)
+        sf[sf < 0.] = 0.
+        directions, values, indices = peak_directions(sf, sphere, relative_peak_threshold=SF_THRESHOLD,
+                                                      min_separation_angle=DEFAULT_MIN_SEPARATION_ANGLE)
+        n = min(NPEAKS, len(values))
+        nbCrossings += n > 1
+        np.testing.assert_array_equal(peakIndices[idx][:n], indices[:n])
+        np.testing.assert_allclose(peakValues[idx][:n], values[:n])
+        np.testing.assert_allclose(peakDirs[idx][:n], directions[:n])
+        assert np.all(peakIndices[idx][n:] == -1) and not np.any(peakValues[idx][n:])
+    # The phantom does exercise the separation of several peaks
+    assert nbCrossings > np.prod(SHAPE) // 3
+
+
+def test_peaksToIndices_matches_find_closest(tracking):
+    sh, sphere, bMatrix = tracking
+    peakDirs, peakValues, _ = shToPeaks(sh, sphere, bMatrix, SF_THRESHOLD, 0., npeaks=NPEAKS)
+    peakData = (peakDirs * peakValues[..., np.newaxis]).reshape(SHAPE + (3 * NPEAKS,))
+
+    values, indices = peaksToIndices(peakData, sphere)
+
+    for idx in np.ndindex(SHAPE):
+        if not np.sum(peakData[idx]):
+            assert not np.any(values[idx]) and not np.any(indices[idx])
+            continue
+        for i in range(NPEAKS):
+            peak = peakData[idx][3 * i:3 * (i + 1)]
+            assert values[idx][i] == pytest.approx(np.linalg.norm(peak))
+            assert indices[idx][i] == sphere.find_closest(peak)
@@ -0,0 +1,143 @@
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from dipy.direction.pmf import SHCoeffPmfGen, SimplePmfGen
+from dipy.tracking import utils
+
+import pmfCache
+from parallelTracking import pftToTrk, trackToTrk
+from pmfCache import PmfCache, pmfVolumePath, trackingSphere
+from test_parallelTracking import (AFFINE, MAX_LENGTH, MAX_STEPS, MIN_LENGTH, SH_BASIS, SHAPE, SPHERE, STEP_SIZE,
+                                   THETA, _phantom)
+
+
+def _entries(cacheDir):
+    return sorted(name for name in os.listdir(cacheDir) if name.endswith(".npy"))
+
+
+def _assertSameStreamlines(first, second):
+    assert len(first) == len(second) > 0
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize("algo", ["det", "prob"])
+def test_trackToTrk_on_pmf_matches_sh(tmp_path, algo):
+    sh, mask, seeds = _phantom()
+    referenceImg = nib.Nifti1Image(mask.astype(np.uint8), AFFINE)
+    cacheDir = str(tmp_path / "pmf_cache")
+    streamlines = {}
+    for shToPmf in [False, True]:
+        outputPath = str(tmp_path / f"{shToPmf}.trk")
+        trackToTrk(outputPath, referenceImg, {"odf": sh}, mask, seeds, algo, THETA, STEP_SIZE, MAX_STEPS,
+                   MIN_LENGTH, MAX_LENGTH, shBasis=SH_BASIS, sphere=SPHERE, randomSeed=1, nbProcesses=1,
+                   shToPmf=shToPmf, pmfCacheDir=cacheDir)
+        streamlines[shToPmf] = nib.streamlines.load(outputPath).streamlines
+
+    # The PMF volume was used, not the fallback on the SH
+    assert len(_entries(cacheDir)) == 1
+    _assertSameStreamlines(streamlines[False], streamlines[True])
+
+
+def test_pftToTrk_on_pmf_matches_sh(tmp_path):
+    sh, mask, _ = _phantom()
+    pveGm = np.zeros(SHAPE)
+    pveGm[2:4][mask[2:4]] = 1.
+    pveGm[-4:-2][mask[-4:-2]] = 1.
+    pveWm = mask - pveGm
+    pveCsf = 1. - mask
+    seedMask = np.zeros(SHAPE, dtype=bool)
+    seedMask[4:-4, 4:-4, 4:-4] = True
+    seeds = utils.seeds_from_mask(seedMask, AFFINE, density=1)
+    cacheDir = str(tmp_path / "pmf_cache")
+    streamlines = {}
+    for shToPmf in [False, True]:
+        outputPath = str(tmp_path / f"{shToPmf}.trk")
+        pftToTrk(outputPath, nib.Nifti1Image(pveWm, AFFINE), sh, pveWm, pveGm, pveCsf, seeds, 2.,
+                 randomSeed=1, nbProcesses=1, shToPmf=shToPmf, pmfCacheDir=cacheDir)
+        streamlines[shToPmf] = nib.streamlines.load(outputPath).streamlines
+
+    assert len(_entries(cacheDir)) == 1
+    _assertSameStreamlines(streamlines[False], streamlines[True])
+
+
+def test_pmf_interpolates_as_the_sh_with_negative_lobes(tmp_path):
+    # Random coefficients: every voxel has negative lobes, and its neighbours other ones
+    rng = np.random.default_rng(0)
+    sh = rng.normal(size=(5, 5, 5, 28))
+    mask = np.ones(sh.shape[:3], dtype=bool)
+    sphere = trackingSphere("repulsion724")
+    pmf = np.load(PmfCache(str(tmp_path)).getOrCompute(sh, mask))
+    assert pmf.min() < 0
+
+    shPmf = SHCoeffPmfGen(sh, sphere, None)
+    volumePmf = SimplePmfGen(pmf, sphere)
+    for point in rng.uniform(0, 4, size=(20, 3)):
+        np.testing.assert_allclose(volumePmf.get_pmf(point), shPmf.get_pmf(point), atol=1e-12)
+
+
+def test_cache_hit_reuses_the_entry(tmp_path, monkeypatch):
+    sh, mask, _ = _phantom()
+    cache = PmfCache(str(tmp_path))
+    path = cache.getOrCompute(sh, mask)
+    os.utime(path, (0, 0))
+
+    def noConversion(*args, **kwargs):
+        raise AssertionError("the PMF volume was converted again")
+
+    monkeypatch.setattr(pmfCache, "sh_to_sf_matrix", noConversion)
+    assert cache.getOrCompute(sh, mask) == path
+    # Read entries are the most recently used ones
+    assert os.stat(path).st_mtime > 0
+    assert _entries(str(tmp_path)) == [os.path.basename(path)]
+
+
+def test_key_changes_with_the_mask_and_the_basis(tmp_path):
+    sh, mask, _ = _phantom()
+    cache = PmfCache(str(tmp_path))
+    key = cache.key(sh, mask, "repulsion724", None)
+    assert cache.key(sh.copy(), mask.copy(), "repulsion724", None) == key
+
+    otherMask = mask.copy()
+    otherMask[mask.nonzero()[0][0]] = False
+    assert cache.key(sh, otherMask, "repulsion724", None) != key
+    assert cache.key(sh, mask, "repulsion724", "tournier07") != key
+    assert cache.key(sh, mask, "symmetric724", None) != key
+
+
+def test_evict_keeps_the_most_recently_used_entries_under_the_cap(tmp_path):
+    cache = PmfCache(str(tmp_path), maxSizeMB=2.5)
+    for i in range(4):
+        path = os.path.join(str(tmp_path), f"{i}.npy")
+        np.save(path, np.ones(2 ** 20 // 8 - 16))
+        os.utime(path, (i, i))
+    # Not an entry: never removed
+    with open(os.path.join(str(tmp_path), "unrelated.tmp"), "wb") as f:
+        f.write(b"\0" * 2 ** 20)
+
+    cache.evict()
+
+    assert _entries(str(tmp_path)) == ["2.npy", "3.npy"]
+    assert sum(size for _, size, _ in cache._entries()) <= cache.maxSizeBytes
+    assert os.path.exists(os.path.join(str(tmp_path), "unrelated.tmp"))
+
+
+def test_pmfVolumePath_falls_back_to_the_sh(tmp_path, monkeypatch):
+    sh, mask, _ = _phantom()
+    cacheDir = str(tmp_path / "pmf_cache")
+
+    monkeypatch.setattr(pmfCache, "availableMemoryBytes", lambda: 1)
+    assert pmfVolumePath(sh, mask, cacheDir=cacheDir) is None
+    monkeypatch.undo()
+
+    monkeypatch.setattr(pmfCache.shutil, "disk_usage", lambda path: type("Usage", (), {"free": 0})())
+    assert pmfVolumePath(sh, mask, cacheDir=cacheDir) is None
+    assert _entries(cacheDir) == []
+
+
+def test_default_cache_dir_is_read_when_the_cache_is_created(tmp_path, monkeypatch):
+    monkeypatch.setattr(pmfCache, "DEFAULT_CACHE_DIR", str(tmp_path / "default"))
+    assert PmfCache().cacheDir == str(tmp_path / "default")
@@ -0,0 +1,139 @@
+import os
+import time
+
+import pytest
+
+from contentHash import HashIndex, fileContentHash
+from fileTransfer import FileTransfer
+from remoteBlobCache import RemoteBlobCache
+from test_fileTransfer import _LocalClient as _TransferClient
+from test_jobSchedulers import _LocalClient as _CommandClient
+
+DAY_S = 24 * 3600
+MIB = 1024 * 1024
+
+
+class _RecordingTransfer(FileTransfer):
+    """FileTransfer on the local file system, remembering the files it uploaded."""
+
+    def __init__(self):
+        super().__init__(_TransferClient(dict(os.environ)))
+        self.uploaded = []
+
+    def upload(self, localPath, remotePath):
+        self.uploaded.append(localPath)
+        return super().upload(localPath, remotePath)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Cache of a remote root holding the blob cache and the job workspaces."""
+    root = tmp_path / "remote"
+    transfer = _RecordingTransfer()
+    cache = RemoteBlobCache(_CommandClient(dict(os.environ)), str(root / "BlobCache"), maxAgeDays=14,
+                            maxSizeGB=3 * MIB / 1024 ** 3, hashIndex=HashIndex(str(tmp_path)), transfer=transfer)
+    return cache, transfer, root
+
+
+def _localFile(tmp_path, name, size=MIB, fill=None):
+    path = tmp_path / name
+    with open(path, "wb") as f:
+        f.write(os.urandom(size) if fill is None else fill * size)
+    return str(path)
+
+
+def _blob(cache, name, size=MIB, ageDays=0.):
+    """A blob of `size` bytes used `ageDays` ago (content unrelated to its name)."""
+    os.makedirs(cache.cacheFolder, exist_ok=True)
+    path = cache.blobPath(name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    mtime = time.time() - ageDays * DAY_S
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_stage_uploads_each_content_once(tmp_path, remote):
+    cache, transfer, root = remote
+    dwi = _localFile(tmp_path, "dwi.nii")
+    mask = _localFile(tmp_path, "mask.nii")
+    sameAsDwi = str(tmp_path / "copy.nii")
+    with open(dwi, "rb") as source, open(sameAsDwi, "wb") as destination:
+        destination.write(source.read())
+    job = root / "Jobs" / "sample_1" / "Input"
+    pairs = [(dwi, str(job / "dwi.nii")), (mask, str(job / "mask.nii")), (sameAsDwi, str(job / "copy.nii")),
+             ("", str(job / "unused.nii"))]
+
+    hashes = cache.stage(pairs)
+
+    # The copy of the DWI is the same blob
+    assert sorted(transfer.uploaded) == sorted([dwi, mask])
+    for localPath, remotePath in pairs[:3]:
+        assert os.readlink(remotePath) == cache.blobPath(fileContentHash(localPath))
+        assert hashes[remotePath] == fileContentHash(localPath)
+    assert not os.path.exists(job / "unused.nii")
+
+    # Another run of the same subject uploads nothing
+    transfer.uploaded.clear()
+    otherJob = root / "Jobs" / "sample_2" / "Input"
+    cache.stage([(dwi, str(otherJob / "dwi.nii")), (mask, str(otherJob / "mask.nii"))])
+    assert transfer.uploaded == []
+    assert cache.missing(hashes.values()) == set()
+    assert cache.missing(["0" * 64]) == {"0" * 64}
+
+
+def test_evict_removes_old_then_least_recently_used_blobs(remote):
+    cache, _, _ = remote
+    names = [f"{i:064x}" for i in range(5)]
+    _blob(cache, names[0], ageDays=30)
+    for i, name in enumerate(names[1:]):
+        _blob(cache, name, ageDays=4 - i)
+
+    removed = cache.evict()
+
+    # The old one, then the least recently used until 3 MiB are left
+    assert sorted(removed) == sorted(names[:2])
+    assert sorted(os.listdir(cache.cacheFolder)) == sorted(names[2:])
+
+
+def test_evict_keeps_blobs_linked_from_workspaces_and_other_files(remote):
+    cache, _, root = remote
+    names = [f"{i:064x}" for i in range(5)]
+    for i, name in enumerate(names):
+        _blob(cache, name, ageDays=30 - i)
+    # A job still queued or running links the two oldest blobs
+    job = root / "Fodf" / "Jobs" / "sample_1" / "Input"
+    os.makedirs(job)
+    os.symlink(cache.blobPath(names[0]), job / "dwi.nii")
+    os.symlink(cache.blobPath(names[1]), job / "mask.nii")
+    # Being uploaded by the prepare of another job
+    part = _blob(cache, f"{5:064x}.part", ageDays=30)
+    other = _blob(cache, "notes.txt", ageDays=30)
+
+    removed = cache.evict()
+
+    assert sorted(removed) == sorted(names[2:])
+    for path in [cache.blobPath(names[0]), cache.blobPath(names[1]), part, other]:
+        assert os.path.exists(path)
+
+
+def test_evict_keeps_blobs_used_since_they_were_listed(remote, monkeypatch):
+    cache, _, _ = remote
+    name = f"{0:064x}"
+    path = _blob(cache, name, ageDays=30)
+    run = cache._run
+
+    def stagedMeanwhile(command):
+        if "rm -f" in command:
+            os.utime(path)
+        return run(command)
+
+    monkeypatch.setattr(cache, "_run", stagedMeanwhile)
+    assert cache.evict() == [name]
+    assert os.path.exists(path)
+
+
+def test_evict_on_an_empty_cache(remote):
+    cache, _, _ = remote
+    assert cache.evict() == []
+    assert os.path.isdir(cache.cacheFolder)
@@ -0,0 +1,77 @@
+import io
+
+import pytest
+
+from remoteJobs import RemoteJob, RemoteJobQueue
+
+
+class _Stream(io.BytesIO):
+    class channel:
+        @staticmethod
+        def recv_exit_status():
+            return 0
+
+
+class _QuietClient:
+    """SSH client stand-in whose commands print nothing (the job log stays empty)."""
+
+    def exec_command(self, command):
+        return None, _Stream(), _Stream()
+
+
+class _ScriptedBackend:
+    """Backend that starts nothing and answers each status poll with the next scripted outcome."""
+
+    name = "scripted"
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+
+    def submit(self, client, job):
+        return "1"
+
+    def status(self, client, job):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def cancel(self, client, job):
+        pass
+
+
+def _runJob(outcomes, collect=None):
+    queue = RemoteJobQueue(backend=_ScriptedBackend(outcomes), pollInterval=0.01)
+    job = RemoteJob("test", "true", "/tmp/job", connect=_QuietClient, collect=collect)
+    assert queue.wait(queue.submit(job), timeout=10)
+    queue.shutdown()
+    return job
+
+
+def test_dropped_connection_is_polled_again():
+    job = _runJob([ConnectionResetError("reset"), EOFError(), None, 0])
+    assert job.state == "finished"
+    assert job.exitCode == 0
+
+
+def test_other_poll_errors_fail_the_job():
+    job = _runJob([ValueError("invalid literal for int()")])
+    assert job.state == "failed"
+    assert "invalid literal" in job.error
+
+
+def test_collect_error_fails_the_job():
+    def collect(client):
+        raise FileNotFoundError("sample_trk.trk")
+
+    job = _runJob([0], collect=collect)
+    assert job.state == "failed"
+    assert "collecting outputs failed" in job.error
+    assert "sample_trk.trk" in job.error
+
+
+@pytest.mark.parametrize("exitCode", [3, -1])
+def test_exit_status_fails_the_job(exitCode):
+    job = _runJob([exitCode])
+    assert job.state == "failed"
+    assert job.exitCode == exitCode
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from dipy.tracking import utils
+
+from seedGenerator import SeedChunks
+
+AFFINE = np.array([[0., -1.5, 0., 12.],
+                   [2., 0., 0., -4.],
+                   [0., 0., 1.25, 7.],
+                   [0., 0., 0., 1.]])
+
+
+def _mask(seed=0):
+    return np.random.default_rng(seed).random((7, 6, 5)) > 0.6
+
+
+@pytest.mark.parametrize("density", [1, 2, 3, (1, 2, 3)])
+def test_grid_matches_seeds_from_mask(density):
+    mask = _mask()
+    chunks = SeedChunks.grid(mask, AFFINE, seedsPerChunk=50, density=density)
+
+    seeds = np.concatenate(list(chunks))
+
+    reference = utils.seeds_from_mask(mask, AFFINE, density=density)
+    assert chunks.nbSeeds == len(reference)
+    np.testing.assert_allclose(seeds, reference, atol=1e-12)
+
+
+@pytest.mark.parametrize("perVoxel, nbSeeds", [(True, 3), (False, 150)])
+def test_random_chunks_depend_only_on_their_index_and_seed(perVoxel, nbSeeds):
+    mask = _mask()
+    chunks = SeedChunks.random(mask, AFFINE, seedsPerChunk=40, nbSeeds=nbSeeds, perVoxel=perVoxel, randomSeed=7)
+    inOrder = list(chunks)
+    assert len(inOrder) > 2
+
+    # Another instance, generating the chunks backwards
+    again = SeedChunks.random(mask, AFFINE, seedsPerChunk=40, nbSeeds=nbSeeds, perVoxel=perVoxel, randomSeed=7)
+    for i in reversed(range(len(again))):
+        np.testing.assert_array_equal(again[i], inOrder[i])
+
+    other = SeedChunks.random(mask, AFFINE, seedsPerChunk=40, nbSeeds=nbSeeds, perVoxel=perVoxel, randomSeed=8)
+    assert not np.array_equal(other[0], inOrder[0])
+
+
+def test_random_seeds_are_in_their_voxels():
+    mask = _mask()
+    chunks = SeedChunks.random(mask, AFFINE, seedsPerChunk=40, nbSeeds=4, randomSeed=0)
+
+    seeds = np.concatenate(list(chunks))
+
+    voxels = np.rint(np.linalg.solve(AFFINE[:3, :3], (seeds - AFFINE[:3, 3]).T).T).astype(int)
+    assert len(seeds) == chunks.nbSeeds == 4 * np.count_nonzero(mask)
+    assert mask[tuple(voxels.T)].all()
+    # Four seeds per voxel, in the order of the voxels
+    np.testing.assert_array_equal(voxels[::4], np.argwhere(mask))
+
+
+@pytest.mark.parametrize("nbSeeds", [1, 39, 40, 1000])
+def test_total_seed_count(nbSeeds):
+    mask = _mask()
+    chunks = SeedChunks.random(mask, AFFINE, seedsPerChunk=40, nbSeeds=nbSeeds, perVoxel=False, randomSeed=0)
+
+    sizes = [len(chunk) for chunk in chunks]
+
+    assert sum(sizes) == chunks.nbSeeds == nbSeeds
+    assert len(sizes) == len(chunks) == -(-nbSeeds // 40)
+    assert all(size == chunks.chunkSeedCount for size in sizes[:-1])
+
+
+@pytest.mark.parametrize("chunks", [
+    SeedChunks.grid(np.zeros((4, 4, 4)), AFFINE, seedsPerChunk=10, density=2),
+    SeedChunks.random(np.zeros((4, 4, 4)), AFFINE, seedsPerChunk=10, nbSeeds=3),
+    SeedChunks.random(np.zeros((4, 4, 4)), AFFINE, seedsPerChunk=10, nbSeeds=100, perVoxel=False),
+])
+def test_empty_mask_has_no_chunks(chunks):
+    assert len(chunks) == chunks.nbSeeds == 0
+    assert list(chunks) == []
+    with pytest.raises(IndexError):
+        chunks[0]
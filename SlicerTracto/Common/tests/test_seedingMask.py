@@ -0,0 +1,46 @@
+import nibabel as nib
+import numpy as np
+import pytest
+
+from asyncWriter import AsyncWriter
+from seedingMask import thresholdMask
+
+AFFINE = np.array([[-1.5, 0., 0., 90.],
+                   [0., 1.5, 0., -126.],
+                   [0., 0., 2., -72.],
+                   [0., 0., 0., 1.]])
+
+
+@pytest.fixture
+def savedMask(tmp_path):
+    """Thresholded probability map, and the path the writer saved its image to."""
+    probabilities = np.random.default_rng(0).uniform(size=(7, 6, 5)).astype(np.float32)
+    img = nib.Nifti1Image(probabilities, AFFINE)
+    mask, maskImg = thresholdMask(img, 0.5)
+    savedPath = str(tmp_path / "seeding_mask.nii.gz")
+    with AsyncWriter() as writer:
+        # As the tractography modules save it
+        writer.saveNifti(maskImg.dataobj, maskImg.affine, savedPath, header=maskImg.header)
+    return probabilities, mask, maskImg, savedPath
+
+
+def test_mask_and_image_share_memory(savedMask):
+    probabilities, mask, maskImg, _ = savedMask
+    assert mask.dtype == bool
+    np.testing.assert_array_equal(mask, probabilities > 0.5)
+    assert 0 < np.count_nonzero(mask) < mask.size
+    assert np.shares_memory(np.asarray(maskImg.dataobj), mask)
+
+
+def test_saved_mask_is_uint8_with_the_source_affine(savedMask):
+    _, mask, _, savedPath = savedMask
+    saved = nib.load(savedPath)
+    assert saved.get_data_dtype() == np.uint8
+    np.testing.assert_allclose(saved.affine, AFFINE)
+    np.testing.assert_array_equal(np.asarray(saved.dataobj), mask.astype(np.uint8))
+
+
+def test_saved_mask_reads_back_as_the_mask(savedMask):
+    get_data_as_mask = pytest.importorskip("scilpy.io.image").get_data_as_mask
+    _, mask, _, savedPath = savedMask
+    np.testing.assert_array_equal(get_data_as_mask(nib.load(savedPath)), mask)
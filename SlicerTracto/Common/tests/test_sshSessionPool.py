@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("paramiko")
+
+import sshSessionPool
+from sshSessionPool import SSHSessionPool
+
+CONNECT_S = 1.
+
+
+class _Transport:
+    def is_active(self):
+        return True
+
+    def send_ignore(self):
+        pass
+
+
+class _Client:
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.closed = False
+
+    def get_transport(self):
+        return _Transport()
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = SSHSessionPool()
+    connections = []
+
+    def connect(hostname, port, username, keyPath, timeout):
+        connections.append(hostname)
+        if hostname == "unreachable":
+            time.sleep(CONNECT_S)
+            raise TimeoutError(f"{hostname} timed out")
+        time.sleep(CONNECT_S / 10)
+        return _Client(hostname)
+
+    monkeypatch.setattr(pool, "_connect", connect)
+    pool.connections = connections
+    return pool
+
+
+def test_unreachable_host_does_not_block_the_others(pool):
+    errors = []
+
+    def borrowUnreachable():
+        try:
+            pool.get("unreachable")
+        except TimeoutError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=borrowUnreachable)
+    thread.start()
+    time.sleep(CONNECT_S / 10)
+    start = time.perf_counter()
+    client = pool.get("cluster")
+    elapsed = time.perf_counter() - start
+    thread.join()
+
+    assert client.hostname == "cluster"
+    assert elapsed < CONNECT_S / 2
+    assert len(errors) == 1
+
+
+def test_concurrent_borrowers_of_a_host_share_one_connection(pool):
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(pool.get("cluster"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pool.connections == ["cluster"]
+    assert all(client is clients[0] for client in clients)
+
+
+def test_dead_session_is_replaced(pool, monkeypatch):
+    first = pool.get("cluster")
+    monkeypatch.setattr(sshSessionPool, "isAlive", lambda client: False)
+
+    second = pool.get("cluster")
+
+    assert second is not first and first.closed
+    assert pool.connections == ["cluster", "cluster"]
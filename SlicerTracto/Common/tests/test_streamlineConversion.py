@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+vtk = pytest.importorskip("vtk")
+from vtk.util import numpy_support
+
+from streamlineConversion import _legacyStreamlinesToPolyData, _syntheticStreamlines, streamlinesToPolyData
+
+
+def _pointsAndCells(polydata):
+    """Point coordinates and the point ids of every cell of a polydata."""
+    points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+    lines = polydata.GetLines()
+    lines.InitTraversal()
+    cells = []
+    ids = vtk.vtkIdList()
+    while lines.GetNextCell(ids):
+        cells.append([ids.GetId(i) for i in range(ids.GetNumberOfIds())])
+    return points, cells
+
+
+def _assertSamePolyData(polydata, reference):
+    points, cells = _pointsAndCells(polydata)
+    referencePoints, referenceCells = _pointsAndCells(reference)
+    assert polydata.GetNumberOfCells() == reference.GetNumberOfCells() == len(cells)
+    np.testing.assert_allclose(points, referencePoints, rtol=0, atol=1e-6)
+    assert cells == referenceCells
+
+
+def _withEmptyAndSinglePoints():
+    rng = np.random.default_rng(1)
+    return [rng.normal(size=(5, 3)).astype(np.float32),
+            np.zeros((0, 3), dtype=np.float32),
+            rng.normal(size=(1, 3)).astype(np.float32),
+            rng.normal(size=(3, 3)).astype(np.float32),
+            np.zeros((0, 3), dtype=np.float32),
+            rng.normal(size=(1, 3)).astype(np.float32)]
+
+
+def test_matches_the_legacy_loop_with_empty_and_single_point_streamlines():
+    streamlines = _withEmptyAndSinglePoints()
+    polydata = streamlinesToPolyData(streamlines)
+    _assertSamePolyData(polydata, _legacyStreamlinesToPolyData(streamlines))
+    _, cells = _pointsAndCells(polydata)
+    assert [len(cell) for cell in cells] == [5, 0, 1, 3, 0, 1]
+
+
+def test_matches_the_legacy_loop_on_an_indexed_view():
+    streamlines = _syntheticStreamlines(50, meanLength=10)
+    # Not contiguous: points are gathered from the shared buffer
+    view = streamlines[np.array([7, 3, 3, 42, 0])]
+    _assertSamePolyData(streamlinesToPolyData(view), _legacyStreamlinesToPolyData(view))
+    _assertSamePolyData(streamlinesToPolyData(streamlines), _legacyStreamlinesToPolyData(streamlines))
+
+
+def test_no_streamlines():
+    polydata = streamlinesToPolyData([])
+    assert polydata.GetNumberOfPoints() == polydata.GetNumberOfCells() == 0
+
+
+def test_point_index_scalars():
+    streamlines = _withEmptyAndSinglePoints()
+    polydata = streamlinesToPolyData(streamlines, pointIndexScalarName="index")
+    scalars = polydata.GetPointData().GetScalars()
+    assert scalars.GetName() == "index"
+    np.testing.assert_array_equal(numpy_support.vtk_to_numpy(scalars), [0, 1, 2, 3, 4, 0, 0, 1, 2, 0])
@@ -0,0 +1,59 @@
+import numpy as np
+import nibabel as nib
+import pytest
+
+from dipy.core.gradients import gradient_table
+from dipy.data import get_sphere
+from dipy.sims.voxel import single_tensor
+
+from resultStore import ResultStore
+from trackingFodf import trackingShCoefficients
+
+SHAPE = (6, 6, 6)
+
+
+@pytest.fixture
+def subject(tmp_path):
+    """Single-shell DWI of one fiber along x everywhere, with its bvals, bvecs and a full WM PVE map."""
+    bvecs = np.vstack([[0., 0., 0.], get_sphere(name="repulsion100").vertices[:64]])
+    bvals = np.r_[0., np.full(64, 1000.)]
+    signal = single_tensor(gradient_table(bvals, bvecs=bvecs), S0=100, evals=np.array([0.0017, 0.0002, 0.0002]))
+    paths = {name: str(tmp_path / name) for name in ("dwi.nii", "dwi.bval", "dwi.bvec", "pve_wm.nii")}
+    nib.save(nib.Nifti1Image(np.tile(signal, SHAPE + (1,)).astype(np.float32), np.eye(4)), paths["dwi.nii"])
+    np.savetxt(paths["dwi.bval"], bvals[None])
+    np.savetxt(paths["dwi.bvec"], bvecs.T)
+    pveWm = np.ones(SHAPE, dtype=np.float32)
+    nib.save(nib.Nifti1Image(pveWm, np.eye(4)), paths["pve_wm.nii"])
+    return paths, pveWm
+
+
+def _shCoefficients(subject, **kwargs):
+    paths, pveWm = subject
+    return trackingShCoefficients(paths["dwi.nii"], paths["dwi.bval"], paths["dwi.bvec"], paths["pve_wm.nii"],
+                                  pveWm, **kwargs)
+
+
+def test_fodf_on_the_pve_grid_is_used_as_is(subject, tmp_path):
+    fodf = np.random.default_rng(0).normal(size=SHAPE + (45,)).astype(np.float32)
+    fodfPath = str(tmp_path / "fodf.nii")
+    nib.save(nib.Nifti1Image(fodf, np.eye(4)), fodfPath)
+
+    np.testing.assert_array_equal(_shCoefficients(subject, fodfPath=fodfPath), fodf)
+
+
+def test_fodf_off_the_pve_grid_falls_back_to_the_csd(subject, tmp_path):
+    fodfPath = str(tmp_path / "fodf.nii")
+    nib.save(nib.Nifti1Image(np.ones((3, 3, 3, 45), dtype=np.float32), np.eye(4)), fodfPath)
+
+    np.testing.assert_allclose(_shCoefficients(subject, fodfPath=fodfPath), _shCoefficients(subject))
+
+
+def test_stored_csd_fit_is_reused(subject, tmp_path):
+    store = ResultStore(storeDir=str(tmp_path / "store"))
+    fitted = _shCoefficients(subject, store=store)
+    assert fitted.dtype == np.float32
+    np.testing.assert_allclose(fitted, _shCoefficients(subject), rtol=1e-6, atol=1e-6)
+
+    # Same inputs and CSD parameters: read back from the store, identical to the first run
+    reused = _shCoefficients(subject, store=store)
+    np.testing.assert_array_equal(reused, fitted)
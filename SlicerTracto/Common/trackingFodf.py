@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+import numpy as np
+import nibabel as nib
+from dipy.core.gradients import gradient_table
+from dipy.io.gradients import read_bvals_bvecs
+from dipy.io.image import load_nifti
+from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel, auto_response_ssst
+
+# CSD fitted when no FODF is given; part of the result store key of the fit
+CSD_ROI_RADII = 10
+CSD_FA_THRESHOLD = 0.7
+CSD_FIT_VERSION = 1
+
+
+def trackingShCoefficients(dwiPath, bvalPath, bvecPath, pveWmPath, pveWm, fodfPath=None, store=None):
+    """
+    SH coefficients (descoteaux07, dipy's default basis) for PFT to track on.
+
+    A precomputed FODF (the Fodf module writes this basis) is used as is
+    when it is on the grid of the PVE maps. Otherwise the CSD is fitted in
+    the white matter. With a `resultStore.ResultStore`, the fit of these
+    inputs is read from it, or fitted and stored, so that tracking again
+    with other seeds or particle counts does not refit it.
+
+    Parameters
+    ----------
+    dwiPath, bvalPath, bvecPath : str
+        Diffusion data, read only when the CSD has to be fitted.
+    pveWmPath : str
+        White matter PVE map (part of the result store key).
+    pveWm : ndarray
+        Its data, the mask of the fit.
+    fodfPath : str, optional
+        FODF of the subject.
+    store : resultStore.ResultStore, optional
+    """
+    if fodfPath is not None:
+        fodfImg = nib.load(fodfPath)
+        if fodfImg.shape[:3] == pveWm.shape[:3]:
+            print(f"[SLICER TRACTO] Tracking on the FODF {fodfPath}")
+            return fodfImg.get_fdata(dtype=np.float32)
+        print(f"[SLICER TRACTO][ERROR]FODF {fodfPath} {fodfImg.shape[:3]} does not match the PVE maps "
+              f"{pveWm.shape[:3]}, fitting the CSD instead")
+
+    if store is not None:
+        inputPaths = {"dwi": dwiPath, "bval": bvalPath, "bvec": bvecPath, "pve_wm": pveWmPath}
+        params = {"version": CSD_FIT_VERSION, "roi_radii": CSD_ROI_RADII, "fa_thr": CSD_FA_THRESHOLD}
+        key = store.key(inputPaths, params)
+        stored = store.get(key)
+        if stored is not None:
+            print(f"[SLICER TRACTO] Reused the stored CSD fit of {dwiPath} (key {key[:12]})")
+            return nib.load(stored["pft_fodf"]).get_fdata(dtype=np.float32)
+
+    data, affine = load_nifti(dwiPath)
+    bvals, bvecs = read_bvals_bvecs(bvalPath, bvecPath)
+    gtab = gradient_table(bvals, bvecs=bvecs)
+
+    response, ratio = auto_response_ssst(gtab, data, roi_radii=CSD_ROI_RADII, fa_thr=CSD_FA_THRESHOLD)
+    csdModel = ConstrainedSphericalDeconvModel(gtab, response)
+    csdFit = csdModel.fit(data, mask=pveWm)
+    if store is None:
+        return csdFit.shm_coeff
+
+    # float32 as stored, so a first run and the runs reusing the fit track on the same values
+    shCoeffs = csdFit.shm_coeff.astype(np.float32)
+    with tempfile.TemporaryDirectory() as folder:
+        fodfPath = os.path.join(folder, "pft_fodf.nii")
+        nib.save(nib.Nifti1Image(shCoeffs, affine), fodfPath)
+        store.put(key, {"pft_fodf": fodfPath}, inputPaths, params)
+    return shCoeffs
@@ -0,0 +1,104 @@
+import numpy as np
+import nibabel as nib
+from nibabel.affines import apply_affine
+from nibabel.streamlines import Field
+from nibabel.streamlines.array_sequence import ArraySequence
+
+DEFAULT_CHUNK_SIZE = 100_000
+SPACES = ["rasmm", "voxcorner"]
+
+
+def tractogramReference(tractogramPath):
+    """
+    Read the reference geometry of a tractogram from its header only.
+
+    Returns `(affine, dimensions, nbStreamlines)` where `affine` maps voxel
+    indices to RAS mm (same as dipy's `space_attributes`) and `nbStreamlines`
+    is None when the header does not store it (e.g. some `.tck` files).
+    """
+    header = nib.streamlines.load(tractogramPath, lazy_load=True).header
+    affine = np.asarray(header[Field.VOXEL_TO_RASMM], dtype=np.float64)
+    dimensions = np.asarray(header[Field.DIMENSIONS], dtype=int)
+    nbStreamlines = header.get(Field.NB_STREAMLINES)
+    if nbStreamlines is not None and int(nbStreamlines) <= 0:
+        nbStreamlines = None
+    return affine, dimensions, None if nbStreamlines is None else int(nbStreamlines)
+
+
+def iterTractogramChunks(tractogramPath, chunkSize=DEFAULT_CHUNK_SIZE, progressCallback=None, space="rasmm"):
+    """
+    Read a tractogram lazily and yield it as fixed-size ArraySequence batches.
+
+    Only one batch is held in memory at a time, on top of whatever the
+    consumer keeps.
+
+    Parameters
+    ----------
+    tractogramPath : str
+        `.trk` / `.tck` file readable by nibabel.
+    chunkSize : int
+        Number of streamlines per batch (the last batch may be smaller).
+    progressCallback : callable, optional
+        Called after every batch as `progressCallback(nbRead, nbTotal)`;
+        `nbTotal` is None when the header does not store the count.
+    space : str
+        "rasmm" (same coordinates as `load_tractogram(..., to_space=Space.RASMM)`)
+        or "voxcorner" (voxel space with corner origin, as after `sft.to_vox(); sft.to_corner()`).
+
+    Yields
+    ------
+    ArraySequence
+    """
+    if space not in SPACES:
+        raise ValueError(f"Invalid space: {space}. Expected one of {SPACES}")
+
+    affine, _, nbTotal = tractogramReference(tractogramPath)
+    rasmmToVox = np.linalg.inv(affine)
+    tractogramFile = nib.streamlines.load(tractogramPath, lazy_load=True)
+
+    def _finalize(batch):
+        chunk = ArraySequence(batch)
+        if space == "voxcorner" and len(chunk):
+            chunk._data = apply_affine(rasmmToVox, chunk._data) + 0.5
+        # TRK/TCK store float32 points, keep them that way in memory
+        chunk._data = chunk._data.astype(np.float32, copy=False)
+        return chunk
+
+    nbRead = 0
+    batch = []
+    for streamline in tractogramFile.tractogram.streamlines:
+        batch.append(streamline)
+        if len(batch) == chunkSize:
+            nbRead += len(batch)
+            yield _finalize(batch)
+            batch = []
+            if progressCallback:
+                progressCallback(nbRead, nbTotal)
+
+    if batch:
+        nbRead += len(batch)
+        yield _finalize(batch)
+        if progressCallback:
+            progressCallback(nbRead, nbTotal)
+
+
+def loadStreamlinesChunked(tractogramPath, chunkSize=DEFAULT_CHUNK_SIZE, progressCallback=None, space="rasmm"):
+    """
+    Read a whole tractogram into a single ArraySequence, batch by batch.
+
+    Unlike `load_tractogram`, no StatefulTractogram (and its space/origin
+    copies) is built: peak memory is the point buffer plus one batch.
+    """
+    streamlines = ArraySequence()
+    for chunk in iterTractogramChunks(tractogramPath, chunkSize, progressCallback, space):
+        streamlines.extend(chunk)
+    streamlines.finalize_append()
+    return streamlines
+
+
+def printProgress(nbRead, nbTotal):
+    """Default progress callback: print the number of streamlines read so far."""
+    if nbTotal:
+        print(f"[SLICER TRACTO]{nbRead}/{nbTotal} streamlines read")
+    else:
+        print(f"[SLICER TRACTO]{nbRead} streamlines read")
@@ -1,6 +1,9 @@
 import logging
 import os
 import sys
+common_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Common")
+if common_path not in sys.path:
+    sys.path.append(common_path)
 from typing import Annotated, Optional
 import vtk
 import slicer
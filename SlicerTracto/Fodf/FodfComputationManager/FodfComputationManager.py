@@ -15,8 +15,9 @@ class FodfComputationManager:
         self.ssh_middleware = SSHManager()
 
 
-    def route_request(self, subjectName, method, algo, inputFolderPath, outputFolderPath):
+    def route_request(self, subjectName, method, algo, inputFolderPath, outputFolderPath, onFinished=None):
+        """Run locally (blocking), or submit a remote job and return its id; `onFinished(job)` is called when it ends."""
         if method == "Local":
             self.local_middleware.execute(subjectName=subjectName, algo=algo, inputFolderPath=inputFolderPath, outputFolderPath=outputFolderPath)
         elif method == "SSH":
-            self.ssh_middleware.execute(subjectName=subjectName, algo=algo, inputFolderPath=inputFolderPath, outputFolderPath=outputFolderPath)
\ No newline at end of file
+            return self.ssh_middleware.execute(subjectName=subjectName, algo=algo, inputFolderPath=inputFolderPath, outputFolderPath=outputFolderPath, onFinished=onFinished)
\ No newline at end of file
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compare the fODF engines of FodfPipeline on the same data: time of each
+engine and largest difference between their SH coefficients.
+
+Without inputs, runs on the `processing` testing dataset of scilpy
+(dwi_crop_3000.nii.gz, 3000.bval, 3000.bvec, frf.txt). Exits with an error
+when the engines differ by more than --tolerance.
+
+    python benchmarkFodfEngines.py
+    python benchmarkFodfEngines.py --sh_order 8 --processes 4 --repeat 3
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import nibabel as nib
+import numpy as np
+
+from dipy.core.gradients import gradient_table
+from dipy.data import get_sphere
+from dipy.io.gradients import read_bvals_bvecs
+from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
+
+from scilpy.gradients.bvec_bval_tools import DEFAULT_B0_THRESHOLD, check_b0_threshold
+from scilpy.reconst.fodf import fit_from_model
+
+common_path = os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.pardir] * 4, "Common"))
+if common_path not in sys.path:
+    sys.path.append(common_path)
+from batchedCsd import fitCsd
+from maskedVoxels import MaskedVoxels
+
+DEFAULT_TOLERANCE = 1e-6
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('--dwi', help='DWI volume (default: scilpy testing data).')
+    p.add_argument('--bval', help='b-values file.')
+    p.add_argument('--bvec', help='b-vectors file.')
+    p.add_argument('--frf', help='Fiber response function file.')
+    p.add_argument('--mask', help='Brain mask restricting the fit.')
+    p.add_argument('--sh_order', type=int, default=6, help='SH order [%(default)s].')
+    p.add_argument('--processes', type=int, default=1,
+                   help='Processes (scilpy) and threads (batched) [%(default)s].')
+    p.add_argument('--repeat', type=int, default=1,
+                   help='Runs of each engine; the fastest is reported [%(default)s].')
+    p.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                   help='Largest accepted difference, relative to the largest '
+                        'coefficient [%(default)s].')
+    return p
+
+
+def _testing_inputs():
+    from scilpy import SCILPY_HOME
+    from scilpy.io.fetcher import fetch_data, get_testing_files_dict
+
+    fetch_data(get_testing_files_dict(), keys=['processing.zip'])
+    folder = os.path.join(SCILPY_HOME, 'processing')
+    return (os.path.join(folder, 'dwi_crop_3000.nii.gz'), os.path.join(folder, '3000.bval'),
+            os.path.join(folder, '3000.bvec'), os.path.join(folder, 'frf.txt'))
+
+
+def _best_time(function, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    args = _build_arg_parser().parse_args()
+    if args.dwi is None:
+        dwi_path, bval_path, bvec_path, frf_path = _testing_inputs()
+    else:
+        dwi_path, bval_path, bvec_path, frf_path = args.dwi, args.bval, args.bvec, args.frf
+
+    data = nib.load(dwi_path).get_fdata(dtype=np.float32)
+    bvals, bvecs = read_bvals_bvecs(bval_path, bvec_path)
+    b0_threshold = check_b0_threshold(bvals.min(), b0_thr=DEFAULT_B0_THRESHOLD, skip_b0_check=False)
+    gtab = gradient_table(bvals, bvecs=bvecs, b0_threshold=b0_threshold)
+    full_frf = np.loadtxt(frf_path)
+    csd_model = ConstrainedSphericalDeconvModel(gtab, (full_frf[0:3], full_frf[3]),
+                                                reg_sphere=get_sphere(name='symmetric362'),
+                                                sh_order_max=args.sh_order)
+    mask = None
+    if args.mask:
+        mask = nib.load(args.mask).get_fdata() > 0
+    voxels = MaskedVoxels.fromSignal(data, mask)
+    signals = voxels.gather(data)
+    print(f"{dwi_path}: {data.shape}, {voxels.nbVoxels} voxels fitted, "
+          f"SH order {args.sh_order}, {args.processes} processes")
+
+    scilpy_time, scilpy_coeffs = _best_time(
+        lambda: fit_from_model(csd_model, signals[:, None, None], mask=None,
+                               nbr_processes=args.processes).shm_coeff[:, 0, 0],
+        args.repeat)
+    batched_time, batched_coeffs = _best_time(
+        lambda: fitCsd(csd_model, signals, nbThreads=args.processes), args.repeat)
+
+    difference = np.abs(scilpy_coeffs - batched_coeffs).max()
+    relative = difference / max(np.abs(scilpy_coeffs).max(), np.finfo(float).tiny)
+    print(f"scilpy : {scilpy_time:8.2f}s")
+    print(f"batched: {batched_time:8.2f}s ({scilpy_time / batched_time:.1f}x)")
+    print(f"largest difference: {difference:.3e} ({relative:.3e} relative)")
+    if relative > args.tolerance:
+        sys.exit(f"The engines differ by more than {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
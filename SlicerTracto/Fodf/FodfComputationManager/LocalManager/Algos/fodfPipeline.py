@@ -0,0 +1,391 @@
+import os
+import time
+import logging
+
+import numpy as np
+import nibabel as nib
+
+from dipy.core.gradients import gradient_table
+from dipy.data import get_sphere
+from dipy.direction.peaks import reshape_peaks_for_visualization
+from dipy.io.gradients import read_bvals_bvecs
+from dipy.reconst.csdeconv import ConstrainedSphericalDeconvModel
+from dipy.reconst.dti import (TensorModel, color_fa, fractional_anisotropy,
+                              geodesic_anisotropy, mean_diffusivity,
+                              axial_diffusivity, norm,
+                              radial_diffusivity, lower_triangular)
+from dipy.reconst.dti import mode as dipy_mode
+
+from scilpy.gradients.bvec_bval_tools import (DEFAULT_B0_THRESHOLD,
+                                              check_b0_threshold,
+                                              is_normalized_bvecs,
+                                              normalize_bvecs)
+from scilpy.io.image import get_data_as_mask
+from scilpy.io.tensor import convert_tensor_from_dipy_format
+from scilpy.reconst.fodf import fit_from_model
+from scilpy.reconst.frf import compute_ssst_frf
+from scilpy.reconst.sh import convert_sh_basis, peaks_from_sh, maps_from_sh
+
+from asyncWriter import AsyncWriter
+from batchedCsd import fitCsd
+from maskedVoxels import MaskedVoxels
+from resourcePlanner import nbShCoeffs, planFodfProcesses
+
+# Defaults of the scil scripts the pipeline replaces, as GenerateFODF called them
+SH_ORDER = 6
+SH_BASIS = "descoteaux07"
+IS_LEGACY = True
+FA_THRESH = 0.7
+MIN_FA_THRESH = 0.5
+MIN_NVOX = 300
+ROI_RADII = 20
+FRF_PRECISION = 4
+DTI_METHOD = "WLS"
+TENSOR_FORMAT = "fsl"
+REG_SPHERE = "symmetric362"
+METRICS_SPHERE = "repulsion724"
+RELATIVE_PEAK_THRESHOLD = 0.1
+ABSOLUTE_PEAK_THRESHOLD = 0.0
+# "scilpy": fit_from_model (one dipy fit per voxel, in processes)
+# "batched": batchedCsd.fitCsd (many voxels per BLAS call, in threads)
+FODF_ENGINES = ("scilpy", "batched")
+FODF_ENGINE = "scilpy"
+# Part of the result store key: bump when a change alters the outputs
+PIPELINE_VERSION = 1
+
+
+class FodfPipeline:
+    """
+    FRF, fODF (SSST CSD), DTI metrics and fODF metrics computed in one process.
+
+    Same results as running `scil_frf_ssst`, `scil_fodf_ssst`,
+    `scil_dti_metrics` and `scil_fodf_metrics` one after the other, but the
+    DWI, the gradients and the masks are read once and every stage gets the
+    arrays of the previous one in memory. Outputs are written by an
+    `AsyncWriter` while the next stage runs.
+
+    Parameters
+    ----------
+    diffusionPath, bvalPath, bvecPath : str
+        DWI volume and gradient files.
+    whiteMaskPath : str, optional
+        White matter mask used to estimate the FRF.
+    maskPath : str, optional
+        Brain mask restricting the fODF fit (`scil_fodf_ssst --mask`). The
+        fit only ever runs on the voxels with a signal.
+    fodfEngine : str
+        CSD solver, one of `FODF_ENGINES`.
+    nbProcesses : int, optional
+        Processes used by the CSD fit and the fODF metrics. By default it is
+        planned from the cores and the free memory once the DWI is loaded
+        (see `resourcePlanner.planFodfProcesses`), at most `maxProcesses`.
+    """
+
+    def __init__(self, diffusionPath, bvalPath, bvecPath, whiteMaskPath=None, maskPath=None,
+                 nbProcesses=None, maxProcesses=None, fodfEngine=FODF_ENGINE):
+        if fodfEngine not in FODF_ENGINES:
+            raise ValueError(f"Unknown fODF engine {fodfEngine!r}, expected one of {FODF_ENGINES}")
+        self.diffusionPath: str = diffusionPath
+        self.bvalPath: str = bvalPath
+        self.bvecPath: str = bvecPath
+        self.whiteMaskPath: str = whiteMaskPath
+        self.maskPath: str = maskPath
+        self.fodfEngine: str = fodfEngine
+        self.nbProcesses: int = nbProcesses
+        self.maxProcesses: int = maxProcesses
+        self.resourcePlan = None
+        self.runLog: list = []
+
+        self.img = None
+        self.data = None
+        self.bvals = None
+        self.bvecs = None
+        self.b0Threshold = None
+        self.maskWm = None
+        self.mask = None
+        self._gtab = None
+
+    # -------------------------------------------------------------------------
+    # Inputs
+    # -------------------------------------------------------------------------
+    def load(self):
+        """Read the DWI, gradients and mask; the only pass over the input files."""
+        if self.data is not None:
+            return
+        self.img = nib.load(self.diffusionPath)
+        self.data = self.img.get_fdata(dtype=np.float32)
+        self.bvals, self.bvecs = read_bvals_bvecs(self.bvalPath, self.bvecPath)
+        self.b0Threshold = check_b0_threshold(self.bvals.min(), b0_thr=DEFAULT_B0_THRESHOLD,
+                                              skip_b0_check=False)
+        if self.whiteMaskPath:
+            self.maskWm = get_data_as_mask(nib.load(self.whiteMaskPath), dtype=bool)
+        if self.maskPath:
+            self.mask = get_data_as_mask(nib.load(self.maskPath), dtype=bool)
+        self.log(f"Loaded {self.diffusionPath} {self.data.shape}")
+
+        if self.nbProcesses is None:
+            self.resourcePlan = planFodfProcesses(self.data.shape, SH_ORDER, maxProcesses=self.maxProcesses)
+            self.nbProcesses = self.resourcePlan.nbProcesses
+            self.log(f"Resource plan: {self.resourcePlan}")
+        else:
+            self.log(f"Using {self.nbProcesses} processes (set by the caller)")
+
+    def log(self, message):
+        """Print a message and keep it, with its time, for the run log file."""
+        print(f"[SLICER TRACTO]{message}")
+        self.runLog.append(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}")
+
+    @property
+    def gtab(self):
+        """Gradient table with normalized b-vectors, shared by the CSD and the tensor fit."""
+        if self._gtab is None:
+            bvecs = self.bvecs
+            if not is_normalized_bvecs(bvecs):
+                logging.warning('Your b-vectors do not seem normalized...')
+                bvecs = normalize_bvecs(bvecs)
+            self._gtab = gradient_table(self.bvals, bvecs=bvecs, b0_threshold=self.b0Threshold)
+        return self._gtab
+
+    def inputPaths(self):
+        return {"dwi": self.diffusionPath, "bval": self.bvalPath, "bvec": self.bvecPath,
+                "wm_mask": self.whiteMaskPath, "mask": self.maskPath}
+
+    def parameters(self):
+        """Every setting the outputs depend on (the number of processes is not one)."""
+        return {"version": PIPELINE_VERSION, "sh_order": SH_ORDER, "sh_basis": SH_BASIS,
+                "is_legacy": IS_LEGACY, "b0_threshold": DEFAULT_B0_THRESHOLD,
+                "fa_thresh": FA_THRESH, "min_fa_thresh": MIN_FA_THRESH, "min_nvox": MIN_NVOX,
+                "roi_radii": ROI_RADII, "frf_precision": FRF_PRECISION, "dti_method": DTI_METHOD,
+                "tensor_format": TENSOR_FORMAT, "reg_sphere": REG_SPHERE,
+                "metrics_sphere": METRICS_SPHERE, "relative_peak_threshold": RELATIVE_PEAK_THRESHOLD,
+                "absolute_peak_threshold": ABSOLUTE_PEAK_THRESHOLD, "fodf_engine": self.fodfEngine}
+
+    # -------------------------------------------------------------------------
+    # Stages
+    # -------------------------------------------------------------------------
+    def computeFrf(self):
+        """
+        Single-shell fiber response (`scil_frf_ssst`).
+
+        The values are rounded as in the FRF text file, so the fODF is the same
+        as when it was computed from the file.
+        """
+        self.load()
+        full_response = compute_ssst_frf(
+            self.data, self.bvals, self.bvecs, self.b0Threshold,
+            mask=None, mask_wm=self.maskWm, fa_thresh=FA_THRESH,
+            min_fa_thresh=MIN_FA_THRESH, min_nvox=MIN_NVOX,
+            roi_radii=ROI_RADII, roi_center=None)
+        return np.array([float(f"{value:.{FRF_PRECISION}f}") for value in full_response])
+
+    def computeFodf(self, full_frf, shOrder=SH_ORDER):
+        """
+        SSST CSD fODF coefficients as float32 (`scil_fodf_ssst`).
+
+        Only the voxels with a signal (within the brain mask, if any) are
+        fitted: they are gathered from the mask's bounding box into an
+        `(N, 1, 1, directions)` array, fitted and converted to the output
+        basis there, then scattered back into the volume. The coefficients
+        are the same as for the full field of view, which is zero outside.
+        The fit itself is scilpy's `fit_from_model` or the batched solver of
+        `batchedCsd`, depending on `fodfEngine`.
+        """
+        self.load()
+        if self.data.shape[-1] < (shOrder + 1) * (shOrder + 2) / 2:
+            logging.warning(
+                'We recommend having at least {} unique DWI volumes, but you '
+                'currently have {} volumes. Try lowering the parameter sh_order '
+                'in case of non convergence.'.format(
+                    (shOrder + 1) * (shOrder + 2) / 2, self.data.shape[-1]))
+
+        reg_sphere = get_sphere(name=REG_SPHERE)
+        csd_model = ConstrainedSphericalDeconvModel(self.gtab, (full_frf[0:3], full_frf[3]),
+                                                    reg_sphere=reg_sphere,
+                                                    sh_order_max=shOrder)
+        voxels = MaskedVoxels.fromSignal(self.data, self.mask)
+        self.log(f"Fitting {voxels.nbVoxels} voxels ({100 * voxels.fraction:.1f}% of the volume)")
+        if voxels.nbVoxels == 0:
+            return np.zeros(self.data.shape[:3] + (nbShCoeffs(shOrder),), dtype=np.float32)
+
+        data = voxels.gather(self.data)
+        if self.fodfEngine == "batched":
+            shm_coeff = fitCsd(csd_model, data, nbThreads=self.nbProcesses)[:, None, None]
+        else:
+            shm_coeff = fit_from_model(csd_model, data[:, None, None], mask=None,
+                                       nbr_processes=self.nbProcesses).shm_coeff
+        shm_coeff = convert_sh_basis(shm_coeff, reg_sphere, mask=None,
+                                     input_basis='descoteaux07',
+                                     output_basis=SH_BASIS,
+                                     is_input_legacy=True,
+                                     is_output_legacy=IS_LEGACY,
+                                     nbr_processes=self.nbProcesses)
+        return voxels.scatter(shm_coeff[:, 0, 0], dtype=np.float32)
+
+    def computeDtiMetrics(self):
+        """
+        Tensor maps of `scil_dti_metrics`, as a `{name: array}` dict.
+
+        The residual QC map (slice by slice refit and plots) is left to the
+        script.
+        """
+        self.load()
+        data = self.data
+        gtab = self.gtab
+        tenmodel = TensorModel(gtab, fit_method=DTI_METHOD, min_signal=np.min(data[data > 0]))
+        tenfit = tenmodel.fit(data)
+
+        metrics = {}
+        metrics["tensor"] = convert_tensor_from_dipy_format(
+            lower_triangular(tenfit.quadratic_form), final_format=TENSOR_FORMAT).astype(np.float32)
+
+        FA = fractional_anisotropy(tenfit.evals)
+        FA[np.isnan(FA)] = 0
+        FA = np.clip(FA, 0, 1)
+        metrics["fa"] = FA.astype(np.float32)
+        metrics["rgb"] = np.array(255 * color_fa(FA, tenfit.evecs), 'uint8')
+
+        GA = geodesic_anisotropy(tenfit.evals)
+        GA[np.isnan(GA)] = 0
+        metrics["ga"] = GA.astype(np.float32)
+        metrics["md"] = mean_diffusivity(tenfit.evals).astype(np.float32)
+        metrics["ad"] = axial_diffusivity(tenfit.evals).astype(np.float32)
+        metrics["rd"] = radial_diffusivity(tenfit.evals).astype(np.float32)
+
+        # The mode computation can generate NANs when not masked
+        inter_mode = dipy_mode(tenfit.quadratic_form)
+        mode = np.zeros(inter_mode.shape)
+        mode[np.isfinite(inter_mode)] = inter_mode[np.isfinite(inter_mode)]
+        metrics["mode"] = mode.astype(np.float32)
+        metrics["tensor_norm"] = norm(tenfit.quadratic_form).astype(np.float32)
+
+        evecs = tenfit.evecs.astype(np.float32)
+        evals = tenfit.evals.astype(np.float32)
+        metrics["tensor_evecs"] = evecs
+        metrics["tensor_evals"] = evals
+        for i in range(3):
+            metrics[f"tensor_evecs_v{i + 1}"] = evecs[..., i]
+            metrics[f"tensor_evals_e{i + 1}"] = evals[..., i]
+
+        S0 = np.mean(data[..., gtab.b0s_mask], axis=-1, keepdims=True)
+        metrics["physically_implausible_signals_mask"] = \
+            np.max(S0 < data[..., ~gtab.b0s_mask], axis=-1).astype(np.int16)
+        metrics["pulsation_and_misalignment_std_dwi"] = \
+            np.std(data[..., ~gtab.b0s_mask], axis=-1).astype(np.float32)
+        if np.sum(gtab.b0s_mask) > 1:
+            metrics["pulsation_and_misalignment_std_b0"] = \
+                np.std(data[..., gtab.b0s_mask], axis=-1).astype(np.float32)
+        return metrics
+
+    def computeFodfMetrics(self, fodf):
+        """Peaks and fODF maps of `scil_fodf_metrics`, as a `{name: array}` dict."""
+        sphere = get_sphere(name=METRICS_SPHERE)
+        peak_dirs, peak_values, peak_indices = peaks_from_sh(
+            fodf, sphere, mask=None,
+            relative_peak_threshold=RELATIVE_PEAK_THRESHOLD,
+            absolute_threshold=ABSOLUTE_PEAK_THRESHOLD,
+            min_separation_angle=25, normalize_peaks=False,
+            sh_basis_type=SH_BASIS, is_legacy=IS_LEGACY,
+            nbr_processes=self.nbProcesses)
+
+        nufo_map, afd_max, afd_sum, rgb_map, _, _ = maps_from_sh(
+            fodf, peak_values, peak_indices, sphere, nbr_processes=self.nbProcesses)
+
+        # Max-normalized peak values, peaks scaled by them
+        peak_values = np.divide(peak_values, peak_values[..., 0, None],
+                                out=np.zeros_like(peak_values),
+                                where=peak_values[..., 0, None] != 0)
+        peak_dirs[...] *= peak_values[..., :, None]
+
+        return {"nufo": nufo_map.astype(np.float32),
+                "afd_max": afd_max.astype(np.float32),
+                "afd_total_sh0": fodf[:, :, :, 0].astype(np.float32),
+                "afd_sum": afd_sum.astype(np.float32),
+                "rgb": rgb_map.astype('uint8'),
+                "peaks": reshape_peaks_for_visualization(peak_dirs),
+                "peak_values": peak_values,
+                "peak_indices": peak_indices}
+
+    # -------------------------------------------------------------------------
+    # Whole pipeline
+    # -------------------------------------------------------------------------
+    def run(self, outputFolderPath, subjectName, writer=None, store=None):
+        """
+        Run every stage and write the outputs to `outputFolderPath`.
+
+        With a `ResultStore`, outputs computed before from the same input
+        files and parameters are copied from the store instead, and new
+        results are added to it.
+
+        Returns a dict of the written paths (`frf`, `fodf`, `dti_<metric>`,
+        `fodf_<metric>` and `log` keys, the log holding the resource plan and
+        the stage timings). The files are all on disk when it returns.
+        """
+        os.makedirs(outputFolderPath, exist_ok=True)
+        key = None
+        if store is not None:
+            key = store.key(self.inputPaths(), self.parameters())
+            stored = store.get(key)
+            if stored is not None:
+                paths = {name: self._outputPath(outputFolderPath, subjectName, storedPath)
+                         for name, storedPath in stored.items()}
+                if store.restore(key, paths):
+                    self.log(f"Reused the stored results of {self.diffusionPath} (key {key[:12]})")
+                    paths["log"] = self._writeLog(outputFolderPath, subjectName)
+                    return paths
+
+        if writer is None:
+            with AsyncWriter() as ownWriter:
+                paths = self._runStages(outputFolderPath, subjectName, ownWriter)
+        else:
+            paths = self._runStages(outputFolderPath, subjectName, writer)
+
+        if store is not None:
+            store.put(key, {name: path for name, path in paths.items() if name != "log"},
+                      self.inputPaths(), self.parameters())
+        return paths
+
+    @staticmethod
+    def _outputPath(outputFolderPath, subjectName, storedPath):
+        return os.path.join(outputFolderPath, f"{subjectName}_{os.path.basename(storedPath)}")
+
+    def _writeLog(self, outputFolderPath, subjectName):
+        logPath = os.path.join(outputFolderPath, f"{subjectName}_fodf_run_log.txt")
+        with open(logPath, "a") as f:
+            f.write("\n".join(self.runLog) + "\n")
+        return logPath
+
+    def _runStages(self, outputFolderPath, subjectName, writer):
+        paths = {}
+
+        def _path(suffix):
+            return os.path.join(outputFolderPath, f"{subjectName}_{suffix}")
+
+        self.load()
+        affine = self.img.affine
+
+        start = time.perf_counter()
+        full_frf = self.computeFrf()
+        paths["frf"] = _path("frf.txt")
+        writer.saveText(full_frf, paths["frf"], fmt=f"%.{FRF_PRECISION}f")
+        self.log(f"Response function estimated successfully (after {time.perf_counter() - start:.1f}s).")
+
+        fodf = self.computeFodf(full_frf)
+        paths["fodf"] = _path("fodf.nii.gz")
+        writer.saveNifti(fodf, affine, paths["fodf"], header=self.img.header)
+        self.log(f"FODF generated successfully (after {time.perf_counter() - start:.1f}s).")
+
+        for name, metric in self.computeDtiMetrics().items():
+            paths[f"dti_{name}"] = _path(f"dti_{name}.nii.gz")
+            writer.saveNifti(metric, affine, paths[f"dti_{name}"])
+        self.log(f"DTI metrics computed successfully (after {time.perf_counter() - start:.1f}s).")
+
+        for name, metric in self.computeFodfMetrics(fodf).items():
+            paths[f"fodf_{name}"] = _path(f"fodf_{name}.nii.gz")
+            writer.saveNifti(metric, affine, paths[f"fodf_{name}"])
+        self.log(f"FODF metrics computed successfully (after {time.perf_counter() - start:.1f}s).")
+
+        writer.wait()
+        self.log(f"Outputs written (after {time.perf_counter() - start:.1f}s).")
+
+        paths["log"] = self._writeLog(outputFolderPath, subjectName)
+        return paths
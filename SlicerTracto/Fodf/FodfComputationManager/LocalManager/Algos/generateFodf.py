@@ -1,60 +1,35 @@
 import os
 
-from scripts.scil_frf_ssst import main as scil_frf_ssst_main
-from scripts.scil_fodf_ssst import main as scil_fodf_ssst_main
-from scripts.scil_dti_metrics import main as scil_dti_metrics_main
-from scripts.scil_fodf_metrics import main as scil_fodf_metrics_main
+from FodfComputationManager.LocalManager.Algos.fodfPipeline import FodfPipeline
+from resultStore import ResultStore
 
 class GenerateFODF:
-    def __init__(self, subjectName, diffusionPath, whiteMaskPath, bvalPath, bvecPath, outputFolderPath):
+    def __init__(self, subjectName, diffusionPath, whiteMaskPath, bvalPath, bvecPath, outputFolderPath, maskPath=None):
         self.whiteMaskPath: str = whiteMaskPath
+        # Brain mask: the fODF is fitted in its bounding box only, instead of every voxel with a signal
+        self.maskPath: str = maskPath
         self.diffusionPath: str = diffusionPath
         self.bvalPath: str = bvalPath
         self.bvecPath: str = bvecPath
         self.fodfPath: str = None
         self.outputFolderPath: str = outputFolderPath
         self.subjectName: str = subjectName
+        self.outputPaths: dict = {}
+        self.resultStore = ResultStore()
 
     def run(self):
         try:
             # Ensure output directory exists
             os.makedirs(self.outputFolderPath, exist_ok=True)
 
-            # Step 2: Estimate response function using SSST
-            frf_file = os.path.join(self.outputFolderPath, f"{self.subjectName}_frf.txt")
-            frf_args = [
-                "scil_frf_ssst.py", self.diffusionPath, self.bvalPath, self.bvecPath, frf_file,
-                "--mask_wm", self.whiteMaskPath, "-f", "-v"
-            ]
-            sys.argv = frf_args
-            scil_frf_ssst_main()
-            print("Response function estimated successfully.")
-
-            # Step 3: Generate FODF using SSST
-            fodf_file = os.path.join(self.outputFolderPath, f"{self.subjectName}_fodf.nii.gz")
-            fodf_args = [
-                "scil_fodf_ssst.py", self.diffusionPath, self.bvalPath, self.bvecPath, frf_file, fodf_file,
-                "--processes", "8", "--sh_order", "6", "-f"
-            ]
-            sys.argv = fodf_args
-            scil_fodf_ssst_main()
-            print("FODF generated successfully.")
-
-            # Compute DTI metrics
-            dti_args = ["scil_dti_metrics.py", self.diffusionPath, self.bvalPath, self.bvecPath]
-            sys.argv = dti_args
-            scil_dti_metrics_main()
-            print("DTI metrics computed successfully.")
-
-            # Compute FODF metrics
-            fodf_metrics_args = ["scil_fodf_metrics.py", fodf_file, "-f"]
-            sys.argv = fodf_metrics_args
-            scil_fodf_metrics_main()
-            print("FODF metrics computed successfully.")
+            # FRF, FODF, DTI metrics and FODF metrics on a DWI loaded once;
+            # the outputs are written in the background while the next step runs.
+            # Unchanged inputs and parameters reuse the outputs of the result store.
+            pipeline = FodfPipeline(diffusionPath=self.diffusionPath, bvalPath=self.bvalPath,
+                                    bvecPath=self.bvecPath, whiteMaskPath=self.whiteMaskPath,
+                                    maskPath=self.maskPath)
+            self.outputPaths = pipeline.run(self.outputFolderPath, self.subjectName, store=self.resultStore)
+            self.fodfPath = self.outputPaths["fodf"]
 
         except Exception as e:
             print(f"An error occurred: {e}")
-
-        finally:
-            # Reset sys.argv to avoid affecting other parts of the program
-            sys.argv = ["main.py"]
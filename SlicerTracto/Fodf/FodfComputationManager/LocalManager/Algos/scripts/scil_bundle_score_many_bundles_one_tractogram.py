@@ -37,6 +37,11 @@ Exemple config file:
   }
 }
 
+With --cache_dir, ground truth tractograms are rasterized once and kept in
+an on-disk cache keyed by their content and reference geometry, so scoring
+again against a fixed atlas skips their rasterization. The cache needs the
+SlicerTracto Common folder (rasterCache.py) on the Python path.
+
 Formerly: scil_score_bundles.py
 """
 import argparse
@@ -45,7 +50,9 @@ import json
 import logging
 import os
 
+import numpy as np
 from dipy.io.streamline import load_tractogram
+from dipy.io.utils import get_reference_info
 
 from scilpy.io.utils import (add_bbox_arg,
                              add_overwrite_arg,
@@ -54,11 +61,20 @@ from scilpy.io.utils import (add_bbox_arg,
                              add_verbose_arg,
                              assert_inputs_exist,
                              assert_outputs_exist)
+from scilpy.io.streamlines import load_tractogram_with_reference
 from scilpy.segment.tractogram_from_roi import compute_masks_from_bundles
 from scilpy.tractanalysis.scoring import compute_tractometry
 from scilpy.tractanalysis.scoring import __doc__ as tractometry_description
+from scilpy.tractanalysis.streamlines_metrics import compute_tract_counts_map
 from scilpy.version import version_string
 
+try:
+    from rasterCache import (RasterCache, DEFAULT_MAX_SIZE_MB,
+                             sparseToDense, denseToSparse)
+except ImportError:
+    RasterCache = None
+    DEFAULT_MAX_SIZE_MB = 2048
+
 
 def _build_arg_parser():
     p = argparse.ArgumentParser(description=__doc__ + tractometry_description,
@@ -83,6 +99,13 @@ def _build_arg_parser():
                    help="Root path of the ground truth files listed in the "
                         "gt_config.\nIf not set, filenames in the config "
                         "file are considered \nas absolute paths.")
+    g.add_argument("--cache_dir", metavar='DIR',
+                   help="Directory of the on-disk cache of rasterized ground "
+                        "truth tractograms.\nIf not set, no cache is used.")
+    g.add_argument("--cache_max_size", metavar='MB', type=float,
+                   default=DEFAULT_MAX_SIZE_MB,
+                   help="Size cap of the cache, least recently used maps "
+                        "are removed above it. [%(default)s]")
 
     add_json_args(p)
     add_reference_arg(p)
@@ -137,7 +160,7 @@ def load_and_verify_everything(parser, args):
     # Now loading everything
     # Load gt masks
     logging.info("Loading and/or computing ground-truth masks.")
-    gt_masks = compute_masks_from_bundles(gt_masks_files, parser, args)
+    gt_masks = compute_masks_from_bundles_cached(gt_masks_files, parser, args)
 
     ref_sft = None
 
@@ -201,6 +224,47 @@ def load_and_verify_everything(parser, args):
             ib_sft_list, nc_sft, ib_names, json_output)
 
 
+def compute_masks_from_bundles_cached(gt_files, parser, args):
+    """
+    Same as compute_masks_from_bundles, but the streamline counts of
+    tractogram ground truths go through the on-disk cache (--cache_dir).
+    """
+    if not args.cache_dir:
+        return compute_masks_from_bundles(gt_files, parser, args)
+    if RasterCache is None:
+        parser.error('--cache_dir needs rasterCache.py (SlicerTracto Common '
+                     'folder) on the Python path.')
+
+    cache = RasterCache(args.cache_dir, args.cache_max_size)
+    save_ref = args.reference
+    gt_masks = []
+    for gt_file in gt_files:
+        if gt_file.endswith(('.nii', '.nii.gz')):
+            gt_masks.extend(compute_masks_from_bundles([gt_file], parser,
+                                                       args))
+            continue
+
+        # Same reference handling as compute_masks_from_bundles
+        args.reference = None if gt_file.endswith('.trk') else save_ref
+        reference = args.reference if args.reference else gt_file
+        transformation, dimensions, _, _ = get_reference_info(reference)
+
+        def rasterize():
+            gt_sft = load_tractogram_with_reference(parser, args, gt_file)
+            gt_sft.to_vox()
+            gt_sft.to_corner()
+            return denseToSparse(compute_tract_counts_map(gt_sft.streamlines,
+                                                          dimensions))
+
+        indices, counts = cache.getOrCompute(gt_file, transformation,
+                                             dimensions, rasterize)
+        gt_mask = sparseToDense(indices, counts, dimensions, dtype=np.int16)
+        gt_mask[gt_mask > 0] = 1
+        gt_masks.append(gt_mask)
+    args.reference = save_ref
+    return gt_masks
+
+
 def read_config_file(args):
     """
     Reads the gt_config file and returns:
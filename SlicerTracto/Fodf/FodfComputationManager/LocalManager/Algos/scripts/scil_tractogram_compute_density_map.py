@@ -6,6 +6,11 @@ Compute a density map from a streamlines file. Can be binary.
 
 This script correctly handles compressed streamlines.
 
+With --cache_dir, the streamline counts are stored in an on-disk cache keyed
+by the content of the tractogram and its reference geometry, so computing the
+map of the same bundle again skips the rasterization. The cache needs the
+SlicerTracto Common folder (rasterCache.py) on the Python path.
+
 Formerly: scil_compute_streamlines_density_map.py
 """
 import argparse
@@ -13,6 +18,7 @@ import logging
 
 import numpy as np
 import nibabel as nib
+from dipy.io.utils import get_reference_info
 
 from scilpy.io.streamlines import load_tractogram_with_reference
 from scilpy.io.utils import (add_overwrite_arg, add_reference_arg,
@@ -21,6 +27,13 @@ from scilpy.io.utils import (add_overwrite_arg, add_reference_arg,
 from scilpy.tractanalysis.streamlines_metrics import compute_tract_counts_map
 from scilpy.version import version_string
 
+try:
+    from rasterCache import (RasterCache, DEFAULT_MAX_SIZE_MB,
+                             sparseToDense, denseToSparse)
+except ImportError:
+    RasterCache = None
+    DEFAULT_MAX_SIZE_MB = 2048
+
 
 def _build_arg_parser():
     p = argparse.ArgumentParser(description=__doc__,
@@ -39,6 +52,13 @@ def _build_arg_parser():
                         'When set without a value, 1 is used (and dtype \n'
                         'uint8). If a value is given, will be used as the '
                         'stored value.')
+    p.add_argument('--cache_dir', metavar='DIR',
+                   help='Directory of the on-disk cache of rasterized '
+                        'tractograms.\nIf not set, no cache is used.')
+    p.add_argument('--cache_max_size', metavar='MB', type=float,
+                   default=DEFAULT_MAX_SIZE_MB,
+                   help='Size cap of the cache, least recently used maps '
+                        'are removed above it. [%(default)s]')
     add_reference_arg(p)
     add_verbose_arg(p)
     add_overwrite_arg(p)
@@ -60,14 +80,33 @@ def main():
                      'must be greater than 0 and smaller or equal to {}'
                      .format(args.binary, max_))
 
-    # Loading
-    sft = load_tractogram_with_reference(parser, args, args.in_bundle)
-    sft.to_vox()
-    sft.to_corner()
-    transformation, dimensions, _, _ = sft.space_attributes
-
-    # Processing
-    streamline_count = compute_tract_counts_map(sft.streamlines, dimensions)
+    if args.cache_dir and RasterCache is None:
+        parser.error('--cache_dir needs rasterCache.py (SlicerTracto Common '
+                     'folder) on the Python path.')
+
+    def rasterize():
+        # Loading
+        sft = load_tractogram_with_reference(parser, args, args.in_bundle)
+        sft.to_vox()
+        sft.to_corner()
+        transformation, dimensions, _, _ = sft.space_attributes
+
+        # Processing
+        return compute_tract_counts_map(sft.streamlines, dimensions), \
+            transformation
+
+    if args.cache_dir:
+        reference = args.in_bundle
+        if args.reference and not args.in_bundle.endswith('.trk'):
+            reference = args.reference
+        transformation, dimensions, _, _ = get_reference_info(reference)
+        cache = RasterCache(args.cache_dir, args.cache_max_size)
+        indices, counts = cache.getOrCompute(
+            args.in_bundle, transformation, dimensions,
+            lambda: denseToSparse(rasterize()[0]))
+        streamline_count = sparseToDense(indices, counts, dimensions)
+    else:
+        streamline_count, transformation = rasterize()
 
     # Saving
     dtype_to_use = np.int32
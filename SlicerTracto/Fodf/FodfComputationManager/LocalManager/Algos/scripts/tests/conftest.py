@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+# The SlicerTracto Common folder, which holds rasterCache.py
+common_path = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                           *[os.pardir] * 6, 'Common'))
+
+
+@pytest.fixture
+def common_on_path(monkeypatch):
+    """Put Common on the path of the test and of the scripts it runs, as
+    it is inside Slicer, where the SlicerTracto modules add it."""
+    monkeypatch.syspath_prepend(common_path)
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(
+        filter(None, [common_path, os.environ.get('PYTHONPATH')])))
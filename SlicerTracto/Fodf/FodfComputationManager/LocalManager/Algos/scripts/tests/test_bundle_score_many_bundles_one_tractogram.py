@@ -46,3 +46,28 @@ def test_score_bundles(script_runner, monkeypatch):
                             "config_file.json", "./", '--no_bbox_check')
 
     assert ret.success
+
+
+def test_score_bundles_cache(script_runner, monkeypatch, common_on_path):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_tractogram = os.path.join(SCILPY_HOME, 'tracking', 'pft.trk')
+
+    os.makedirs('./cache_case/segmented_VB')
+    shutil.copyfile(in_tractogram, './cache_case/IS.trk')
+    shutil.copyfile(in_tractogram, './cache_case/segmented_VB/bundle1_VS.trk')
+
+    json_contents = {"bundle1": {"gt_mask": in_tractogram}}
+    with open(os.path.join("config_cache.json"), "w") as f:
+        json.dump(json_contents, f)
+
+    # Second run reads the ground truth mask from the cache
+    results = []
+    for _ in range(2):
+        ret = script_runner.run(
+            'scil_bundle_score_many_bundles_one_tractogram.py',
+            "config_cache.json", "./cache_case", '--no_bbox_check',
+            '--cache_dir', 'raster_cache', '-f')
+        assert ret.success
+        with open('./cache_case/results.json') as f:
+            results.append(json.load(f))
+    assert results[0] == results[1]
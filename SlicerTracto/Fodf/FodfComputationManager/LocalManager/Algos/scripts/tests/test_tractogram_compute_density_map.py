@@ -4,6 +4,9 @@
 import os
 import tempfile
 
+import nibabel as nib
+import numpy as np
+
 from scilpy import SCILPY_HOME
 from scilpy.io.fetcher import fetch_data, get_testing_files_dict
 
@@ -32,3 +35,20 @@ def test_execution_tractometry(script_runner, monkeypatch):
     ret = script_runner.run('scil_tractogram_compute_density_map.py',
                             in_bundle, 'IFGWM.nii.gz', '--binary')
     assert ret.success
+
+
+def test_execution_cache(script_runner, monkeypatch, common_on_path):
+    monkeypatch.chdir(os.path.expanduser(tmp_dir.name))
+    in_bundle = os.path.join(SCILPY_HOME, 'others', 'IFGWM.trk')
+    ret = script_runner.run('scil_tractogram_compute_density_map.py',
+                            in_bundle, 'density_ref.nii.gz')
+    assert ret.success
+
+    # First run fills the cache, second run reads from it
+    for _ in range(2):
+        ret = script_runner.run('scil_tractogram_compute_density_map.py',
+                                in_bundle, 'density_cached.nii.gz',
+                                '--cache_dir', 'raster_cache', '-f')
+        assert ret.success
+        assert np.array_equal(nib.load('density_ref.nii.gz').get_fdata(),
+                              nib.load('density_cached.nii.gz').get_fdata())
@@ -9,7 +9,8 @@ class LocalManager(BaseManager):
 
     def execute(self, subjectName, algo, inputFolderPath, outputFolderPath):
         if algo == 'Scilpy':
-            diffusionPath, whiteMaskPath, bvalPath, bvecPath = self.getDipyInputs(folderPath=inputFolderPath)
-            generateFodf = GenerateFODF(subjectName=subjectName, diffusionPath=diffusionPath, whiteMaskPath=whiteMaskPath, bvalPath=bvalPath, bvecPath=bvecPath, outputFolderPath=outputFolderPath)
+            diffusionPath, whiteMaskPath, bvalPath, bvecPath = self.getFodfInputs(folderPath=inputFolderPath)
+            maskPath = self.getBrainMask(folderPath=inputFolderPath)
+            generateFodf = GenerateFODF(subjectName=subjectName, diffusionPath=diffusionPath, whiteMaskPath=whiteMaskPath, bvalPath=bvalPath, bvecPath=bvecPath, outputFolderPath=outputFolderPath, maskPath=maskPath)
             generateFodf.run()
             
\ No newline at end of file
@@ -1,10 +1,11 @@
 import os
 import time
-import paramiko
 from pathlib import Path
 from scp import SCPClient
 from select import select
 
+from sshSessionPool import sshSessionPool
+
 
 # DEFAULT_REMOTE_SCRIPT = "/neuro/DL_Code_1/process_script.py"
 DEFAULT_LOCAL_INPUT_DIR = "./local_input/"
@@ -45,20 +46,14 @@ class RemoteProcessing:
             self.parameters['brain_mask'] = str(path)
     
     def connect(self):
-        """Establish SSH connection with explicit key format"""
+        """Borrow the shared SSH session to the server (opened on first use, reopened if it died)"""
         try:
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
             private_key_path = os.path.expanduser("~/.ssh/filename")
-            
-            # Load the key explicitly
-            pkey = paramiko.RSAKey(filename=private_key_path)
 
-            self.ssh.connect(
+            self.ssh = sshSessionPool().get(
                 hostname=self.ssh_config['hostname'],
                 username=self.ssh_config['username'],
-                pkey=pkey,  
+                keyPath=private_key_path,
                 timeout=self.ssh_config['timeout']
             )
 
@@ -100,10 +95,7 @@ class RemoteProcessing:
 
         finally:
             self.cleanup()
-            if self.scp:
-                self.scp.close()
-            if self.ssh:
-                self.ssh.close()
+            self.close_connection()
             self._running = False
 
     def transfer_files(self):
@@ -204,10 +196,11 @@ class RemoteProcessing:
             raise RuntimeError(f"Command failed: {command}\nError: {error}")
     
     def close_connection(self):
+        """Close the SCP channel and give the SSH session back to the pool (it stays open)"""
         if self.scp:
             self.scp.close()
-        if self.ssh:
-            self.ssh.close()
+            self.scp = None
+        self.ssh = None
     
     def execute_pipeline(self):
         try:
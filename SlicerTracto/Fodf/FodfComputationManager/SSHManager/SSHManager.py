@@ -1,10 +1,12 @@
-import paramiko
 import os
 import logging
 from FodfComputationManager.SSHManager import configuration
-from scp import SCPClient
-from paramiko import SFTPClient
 import time
+from sshSessionPool import sshSessionPool
+from fileTransfer import FileTransfer
+from remoteBlobCache import RemoteBlobCache
+from remoteJobs import RemoteJob, remoteJobQueue
+from jobSchedulers import estimateResources, jobBackend
 from FodfComputationManager.baseManager import BaseManager
 
 class SSHManager(BaseManager):
@@ -15,7 +17,7 @@ class SSHManager(BaseManager):
         self.username = configuration.username
         self.private_key_path = configuration.private_key_path  # Add private key folder path from config
         self.private_key = None
-        self.client = None
+        self.ssh_client = None
         self.ssh_status = False
         self.algoFolderPath = os.path.join(os.path.dirname(__file__), "Algos")
         self.remoteFolder = "/scratch/mahirj.scee.iitmandi/Gagan/SlicerTracto/Fodf"
@@ -27,22 +29,11 @@ class SSHManager(BaseManager):
         # self.connect()  # Optionally, you can call connect here if needed
 
     def connect(self):
-        """Establish the SSH connection."""
+        """Borrow the shared SSH session to the host (opened on first use, reopened if it died)."""
         try:
-            # Create an SSH client
-            self.ssh_client = paramiko.SSHClient()
-            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # Automatically accept unknown host keys
-
-            # Load the private key for authentication
-            private_key = paramiko.Ed25519Key.from_private_key_file(self.private_key_path)  # Replace with RSAKey if using RSA
-
-            # Use private key authentication
-
-            self.ssh_client.connect(self.hostname, port=self.port, username=self.username, pkey=private_key)
-
+            self.ssh_client = sshSessionPool().get(self.hostname, port=self.port, username=self.username,
+                                                   keyPath=self.private_key_path)
             self.ssh_status = True
-            logging.info(f"SSH connection established to {self.hostname}")
-            print(f"[SLICER TRACTO]SSH connection established to {self.hostname}")
         except Exception as e:
             self.ssh_status = False
             logging.error(f"Failed to connect to {self.hostname}: {e}")
@@ -51,119 +42,136 @@ class SSHManager(BaseManager):
         """Return the connection status."""
         return self.ssh_status
 
-    def close(self):
-        """Close the SSH connection."""
-        if self.client:
-            self.client.close()
+    def close(self, disconnect=False):
+        """
+        Stop using the SSH session.
+
+        The session stays open in the pool for the next request unless
+        `disconnect` is set.
+        """
+        if self.ssh_client:
+            if disconnect:
+                sshSessionPool().close(self.hostname, port=self.port, username=self.username,
+                                       keyPath=self.private_key_path)
+                logging.info(f"SSH connection to {self.hostname} closed.")
+            self.ssh_client = None
             self.ssh_status = False
-            logging.info(f"SSH connection to {self.hostname} closed.")
         else:
             logging.error("No active SSH connection to close.")
 
     def upload_file(self, local_path, remote_path):
+        """Upload a file (e.g. a script) directly to `remote_path`."""
         try:
-            sftp = self.ssh_client.open_sftp()
-            sftp.put(local_path, remote_path)
-            sftp.close()
-            print(f"[SLICER TRACTO]File uploaded successfully to {remote_path}")
+            print(f"[SLICER TRACTO]{FileTransfer(self.ssh_client).upload(local_path, remote_path)}")
         except Exception as e:
-            print(f"[SLICER TRACTO]Error during upload: {e}")
+            print(f"[SLICER TRACTO][ERROR]Error during upload: {e}")
+            raise
 
     def download_file(self, local_path, remote_path):
+        self.download_files([(remote_path, local_path)])
+
+    def upload_files(self, pairs):
+        """
+        Stage input files: `(local path, remote path)` pairs become symlinks into
+        the remote blob cache, and only the files the server does not have yet
+        are uploaded (concurrently, compressed and resumable).
+        """
         try:
-            scp = SCPClient(self.ssh_client.get_transport())
-            scp.get(remote_path, local_path)
-            scp.close()
-            print(f"[SLICER TRACTO]File downloaded successfully to {local_path}")
+            self.remoteCache().stage(pairs)
         except Exception as e:
-            print(f"[SLICER TRACTO]Error during download: {e}")
-    
-    def run_file(self, remote_path):
+            print(f"[SLICER TRACTO][ERROR]Error during upload: {e}")
+            raise
+
+    def remoteCache(self):
+        return RemoteBlobCache(self.ssh_client, configuration.remote_cache_folder,
+                               maxAgeDays=configuration.remote_cache_max_age_days,
+                               maxSizeGB=configuration.remote_cache_max_size_gb)
+
+    def evict_remote_cache(self):
+        """Drop cached inputs unused for a while (instead of deleting them after every run)."""
+        try:
+            self.remoteCache().evict()
+        except Exception as e:
+            print(f"[SLICER TRACTO]Error during remote cache eviction: {e}")
+
+    def download_files(self, pairs):
+        """Download `(remote path, local path)` pairs concurrently, compressed and resumable."""
         try:
-            # Activate conda environment if specified
-            conda_command = f"conda activate {self.conda_env} && " if self.conda_env else ""
-            command = f"{conda_command}python3 {remote_path}"
-            stdin, stdout, stderr = self.ssh_client.exec_command(command)
-
-            # Print the output of the script execution
-            for line in stdout:
-                print("[SLICER TRACTO]" + line.strip())
-            # Print any errors encountered during execution
-            for line in stderr:
-                print(f"[SLICER TRACTO]Error: {line.strip()}")
-            # Ensure the script execution is complete
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status == 0:
-                print(f"[SLICER TRACTO]Script executed successfully.")
-            else:
-                print(f"[SLICER TRACTO]Script execution failed with exit status {exit_status}.")
+            FileTransfer(self.ssh_client).downloadMany(pairs)
         except Exception as e:
-            print(f"[SLICER TRACTO]Error during script execution: {e}")
+            print(f"[SLICER TRACTO][ERROR]Error during download: {e}")
+            raise
+    
+    def job_backend(self):
+        return jobBackend(configuration.scheduler, queue=configuration.scheduler_queue,
+                          account=configuration.scheduler_account)
 
-    def execute(self, subjectName, algo, inputFolderPath, outputFolderPath):
-        start_time = time.time()  # Start the timer at the beginning of the function
+    def session(self):
+        """The connected SSH client; used by the job queue's worker thread."""
         self.connect()
-        # Remote paths
-        # Execute algorithm if 'algo1' is selected
-        if algo == 'Scilpy':
-            
-            diffusionPath, whiteMaskPath, bvalPath, bvecPath = self.getFodfInputs(folderPath=inputFolderPath)
-            
-            remoteDiffusionPath = self.remoteInputFolder + "/sample_dwi.nii"
-            remoteWhiteMaskPath= self.remoteInputFolder + "/sample_wm.nii"
-            remoteBvalPath= self.remoteInputFolder + "/sample.bval"
-            remoteBvecPath= self.remoteInputFolder + "/sample.bvec"
-
-            print("Uploading Diffusion File...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=diffusionPath, remote_path=remoteDiffusionPath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload Diffusion File: {upload_end_time - upload_start_time:.2f} seconds")
-            
-            print("Uploading White Matter Mask...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=whiteMaskPath, remote_path=remoteWhiteMaskPath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload White Matter Mask: {upload_end_time - upload_start_time:.2f} seconds")
-            
-            print("Uploading Bval File...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=bvalPath, remote_path=remoteBvalPath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload Bval File: {upload_end_time - upload_start_time:.2f} seconds")
-            
-            print("Uploading Bvec File...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=bvecPath, remote_path=remoteBvecPath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload Bvec File: {upload_end_time - upload_start_time:.2f} seconds")
+        if not self.ssh_status:
+            raise ConnectionError(f"Cannot connect to {self.hostname}")
+        return self.ssh_client
+
+    def submit_file(self, name, remote_path, job_folder, prepare=None, collect=None, onFinished=None,
+                    resources=None):
+        """
+        Run a remote script as a detached job and return its id right away.
+
+        `prepare` (upload) and `collect` (download) run on the job queue's
+        worker thread, `onFinished(job)` on the main thread (see `remoteJobs`).
+        The script runs through `configuration.scheduler` with the requested
+        `resources` (see `jobSchedulers`).
+        The script reads and writes fixed remote paths, so jobs of this
+        manager run one at a time.
+        """
+        conda_command = f"conda activate {self.conda_env} && " if self.conda_env else ""
+        job = RemoteJob(name=name, command=f"{conda_command}python3 {remote_path}", folder=job_folder,
+                        connect=self.session, prepare=prepare, collect=collect, onFinished=onFinished,
+                        exclusiveKey=self.remoteFolder, backend=self.job_backend(), resources=resources)
+        return remoteJobQueue().submit(job)
+
+    def execute(self, subjectName, algo, inputFolderPath, outputFolderPath, onFinished=None):
+        """Submit the FODF computation of a subject as a remote job; returns the job id."""
+        if algo != 'Scilpy':
+            print(f"[SLICER TRACTO][ERROR]Unsupported algorithm: {algo}")
+            return None
+
+        diffusionPath, whiteMaskPath, bvalPath, bvecPath = self.getFodfInputs(folderPath=inputFolderPath)
+
+        remoteDiffusionPath = self.remoteInputFolder + "/sample_dwi.nii"
+        remoteWhiteMaskPath= self.remoteInputFolder + "/sample_wm.nii"
+        remoteBvalPath= self.remoteInputFolder + "/sample.bval"
+        remoteBvecPath= self.remoteInputFolder + "/sample.bvec"
+
+        localAlgoPath = os.path.join(self.algoFolderPath, "generateFodf.py")
+        remoteAlgoPath = self.remoteScriptsFolder + "/generateFodf.py"
 
-            localAlgoPath = os.path.join(self.algoFolderPath, "generateFodf.py")
-            remoteAlgoPath = self.remoteScriptsFolder + "/generateFodf.py"
-            
-            print("Uploading algorithm script...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=localAlgoPath, remote_path=remoteAlgoPath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload algorithm script: {upload_end_time - upload_start_time:.2f} seconds")
-
-            print("Running algorithm script...")
-            run_start_time = time.time()
-            self.run_file(remote_path=remoteAlgoPath)
-            run_end_time = time.time()
-            print(f"Time taken to execute algorithm: {run_end_time - run_start_time:.2f} seconds")
-        
-        # Define paths for seeding mask and trk files
         localFodfFilePath = os.path.join(outputFolderPath, f"{subjectName}_fodf.nii")
         remoteFodfFilePath = self.remoteOutputFolder + "/sample_fodf.nii"
 
-        # Download Seeding Mask
-        print("Downloading FODF...")
-        download_start_time = time.time()
-        self.download_file(local_path=localFodfFilePath, remote_path=remoteFodfFilePath)
-        download_end_time = time.time()
-        print(f"Time taken to download FODF: {download_end_time - download_start_time:.2f} seconds")
-
-        # Print total time taken for the entire process
-        end_time = time.time()
-        print(f"Total time taken: {end_time - start_time:.2f} seconds")
+        def prepare(client):
+            print("Uploading Diffusion File, White Matter Mask, Bval/Bvec Files and algorithm script...")
+            upload_start_time = time.time()
+            self.upload_files([(diffusionPath, remoteDiffusionPath),
+                               (whiteMaskPath, remoteWhiteMaskPath),
+                               (bvalPath, remoteBvalPath),
+                               (bvecPath, remoteBvecPath)])
+            # Not staged as a symlink: the script imports the `scripts` package next to it
+            self.upload_file(localAlgoPath, remoteAlgoPath)
+            upload_end_time = time.time()
+            print(f"Time taken to upload inputs: {upload_end_time - upload_start_time:.2f} seconds")
+
+        def collect(client):
+            print("Downloading FODF...")
+            download_start_time = time.time()
+            self.download_file(local_path=localFodfFilePath, remote_path=remoteFodfFilePath)
+            download_end_time = time.time()
+            print(f"Time taken to download FODF: {download_end_time - download_start_time:.2f} seconds")
+            self.evict_remote_cache()
+
+        jobFolder = f"{self.remoteFolder}/Jobs/{subjectName}_{int(time.time())}"
+        # generateFodf.py runs scilpy with 8 processes
+        resources = estimateResources([diffusionPath, whiteMaskPath], cpus=8)
+        return self.submit_file(subjectName, remoteAlgoPath, jobFolder, prepare=prepare, collect=collect,
+                                onFinished=onFinished, resources=resources)
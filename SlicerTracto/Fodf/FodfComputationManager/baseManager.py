@@ -24,3 +24,14 @@ class BaseManager(ABC):
                 break  
 
         return diffusionPath, whiteMaskPath, bvalPath, bvecPath
+
+    def getBrainMask(self, folderPath):
+        """
+        Brain mask of the subject (a file ending in `brain_mask.nii` or
+        `brain_mask.nii.gz`), or None. The fODF is only fitted inside it.
+        """
+        for file_name in sorted(os.listdir(folderPath)):
+            if file_name.endswith(("brain_mask.nii", "brain_mask.nii.gz")):
+                print(f"[SLICER TRACTO] Brain mask found: {file_name}")
+                return os.path.join(folderPath, file_name)
+        return None
@@ -4,6 +4,9 @@ import sys
 module_path = os.path.join(os.path.dirname(__file__), "Modules")
 if module_path not in sys.path:
     sys.path.append(module_path)
+common_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Common")
+if common_path not in sys.path:
+    sys.path.append(common_path)
 from typing import Annotated, Optional
 import vtk
 import slicer
@@ -145,11 +148,25 @@ class MetricsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.predictedTrkPath.connect('currentPathChanged(QString)', self._metricAnalysis.setPredictedTrkPath)
         self.ui.groundTruthTrkPath.connect('currentPathChanged(QString)', self._metricAnalysis.setGroundTruthTrkPath)
 
+        self.ui.useCacheCheckBox.connect('toggled(bool)', self._metricAnalysis.setUseCache)
+
+        # Batch mode
+        self.ui.batchManifestPath.connect('currentPathChanged(QString)', self._metricAnalysis.setBatchManifestPath)
+        self.ui.batchPredictedFolder.connect('currentPathChanged(QString)', self._metricAnalysis.setBatchPredictedFolder)
+        self.ui.batchGroundTruthFolder.connect('currentPathChanged(QString)', self._metricAnalysis.setBatchGroundTruthFolder)
+        self.ui.batchOutputPath.connect('currentPathChanged(QString)', self._metricAnalysis.setBatchOutputPath)
+        self.ui.batchProcessesSpinBox.connect('valueChanged(int)', self._metricAnalysis.setBatchProcesses)
+        self.ui.generateBatchResultsButton.connect("clicked(bool)", self._metricAnalysis.generateBatchMetrics)
+
         # Initializing Outputs Text
         self.ui.diceScore.setText(f'Dice Score: -')
+        self.ui.weightedDiceScore.setText(f'Weighted Dice Score: -')
         self.ui.overlapScore.setText(f'Overlap: -')
         self.ui.overreachScore.setText(f'Overreach: -')
 
+        self._metricAnalysis.setBatchProcesses(self.ui.batchProcessesSpinBox.value)
+        self._metricAnalysis.setUseCache(self.ui.useCacheCheckBox.checked)
+
         # passing UI parameter
         self._metricAnalysis.ui = self.ui
 
@@ -171,9 +188,169 @@ class MetricsWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     def onSceneEndClose(self, caller, event) -> None:
         pass
 
-    
 
-    
+#
+# MetricsTest
+#
 
-  
 
+class MetricsTest(ScriptedLoadableModuleTest):
+    """
+    This is the test case for your scripted module.
+    Uses ScriptedLoadableModuleTest base class, available at:
+    https://github.com/Slicer/Slicer/blob/main/Base/Python/slicer/ScriptedLoadableModule.py
+    """
+
+    def setUp(self):
+        """Do whatever is needed to reset the state - typically a scene clear will be enough."""
+        slicer.mrmlScene.Clear()
+
+    def runTest(self):
+        """Run as few or as many tests as needed here."""
+        self.setUp()
+        self.test_TractCountsMapMatchesLoop()
+        self.test_TractCountsMapEdgeCases()
+        self.test_VoxelPairwiseMeasures()
+        self.test_RasterCache()
+        self.test_BatchScoringInBackground()
+
+    def test_TractCountsMapMatchesLoop(self):
+        """The vectorized tract counts map must be identical to the per-segment loop."""
+        import numpy as np
+        from metricAnalysis import _synthetic_voxel_streamlines
+
+        vol_dims = (40, 48, 40)
+        streamlines = _synthetic_voxel_streamlines(300, vol_dims, mean_length=40, seed=1)
+        metric_analysis = MetricAnalysis()
+
+        expected = metric_analysis.compute_tract_counts_map_loop(streamlines, vol_dims)
+        result = metric_analysis.compute_tract_counts_map(streamlines, vol_dims)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertTrue(np.array_equal(result, expected))
+
+    def test_TractCountsMapEdgeCases(self):
+        """Points on voxel edges, zero-length segments and streamlines with fewer than 2 points."""
+        import numpy as np
+
+        vol_dims = (10, 12, 8)
+        streamlines = [
+            np.zeros((0, 3), dtype=np.float32),
+            np.array([[2.5, 3.5, 1.5]], dtype=np.float32),
+            np.array([[1., 2., 3.], [3., 2., 3.], [3., 5., 3.]], dtype=np.float32),
+            np.array([[4.5, 4.5, 4.5], [4.5, 4.5, 4.5], [6.25, 7.75, 2.5]], dtype=np.float32),
+            np.array([[7.2, 1.1, 6.9]], dtype=np.float32),
+            np.array([[8.9, 10.2, 0.3], [0.1, 0.4, 7.6]], dtype=np.float32),
+        ]
+        metric_analysis = MetricAnalysis()
+
+        expected = metric_analysis.compute_tract_counts_map_loop(streamlines, vol_dims)
+        result = metric_analysis.compute_tract_counts_map(streamlines, vol_dims)
+        self.assertTrue(np.array_equal(result, expected))
+        self.assertTrue(np.array_equal(metric_analysis.compute_tract_counts_map([], vol_dims), np.zeros(vol_dims, dtype=int)))
+
+    def test_VoxelPairwiseMeasures(self):
+        """Sparse measures against counts computed by hand on dense maps."""
+        import numpy as np
+        from metricAnalysis import compute_voxel_pairwise_measures
+
+        bundle = np.array([0, 3, 0, 2, 1, 0])
+        gold_standard = np.array([1, 1, 0, 4, 0, 0])
+        sparse = lambda density: (np.flatnonzero(density), density[density > 0])
+
+        scores = compute_voxel_pairwise_measures(sparse(bundle), sparse(gold_standard))
+        # tp = {1, 3}, fp = {4}, fn = {0}
+        self.assertAlmostEqual(scores["dice"], 4 / 6)
+        self.assertAlmostEqual(scores["overlap"], 2 / 3)
+        self.assertAlmostEqual(scores["overreach"], 1 / 3)
+        self.assertAlmostEqual(scores["weighted_dice"], (3 + 2 + 1 + 4) / (6 + 6))
+
+        empty = compute_voxel_pairwise_measures(sparse(bundle), sparse(np.zeros(6, dtype=int)))
+        self.assertEqual(empty["dice"], 0.)
+        self.assertIsNone(empty["overreach"])
+
+    def test_RasterCache(self):
+        """Cache hits return the stored map; least recently used entries are evicted first."""
+        import os
+        import tempfile
+        import time
+        import numpy as np
+        from rasterCache import RasterCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tractograms = []
+            for i in range(3):
+                path = os.path.join(tmp, f"bundle{i}.trk")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(1024))
+                tractograms.append(path)
+
+            affine, dimensions = np.eye(4), (10, 10, 10)
+            cache = RasterCache(os.path.join(tmp, "cache"), maxSizeMB=1)
+            computed = []
+
+            def compute(i):
+                computed.append(i)
+                indices = np.arange(i, 1000, 7, dtype=np.int64)
+                return indices, np.full(len(indices), i + 1, dtype=np.int64)
+
+            first = cache.getOrCompute(tractograms[0], affine, dimensions, lambda: compute(0))
+            again = cache.getOrCompute(tractograms[0], affine, dimensions, lambda: compute(0))
+            self.assertEqual(computed, [0])
+            self.assertTrue(np.array_equal(first[0], again[0]) and np.array_equal(first[1], again[1]))
+
+            # Another grid is another entry
+            cache.getOrCompute(tractograms[0], affine * 2, dimensions, lambda: compute(0))
+            self.assertEqual(computed, [0, 0])
+
+            # Keep 2 entries: the oldest one goes when a third is added
+            keys = [cache.key(path, affine, dimensions) for path in tractograms]
+            entrySize = os.path.getsize(os.path.join(cache.cacheDir, f"{keys[0]}.npz"))
+            cache.maxSizeBytes = int(2.5 * entrySize)
+            cache.clear()
+            for i in range(3):
+                cache.getOrCompute(tractograms[i], affine, dimensions, lambda: compute(i))
+                time.sleep(0.01)
+            self.assertIsNone(cache.get(keys[0]))
+            self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_BatchScoringInBackground(self):
+        """Batch scores computed on the worker thread, with progress, match `score_pairs`."""
+        import os
+        import tempfile
+        import nibabel as nib
+        import numpy as np
+        from metricAnalysis import BatchScoring, score_pairs, _synthetic_voxel_streamlines
+
+        vol_dims = (20, 24, 20)
+        header = {nib.streamlines.Field.VOXEL_TO_RASMM: np.eye(4), nib.streamlines.Field.DIMENSIONS: vol_dims,
+                  nib.streamlines.Field.VOXEL_SIZES: (1., 1., 1.), nib.streamlines.Field.VOXEL_ORDER: "RAS"}
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i in range(3):
+                path = os.path.join(tmp, f"bundle{i}.trk")
+                streamlines = _synthetic_voxel_streamlines(50, vol_dims, mean_length=10, seed=i)
+                tractogram = nib.streamlines.Tractogram(streamlines, affine_to_rasmm=np.eye(4))
+                nib.streamlines.save(tractogram, path, header=header)
+                paths.append(path)
+            pairs = [(paths[0], paths[2]), (paths[1], paths[2])]
+            output_path = os.path.join(tmp, "scores.csv")
+
+            progress, finished = [], []
+            batch = BatchScoring(pairs, output_path, onProgress=lambda *args: progress.append(args),
+                                 onFinished=lambda rows, error: finished.append((rows, error)))
+            batch.start()
+            self.assertTrue(batch.wait(timeout=60))
+
+            self.assertEqual([done for done, total, _ in progress], [1, 2, 3])
+            self.assertEqual(len(finished), 1)
+            rows, error = finished[0]
+            self.assertIsNone(error)
+            self.assertEqual(rows, score_pairs(pairs))
+            self.assertTrue(os.path.isfile(output_path))
+
+            # Errors are reported to onFinished, not raised on the worker thread
+            batch = BatchScoring([(paths[0], os.path.join(tmp, "missing.trk"))], output_path,
+                                 onFinished=lambda rows, error: finished.append((rows, error)))
+            batch.start()
+            self.assertTrue(batch.wait(timeout=60))
+            self.assertIsNotNone(finished[-1][1])
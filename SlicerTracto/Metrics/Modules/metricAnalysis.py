@@ -1,17 +1,40 @@
 import os
+import collections
+import csv
 import json
+import multiprocessing
+import threading
+from functools import partial
 import nibabel as nib
-from dipy.io.streamline import load_tractogram
 import numpy as np
 from dipy.tracking.metrics import length as slength
+from tractogramStreaming import tractogramReference, iterTractogramChunks, printProgress, DEFAULT_CHUNK_SIZE
+from rasterCache import RasterCache, DEFAULT_CACHE_DIR
+
+try:
+    import qt
+except ImportError:
+    qt = None
+
+BATCH_RESULT_FIELDS = ["prediction", "ground_truth", "dice", "weighted_dice", "overlap", "overreach"]
+DELIVERY_INTERVAL_MS = 200
+
 
 class MetricAnalysis:
-    def _init_(self):
+    def __init__(self):
         self.predictedTrkPath : str = None
         self.groundTruthTrkPath : str = None
         self.diceScore : float = None
+        self.weightedDiceScore : float = None
         self.overReachScore: float = None
         self.overlapScore: float = None
+        self.batchManifestPath : str = None
+        self.batchPredictedFolder : str = None
+        self.batchGroundTruthFolder : str = None
+        self.batchOutputPath : str = None
+        self.batchProcesses : int = 4
+        self.cacheDir : str = DEFAULT_CACHE_DIR
+        self.batchScoring : BatchScoring = None
         self.ui = None
 
     @staticmethod
@@ -37,6 +60,26 @@ class MetricAnalysis:
         else:
             raise FileNotFoundError(f"Invalid ground truth .trk path: {path}")
 
+    def setBatchManifestPath(self, path: str):
+        """Set a CSV/JSON manifest of prediction/ground truth pairs (takes precedence over the folders)."""
+        self.batchManifestPath = path or None
+
+    def setBatchPredictedFolder(self, path: str):
+        self.batchPredictedFolder = path or None
+
+    def setBatchGroundTruthFolder(self, path: str):
+        self.batchGroundTruthFolder = path or None
+
+    def setBatchOutputPath(self, path: str):
+        self.batchOutputPath = path or None
+
+    def setBatchProcesses(self, value: int):
+        self.batchProcesses = int(value)
+
+    def setUseCache(self, enabled: bool):
+        """Reuse rasterized maps across runs (keyed by tractogram content and grid)."""
+        self.cacheDir = DEFAULT_CACHE_DIR if enabled else None
+
     def set_dice_score(self, score: str):
         self.diceScore = score
 
@@ -52,51 +95,63 @@ class MetricAnalysis:
             print("Both predicted_trk and groundTruthTrkPath are required.")
             return
 
-        def compute_binary_map(sft):
-            """Compute the binary map of a tractogram."""
-            sft.to_vox()
-            sft.to_corner()
-            streamlines = sft.streamlines
-            _, dimensions, _, _ = sft.space_attributes
-            if not streamlines:
-                pass
-            binary_map = self.compute_tract_counts_map(streamlines, dimensions)
-            binary_map[binary_map > 0] = 1
-            return binary_map
-
-        def compute_voxel_pairwise_measures(bundle_fname, gs_fname):
-            """Compute comparison measures between two bundles."""
-            bundle_binary_map = compute_binary_map(bundle_fname)
-            gs_binary_map = compute_binary_map(gs_fname)
-
-            bundle_indices = np.where(bundle_binary_map.flatten() > 0)[0]
-            gs_indices = np.where(gs_binary_map.flatten() > 0)[0]
-
-            tp = len(np.intersect1d(bundle_indices, gs_indices))
-            fp = len(np.setdiff1d(bundle_indices, gs_indices))
-            fn = len(np.setdiff1d(gs_indices, bundle_indices))
-
-            if tp == 0:
-                overlap = 0.
-                overreach = None
-                dice = 0.
-            else:
-                overlap = tp / float(tp + fn)
-                overreach = fp / float(tp + fn)
-                dice = 2 * tp / float(2 * tp + fp + fn)
-
-            return {"dice": dice, "overlap": overlap, "overreach": overreach}
-        
-        scores = compute_voxel_pairwise_measures(load_tractogram(self.predictedTrkPath, 'same', bbox_valid_check=False), load_tractogram(self.groundTruthTrkPath, 'same', bbox_valid_check=False))
+        cache = RasterCache(self.cacheDir) if self.cacheDir else None
+        bundle_density = compute_sparse_density(self.predictedTrkPath, cache=cache)
+        gs_density = compute_sparse_density(self.groundTruthTrkPath, cache=cache)
+        scores = compute_voxel_pairwise_measures(bundle_density, gs_density)
         self.diceScore = scores["dice"]
+        self.weightedDiceScore = scores["weighted_dice"]
         self.overlap = scores["overlap"]
         self.overreach = scores['overreach']
         self.ui.diceScore.setText(f'Dice Score: {scores["dice"]}')
+        self.ui.weightedDiceScore.setText(f'Weighted Dice Score: {scores["weighted_dice"]}')
         self.ui.overlapScore.setText(f'Overlap: {scores["overlap"]}')
         self.ui.overreachScore.setText(f'Overreach: {scores["overreach"]}')
 
+    def generateBatchMetrics(self):
+        print("Generating Batch Metrics ...")
+        if self.batchManifestPath:
+            pairs = read_pairs_manifest(self.batchManifestPath)
+        elif self.batchPredictedFolder and self.batchGroundTruthFolder:
+            pairs = pairs_from_folders(self.batchPredictedFolder, self.batchGroundTruthFolder)
+        else:
+            print("A pairs manifest or both predicted and ground truth folders are required.")
+            return
+        if not self.batchOutputPath:
+            print("A results file (.csv or .json) is required.")
+            return
+
+        if self.batchScoring is not None and self.batchScoring.running:
+            print("A batch is already being scored.")
+            return
+
+        self.ui.batchStatus.setText(f'Batch: scoring {len(pairs)} pairs ...')
+        self.ui.generateBatchResultsButton.enabled = False
+        self.batchScoring = BatchScoring(pairs, self.batchOutputPath, self.batchProcesses, self.cacheDir,
+                                         onProgress=self.onBatchProgress, onFinished=self.onBatchFinished)
+        self.batchScoring.start()
+
+    def onBatchProgress(self, done, total, trk_path):
+        self.ui.batchStatus.setText(f'Batch: rasterized {done}/{total} tractograms ({os.path.basename(trk_path)})')
+
+    def onBatchFinished(self, rows, error):
+        self.ui.generateBatchResultsButton.enabled = True
+        if error is not None:
+            print(f"[SLICER TRACTO][ERROR]Batch scoring failed: {error}")
+            self.ui.batchStatus.setText(f'Batch: failed ({error})')
+            return
+        self.ui.batchStatus.setText(f'Batch: {len(rows)} pairs scored, saved to {os.path.basename(self.batchOutputPath)}')
+
     def compute_tract_counts_map(self, streamlines, vol_dims):
         """Compute the number of different tracks going through each voxel."""
+        vol_dims = np.asarray(vol_dims).astype(int)
+        indices, counts = sparse_tract_counts(streamlines, vol_dims)
+        traversal_tags = np.zeros((np.prod(vol_dims),), dtype=int)
+        traversal_tags[indices] = counts
+        return traversal_tags.reshape(vol_dims)
+
+    def compute_tract_counts_map_loop(self, streamlines, vol_dims):
+        """Per-segment reference of `compute_tract_counts_map` (port of dipy's `track_counts`)."""
         # Set numpy error handling
         flags = np.seterr(divide="ignore", under="ignore")
 
@@ -195,6 +250,7 @@ class MetricAnalysis:
         return traversal_tags.reshape(vol_dims)
 
 
+import time
 from math import sqrt, floor, ceil, fabs, inf
 import numpy as np
 
@@ -208,4 +264,470 @@ def get_closest_edge(p_x, p_y, p_z, d_x, d_y, d_z, eps=1.):
         edge[0] = floor(p_x + eps) if d_x >= 0.0 else ceil(p_x - eps)
         edge[1] = floor(p_y + eps) if d_y >= 0.0 else ceil(p_y - eps)
         edge[2] = floor(p_z + eps) if d_z >= 0.0 else ceil(p_z - eps)
-        return edge
\ No newline at end of file
+        return edge
+
+
+SEGMENT_BATCH_SIZE = 250_000
+
+
+def sparse_tract_counts(streamlines, vol_dims):
+    """
+    Vectorized `compute_tract_counts_map_loop`, returned in sparse form.
+
+    All segments of a batch of streamlines are walked through the voxel grid
+    at once: every iteration moves each active segment to its next voxel edge
+    with the same floating point operations (in the same order) as the
+    per-segment loop, so the visited voxels are identical. Each streamline is
+    counted once per voxel, including the quirks of the reference:
+    streamlines with fewer than 2 points reuse the last point of the previous
+    streamline (the origin for the first one) and negative flat indices wrap
+    around.
+
+    Parameters
+    ----------
+    streamlines : ArraySequence or list of (N, 3) arrays
+        Streamlines in voxel space with corner origin.
+    vol_dims : array-like of 3 ints
+        Volume dimensions.
+
+    Returns
+    -------
+    indices : ndarray of int64
+        Sorted flat (C order) indices of the voxels touched by any streamline.
+    counts : ndarray of int64
+        Number of streamlines going through each of these voxels.
+    """
+    vol_dims = np.asarray(vol_dims).astype(int)
+    n_voxels = int(np.prod(vol_dims))
+    lengths = np.asarray([len(s) for s in streamlines], dtype=np.int64)
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    points = np.concatenate([np.asarray(s, dtype=np.double).reshape(-1, 3) for s in streamlines])
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    # Last point of each streamline, carried over to the following short streamlines
+    long_tracks = np.flatnonzero(lengths >= 2)
+    last_voxel = np.zeros((len(lengths), 3), dtype=np.int64)
+    touched = []
+    for first, last in _track_batches(lengths, SEGMENT_BATCH_SIZE):
+        batch = long_tracks[(long_tracks >= first) & (long_tracks < last)]
+        track_ids, voxels, final_voxels = _traverse_segments(points, starts[batch], lengths[batch], batch)
+        last_voxel[batch] = final_voxels
+        touched.append((track_ids, voxels))
+
+    # Forward fill: a short streamline takes the last voxel of the closest previous long one
+    source = np.where(lengths >= 2, np.arange(len(lengths)), -1)
+    source = np.maximum.accumulate(source)
+    short = np.flatnonzero(lengths < 2)
+    short_voxels = np.zeros((len(short), 3), dtype=np.int64)
+    has_source = source[short] >= 0
+    short_voxels[has_source] = last_voxel[source[short][has_source]]
+    touched.append((short, short_voxels))
+
+    vd = vol_dims.astype(np.int64)
+    track_ids = np.concatenate([t for t, _ in touched])
+    voxels = np.concatenate([v for _, v in touched])
+    el_no = voxels[:, 0] * (vd[1] * vd[2]) + voxels[:, 1] * vd[2] + voxels[:, 2]
+    if len(el_no) and (el_no.min() < -n_voxels or el_no.max() >= n_voxels):
+        bad = el_no[(el_no < -n_voxels) | (el_no >= n_voxels)][0]
+        raise IndexError(f"index {bad} is out of bounds for axis 0 with size {n_voxels}")
+    el_no[el_no < 0] += n_voxels
+
+    # One count per (streamline, voxel) pair
+    pairs, _ = _sorted_unique(track_ids * n_voxels + el_no)
+    return _sorted_unique(pairs % n_voxels)
+
+
+def compute_sparse_density(trk_path, chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=printProgress, cache=None):
+    """
+    Streamline counts of a tractogram file, for the voxels it touches only.
+
+    The file is read chunk by chunk and each chunk is traversed with
+    `sparse_tract_counts`; no full-volume array is allocated. With a
+    `RasterCache`, a tractogram already rasterized on the same grid is not
+    read at all.
+
+    Returns sorted flat voxel `(indices, counts)`.
+    """
+    affine, dimensions, _ = tractogramReference(trk_path)
+
+    def compute():
+        parts = [sparse_tract_counts(streamlines, dimensions)
+                 for streamlines in iterTractogramChunks(trk_path, chunk_size, progress_callback, space="voxcorner")]
+        return _merge_sparse_counts(parts)
+
+    if cache is None:
+        return compute()
+    return cache.getOrCompute(trk_path, affine, dimensions, compute)
+
+
+def compute_voxel_pairwise_measures(bundle_density, gs_density):
+    """
+    Compute comparison measures between two sparse density maps.
+
+    Both maps are sorted `(indices, counts)` pairs as returned by
+    `compute_sparse_density`, so the cost only depends on the number of
+    touched voxels. The weighted Dice uses the streamline counts of the
+    overlapping voxels (as in scilpy's `compute_dice_voxel`).
+    """
+    bundle_indices, bundle_counts = bundle_density
+    gs_indices, gs_counts = gs_density
+
+    # Position of every bundle voxel in the (sorted) gold standard voxels
+    position = np.searchsorted(gs_indices, bundle_indices)
+    in_gs = np.zeros(len(bundle_indices), dtype=bool)
+    valid = position < len(gs_indices)
+    in_gs[valid] = gs_indices[position[valid]] == bundle_indices[valid]
+
+    tp = int(in_gs.sum())
+    fp = len(bundle_indices) - tp
+    fn = len(gs_indices) - tp
+
+    if tp == 0:
+        overlap = 0.
+        overreach = None
+        dice = 0.
+        weighted_dice = 0.
+    else:
+        overlap = tp / float(tp + fn)
+        overreach = fp / float(tp + fn)
+        dice = 2 * tp / float(2 * tp + fp + fn)
+        weighted_dice = float(bundle_counts[in_gs].sum() + gs_counts[position[in_gs]].sum()) / \
+            float(bundle_counts.sum() + gs_counts.sum())
+
+    return {"dice": dice, "weighted_dice": weighted_dice, "overlap": overlap, "overreach": overreach}
+
+
+def read_pairs_manifest(manifest_path):
+    """
+    Read prediction/ground truth pairs from a CSV or JSON manifest.
+
+    The CSV needs `prediction` and `ground_truth` columns, the JSON is a list
+    of objects with these keys. Relative paths are resolved against the
+    folder of the manifest.
+    """
+    if manifest_path.lower().endswith(".json"):
+        with open(manifest_path) as f:
+            entries = json.load(f)
+    else:
+        with open(manifest_path, newline="") as f:
+            entries = list(csv.DictReader(f))
+
+    root = os.path.dirname(os.path.abspath(manifest_path))
+    pairs = []
+    for entry in entries:
+        if "prediction" not in entry or "ground_truth" not in entry:
+            raise ValueError(f"Manifest entries need 'prediction' and 'ground_truth' keys: {entry}")
+        pairs.append((os.path.join(root, entry["prediction"]), os.path.join(root, entry["ground_truth"])))
+    return pairs
+
+
+def pairs_from_folders(predicted_folder, ground_truth_folder, extension=".trk"):
+    """Pair the tractograms of two folders by file name (e.g. one file per bundle)."""
+    predictions = {f for f in os.listdir(predicted_folder) if f.endswith(extension)}
+    ground_truths = {f for f in os.listdir(ground_truth_folder) if f.endswith(extension)}
+    missing = sorted(ground_truths - predictions)
+    if missing:
+        print(f"[SLICER TRACTO]No prediction for {len(missing)} ground truth bundles: {', '.join(missing)}")
+    return [(os.path.join(predicted_folder, f), os.path.join(ground_truth_folder, f))
+            for f in sorted(predictions & ground_truths)]
+
+
+def _sparse_density_worker(trk_path, cache_dir=None):
+    cache = RasterCache(cache_dir) if cache_dir else None
+    return trk_path, compute_sparse_density(trk_path, progress_callback=None, cache=cache)
+
+
+def _report_rasterized(done, total, trk_path, progress_callback):
+    print(f"[SLICER TRACTO]Rasterized {done}/{total}: {trk_path}")
+    if progress_callback is not None:
+        progress_callback(done, total, trk_path)
+
+
+def score_pairs(pairs, nbr_processes=1, cache_dir=None, progress_callback=None):
+    """
+    Compute the pairwise measures of many prediction/ground truth pairs.
+
+    Every distinct tractogram is rasterized once, whatever the number of
+    pairs it appears in (a ground truth shared by several predictions is
+    reused), in a pool of `nbr_processes` processes. With `cache_dir`, maps
+    are also reused across runs through a `RasterCache`.
+    `progress_callback(done, total, trk_path)` is called after each
+    tractogram is rasterized.
+
+    Returns one dict per pair with the keys of `BATCH_RESULT_FIELDS`.
+    """
+    # Flat voxel indices are only comparable between tractograms of the same grid
+    for prediction, ground_truth in pairs:
+        prediction_dims = tractogramReference(prediction)[1]
+        ground_truth_dims = tractogramReference(ground_truth)[1]
+        if not np.array_equal(prediction_dims, ground_truth_dims):
+            raise ValueError(f"Dimensions differ: {prediction} {prediction_dims} vs "
+                             f"{ground_truth} {ground_truth_dims}")
+
+    paths = list(dict.fromkeys(path for pair in pairs for path in pair))
+    densities = {}
+    if nbr_processes > 1 and len(paths) > 1:
+        # spawn rather than fork: the workers must not inherit the Qt application state
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(nbr_processes, len(paths))) as pool:
+            worker = partial(_sparse_density_worker, cache_dir=cache_dir)
+            for trk_path, density in pool.imap_unordered(worker, paths):
+                densities[trk_path] = density
+                _report_rasterized(len(densities), len(paths), trk_path, progress_callback)
+    else:
+        for trk_path in paths:
+            densities[trk_path] = _sparse_density_worker(trk_path, cache_dir)[1]
+            _report_rasterized(len(densities), len(paths), trk_path, progress_callback)
+
+    rows = []
+    for prediction, ground_truth in pairs:
+        scores = compute_voxel_pairwise_measures(densities[prediction], densities[ground_truth])
+        rows.append({"prediction": prediction, "ground_truth": ground_truth, **scores})
+    return rows
+
+
+def save_scores(rows, output_path):
+    """Write batch results to a `.json` file (list of rows) or a `.csv` table."""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    if output_path.lower().endswith(".json"):
+        with open(output_path, "w") as f:
+            json.dump(rows, f, indent=4)
+    else:
+        with open(output_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=BATCH_RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    print(f"[SLICER TRACTO]Saved scores of {len(rows)} pairs to {output_path}")
+
+
+class BatchScoring:
+    """
+    Score pairs (`score_pairs`) and save the results on a background thread.
+
+    Same scheme as `remoteJobs.RemoteJobQueue`: the worker thread appends
+    its progress and its outcome to a queue that a Qt timer drains on the
+    main thread (directly on the worker thread outside Slicer). So
+    `onProgress(done, total, trk_path)` and `onFinished(rows, error)` may
+    update the UI while Slicer stays responsive. `error` is None on success.
+    """
+
+    def __init__(self, pairs, output_path, nbr_processes=1, cache_dir=None, onProgress=None, onFinished=None):
+        self.pairs = pairs
+        self.outputPath = output_path
+        self.nbrProcesses = nbr_processes
+        self.cacheDir = cache_dir
+        self.onProgress = onProgress
+        self.onFinished = onFinished
+        self.rows = None
+        self.error = None
+        self._events = collections.deque()
+        self._thread = None
+        self._done = threading.Event()
+        self._timer = None
+
+    @property
+    def running(self):
+        return self._thread is not None and not self._done.is_set()
+
+    def start(self):
+        if qt is not None:
+            self._timer = qt.QTimer()
+            self._timer.setInterval(DELIVERY_INTERVAL_MS)
+            self._timer.connect("timeout()", self.deliver)
+            self._timer.start()
+        self._thread = threading.Thread(target=self._work, name="SlicerTractoBatchScoring", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """Block until the batch is scored and its callbacks are called (for scripts and tests, not the UI)."""
+        self._thread.join(timeout)
+        self.deliver()
+        return self._done.is_set()
+
+    def deliver(self):
+        """Call the callbacks of the events queued since the last call."""
+        while self._events:
+            event, args = self._events.popleft()
+            callback = self.onProgress if event == "progress" else self.onFinished
+            if event == "finished" and self._timer is not None:
+                self._timer.stop()
+            if callback is not None:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"[SLICER TRACTO][ERROR]Batch scoring callback failed: {e}")
+
+    def _post(self, event, *args):
+        self._events.append((event, args))
+        if self._timer is None:
+            self.deliver()
+
+    def _work(self):
+        try:
+            self.rows = score_pairs(self.pairs, self.nbrProcesses, self.cacheDir,
+                                    progress_callback=lambda *args: self._post("progress", *args))
+            save_scores(self.rows, self.outputPath)
+        except Exception as e:
+            self.error = e
+        self._done.set()
+        self._post("finished", self.rows, self.error)
+
+
+def _merge_sparse_counts(parts):
+    """Sum sparse `(indices, counts)` pairs, e.g. computed on successive chunks."""
+    if not parts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    indices = np.concatenate([part[0] for part in parts])
+    counts = np.concatenate([part[1] for part in parts])
+    order = np.argsort(indices, kind="stable")
+    indices, counts = indices[order], counts[order]
+    if len(indices) == 0:
+        return indices, counts
+    first = np.empty(len(indices), dtype=bool)
+    first[0] = True
+    np.not_equal(indices[1:], indices[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    return indices[starts], np.add.reduceat(counts, starts)
+
+
+def _sorted_unique(values):
+    """`np.unique(values, return_counts=True)` through a plain sort (much faster on large int64 arrays)."""
+    values = np.sort(values)
+    if len(values) == 0:
+        return values, np.zeros(0, dtype=np.int64)
+    first = np.empty(len(values), dtype=bool)
+    first[0] = True
+    np.not_equal(values[1:], values[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.append(starts, len(values)))
+    return values[starts], counts.astype(np.int64)
+
+
+def _track_batches(lengths, max_segments):
+    """Split streamline indices into `[first, last)` ranges of at most ~`max_segments` segments."""
+    segments = np.cumsum(np.maximum(lengths - 1, 0))
+    first = 0
+    while first < len(lengths):
+        offset = segments[first - 1] if first else 0
+        last = int(np.searchsorted(segments, offset + max_segments, side="right"))
+        last = max(last, first + 1)
+        yield first, last
+        first = last
+
+
+def _traverse_segments(points, starts, lengths, track_ids):
+    """
+    Walk all segments of the given streamlines (at least 2 points each) through the grid.
+
+    Returns the `(track_ids, voxels)` of every voxel visit and the voxel of
+    the last point of each streamline.
+    """
+    if len(track_ids) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 3), dtype=np.int64), np.zeros((0, 3), dtype=np.int64)
+
+    nb_segments = lengths - 1
+    seg_track = np.repeat(track_ids, nb_segments)
+    seg_start = np.repeat(starts - np.cumsum(np.concatenate(([0], nb_segments[:-1]))), nb_segments) \
+        + np.arange(int(nb_segments.sum()), dtype=np.int64)
+
+    in_pt = points[seg_start].copy()
+    next_pt = points[seg_start + 1]
+    dir_vect = next_pt - in_pt
+    dir_vect_norm = np.sqrt(dir_vect[:, 0] * dir_vect[:, 0] + dir_vect[:, 1] * dir_vect[:, 1]
+                            + dir_vect[:, 2] * dir_vect[:, 2])
+
+    # Start from the point itself if it lies on an edge, from the closest edge otherwise
+    cur_edge = in_pt.copy()
+    off_edge = np.all(np.floor(in_pt) != in_pt, axis=1)
+    cur_edge[off_edge] = _closest_edges(in_pt[off_edge], dir_vect[off_edge])
+
+    visited_tracks = []
+    visited_voxels = []
+    # Only the active segments are kept, compacted after every step
+    active = np.flatnonzero(dir_vect_norm != 0)
+    p, d, edge = in_pt[active], dir_vect[active], cur_edge[active]
+    norm_active, remaining, nonzero = dir_vect_norm[active], dir_vect_norm[active], dir_vect[active] != 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        while len(active):
+            ratios = np.where(nonzero, np.abs((edge - p) / d), inf)
+            length_ratio = np.minimum(np.minimum(ratios[:, 0], ratios[:, 1]), ratios[:, 2])
+
+            remaining = remaining - length_ratio * norm_active
+            keep = ~((remaining < 0) & ~(np.abs(remaining) < 1e-8))
+            if not keep.all():
+                in_pt[active[~keep]] = p[~keep]
+                active, p, d, nonzero = active[keep], p[keep], d[keep], nonzero[keep]
+                norm_active, remaining, length_ratio = norm_active[keep], remaining[keep], length_ratio[keep]
+
+            visited_voxels.append(np.floor(p + (0.5 * length_ratio)[:, None] * d).astype(np.int64))
+            visited_tracks.append(seg_track[active])
+
+            p = p + length_ratio[:, None] * d
+            p[np.abs(p) <= 1e-16] = 0.0
+            edge = _closest_edges(p, d)
+
+    # Last point, from the state left by the last segment of each streamline
+    last_segment = np.cumsum(nb_segments) - 1
+    p = in_pt[last_segment]
+    final_voxels = np.floor(p + 0.5 * (next_pt[last_segment] - p)).astype(np.int64)
+    visited_voxels.append(final_voxels)
+    visited_tracks.append(track_ids)
+
+    return np.concatenate(visited_tracks), np.concatenate(visited_voxels), final_voxels
+
+
+def _closest_edges(p, d, eps=1.):
+    """Vectorized `get_closest_edge` over rows of points and directions."""
+    return np.where(d >= 0.0, np.floor(p + eps), np.ceil(p - eps))
+
+
+def _synthetic_voxel_streamlines(count, vol_dims=(96, 114, 96), mean_length=60, step=0.5, seed=0):
+    """Random walks inside the volume, in voxel space with corner origin."""
+    rng = np.random.default_rng(seed)
+    vol_dims = np.asarray(vol_dims, dtype=np.double)
+    lengths = rng.integers(mean_length // 2, mean_length * 3 // 2, size=count)
+    seeds = rng.uniform(0.25 * vol_dims, 0.75 * vol_dims, size=(count, 3))
+    steps = rng.normal(size=(int(lengths.sum()), 3))
+    steps *= step / np.linalg.norm(steps, axis=1, keepdims=True)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    steps[offsets] = seeds
+    points = np.cumsum(steps, axis=0)
+    # The cumulative sum runs across streamlines, restart each one at its seed
+    points -= np.repeat(points[offsets] - seeds, lengths, axis=0)
+    points = np.clip(points, 0, vol_dims - 1e-3).astype(np.float32)
+    return np.split(points, np.cumsum(lengths)[:-1])
+
+
+def benchmark_tract_counts_map(count=100_000, vol_dims=(96, 114, 96), loop_max_count=2_000):
+    """
+    Time the vectorized tract counts map, and the per-segment loop on a subset.
+
+    The loop is only run on the first `loop_max_count` streamlines (it takes
+    minutes on the full set); both maps are checked to be identical there.
+    """
+    streamlines = _synthetic_voxel_streamlines(count, vol_dims)
+    metric_analysis = MetricAnalysis()
+
+    start = time.perf_counter()
+    metric_analysis.compute_tract_counts_map(streamlines, vol_dims)
+    vectorized = time.perf_counter() - start
+    print(f"[SLICER TRACTO]Vectorized tract counts map: {count} streamlines in {vectorized:.2f}s")
+
+    subset = streamlines[:loop_max_count]
+    start = time.perf_counter()
+    expected = metric_analysis.compute_tract_counts_map_loop(subset, vol_dims)
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    result = metric_analysis.compute_tract_counts_map(subset, vol_dims)
+    vectorized_subset = time.perf_counter() - start
+    assert np.array_equal(result, expected)
+    print(f"[SLICER TRACTO]{len(subset)} streamlines: loop {loop:.2f}s, vectorized {vectorized_subset:.3f}s "
+          f"(~{loop / len(subset) * count:.0f}s estimated for the loop on {count})")
+    return vectorized, loop
+
+
+if __name__ == "__main__":
+    benchmark_tract_counts_map()
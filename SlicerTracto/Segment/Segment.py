@@ -4,6 +4,9 @@ import sys
 module_path = os.path.join(os.path.dirname(__file__), "Modules")
 if module_path not in sys.path:
     sys.path.append(module_path)
+common_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Common")
+if common_path not in sys.path:
+    sys.path.append(common_path)
 from typing import Annotated, Optional
 
 import vtk
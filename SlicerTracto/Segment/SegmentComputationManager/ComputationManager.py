@@ -7,8 +7,9 @@ class ComputationManager:
         self.ssh_middleware = SSHManager()
 
 
-    def route_request(self, method, algo, trkPath, segmentedTrkFolderPath):
+    def route_request(self, method, algo, trkPath, segmentedTrkFolderPath, onFinished=None):
+        """Run locally (blocking), or submit a remote job and return its id; `onFinished(job)` is called when it ends."""
         if method == "Local":
             self.local_middleware.execute(algo=algo, trkPath=trkPath, segmentedTrkFolderPath=segmentedTrkFolderPath)
         elif method == "SSH":
-            self.ssh_middleware.execute(algo=algo, trkPath=trkPath, segmentedTrkFolderPath=segmentedTrkFolderPath)
\ No newline at end of file
+            return self.ssh_middleware.execute(algo=algo, trkPath=trkPath, segmentedTrkFolderPath=segmentedTrkFolderPath, onFinished=onFinished)
\ No newline at end of file
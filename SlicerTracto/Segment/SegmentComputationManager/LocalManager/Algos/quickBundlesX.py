@@ -1,4 +1,4 @@
-from dipy.io.streamline import load_tractogram, save_tractogram
+from dipy.io.streamline import save_tractogram
 from dipy.segment.clustering import QuickBundlesX
 from dipy.tracking.streamline import transform_streamlines
 import vtk
@@ -7,6 +7,8 @@ import slicer
 import random
 from dipy.io.stateful_tractogram import StatefulTractogram, Space
 import numpy as np # Import numpy
+from streamlineConversion import saveStreamlinesVTK
+from tractogramStreaming import loadStreamlinesChunked, printProgress
 
 DEFAULT_SEGMENTED_TRK_FILE_NAME_PREFIX = 'segmentedTrk'
 file_path = os.path.abspath(__file__)
@@ -23,8 +25,7 @@ class QuickBundlesXAlgo:
         print("Segmenting Trk using QuickBundlesX...")
         
         # Load tractogram
-        tractogram = load_tractogram(self.trkPath, reference="same")
-        streamlines = tractogram.streamlines
+        streamlines = loadStreamlinesChunked(self.trkPath, progressCallback=printProgress)
 
         # Initialize QuickBundlesX with threshold
         qb = QuickBundlesX(thresholds=self.thresholds)  # Pass the threshold to the constructor
@@ -44,38 +45,10 @@ class QuickBundlesXAlgo:
             vtkFilePath = os.path.join(self.segmentedTrkFolderPath, vtkFileName)
 
             # Create a new tractogram with only the cluster's streamlines
-            new_tractogram = StatefulTractogram(cluster_streamlines, tractogram.space_attributes, Space.RASMM)
+            new_tractogram = StatefulTractogram(cluster_streamlines, self.trkPath, Space.RASMM)
 
             # Save the tractogram
             save_tractogram(new_tractogram, trkFilePath, bbox_valid_check=False)
 
             # Convert and save as VTK
-            self._saveStreamlinesVTK(cluster_streamlines, vtkFilePath)
-
-    def _saveStreamlinesVTK(self, streamlines, filePath):
-        """Save streamlines as VTK PolyData."""
-        polydata = vtk.vtkPolyData()
-        lines = vtk.vtkCellArray()
-        points = vtk.vtkPoints()
-
-        ptCtr = 0
-        for streamline in streamlines:
-            line = vtk.vtkPolyLine()
-            line.GetPointIds().SetNumberOfIds(len(streamline))
-
-            for j, point in enumerate(streamline):
-                points.InsertNextPoint(point)
-                line.GetPointIds().SetId(j, ptCtr)
-                ptCtr += 1
-
-            lines.InsertNextCell(line)
-
-        polydata.SetPoints(points)
-        polydata.SetLines(lines)
-
-        writer = vtk.vtkPolyDataWriter()
-        writer.SetFileName(filePath)
-        writer.SetInputData(polydata)
-        writer.Write()
-
-        print(f"Wrote streamlines to {filePath}")
+            saveStreamlinesVTK(cluster_streamlines, vtkFilePath)
@@ -9,6 +9,7 @@ import vtk
 import os
 import slicer
 import random
+from streamlineConversion import streamlinesToPolyData, saveStreamlinesVTK
 
 DEFAULT_SEGMENTED_TRK_FILE_NAME_PREFIX = 'segmentedTrk'
 file_path = os.path.abspath(__file__)
@@ -77,7 +78,7 @@ class Segmentation:
 
             save_tractogram(tractogram, trkFilePath)
             tractogram = load_tractogram(trkFilePath, reference="same")
-            self._saveStreamlinesVTK(tractogram.streamlines, vtkFilePath )
+            saveStreamlinesVTK(tractogram.streamlines, vtkFilePath)
             self.outputText.append(f'Cluster {i} saved in file {trkFileName} \n\n')
 
     def visualizeSegmentation(self):
@@ -117,29 +118,7 @@ class Segmentation:
 
     def _convertToVTK(self, cluster):
         """Convert a cluster of streamlines to VTK polydata with per-cluster coloring."""
-        points = vtk.vtkPoints()
-        lines = vtk.vtkCellArray()
-        scalars = vtk.vtkFloatArray()
-        scalars.SetName("ClusterIndex")
-
-        for streamline in cluster:
-            line = vtk.vtkPolyLine()
-            line.GetPointIds().SetNumberOfIds(len(streamline))
-
-            for i, point in enumerate(streamline):
-                pointId = points.InsertNextPoint(point)
-                line.GetPointIds().SetId(i, pointId)
-                scalars.InsertNextValue(i)  # Assign scalar value (index)
-
-            lines.InsertNextCell(line)
-
-        polydata = vtk.vtkPolyData()
-        polydata.SetPoints(points)
-        polydata.SetLines(lines)
-        polydata.GetPointData().SetScalars(scalars)  # Add scalars for coloring
-
-        return polydata
-
+        return streamlinesToPolyData(cluster, pointIndexScalarName="ClusterIndex")
 
     def _generateColors(self, numClusters):
         """Generate distinct colors for each cluster."""
@@ -150,40 +129,3 @@ class Segmentation:
             colorName = predefinedColors[i % len(predefinedColors)]
             colors.append(colormap.GetColor3d(colorName))
         return colors
-    
-    def _saveStreamlinesVTK(self, streamlines, pStreamlines):
-        
-        polydata = vtk.vtkPolyData()
-
-        lines = vtk.vtkCellArray()
-        points = vtk.vtkPoints()
-
-        ptCtr = 0
-
-        for i, streamline in enumerate(streamlines):
-            if (i % 10000) == 0:
-                print(f"{i}/{len(streamlines)}")
-            
-            line = vtk.vtkLine()
-            line.GetPointIds().SetNumberOfIds(len(streamline))
-
-            for j, point in enumerate(streamline):
-                points.InsertNextPoint(point)
-                line.GetPointIds().SetId(j, ptCtr)
-                ptCtr += 1
-
-            lines.InsertNextCell(line)
-
-        polydata.SetLines(lines)
-        polydata.SetPoints(points)
-
-        writer = vtk.vtkPolyDataWriter()
-        writer.SetFileName(pStreamlines)
-        writer.SetInputData(polydata)
-        writer.Write()
-
-        print(f"Wrote streamlines to {writer.GetFileName()}")
-            
-
-
-        
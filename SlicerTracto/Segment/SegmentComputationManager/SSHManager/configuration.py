@@ -2,4 +2,15 @@ import os
 hostname = "paramhimalaya.iitmandi.ac.in"
 port = 4422
 username = "mahirj.scee.iitmandi"
-private_key_path = os.path.expanduser("~/.ssh/id_ed25519")
\ No newline at end of file
+private_key_path = os.path.expanduser("~/.ssh/id_ed25519")
+
+# Content-addressed cache of uploaded inputs, shared by the modules (see remoteBlobCache)
+remote_cache_folder = "/scratch/mahirj.scee.iitmandi/Gagan/SlicerTracto/BlobCache"
+remote_cache_max_age_days = 14
+remote_cache_max_size_gb = 50
+
+# How remote scripts run: "nohup" (on the login node itself) or through the batch scheduler ("slurm", "pbs")
+scheduler = "slurm"
+# Partition (SLURM) or queue (PBS) and account of the batch jobs; the scheduler's defaults when None
+scheduler_queue = None
+scheduler_account = None
@@ -7,8 +7,9 @@ class ComputationManager:
         self.ssh_middleware = SSHManager()
 
 
-    def route_request(self, subjectName, method, algo, folderPath):
+    def route_request(self, subjectName, method, algo, folderPath, onFinished=None):
+        """Run locally (blocking), or submit a remote job and return its id; `onFinished(job)` is called when it ends."""
         if method == "Local":
             self.local_middleware.execute(subjectName=subjectName, algo=algo, folderPath = folderPath)
         elif method == "SSH":
-            self.ssh_middleware.execute(subjectName=subjectName, algo=algo, folderPath = folderPath)
\ No newline at end of file
+            return self.ssh_middleware.execute(subjectName=subjectName, algo=algo, folderPath = folderPath, onFinished=onFinished)
\ No newline at end of file
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Scaling of the parallel Particle Filtering Tracking (parallelTracking.pftToTrk):
+time and speedup for 1, 2, 4, ... worker processes on the same seeds, and a
+check that every run writes the same streamlines in the same order.
+
+Without inputs, runs on a synthetic phantom: a bundle along x in white
+matter, ending in grey matter, surrounded by CSF. With --sh (fODF SH
+coefficients, descoteaux07 basis), --wm, --gm, --csf (PVE maps) and --seeding
+(mask), runs on real data. Exits with an error when the runs differ.
+
+    python benchmarkPftScaling.py
+    python benchmarkPftScaling.py --processes 8 --density 3
+    python benchmarkPftScaling.py --sh fodf.nii.gz --wm pve_2.nii.gz \\
+        --gm pve_1.nii.gz --csf pve_0.nii.gz --seeding bundle_mask.nii.gz
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from dipy.data import default_sphere
+from dipy.reconst.shm import sf_to_sh
+from dipy.tracking import utils
+
+common_path = os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.pardir] * 4, "Common"))
+if common_path not in sys.path:
+    sys.path.append(common_path)
+from parallelTracking import DEFAULT_PFT_SEEDS_PER_CHUNK, pftToTrk
+from resourcePlanner import availableCores
+
+PHANTOM_SHAPE = (48, 16, 16)
+PHANTOM_VOXEL_SIZE = 2.
+DEFAULT_RANDOM_SEED = 0
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('--sh', help='fODF SH coefficients (default: synthetic phantom).')
+    p.add_argument('--wm', help='White matter PVE map.')
+    p.add_argument('--gm', help='Grey matter PVE map.')
+    p.add_argument('--csf', help='CSF PVE map.')
+    p.add_argument('--seeding', help='Seeding mask (restricted to WM PVE >= 0.5).')
+    p.add_argument('--sh_order', type=int, default=8,
+                   help='SH order of the phantom fODF [%(default)s].')
+    p.add_argument('--density', type=int, default=2,
+                   help='Seeds per voxel along each axis [%(default)s].')
+    p.add_argument('--processes', type=int, default=availableCores(),
+                   help='Largest number of processes; runs 1, 2, 4, ... up to it [%(default)s].')
+    p.add_argument('--seeds_per_chunk', type=int, default=DEFAULT_PFT_SEEDS_PER_CHUNK,
+                   help='Seeds per chunk [%(default)s].')
+    p.add_argument('--particle_count', type=int, default=15,
+                   help='Particles of the filter [%(default)s].')
+    p.add_argument('--random_seed', type=int, default=DEFAULT_RANDOM_SEED,
+                   help='Random seed shared by all runs [%(default)s].')
+    p.add_argument('--sh_to_pmf', action='store_true',
+                   help='Track on a cached PMF volume instead of the SH coefficients.')
+    return p
+
+
+def _phantom(sh_order):
+    """SH coefficients, WM/GM/CSF maps and seeding mask of a straight bundle along x."""
+    wm = np.zeros(PHANTOM_SHAPE)
+    gm = np.zeros(PHANTOM_SHAPE)
+    wm[4:-4, 4:-4, 4:-4] = 1.
+    gm[2:-2, 3:-3, 3:-3] = 1.
+    gm[wm > 0] = 0.
+    csf = 1. - wm - gm
+
+    # One sharp lobe along x everywhere, descoteaux07 basis
+    cos2 = default_sphere.x ** 2
+    sf = np.exp(-20. * (1. - cos2))
+    sh = sf_to_sh(sf, default_sphere, sh_order_max=sh_order)
+    shCoeffs = np.broadcast_to(sh, PHANTOM_SHAPE + sh.shape).copy()
+
+    seeding = np.zeros(PHANTOM_SHAPE, dtype=bool)
+    seeding[8:-8, 5:-5, 5:-5] = True
+    affine = np.diag([PHANTOM_VOXEL_SIZE] * 3 + [1.])
+    return nib.Nifti1Image(wm.astype(np.float32), affine), shCoeffs, wm, gm, csf, seeding
+
+
+def _inputs(args):
+    if args.sh is None:
+        return _phantom(args.sh_order)
+    sh_img = nib.load(args.sh)
+    wm_img = nib.load(args.wm)
+    seeding = nib.load(args.seeding).get_fdata() > 0
+    return (wm_img, sh_img.get_fdata(), wm_img.get_fdata(), nib.load(args.gm).get_fdata(),
+            nib.load(args.csf).get_fdata(), seeding)
+
+
+def main():
+    args = _build_arg_parser().parse_args()
+    reference_img, sh, wm, gm, csf, seeding = _inputs(args)
+    seeding = seeding & (wm >= 0.5)
+    seeds = utils.seeds_from_mask(seeding, reference_img.affine, density=args.density)
+    voxel_size = float(np.mean(reference_img.header.get_zooms()[:3]))
+    processes = [1]
+    while processes[-1] * 2 <= args.processes:
+        processes.append(processes[-1] * 2)
+    if processes[-1] != args.processes:
+        processes.append(args.processes)
+    print(f"{args.sh or 'phantom'}: {wm.shape}, {len(seeds)} seeds in chunks of "
+          f"{args.seeds_per_chunk}, {availableCores()} CPUs available")
+
+    folder = tempfile.mkdtemp(prefix="slicertracto_pft_benchmark_")
+    try:
+        reference, reference_time = None, None
+        for nb_processes in processes:
+            output_path = os.path.join(folder, f"pft_{nb_processes}.trk")
+            start = time.perf_counter()
+            nb_streamlines = pftToTrk(output_path, reference_img, sh, wm, gm, csf, seeds, voxel_size,
+                                      particleCount=args.particle_count, randomSeed=args.random_seed,
+                                      nbProcesses=nb_processes, seedsPerChunk=args.seeds_per_chunk,
+                                      shToPmf=args.sh_to_pmf)
+            elapsed = time.perf_counter() - start
+            streamlines = nib.streamlines.load(output_path).streamlines
+            if reference is None:
+                reference, reference_time = streamlines, elapsed
+            elif len(streamlines) != len(reference) or not all(
+                    np.array_equal(a, b) for a, b in zip(streamlines, reference)):
+                sys.exit(f"{nb_processes} processes did not write the streamlines of 1 process")
+            speedup = reference_time / elapsed
+            print(f"{nb_processes:3d} processes: {elapsed:8.2f}s, {nb_streamlines} streamlines, "
+                  f"speedup {speedup:.2f}x, efficiency {speedup / nb_processes:.0%}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Scaling of the parallel LocalTracking (parallelTracking.trackToTrk): time
+and speedup for 1, 2, 4, ... worker processes on the same seeds, and a check
+that every run writes the same streamlines in the same order.
+
+Without inputs, runs on a synthetic phantom: a box mask with one fiber
+direction along x. With --fodf (SH coefficients, in --sh_basis) and --mask
+(tracking and seeding mask), runs on real data. Exits with an error when the
+runs differ.
+
+    python benchmarkTrackingScaling.py
+    python benchmarkTrackingScaling.py --processes 32 --density 3 --algo prob
+    python benchmarkTrackingScaling.py --fodf fodf.nii.gz --mask wm_mask.nii.gz
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from dipy.data import default_sphere
+from dipy.reconst.shm import sf_to_sh
+from dipy.tracking import utils
+
+common_path = os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.pardir] * 4, "Common"))
+if common_path not in sys.path:
+    sys.path.append(common_path)
+from parallelTracking import DEFAULT_SEEDS_PER_CHUNK, TRACKING_ALGOS, trackToTrk
+from resourcePlanner import availableCores
+
+PHANTOM_SHAPE = (64, 24, 24)
+PHANTOM_VOXEL_SIZE = 2.
+DEFAULT_RANDOM_SEED = 0
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('--fodf', help='fODF SH coefficients (default: synthetic phantom).')
+    p.add_argument('--mask', help='Tracking and seeding mask.')
+    p.add_argument('--sh_basis', default='tournier07',
+                   help='SH basis of --fodf [%(default)s].')
+    p.add_argument('--algo', default='det', choices=[a for a in TRACKING_ALGOS if a != 'eudx'],
+                   help='Tracking algorithm [%(default)s].')
+    p.add_argument('--density', type=int, default=2,
+                   help='Seeds per voxel along each axis [%(default)s].')
+    p.add_argument('--step_size', type=float, default=0.5,
+                   help='Step size, in voxels [%(default)s].')
+    p.add_argument('--processes', type=int, default=availableCores(),
+                   help='Largest number of processes; runs 1, 2, 4, ... up to it [%(default)s].')
+    p.add_argument('--seeds_per_chunk', type=int, default=DEFAULT_SEEDS_PER_CHUNK,
+                   help='Seeds per chunk [%(default)s].')
+    p.add_argument('--random_seed', type=int, default=DEFAULT_RANDOM_SEED,
+                   help='Random seed shared by all runs [%(default)s].')
+    return p
+
+
+def _phantom(sh_basis):
+    """SH coefficients and mask of a box with one sharp lobe along x everywhere."""
+    sf = np.exp(-20. * (1. - default_sphere.x ** 2))
+    sh = sf_to_sh(sf, default_sphere, sh_order_max=8, basis_type=sh_basis)
+    sh = np.broadcast_to(sh, PHANTOM_SHAPE + sh.shape).copy()
+    mask = np.zeros(PHANTOM_SHAPE, dtype=bool)
+    mask[2:-2, 2:-2, 2:-2] = True
+    affine = np.diag([PHANTOM_VOXEL_SIZE] * 3 + [1.])
+    return nib.Nifti1Image(mask.astype(np.uint8), affine), sh, mask
+
+
+def _inputs(args):
+    if args.fodf is None:
+        return _phantom(args.sh_basis)
+    mask_img = nib.load(args.mask)
+    return mask_img, nib.load(args.fodf).get_fdata(dtype=np.float32), mask_img.get_fdata() > 0
+
+
+def main():
+    args = _build_arg_parser().parse_args()
+    reference_img, sh, mask = _inputs(args)
+    seeds = utils.seeds_from_mask(mask, np.eye(4), density=args.density)
+    processes = [1]
+    while processes[-1] * 2 <= args.processes:
+        processes.append(processes[-1] * 2)
+    if processes[-1] != args.processes:
+        processes.append(args.processes)
+    print(f"{args.fodf or 'phantom'}: {mask.shape}, {len(seeds)} seeds in chunks of "
+          f"{args.seeds_per_chunk}, {availableCores()} CPUs available")
+
+    folder = tempfile.mkdtemp(prefix="slicertracto_tracking_benchmark_")
+    try:
+        reference, reference_time = None, None
+        for nb_processes in processes:
+            output_path = os.path.join(folder, f"tracking_{nb_processes}.trk")
+            start = time.perf_counter()
+            nb_streamlines = trackToTrk(output_path, reference_img, {"odf": sh}, mask, seeds, args.algo,
+                                        45., args.step_size, 1000, 10., 400., shBasis=args.sh_basis,
+                                        randomSeed=args.random_seed, nbProcesses=nb_processes,
+                                        seedsPerChunk=args.seeds_per_chunk)
+            elapsed = time.perf_counter() - start
+            streamlines = nib.streamlines.load(output_path).streamlines
+            if reference is None:
+                reference, reference_time = streamlines, elapsed
+            elif len(streamlines) != len(reference) or not all(
+                    np.array_equal(a, b) for a, b in zip(streamlines, reference)):
+                sys.exit(f"{nb_processes} processes did not write the streamlines of 1 process")
+            speedup = reference_time / elapsed
+            print(f"{nb_processes:3d} processes: {elapsed:8.2f}s, {nb_streamlines} streamlines, "
+                  f"speedup {speedup:.2f}x, efficiency {speedup / nb_processes:.0%}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
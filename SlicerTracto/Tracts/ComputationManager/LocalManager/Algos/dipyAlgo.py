@@ -7,8 +7,7 @@ sibling_folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '.
 if sibling_folder_path not in sys.path:
     sys.path.append(sibling_folder_path)
 
-from scilpy.reconst.utils import (find_order_from_nb_coeff,
-                                    get_maximas)
+from scilpy.reconst.utils import find_order_from_nb_coeff
 from scilpy.io.image import get_data_as_mask
 from scilpy.tracking.utils import get_theta
 
@@ -37,6 +36,11 @@ import numpy as np
 import warnings
 import nibabel as nib
 from nibabel.streamlines.tractogram import LazyTractogram
+from parallelTracking import trackToTrk, DEFAULT_SEEDS_PER_CHUNK
+from asyncWriter import AsyncWriter
+from seedingMask import thresholdMask
+from seedGenerator import SeedChunks
+from peakExtraction import shToPeaks, peaksToIndices
 from scripts.scil_frf_ssst import main as scil_frf_ssst_main
 import slicer.util
 import slicer
@@ -56,6 +60,14 @@ SEED = None
 SAVE_SEEDS = False
 FILETYPE = nib.streamlines.TrkFile
 COMPRESS : float = 0.0
+NB_PROCESSES = None  # all cores
+SEEDS_PER_CHUNK : int = DEFAULT_SEEDS_PER_CHUNK
+# Track on a cached PMF volume (SH evaluated once on the sphere) instead of the SH, when it fits in memory
+SH_TO_PMF = True
+# Only report the seed count and a memory/time estimate (tracking a few seeds), without tracking
+DRY_RUN = False
+# Write the seeding mask to SEEDING_MASK_FOLDER_PATH, in the background while tracking
+SAVE_SEEDING_MASK = True
 ALGO = "det"
 STEP_SIZE = 0.5
 OUTPUT_FOLDER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "Output")
@@ -66,14 +78,18 @@ os.makedirs(TRKS_FOLDER_PATH, exist_ok=True)
 
 
 def run(subjectName, approxMaskPathFilePath, fodfFilePath):
+    with AsyncWriter() as writer:
+        _run(subjectName, approxMaskPathFilePath, fodfFilePath, writer)
+
+
+def _run(subjectName, approxMaskPathFilePath, fodfFilePath, writer):
     print("[SLICER TRACTO] Generating SEEDING MASKS...")
-    seeding_mask_file_path = _create_binary_mask(approxMaskPathFilePath, subjectName)
+    # One array for the seeds and the stopping criterion; the saved copy is a side output
+    mask_data, seed_img = _create_binary_mask(approxMaskPathFilePath, subjectName,
+                                              writer if SAVE_SEEDING_MASK else None)
     print("[SLICER TRACTO] SEEDING MASKS GENERATED...")
     print("[SLICER TRACTO] Generating TRACKS MASKS...")
 
-    mask_img = nib.load(seeding_mask_file_path)
-    mask_data = get_data_as_mask(mask_img, dtype=bool)
-
     odf_sh_img = nib.load(fodfFilePath)
     if not np.allclose(np.mean(odf_sh_img.header.get_zooms()[:3]),
                     odf_sh_img.header.get_zooms()[0], atol=1e-03):
@@ -92,62 +108,42 @@ def run(subjectName, approxMaskPathFilePath, fodfFilePath):
 
     voxel_size = odf_sh_img.header.get_zooms()[0]
     vox_step_size = STEP_SIZE / voxel_size
-    seed_img = nib.load(seeding_mask_file_path)
-    seeds = track_utils.random_seeds_from_mask(
-        seed_img.get_fdata(dtype=np.float32),
-        np.eye(4),
-        seeds_count=nb_seeds,
-        seed_count_per_voxel=seed_per_vox,
-        random_seed=None)
-
-    max_steps = int(MAX_LENGTH / STEP_SIZE) + 1
-    streamlines_generator = LocalTracking(
-        _get_direction_getter(fodfFilePath),
-        BinaryStoppingCriterion(mask_data),
-        seeds, np.eye(4),
-        step_size=vox_step_size, max_cross=1,
-        maxlen=max_steps,
-        fixedstep=True, return_all=True,
-        random_seed=SEED,
-        save_seeds=SAVE_SEEDS)
-    
-    scaled_min_length = MIN_LENGTH / voxel_size
-    scaled_max_length = MAX_LENGTH / voxel_size
-
-    if SAVE_SEEDS:
-        filtered_streamlines, seeds = \
-            zip(*((s, p) for s, p in streamlines_generator
-                if scaled_min_length <= length(s) <= scaled_max_length))
-        data_per_streamlines = {'seeds': lambda: seeds}
-    else:
-        filtered_streamlines = \
-            (s for s in streamlines_generator
-            if scaled_min_length <= length(s) <= scaled_max_length)
-        data_per_streamlines = {}
-
-    if COMPRESS:
-        filtered_streamlines = (
-            compress_streamlines(s, COMPRESS)
-            for s in filtered_streamlines)
-
-    tractogram = LazyTractogram(lambda: filtered_streamlines,
-                                data_per_streamlines,
-                                affine_to_rasmm=seed_img.affine)
-
-    
-    reference = get_reference_info(seed_img)
-    header = create_tractogram_header(FILETYPE, *reference)
+    # Generated chunk by chunk while tracking, deterministic for a given SEED
+    seeds = SeedChunks.random(mask_data, np.eye(4), SEEDS_PER_CHUNK, nbSeeds=nb_seeds,
+                              perVoxel=seed_per_vox, randomSeed=SEED)
 
-    # Use generator to save the streamlines on-the-fly
     trkFileName = subjectName + "_trk.trk"
     output_trk_path = os.path.join(TRKS_FOLDER_PATH, trkFileName)
-    
-    
-    nib.streamlines.save(tractogram, output_trk_path, header=header)
+
+    # Seeds are tracked in chunks by a pool of processes and streamed to the file
+    tracked = trackToTrk(output_trk_path, seed_img, _get_direction_arrays(fodfFilePath), mask_data, seeds,
+               ALGO, get_theta(THETA, ALGO), vox_step_size,
+               int(MAX_LENGTH / STEP_SIZE) + 1,
+               MIN_LENGTH / voxel_size, MAX_LENGTH / voxel_size,
+               sfThreshold=SF_THRESHOLD, shBasis=SH_BASIS, sphere=SPHERE,
+               randomSeed=SEED, saveSeeds=SAVE_SEEDS, compress=COMPRESS,
+               nbProcesses=NB_PROCESSES, seedsPerChunk=SEEDS_PER_CHUNK, shToPmf=SH_TO_PMF,
+               fileType=FILETYPE, dryRun=DRY_RUN)
+    if DRY_RUN:
+        return tracked
     print("[SLICER TRACTO] TRK GENERATED...")
 
     # self.outputText.append(f'Trk Genererated Successfully \n (location: {self.output_trk_path}) \n')
 
+def _get_direction_arrays(fodfFilePath):
+    """Arrays the tracking workers build their direction getter from (see parallelTracking)."""
+    if ALGO == 'eudx':
+        dg = _get_direction_getter(fodfFilePath)
+        return {'peak_dirs': dg.peak_dirs, 'peak_values': dg.peak_values, 'peak_indices': dg.peak_indices}
+
+    odf_data = nib.load(fodfFilePath).get_fdata(dtype=np.float32)
+    non_zeros_count = np.count_nonzero(np.sum(odf_data, axis=-1))
+    non_first_val_count = np.count_nonzero(np.argmax(odf_data, axis=-1))
+    if non_first_val_count / non_zeros_count > 0.5:
+        logging.warning('Input detected as peaks. Input should be'
+                        'fodf for det/prob, verify input just in case.')
+    return {'odf': odf_data}
+
 def _get_direction_getter(fodfFilePath):
         odf_data = nib.load(fodfFilePath).get_fdata(dtype=np.float32)
         sphere = HemiSphere.from_sphere(get_sphere(SPHERE))
@@ -171,7 +167,6 @@ def _get_direction_getter(fodfFilePath):
         elif ALGO == 'eudx':
             # Code for type EUDX. We don't use peaks_from_model
             # because we want the peaks from the provided sh.
-            odf_shape_3d = odf_data.shape[:-1]
             dg = PeaksAndMetrics()
             dg.sphere = sphere
             dg.ang_thr = theta
@@ -181,40 +176,16 @@ def _get_direction_getter(fodfFilePath):
             # fodf are always around 0.15 and peaks around 0.75
             if non_first_val_count / non_zeros_count > 0.5:
                 logging.info('Input detected as peaks.')
-                nb_peaks = odf_data.shape[-1] // 3
-                slices = np.arange(0, 15+1, 3)
-                peak_values = np.zeros(odf_shape_3d+(nb_peaks,))
-                peak_indices = np.zeros(odf_shape_3d+(nb_peaks,))
-
-                for idx in np.argwhere(np.sum(odf_data, axis=-1)):
-                    idx = tuple(idx)
-                    for i in range(nb_peaks):
-                        peak_values[idx][i] = np.linalg.norm(
-                            odf_data[idx][slices[i]:slices[i+1]], axis=-1)
-                        peak_indices[idx][i] = sphere.find_closest(
-                            odf_data[idx][slices[i]:slices[i+1]])
-
+                peak_values, peak_indices = peaksToIndices(odf_data, sphere)
                 dg.peak_dirs = odf_data
             else:
                 logging.info('Input detected as fodf.')
-                npeaks = 5
-                peak_dirs = np.zeros((odf_shape_3d + (npeaks, 3)))
-                peak_values = np.zeros((odf_shape_3d + (npeaks, )))
-                peak_indices = np.full((odf_shape_3d + (npeaks, )), -1, dtype='int')
                 b_matrix = _get_b_matrix(
                     find_order_from_nb_coeff(odf_data), sphere, SH_BASIS)
-
-                for idx in np.argwhere(np.sum(odf_data, axis=-1)):
-                    idx = tuple(idx)
-                    directions, values, indices = get_maximas(odf_data[idx],
-                                                            sphere, b_matrix,
-                                                            SF_THRESHOLD, 0)
-                    if values.shape[0] != 0:
-                        n = min(npeaks, values.shape[0])
-                        peak_dirs[idx][:n] = directions[:n]
-                        peak_values[idx][:n] = values[:n]
-                        peak_indices[idx][:n] = indices[:n]
-
+                # All voxels at once: one SH to SF product per chunk of voxels
+                peak_dirs, peak_values, peak_indices = shToPeaks(
+                    odf_data, sphere, b_matrix, SF_THRESHOLD, 0, npeaks=5,
+                    nbThreads=NB_PROCESSES)
                 dg.peak_dirs = peak_dirs
 
             dg.peak_values = peak_values
@@ -222,23 +193,13 @@ def _get_direction_getter(fodfFilePath):
 
             return dg
         
-def _create_binary_mask(approxMaskPathFilePath, subjectName:str, threshold=0.5):
-        # Load the image
-        img = nib.load(approxMaskPathFilePath)
-
-        # Get the image data
-        data = img.get_fdata()
-
-        # Threshold the data to create a binary mask
-        mask_data = (data > threshold).astype(np.uint8)
-
-        # Create a new nibabel image with the binary mask
-        mask_img = nib.Nifti1Image(mask_data, img.affine, img.header)
-        mask_img.set_data_dtype(np.uint8)
-        seeding_mask_file_path = os.path.join(SEEDING_MASK_FOLDER_PATH, subjectName+"_seeding_mask.nii")
-        # Save the new image
-        nib.save(mask_img, seeding_mask_file_path)
-        return seeding_mask_file_path
+def _create_binary_mask(approxMaskPathFilePath, subjectName:str, writer=None, threshold=0.5):
+        """Seeding mask (bool) and its image; saved to SEEDING_MASK_FOLDER_PATH by `writer` when given."""
+        mask_data, mask_img = thresholdMask(nib.load(approxMaskPathFilePath), threshold)
+        if writer is not None:
+            seeding_mask_file_path = os.path.join(SEEDING_MASK_FOLDER_PATH, subjectName+"_seeding_mask.nii")
+            writer.saveNifti(mask_img.dataobj, mask_img.affine, seeding_mask_file_path, header=mask_img.header)
+        return mask_data, mask_img
 
 def _get_b_matrix(order, sphere, sh_basis_type, return_all=False):
     sh_basis = _honor_authorsnames_sh_basis(sh_basis_type)
@@ -22,6 +22,18 @@ from dipy.viz  import has_fury
 # from dipy.viz import window, actor, colormap, has_fury
 import nibabel as nib
 import os
+from parallelTracking import pftToTrk, DEFAULT_PFT_SEEDS_PER_CHUNK
+from seedGenerator import SeedChunks
+from resultStore import ResultStore
+from trackingFodf import trackingShCoefficients
+
+NB_PROCESSES = None  # all cores
+SEEDS_PER_CHUNK : int = DEFAULT_PFT_SEEDS_PER_CHUNK
+# Track on a cached PMF volume (SH evaluated once on the sphere) instead of the SH, when it fits in memory
+SH_TO_PMF = True
+# Only report the seed count and a memory/time estimate (tracking a few seeds), without tracking
+DRY_RUN = False
+SEED = None
 OUTPUT_FOLDER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "Output")
 SEEDING_MASK_FOLDER_PATH: str = os.path.join(OUTPUT_FOLDER_PATH, "SeedingMask")
 TRKS_FOLDER_PATH: str = os.path.join(OUTPUT_FOLDER_PATH, "TRKS")
@@ -32,43 +44,33 @@ os.makedirs(TRKS_FOLDER_PATH, exist_ok=True)
 
 interactive = False
 
-def run(HARDI_FNAME, HARDI_BVAL_FNAME, HARDI_BVEC_FNAME, F_PVE_CSF, F_PVE_GM, F_PVE_WM, BUNDLE_MASK, subjectName):
+def run(HARDI_FNAME, HARDI_BVAL_FNAME, HARDI_BVEC_FNAME, F_PVE_CSF, F_PVE_GM, F_PVE_WM, BUNDLE_MASK, subjectName,
+        FODF_FNAME=None):
 
     trkFileName = subjectName + "_trk.trk"
     output_trk_path = os.path.join(TRKS_FOLDER_PATH, trkFileName)
 
     seeding_mask_file_path = os.path.join(SEEDING_MASK_FOLDER_PATH, subjectName+"_seeding_mask.nii")
     
-    data, affine, hardi_img = load_nifti(HARDI_FNAME, return_img=True)
-    bvals, bvecs = read_bvals_bvecs(HARDI_BVAL_FNAME, HARDI_BVEC_FNAME)
-    gtab = gradient_table(bvals, bvecs)
+    # Header only: the DWI itself is read when the CSD has to be fitted
+    hardi_img = nib.load(HARDI_FNAME)
+    affine = hardi_img.affine
 
 
     pve_csf_data = load_nifti_data(F_PVE_CSF)
     pve_gm_data = load_nifti_data(F_PVE_GM)
     pve_wm_data, _, voxel_size = load_nifti(F_PVE_WM, return_voxsize=True)
 
-
-
-
-    shape = data.shape[:-1]
-
-    response, ratio = auto_response_ssst(gtab, data, roi_radii=10, fa_thr=0.7)
-    csd_model = ConstrainedSphericalDeconvModel(gtab, response)
-    csd_fit = csd_model.fit(data, mask=pve_wm_data)
-
-    dg = ProbabilisticDirectionGetter.from_shcoeff(csd_fit.shm_coeff,
-                                                max_angle=20.,
-                                                sphere=default_sphere)
-
-
+    sh_coeffs = trackingShCoefficients(HARDI_FNAME, HARDI_BVAL_FNAME, HARDI_BVEC_FNAME, F_PVE_WM, pve_wm_data,
+                                       fodfPath=FODF_FNAME, store=ResultStore())
 
     seed_mask0 = load_nifti_data(BUNDLE_MASK)
     seed_mask = (seed_mask0 > 0)
     seed_mask[pve_wm_data < 0.5] = 0
 
 
-    seeds = utils.seeds_from_mask(seed_mask, affine, density=2)
+    # Generated chunk by chunk while tracking (the seeds of seeds_from_mask, in its order)
+    seeds = SeedChunks.grid(seed_mask, affine, SEEDS_PER_CHUNK, density=2)
 
 
 
@@ -78,34 +80,23 @@ def run(HARDI_FNAME, HARDI_BVAL_FNAME, HARDI_BVEC_FNAME, F_PVE_CSF, F_PVE_GM, F_
     voxel_size = np.average(voxel_size[1:4])
     step_size = 0.375
 
-    cmc_criterion = CmcStoppingCriterion.from_pve(pve_wm_data,
-                                                pve_gm_data,
-                                                pve_csf_data,
-                                                step_size=step_size,
-                                                average_voxel_size=voxel_size)
-
-
-
-
-
-
-
-
-    pft_streamline_gen = ParticleFilteringTracking(dg,
-                                                cmc_criterion,
-                                                seeds,
-                                                affine,
-                                                max_cross=1,
-                                                step_size=step_size,
-                                                maxlen=1000,
-                                                pft_back_tracking_dist=2,
-                                                pft_front_tracking_dist=1,
-                                                particle_count=15,
-                                                return_all=False)
-                                                #    min_wm_pve_before_stopping=1)
-    streamlines = Streamlines(pft_streamline_gen)
-    sft = StatefulTractogram(streamlines, hardi_img, Space.RASMM)
-    save_trk(sft, output_trk_path)
+    # Seeds are tracked in chunks by a pool of processes sharing the SH and PVE maps,
+    # and streamed to the file in seed order
+    tracked = pftToTrk(output_trk_path, hardi_img, sh_coeffs,
+                       pve_wm_data, pve_gm_data, pve_csf_data, seeds, voxel_size,
+                       stepSize=step_size,
+                       maxAngle=20.,
+                       maxLen=1000,
+                       backTrackingDist=2,
+                       frontTrackingDist=1,
+                       particleCount=15,
+                       randomSeed=SEED,
+                       nbProcesses=NB_PROCESSES,
+                       seedsPerChunk=SEEDS_PER_CHUNK,
+                       shToPmf=SH_TO_PMF,
+                       dryRun=DRY_RUN)
+    if DRY_RUN:
+        return tracked
 
 
 
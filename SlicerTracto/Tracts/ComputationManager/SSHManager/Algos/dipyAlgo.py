@@ -38,6 +38,11 @@ import warnings
 import nibabel as nib
 from nibabel.streamlines.tractogram import LazyTractogram
 from scripts.scil_frf_ssst import main as scil_frf_ssst_main
+# Uploaded next to this script by the SSH manager
+from asyncWriter import AsyncWriter
+from seedingMask import thresholdMask
+from seedGenerator import SeedChunks
+import itertools
 import vtk
 import parser
 
@@ -54,6 +59,8 @@ SEED = None
 SAVE_SEEDS = False
 FILETYPE = nib.streamlines.TrkFile
 COMPRESS : float = 0.0
+# Seeds generated at a time
+SEEDS_PER_CHUNK : int = 2_000
 ALGO = "det"
 STEP_SIZE = 0.5
 OUTPUT_FOLDER_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Output")
@@ -64,14 +71,17 @@ os.makedirs(INPUT_FOLDER_PATH, exist_ok=True)
 
 
 def run(subjectName, approxMaskPathFilePath, fodfFilePath):
+    with AsyncWriter() as writer:
+        _run(subjectName, approxMaskPathFilePath, fodfFilePath, writer)
+
+
+def _run(subjectName, approxMaskPathFilePath, fodfFilePath, writer):
     print("[SLICER TRACTO] Generating SEEDING MASKS...")
-    seeding_mask_file_path = _create_binary_mask(approxMaskPathFilePath, subjectName)
+    # One array for the seeds and the stopping criterion; the mask is written while tracking
+    mask_data, seed_img = _create_binary_mask(approxMaskPathFilePath, subjectName, writer)
     print("[SLICER TRACTO] SEEDING MASKS GENERATED...")
     print("[SLICER TRACTO] Generating TRACKS MASKS...")
 
-    mask_img = nib.load(seeding_mask_file_path)
-    mask_data = get_data_as_mask(mask_img, dtype=bool)
-
     odf_sh_img = nib.load(fodfFilePath)
     if not np.allclose(np.mean(odf_sh_img.header.get_zooms()[:3]),
                     odf_sh_img.header.get_zooms()[0], atol=1e-03):
@@ -90,13 +100,9 @@ def run(subjectName, approxMaskPathFilePath, fodfFilePath):
 
     voxel_size = odf_sh_img.header.get_zooms()[0]
     vox_step_size = STEP_SIZE / voxel_size
-    seed_img = nib.load(seeding_mask_file_path)
-    seeds = track_utils.random_seeds_from_mask(
-        seed_img.get_fdata(dtype=np.float32),
-        np.eye(4),
-        seeds_count=nb_seeds,
-        seed_count_per_voxel=seed_per_vox,
-        random_seed=None)
+    # Generated chunk by chunk while LocalTracking consumes them
+    seeds = itertools.chain.from_iterable(SeedChunks.random(mask_data, np.eye(4), SEEDS_PER_CHUNK, nbSeeds=nb_seeds,
+                                                            perVoxel=seed_per_vox))
 
     max_steps = int(MAX_LENGTH / STEP_SIZE) + 1
     streamlines_generator = LocalTracking(
@@ -220,23 +226,12 @@ def _get_direction_getter(fodfFilePath):
 
             return dg
         
-def _create_binary_mask(approxMaskPathFilePath, subjectName:str, threshold=0.5):
-        # Load the image
-        img = nib.load(approxMaskPathFilePath)
-
-        # Get the image data
-        data = img.get_fdata()
-
-        # Threshold the data to create a binary mask
-        mask_data = (data > threshold).astype(np.uint8)
-
-        # Create a new nibabel image with the binary mask
-        mask_img = nib.Nifti1Image(mask_data, img.affine, img.header)
-        mask_img.set_data_dtype(np.uint8)
+def _create_binary_mask(approxMaskPathFilePath, subjectName:str, writer, threshold=0.5):
+        """Seeding mask (bool) and its image; saved to OUTPUT_FOLDER_PATH by `writer` (downloaded with the trk)."""
+        mask_data, mask_img = thresholdMask(nib.load(approxMaskPathFilePath), threshold)
         seeding_mask_file_path = OUTPUT_FOLDER_PATH+f"/{subjectName}_seeding_mask.nii"
-        # Save the new image
-        nib.save(mask_img, seeding_mask_file_path)
-        return seeding_mask_file_path
+        writer.saveNifti(mask_img.dataobj, mask_img.affine, seeding_mask_file_path, header=mask_img.header)
+        return mask_data, mask_img
 
 def _get_b_matrix(order, sphere, sh_basis_type, return_all=False):
     sh_basis = _honor_authorsnames_sh_basis(sh_basis_type)
@@ -1,15 +1,18 @@
 import os
 import vtk
-import paramiko
 import time
 from scp import SCPClient
 from pathlib import Path
-from select import select
+
+from sshSessionPool import sshSessionPool
+from remoteBlobCache import RemoteBlobCache
+from remoteJobs import RemoteJob, remoteJobQueue
 import slicer
 from vtk import vtkPolyDataReader
 from dipy.io.stateful_tractogram import Space
 from dipy.io.streamline import load_tractogram, save_vtk
 from dipy.io.streamline import load_tractogram
+from streamlineModels import loadTrkAsModelNode
 
 DEFAULT_VTK_FILE_NAME = "result.vtk"
 DEFAULT_DIR = "/Users/mahir/Desktop/MTP/TractRLFormer/Output"
@@ -22,9 +25,11 @@ class Tract_RLFormer:
         self.scp = None
         self.output_filename = None
         self._running = False
+        self.jobId = None
         
         self.output_trk_path = None  # Track generated TRK file
         self.trkPath = None
+        self.exportVtk = False
 
         # SSH Configuration (should be moved to config file in production)
         self.ssh_config = {
@@ -97,49 +102,62 @@ class Tract_RLFormer:
     # -------------------------------------------------------------------------
     # Main function triggered by UI
     # -------------------------------------------------------------------------
-    def runTracking(self):
+    def runTracking(self, name="TRLF", onFinished=None):
         """
         Main entry point to run the pipeline from the Slicer UI button.
+
+        The pipeline is submitted as a remote job (see `remoteJobs`) and this
+        returns its id right away, so Slicer stays usable while it runs:
         1. Validate parameters
-        2. SSH connect
-        3. Upload input data
-        4. Execute tracking script on remote
-        5. Download results
-        6. Cleanup remote
+        2. SSH connect and upload input data (job queue thread)
+        3. Execute tracking script on remote, detached
+        4. Download results once it ends (job queue thread)
+        5. Cleanup remote, then `onFinished(job)` (main thread)
         """
         if not self._validate_all_paths():
             self._log_error("Aborting due to invalid parameters")
-            return
-
-        try:
+            return None
 
-            self._log("Starting remote tracking pipeline...")
-            self._running = True
+        self._log("Submitting remote tracking pipeline...")
+        self._running = True
+
+        command = self.tracking_command()
+        job = RemoteJob(
+            name=name,
+            command=command,
+            folder=f"{self.remote_workspace}/jobs/{os.path.splitext(self.output_filename)[0]}",
+            connect=self._session,
+            prepare=lambda client: self.transfer_files(),
+            collect=lambda client: self.retrieve_results(),
+            onFinished=lambda job: self._onJobFinished(job, onFinished),
+            # Inputs and outputs share the workspace's input/output folders
+            exclusiveKey=self.remote_workspace
+        )
+        self.jobId = remoteJobQueue().submit(job)
+        return self.jobId
 
+    def _session(self):
+        if self.ssh is None or not self.ssh.get_transport() or not self.ssh.get_transport().is_active():
             self.connect()
-            self.transfer_files()
-            self.execute_tracking()
-            result_path = self.retrieve_results()
-
-            self._log(f"Tracking complete! Results saved to:\n{result_path}")
-
-        except Exception as e:
-            self._log_error(f"Pipeline failed: {str(e)}")
-
-        finally:
-            self.cleanup()
-            if self.scp:
-                self.scp.close()
-            if self.ssh:
-                self.ssh.close()
-            self._running = False
+        return self.ssh
+
+    def _onJobFinished(self, job, onFinished):
+        if job.state == "finished":
+            self._log(f"Tracking complete! Results saved to:\n{self.local_results / self.output_filename}")
+        elif job.state == "failed":
+            self._log_error(f"Pipeline failed: {job.error}")
+        self.cleanup()
+        self.close_connection()
+        self._running = False
+        if onFinished is not None:
+            onFinished(job)
 
     def cancelTracking(self):
         """Cancel ongoing tracking operation"""
         if self._running:
             self._log("Cancelling tracking operation...")
-            self._running = False
-            self.cleanup()  # optionally also close ssh/scp
+            # The remote process is stopped, then the job's end cleans up
+            remoteJobQueue().cancel(self.jobId)
 
     # -------------------------------------------------------------------------
     # Validation methods
@@ -202,20 +220,14 @@ class Tract_RLFormer:
     # -------------------------------------------------------------------------
     
     def connect(self):
-        """Establish SSH connection with explicit key format"""
+        """Borrow the shared SSH session to the server (opened on first use, reopened if it died)"""
         try:
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
             private_key_path = os.path.expanduser("~/.ssh/filename")
-            
-            # Load the key explicitly
-            pkey = paramiko.RSAKey(filename=private_key_path)
 
-            self.ssh.connect(
+            self.ssh = sshSessionPool().get(
                 hostname=self.ssh_config['hostname'],
                 username=self.ssh_config['username'],
-                pkey=pkey,  
+                keyPath=private_key_path,
                 timeout=self.ssh_config['timeout']
             )
 
@@ -227,30 +239,35 @@ class Tract_RLFormer:
             raise
 
     def transfer_files(self):
-        """Transfer all required input files to the remote server"""
+        """
+        Stage all required input files on the remote server.
+
+        The inputs are symlinks into the workspace's blob cache, so a file
+        already sent by a previous run (same content) is not uploaded again.
+        """
         remote_input_dir = f'{self.remote_workspace}/input'
 
         # Create remote directories
         self.execute_command(f'mkdir -p {remote_input_dir}')
         self.execute_command(f'mkdir -p {self.remote_workspace}/output')
 
-        # Transfer each relevant file, but **skip empty paths**
-        for key in [
-            'trlf_model_load_path', 'offline_trajectories',
-            'input_fodf_signal', 'seeding_mask', 'tracking_mask',
-            'bundle_mask', 'peaks', 'reference_file_fa'
-        ]:
-            local_path = self.parameters[key]
-
-            if not local_path:  # **SKIP EMPTY PATHS**
-                continue
-
-            remote_path = f'{remote_input_dir}/{os.path.basename(local_path)}'
-            self.scp.put(local_path, remote_path)
+        # Stage each relevant file; empty paths are skipped
+        pairs = [
+            (self.parameters[key], f'{remote_input_dir}/{os.path.basename(self.parameters[key])}')
+            for key in [
+                'trlf_model_load_path', 'offline_trajectories',
+                'input_fodf_signal', 'seeding_mask', 'tracking_mask',
+                'bundle_mask', 'peaks', 'reference_file_fa'
+            ]
+            if self.parameters[key]
+        ]
+        self._remote_cache().stage(pairs)
 
-    def execute_tracking(self):
-        """Execute the tracking command on the remote server"""
+    def _remote_cache(self):
+        return RemoteBlobCache(self.ssh, f'{self.remote_workspace}/blob_cache')
 
+    def tracking_command(self):
+        """The remote tracking command (with a new output file name)"""
         # Generate unique output filename
         timestamp = int(time.time())
         self.output_filename = f'trk_trlf_{timestamp}.trk'
@@ -274,23 +291,7 @@ class Tract_RLFormer:
         # **Only include offline_trajectories if it is NOT empty**
         if self.parameters.get("offline_trajectories"):
             cmd += f' --offline_trajectories input/{os.path.basename(self.parameters["offline_trajectories"])}'
-
-        # Execute and monitor
-        stdin, stdout, stderr = self.ssh.exec_command(cmd, get_pty=True)
-
-        # Print real-time output
-        while self.ssh.get_transport().is_active():
-            if select([stdout.channel], [], [], 0.1)[0]:
-                line = stdout.readline()
-                if not line:
-                    break
-                print(line.strip())
-
-        # Check exit status
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status != 0:
-            error = stderr.read().decode()
-            raise RuntimeError(f"Tracking failed with error: {error}")
+        return cmd
 
     def retrieve_results(self):
         """Download the tracking result (.trk) from the remote server"""
@@ -301,11 +302,16 @@ class Tract_RLFormer:
         return local_path
 
     def cleanup(self):
-        """Remove remote input/output files to keep HPC workspace clean"""
+        """
+        Remove the staged inputs (symlinks) and the output to keep the HPC workspace clean.
+
+        The uploaded blobs stay cached for the next runs; only those unused for
+        a while, or beyond the cache's size limit, are removed.
+        """
         if not self.ssh:
             return
         try:
-            # Remove everything we uploaded
+            # Remove the symlinks to the uploaded blobs
             remote_input_dir = f'{self.remote_workspace}/input'
             input_files = ' '.join(
                 f'{remote_input_dir}/{os.path.basename(val)}'
@@ -318,6 +324,8 @@ class Tract_RLFormer:
                 f'rm -f {self.remote_workspace}/output/{self.output_filename}'
             )
 
+            self._remote_cache().evict()
+
         except Exception as e:
             self._log_error(f"Cleanup failed: {e}")
 
@@ -328,17 +336,24 @@ class Tract_RLFormer:
         if exit_status != 0:
             error = stderr.read().decode()
             raise RuntimeError(f"Command failed: {command}\nError: {error}")
+
+    def close_connection(self):
+        """Close the SCP channel and give the SSH session back to the pool (it stays open)"""
+        if self.scp:
+            self.scp.close()
+            self.scp = None
+        self.ssh = None
         
     def visualizeTrk(self):
         """
-        Convert a .trk file to .vtk format for visualization in Slicer 3D.
+        Load a .trk file in Slicer 3D as a model node, directly from memory.
         
         Parameters:
             trk_path (str): Path to the input .trk file.
-            output_dir (str): Directory to save the output .vtk file.
+            output_dir (str): Directory to save the output .vtk file (only used when self.exportVtk is set).
         
         Returns:
-            output_vtk_path (str): Path of the converted .vtk file.
+            output_vtk_path (str): Path of the .vtk file being exported in the background, or None.
         """
         
         trk_path = "/Users/mahir/Desktop/MTP/TractRLFormer/Output/trk_trlf_1739181068.trk"
@@ -348,81 +363,27 @@ class Tract_RLFormer:
             print(f"[ERROR] .trk file not found: {trk_path}")
             return None
 
-        output_dir = self.parameters['output_dir']
-        # Create output directory if not exists
-        os.makedirs(output_dir, exist_ok=True)
+        output_vtk_path = None
+        if self.exportVtk:
+            output_dir = self.parameters['output_dir']
+            # Create output directory if not exists
+            os.makedirs(output_dir, exist_ok=True)
+            output_vtk_path = os.path.join(output_dir, os.path.basename(trk_path).replace(".trk", ".vtk"))
 
         # Load the .trk file
         print(f"[INFO] Loading .trk file from: {trk_path}")
         try:
-            tractogram = load_tractogram(trk_path, reference='same', bbox_valid_check=False, to_space=Space.RASMM)
-
-            # Define output VTK file path
-            output_vtk_path = os.path.join(output_dir, os.path.basename(trk_path).replace(".trk", ".vtk"))
-
-            # Convert streamlines to VTK format
-            self._saveStreamlinesVTK(tractogram.streamlines, output_vtk_path)
-
-            # Load the VTK file into Slicer
-            reader = vtkPolyDataReader()
-            reader.SetFileName(output_vtk_path)
-            reader.Update()
-
-            polydata = reader.GetOutput()
-
-            # Create visualization node
-            streamline_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
-            streamline_node.SetAndObservePolyData(polydata)
-
-            display_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode")
-            streamline_node.SetAndObserveDisplayNodeID(display_node.GetID())
-
-            display_node.SetColor(0, 1, 0)  
-            display_node.SetOpacity(1.0)
+            # Create visualization node from memory, the optional .vtk export runs in the background
+            streamline_node, display_node, _ = loadTrkAsModelNode(trk_path, exportPath=output_vtk_path)
 
             slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveVolumeID(streamline_node.GetID())
             slicer.app.applicationLogic().PropagateVolumeSelection()
             slicer.app.layoutManager().resetThreeDViews()
 
-            print(f"[INFO] Visualization complete. VTK saved at: {output_vtk_path}")
+            print("[INFO] Visualization complete.")
 
             return output_vtk_path
 
         except Exception as e:
             print(f"[ERROR] Conversion failed: {e}")
             return None
-
-    def _saveStreamlinesVTK(self, streamlines, output_vtk_path):
-        """
-        Save streamlines in .vtk format.
-        """
-
-        polydata = vtk.vtkPolyData()
-        lines = vtk.vtkCellArray()
-        points = vtk.vtkPoints()
-
-        ptCtr = 0
-
-        for i, streamline in enumerate(streamlines):
-            if (i % 10000) == 0:
-                print(f"Processing streamline {i}/{len(streamlines)}")
-
-            line = vtk.vtkLine()
-            line.GetPointIds().SetNumberOfIds(len(streamline))
-
-            for j, point in enumerate(streamline):
-                points.InsertNextPoint(point)
-                line.GetPointIds().SetId(j, ptCtr)
-                ptCtr += 1
-
-            lines.InsertNextCell(line)
-
-        polydata.SetLines(lines)
-        polydata.SetPoints(points)
-
-        writer = vtk.vtkPolyDataWriter()
-        writer.SetFileName(output_vtk_path)
-        writer.SetInputData(polydata)
-        writer.Write()
-
-        print(f"[INFO] Wrote streamlines to: {output_vtk_path}")
\ No newline at end of file
@@ -1,13 +1,18 @@
-import paramiko
 import os
 import logging
 from ComputationManager.SSHManager import configuration
-from scp import SCPClient
-from paramiko import SFTPClient
 import time
+from sshSessionPool import sshSessionPool
+from fileTransfer import FileTransfer
+from remoteBlobCache import RemoteBlobCache
+from remoteJobs import RemoteJob, remoteJobQueue, runRemoteCommand
+from jobSchedulers import estimateResources, jobBackend
 from ComputationManager.baseManager import BaseManager
 from ComputationManager.SSHManager.Algos.trlfAlgo import Tract_RLFormer
 
+# Worker processes of a remote PFT run (see parallelTracking.pftToTrk)
+PFT_JOB_CPUS = 8
+
 
 class SSHManager(BaseManager):
     def __init__(self):
@@ -17,34 +22,25 @@ class SSHManager(BaseManager):
         self.username = configuration.username
         self.private_key_path = configuration.private_key_path  # Add private key folder path from config
         self.private_key = None
-        self.client = None
+        self.ssh_client = None
         self.ssh_status = False
         self.algoFolderPath = os.path.join(os.path.dirname(__file__), "Algos")
+        self.commonFolderPath = os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.pardir] * 3, "Common"))
         self.remoteFolder = "/scratch/mahirj.scee.iitmandi/Gagan/SlicerTracto"
         self.remoteScriptsFolder = self.remoteFolder+"/Scripts"
         self.remoteInputFolder = self.remoteFolder+"/Input"
         self.remoteOutputFolder = self.remoteFolder+"/Output"
+        self.remoteJobsFolder = self.remoteFolder+"/Jobs"
         self.localOutputFolder = os.path.join(os.path.dirname(os.path.dirname(__file__)), "Output")
         self.conda_env = "slicer_env"
         # self.connect()  # Optionally, you can call connect here if needed
 
     def connect(self):
-        """Establish the SSH connection."""
+        """Borrow the shared SSH session to the host (opened on first use, reopened if it died)."""
         try:
-            # Create an SSH client
-            self.ssh_client = paramiko.SSHClient()
-            self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # Automatically accept unknown host keys
-
-            # Load the private key for authentication
-            private_key = paramiko.Ed25519Key.from_private_key_file(self.private_key_path)  # Replace with RSAKey if using RSA
-
-            # Use private key authentication
-
-            self.ssh_client.connect(self.hostname, port=self.port, username=self.username, pkey=private_key)
-
+            self.ssh_client = sshSessionPool().get(self.hostname, port=self.port, username=self.username,
+                                                   keyPath=self.private_key_path)
             self.ssh_status = True
-            logging.info(f"SSH connection established to {self.hostname}")
-            print(f"[SLICER TRACTO]SSH connection established to {self.hostname}")
         except Exception as e:
             self.ssh_status = False
             logging.error(f"Failed to connect to {self.hostname}: {e}")
@@ -53,182 +49,194 @@ class SSHManager(BaseManager):
         """Return the connection status."""
         return self.ssh_status
 
-    def close(self):
-        """Close the SSH connection."""
-        if self.client:
-            self.client.close()
+    def close(self, disconnect=False):
+        """
+        Stop using the SSH session.
+
+        The session stays open in the pool for the next request unless
+        `disconnect` is set.
+        """
+        if self.ssh_client:
+            if disconnect:
+                sshSessionPool().close(self.hostname, port=self.port, username=self.username,
+                                       keyPath=self.private_key_path)
+                logging.info(f"SSH connection to {self.hostname} closed.")
+            self.ssh_client = None
             self.ssh_status = False
-            logging.info(f"SSH connection to {self.hostname} closed.")
         else:
             logging.error("No active SSH connection to close.")
 
     def upload_file(self, local_path, remote_path):
+        """Upload a file (e.g. a script) directly to `remote_path`."""
         try:
-            sftp = self.ssh_client.open_sftp()
-            sftp.put(local_path, remote_path)
-            sftp.close()
-            print(f"[SLICER TRACTO]File uploaded successfully to {remote_path}")
+            print(f"[SLICER TRACTO]{FileTransfer(self.ssh_client).upload(local_path, remote_path)}")
         except Exception as e:
-            print(f"[SLICER TRACTO]Error during upload: {e}")
+            print(f"[SLICER TRACTO][ERROR]Error during upload: {e}")
+            raise
 
     def download_file(self, local_path, remote_path):
+        self.download_files([(remote_path, local_path)])
+
+    def upload_files(self, pairs):
+        """
+        Stage input files: `(local path, remote path)` pairs become symlinks into
+        the remote blob cache, and only the files the server does not have yet
+        are uploaded (concurrently, compressed and resumable).
+        """
         try:
-            scp = SCPClient(self.ssh_client.get_transport())
-            scp.get(remote_path, local_path)
-            scp.close()
-            print(f"[SLICER TRACTO]File downloaded successfully to {local_path}")
+            self.remoteCache().stage(pairs)
         except Exception as e:
-            print(f"[SLICER TRACTO]Error during download: {e}")
-    
-    def run_file(self, remote_path):
+            print(f"[SLICER TRACTO][ERROR]Error during upload: {e}")
+            raise
+
+    def remoteCache(self):
+        return RemoteBlobCache(self.ssh_client, configuration.remote_cache_folder,
+                               maxAgeDays=configuration.remote_cache_max_age_days,
+                               maxSizeGB=configuration.remote_cache_max_size_gb)
+
+    def evict_remote_cache(self):
+        """Drop cached inputs unused for a while (instead of deleting them after every run)."""
         try:
-            # Activate conda environment if specified
-            conda_command = f"conda activate {self.conda_env} && " if self.conda_env else ""
-            command = f"{conda_command}python3 {remote_path}"
-            stdin, stdout, stderr = self.ssh_client.exec_command(command)
-
-            # Print the output of the script execution
-            for line in stdout:
-                print("[SLICER TRACTO]" + line.strip())
-            # Print any errors encountered during execution
-            for line in stderr:
-                print(f"[SLICER TRACTO]Error: {line.strip()}")
-            # Ensure the script execution is complete
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status == 0:
-                print(f"[SLICER TRACTO]Script executed successfully.")
-            else:
-                print(f"[SLICER TRACTO]Script execution failed with exit status {exit_status}.")
+            self.remoteCache().evict()
         except Exception as e:
-            print(f"[SLICER TRACTO]Error during script execution: {e}")
+            print(f"[SLICER TRACTO]Error during remote cache eviction: {e}")
+
+    def create_job_workspace(self, jobFolder):
+        """
+        Create a per-run workspace (`Jobs/<subject>_<timestamp>` with Scripts,
+        Input and Output), so runs do not overwrite each other's inputs and
+        outputs. Inputs in it are symlinks into the blob cache.
+        """
+        runRemoteCommand(self.ssh_client, f"mkdir -p {jobFolder}/Scripts {jobFolder}/Input {jobFolder}/Output")
+
+    def download_files(self, pairs):
+        """Download `(remote path, local path)` pairs concurrently, compressed and resumable."""
+        try:
+            FileTransfer(self.ssh_client).downloadMany(pairs)
+        except Exception as e:
+            print(f"[SLICER TRACTO][ERROR]Error during download: {e}")
+            raise
+    
+    def job_backend(self):
+        return jobBackend(configuration.scheduler, queue=configuration.scheduler_queue,
+                          account=configuration.scheduler_account)
 
-    def execute(self, subjectName, algo, folderPath):
-        start_time = time.time()  # Start the timer at the beginning of the function
+    def session(self):
+        """The connected SSH client; used by the job queue's worker thread."""
         self.connect()
-        # Remote paths
-        # Execute algorithm if 'algo1' is selected
+        if not self.ssh_status:
+            raise ConnectionError(f"Cannot connect to {self.hostname}")
+        return self.ssh_client
+
+    def submit_file(self, name, remote_path, job_folder, prepare=None, collect=None, onFinished=None,
+                    resources=None):
+        """
+        Run a remote script as a detached job and return its id right away.
+
+        `prepare` (upload) and `collect` (download) run on the job queue's
+        worker thread, `onFinished(job)` on the main thread (see `remoteJobs`).
+        The script runs through `configuration.scheduler` with the requested
+        `resources` (see `jobSchedulers`).
+        Every job has its own workspace, so jobs of this manager run
+        concurrently.
+        """
+        conda_command = f"conda activate {self.conda_env} && " if self.conda_env else ""
+        job = RemoteJob(name=name, command=f"{conda_command}python3 {remote_path}", folder=job_folder,
+                        connect=self.session, prepare=prepare, collect=collect, onFinished=onFinished,
+                        backend=self.job_backend(), resources=resources)
+        return remoteJobQueue().submit(job)
+
+    def execute(self, subjectName, algo, folderPath, onFinished=None):
+        """Submit the tractography of a subject as a remote job; returns the job id."""
+        if algo == "TRLF":
+            return self.executeTRLF(subjectName, folderPath, onFinished=onFinished)
+
+        jobFolder = f"{self.remoteJobsFolder}/{subjectName}_{int(time.time())}"
+        remoteInputFolder = jobFolder + "/Input"
+        remoteOutputFolder = jobFolder + "/Output"
+
         if algo == 'dipy':
-            
             fodfFilePath, approxMaskPathFilePath = self.getDipyInputs(folderPath=folderPath)
-            
-            remoteFodfFilePath = self.remoteInputFolder + "/sample_fodf.nii"
-            remoteApproxMaskPathFilePath = self.remoteInputFolder + "/sample_approx_mask.nii"
-
-            # Upload FODF file
-            print("Uploading FODF file...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=fodfFilePath, remote_path=remoteFodfFilePath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload FODF file: {upload_end_time - upload_start_time:.2f} seconds")
-
-            # Upload Approximate Mask file
-            print("Uploading Approximate Mask file...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=approxMaskPathFilePath, remote_path=remoteApproxMaskPathFilePath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload Approximate Mask file: {upload_end_time - upload_start_time:.2f} seconds")
+            inputs = [(fodfFilePath, remoteInputFolder + "/sample_fodf.nii"),
+                      (approxMaskPathFilePath, remoteInputFolder + "/sample_approx_mask.nii")]
+            scriptName = "dipyAlgo.py"
+            # Imported by the script, which keeps the seeding mask in memory and generates the seeds lazily
+            modules = ["asyncWriter.py", "seedingMask.py", "seedGenerator.py"]
+            cpus = 1
 
-        
-            localAlgoPath = os.path.join(self.algoFolderPath, "dipyAlgo.py")
-            remoteAlgoPath = self.remoteScriptsFolder + "/dipyAlgo.py"
-            
-            print("Uploading algorithm script...")
-            upload_start_time = time.time()
-            self.upload_file(local_path=localAlgoPath, remote_path=remoteAlgoPath)
-            upload_end_time = time.time()
-            print(f"Time taken to upload algorithm script: {upload_end_time - upload_start_time:.2f} seconds")
-
-            print("Running algorithm script...")
-            run_start_time = time.time()
-            self.run_file(remote_path=remoteAlgoPath)
-            run_end_time = time.time()
-            print(f"Time taken to execute algorithm: {run_end_time - run_start_time:.2f} seconds")
-
-            # Define paths for seeding mask and trk files
-            localSeddingMaskPath = os.path.join(self.localOutputFolder, "SeedingMask", f"{subjectName}_seeding_mask.nii")
-            localTrkPath = os.path.join(self.localOutputFolder, "SeedingMask", f"{subjectName}_trk.trk")
-            remoteSeddingMaskPath = self.remoteOutputFolder + "/sample_seeding_mask.nii"
-            remoteTrkPath = self.remoteOutputFolder + "/sample_trk.trk" 
-
-            # Download Seeding Mask
-            print("Downloading Seeding Mask...")
-            download_start_time = time.time()
-            self.download_file(local_path=localSeddingMaskPath, remote_path=remoteSeddingMaskPath)
-            download_end_time = time.time()
-            print(f"Time taken to download Seeding Mask: {download_end_time - download_start_time:.2f} seconds")
-
-            # Download TRK file
-            print("Downloading TRK file...")
-            download_start_time = time.time()
-            self.download_file(local_path=localTrkPath, remote_path=remoteTrkPath)
-            download_end_time = time.time()
-            print(f"Time taken to download TRK file: {download_end_time - download_start_time:.2f} seconds")
-                
-        
         elif algo == "PFT":
-            
             localHardiFName, localHardiBvalFName, localHardiBvecFName, localFPveCsf, localFPveGm, localFPveWm, localBundleMask  = self.getPFTInputs(folderPath=folderPath)
-            remoteHardiFName = self.remoteInputFolder + "/sample___dwi.nii.gz"
-            remoteHardiBvalFName = self.remoteInputFolder + "/sample__dwi.bval"
-            remoteHardiBvecFName = self.remoteInputFolder + "/sample__dwi.bvec"
-            remoteFPveCsf = self.remoteInputFolder + "/sample_pve_0.nii.gz"
-            remoteFPveGm = self.remoteInputFolder + "/sample_pve_1.nii.gz"
-            remoteFPveWm = self.remoteInputFolder + "/sample_pve_2.nii.gz"
-            remoteBundleMask = self.remoteInputFolder + "/sample_aligned.nii.gz"
-            
-            self.upload_file(local_path=localHardiFName, remote_path=remoteHardiFName)
-            self.upload_file(local_path=localHardiBvalFName, remote_path=remoteHardiBvalFName)
-            self.upload_file(local_path=localHardiBvecFName, remote_path=remoteHardiBvecFName)
-            self.upload_file(local_path=localFPveCsf, remote_path=remoteFPveCsf)
-            self.upload_file(local_path=localFPveGm, remote_path=remoteFPveGm)
-            self.upload_file(local_path=localFPveWm, remote_path=remoteFPveWm)
-            self.upload_file(local_path=localBundleMask, remote_path=remoteBundleMask)
-
-            localAlgoPath = os.path.join(self.algoFolderPath, "pftAlgo.py")
-            remoteAlgoPath = self.remoteScriptsFolder + "/pftAlgo.py"
-            
-            self.upload_file(local_path=localAlgoPath, remote_path=remoteAlgoPath)
-            self.run_file(remote_path=remoteAlgoPath)
-
-            # Define paths for seeding mask and trk files
-            localSeddingMaskPath = os.path.join(self.localOutputFolder, "SeedingMask", f"{subjectName}_seeding_mask.nii")
-            localTrkPath = os.path.join(self.localOutputFolder, "SeedingMask", f"{subjectName}_trk.trk")
-            remoteSeddingMaskPath = self.remoteOutputFolder + "/sample_seeding_mask.nii"
-            remoteTrkPath = self.remoteOutputFolder + "/sample_trk.trk" 
-
-            # Download Seeding Mask
-            print("Downloading Seeding Mask...")
-            download_start_time = time.time()
-            self.download_file(local_path=localSeddingMaskPath, remote_path=remoteSeddingMaskPath)
-            download_end_time = time.time()
-            print(f"Time taken to download Seeding Mask: {download_end_time - download_start_time:.2f} seconds")
+            inputs = [(localHardiFName, remoteInputFolder + "/sample___dwi.nii.gz"),
+                      (localHardiBvalFName, remoteInputFolder + "/sample__dwi.bval"),
+                      (localHardiBvecFName, remoteInputFolder + "/sample__dwi.bvec"),
+                      (localFPveCsf, remoteInputFolder + "/sample_pve_0.nii.gz"),
+                      (localFPveGm, remoteInputFolder + "/sample_pve_1.nii.gz"),
+                      (localFPveWm, remoteInputFolder + "/sample_pve_2.nii.gz"),
+                      (localBundleMask, remoteInputFolder + "/sample_aligned.nii.gz")]
+            # The script tracks on the FODF of the subject when there is one instead of fitting the CSD
+            localFodf = self.getPFTFodf(folderPath, localHardiFName, localHardiBvalFName, localHardiBvecFName)
+            if localFodf:
+                fodfName = "sample_fodf.nii.gz" if localFodf.endswith(".gz") else "sample_fodf.nii"
+                inputs.append((localFodf, remoteInputFolder + "/" + fodfName))
+            scriptName = "pftAlgo.py"
+            # Imported by the script, which tracks seed chunks on all the CPUs of the job
+            modules = ["parallelTracking.py", "pmfCache.py", "resourcePlanner.py", "seedGenerator.py",
+                       "trackingFodf.py"]
+            cpus = PFT_JOB_CPUS
 
-            # Download TRK file
-            print("Downloading TRK file...")
-            download_start_time = time.time()
-            self.download_file(local_path=localTrkPath, remote_path=remoteTrkPath)
-            download_end_time = time.time()
-            print(f"Time taken to download TRK file: {download_end_time - download_start_time:.2f} seconds")
-
-        elif algo == "TRLF":
-
-            trlf_model_load_path, offline_trajectories, input_fodf_signal, seeding_mask, tracking_mask, bundle_mask, peaks, reference_file_fa = self.getTRLFInputs(folderPath=folderPath)
+        else:
+            print(f"[SLICER TRACTO][ERROR]Unsupported algorithm: {algo}")
+            return None
 
-            tracker = Tract_RLFormer()
+        localAlgoPath = os.path.join(self.algoFolderPath, scriptName)
+        remoteAlgoPath = jobFolder + "/Scripts/" + scriptName
 
-            tracker.setTrlfModelPath(trlf_model_load_path)  
-            tracker.setOfflineTrajectoriesPath(offline_trajectories)  
-            tracker.setFodfPath(input_fodf_signal)  
-            tracker.setSeedingMaskPath(seeding_mask)  
-            tracker.setTrackingMaskPath(tracking_mask)  
-            tracker.setBundleMaskPath(bundle_mask)  
-            tracker.setPeaksPath(peaks)  
-            tracker.setReferenceFAPath(reference_file_fa)  
-            tracker.setOutputDirPath(os.path.join(self.localOutputFolder, f"{subjectName}_trk.trk"))  
+        # Define paths for seeding mask and trk files
+        localSeddingMaskPath = os.path.join(self.localOutputFolder, "SeedingMask", f"{subjectName}_seeding_mask.nii")
+        localTrkPath = os.path.join(self.localOutputFolder, "SeedingMask", f"{subjectName}_trk.trk")
+        remoteSeddingMaskPath = remoteOutputFolder + "/sample_seeding_mask.nii"
+        remoteTrkPath = remoteOutputFolder + "/sample_trk.trk"
 
-            tracker.runTracking()
-        
+        def prepare(client):
+            print("Uploading inputs and algorithm script...")
+            upload_start_time = time.time()
+            self.create_job_workspace(jobFolder)
+            self.upload_files(inputs)
+            self.upload_file(localAlgoPath, remoteAlgoPath)
+            for module in modules:
+                self.upload_file(os.path.join(self.commonFolderPath, module), jobFolder + "/Scripts/" + module)
+            upload_end_time = time.time()
+            print(f"Time taken to upload inputs: {upload_end_time - upload_start_time:.2f} seconds")
 
-        # Print total time taken for the entire process
-        end_time = time.time()
-        print(f"Total time taken: {end_time - start_time:.2f} seconds")
+        def collect(client):
+            print("Downloading Seeding Mask and TRK file...")
+            download_start_time = time.time()
+            self.download_files([(remoteSeddingMaskPath, localSeddingMaskPath), (remoteTrkPath, localTrkPath)])
+            download_end_time = time.time()
+            print(f"Time taken to download outputs: {download_end_time - download_start_time:.2f} seconds")
+            self.evict_remote_cache()
+            try:
+                self.remoteCache().evictWorkspaces(self.remoteJobsFolder)
+            except Exception as e:
+                print(f"[SLICER TRACTO]Error during remote workspace eviction: {e}")
+
+        resources = estimateResources([localPath for localPath, _ in inputs], cpus=cpus)
+        return self.submit_file(subjectName, remoteAlgoPath, jobFolder, prepare=prepare, collect=collect,
+                                onFinished=onFinished, resources=resources)
+
+    def executeTRLF(self, subjectName, folderPath, onFinished=None):
+        trlf_model_load_path, offline_trajectories, input_fodf_signal, seeding_mask, tracking_mask, bundle_mask, peaks, reference_file_fa = self.getTRLFInputs(folderPath=folderPath)
+
+        tracker = Tract_RLFormer()
+
+        tracker.setTrlfModelPath(trlf_model_load_path)
+        tracker.setOfflineTrajectoriesPath(offline_trajectories)
+        tracker.setFodfPath(input_fodf_signal)
+        tracker.setSeedingMaskPath(seeding_mask)
+        tracker.setTrackingMaskPath(tracking_mask)
+        tracker.setBundleMaskPath(bundle_mask)
+        tracker.setPeaksPath(peaks)
+        tracker.setReferenceFAPath(reference_file_fa)
+        tracker.setOutputDirPath(os.path.join(self.localOutputFolder, f"{subjectName}_trk.trk"))
+
+        return tracker.runTracking(name=subjectName, onFinished=onFinished)
@@ -1,5 +1,6 @@
 from abc import ABC
 import os
+from resultStore import ResultStore
 class BaseManager(ABC):
     def getDipyInputs(self, folderPath):
         fodf_path = None
@@ -10,7 +11,7 @@ class BaseManager(ABC):
             file_path = os.path.join(folderPath, file_name)
 
             # Check if the current file is a .nii file
-            if file_name.endswith("fodf.nii"):
+            if file_name.endswith(("fodf.nii", "fodf.nii.gz")):
                 fodf_path = file_path
             elif file_name.endswith("approximated_mask.nii"):
                 mask_path = file_path
@@ -18,11 +19,34 @@ class BaseManager(ABC):
             # Stop searching if both files are found
             if fodf_path and mask_path:
                 break
+        if fodf_path is None:
+            fodf_path = self.findStoredFodf(folderPath)
         if fodf_path and mask_path:
             print("[SLICER TRACTO] FODF and MASK file found")
         
         return fodf_path, mask_path
 
+    def findStoredFodf(self, folderPath):
+        """FODF computed earlier by the Fodf module from the DWI of this folder, looked up in the result store."""
+        inputPaths = {}
+        for file_name in os.listdir(folderPath):
+            file_path = os.path.join(folderPath, file_name)
+            if file_name.endswith("dwi.nii"):
+                inputPaths["dwi"] = file_path
+            elif file_name.endswith("wm.nii"):
+                inputPaths["wm_mask"] = file_path
+            elif file_name.endswith(".bval"):
+                inputPaths["bval"] = file_path
+            elif file_name.endswith(".bvec"):
+                inputPaths["bvec"] = file_path
+
+        if "dwi" not in inputPaths:
+            return None
+        fodf_path = ResultStore().findOutput("fodf", inputPaths=inputPaths)
+        if fodf_path:
+            print(f"[SLICER TRACTO] FODF found in the result store: {fodf_path}")
+        return fodf_path
+
     def getPFTInputs(self, folderPath):
         hardiFName = None
         hardiBvalFName = None
@@ -54,7 +78,26 @@ class BaseManager(ABC):
             print("[SLICER TRACTO] one of the file not found")
         else:
             print("[SLICER TRACTO] Files Found")
-        return hardiFName, hardiBvalFName, hardiBvecFName, FPveCsf, FPveGm, FPveWm, BundleMask  
+        return hardiFName, hardiBvalFName, hardiBvecFName, FPveCsf, FPveGm, FPveWm, BundleMask
+
+    def getPFTFodf(self, folderPath, hardiFName, hardiBvalFName, hardiBvecFName):
+        """
+        FODF the PFT can track on instead of fitting the CSD again: a `*fodf.nii(.gz)`
+        in the folder, or the one the Fodf module computed from the same DWI,
+        looked up in the result store. None when there is neither.
+        """
+        for file_name in os.listdir(folderPath):
+            if file_name.endswith(("fodf.nii", "fodf.nii.gz")):
+                print("[SLICER TRACTO] FODF file found")
+                return os.path.join(folderPath, file_name)
+
+        if hardiFName is None:
+            return None
+        fodf_path = ResultStore().findOutput("fodf", inputPaths={"dwi": hardiFName, "bval": hardiBvalFName,
+                                                                 "bvec": hardiBvecFName})
+        if fodf_path:
+            print(f"[SLICER TRACTO] FODF found in the result store: {fodf_path}")
+        return fodf_path
 
     def getTRLFInputs(self, folderPath):
         trlf_model_load_path = None
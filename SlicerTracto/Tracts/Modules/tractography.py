@@ -7,8 +7,7 @@ sibling_folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '.
 if sibling_folder_path not in sys.path:
     sys.path.append(sibling_folder_path)
 
-from scilpy.reconst.utils import (find_order_from_nb_coeff,
-                                    get_maximas)
+from scilpy.reconst.utils import find_order_from_nb_coeff
 from scilpy.io.image import get_data_as_mask
 from scilpy.tracking.utils import get_theta
 
@@ -37,7 +36,13 @@ import numpy as np
 import warnings
 import nibabel as nib
 from nibabel.streamlines.tractogram import LazyTractogram
+from parallelTracking import trackToTrk, DEFAULT_SEEDS_PER_CHUNK
+from asyncWriter import AsyncWriter
+from seedingMask import thresholdMask
+from seedGenerator import SeedChunks
+from peakExtraction import shToPeaks, peaksToIndices
 from scripts.scil_frf_ssst import main as scil_frf_ssst_main
+from streamlineModels import loadTrkAsModelNode
 import slicer.util
 import slicer
 import vtk
@@ -56,6 +61,14 @@ SEED = None
 SAVE_SEEDS = False
 FILETYPE = nib.streamlines.TrkFile
 COMPRESS : float = 0.0
+NB_PROCESSES = None  # all cores
+SEEDS_PER_CHUNK : int = DEFAULT_SEEDS_PER_CHUNK
+# Track on a cached PMF volume (SH evaluated once on the sphere) instead of the SH, when it fits in memory
+SH_TO_PMF = True
+# Only report the seed count and a memory/time estimate (tracking a few seeds), without tracking
+DRY_RUN = False
+# Also write the thresholded seeding mask to `seedingMaskPath` (in the background, tracking does not read it)
+SAVE_SEEDING_MASK = False
 SEEDING_MASK_FILE_PATH: str = "C:/Users/HP/Documents/MTP/Slicer-Task/Final Modules/Results/sub_1061_seeding_mask.nii"
 DEFAULT_TRK_FILE_NAME = "result.trk"
 DEFAULt_VTK_FILE_NAME = "result.vtk"
@@ -71,6 +84,7 @@ class Tractography:
         self.seedingMaskPath = SEEDING_MASK_FILE_PATH
         self.outputText = None
         self.output_trk_path = None
+        self.exportVtk: bool = False
 
     @staticmethod
     def _isValidPath(path: str) -> bool:
@@ -102,6 +116,11 @@ class Tractography:
         else:
             raise FileNotFoundError(f"Invalid trk path: {path}")
 
+    def set_exportVtk(self, export: bool):
+        """Enable or disable the background .vtk export when visualizing."""
+        self.exportVtk = bool(export)
+        print(f"Export VTK set to: {self.exportVtk}")
+
     def set_stepSize(self, step: float):
         """Set the step size with validation."""
         step = float(step)
@@ -118,9 +137,12 @@ class Tractography:
 
     # Placeholder for generate, and visualize methods
     def generateTrk(self):
-        self._create_binary_mask()
-        mask_img = nib.load(self.seedingMaskPath)
-        mask_data = get_data_as_mask(mask_img, dtype=bool)
+        with AsyncWriter() as writer:
+            self._generateTrk(writer)
+
+    def _generateTrk(self, writer):
+        # One array for the seeds and the stopping criterion; the saved copy is a side output
+        mask_data, seed_img = self._create_binary_mask(writer if SAVE_SEEDING_MASK else None)
 
         odf_sh_img = nib.load(self.fodfPath)
         if not np.allclose(np.mean(odf_sh_img.header.get_zooms()[:3]),
@@ -140,59 +162,27 @@ class Tractography:
 
         voxel_size = odf_sh_img.header.get_zooms()[0]
         vox_step_size = self.stepSize / voxel_size
-        seed_img = nib.load(self.seedingMaskPath)
-        seeds = track_utils.random_seeds_from_mask(
-            seed_img.get_fdata(dtype=np.float32),
-            np.eye(4),
-            seeds_count=nb_seeds,
-            seed_count_per_voxel=seed_per_vox,
-            random_seed=None)
-
-        max_steps = int(MAX_LENGTH / self.stepSize) + 1
-        streamlines_generator = LocalTracking(
-            self._get_direction_getter(),
-            BinaryStoppingCriterion(mask_data),
-            seeds, np.eye(4),
-            step_size=vox_step_size, max_cross=1,
-            maxlen=max_steps,
-            fixedstep=True, return_all=True,
-            random_seed=SEED,
-            save_seeds=SAVE_SEEDS)
-        
-        scaled_min_length = MIN_LENGTH / voxel_size
-        scaled_max_length = MAX_LENGTH / voxel_size
-
-        if SAVE_SEEDS:
-            filtered_streamlines, seeds = \
-                zip(*((s, p) for s, p in streamlines_generator
-                    if scaled_min_length <= length(s) <= scaled_max_length))
-            data_per_streamlines = {'seeds': lambda: seeds}
-        else:
-            filtered_streamlines = \
-                (s for s in streamlines_generator
-                if scaled_min_length <= length(s) <= scaled_max_length)
-            data_per_streamlines = {}
-
-        if COMPRESS:
-            filtered_streamlines = (
-                compress_streamlines(s, COMPRESS)
-                for s in filtered_streamlines)
+        # Generated chunk by chunk while tracking, deterministic for a given SEED
+        seeds = SeedChunks.random(mask_data, np.eye(4), SEEDS_PER_CHUNK, nbSeeds=nb_seeds,
+                                  perVoxel=seed_per_vox, randomSeed=SEED)
 
-        tractogram = LazyTractogram(lambda: filtered_streamlines,
-                                    data_per_streamlines,
-                                    affine_to_rasmm=seed_img.affine)
-
-        
-        reference = get_reference_info(seed_img)
-        header = create_tractogram_header(FILETYPE, *reference)
-
-        # Use generator to save the streamlines on-the-fly
         if self.trkPath:
             self.output_trk_path = os.path.join(self.trkPath, DEFAULT_TRK_FILE_NAME)
         else:
             self.output_trk_path = os.path.join(DEFAULT_DIR, DEFAULT_TRK_FILE_NAME)
-        
-        nib.streamlines.save(tractogram, self.output_trk_path, header=header)
+
+        # Seeds are tracked in chunks by a pool of processes and streamed to the file
+        tracked = trackToTrk(self.output_trk_path, seed_img, self._get_direction_arrays(), mask_data, seeds,
+                   self.algo, get_theta(THETA, self.algo), vox_step_size,
+                   int(MAX_LENGTH / self.stepSize) + 1,
+                   MIN_LENGTH / voxel_size, MAX_LENGTH / voxel_size,
+                   sfThreshold=SF_THRESHOLD, shBasis=SH_BASIS, sphere=SPHERE,
+                   randomSeed=SEED, saveSeeds=SAVE_SEEDS, compress=COMPRESS,
+                   nbProcesses=NB_PROCESSES, seedsPerChunk=SEEDS_PER_CHUNK, shToPmf=SH_TO_PMF,
+                   fileType=FILETYPE, dryRun=DRY_RUN)
+        if DRY_RUN:
+            self.outputText.append(f'Dry run: {tracked} \n')
+            return
         self.outputText.append(f'Trk Genererated Successfully \n (location: {self.output_trk_path}) \n')
 
     def visualizeTrk(self):
@@ -200,34 +190,24 @@ class Tractography:
         if self.output_trk_path == None:
             print("Generate Trk First...")
             return
-        tractogram = load_tractogram(self.output_trk_path, reference='same', bbox_valid_check=False, to_space=Space.RASMM)
-        print(" tractography Visualization...jdsj")
-        if self.trkPath:
-            output_vtk_path = os.path.join(self.trkPath, DEFAULt_VTK_FILE_NAME)
-        else:
-            output_vtk_path = os.path.join(DEFAULT_DIR, DEFAULt_VTK_FILE_NAME)
-        
-        self._saveStreamlinesVTK(tractogram.streamlines, output_vtk_path )
-        reader = vtkPolyDataReader()
-        reader.SetFileName(output_vtk_path)
-        reader.Update()
-
-        polydata = reader.GetOutput()
-
-        streamline_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
-        streamline_node.SetAndObservePolyData(polydata)
-
-        display_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode")
-        streamline_node.SetAndObserveDisplayNodeID(display_node.GetID())
+        print(" tractography Visualization...")
+        output_vtk_path = None
+        if self.exportVtk:
+            if self.trkPath:
+                output_vtk_path = os.path.join(self.trkPath, DEFAULt_VTK_FILE_NAME)
+            else:
+                output_vtk_path = os.path.join(DEFAULT_DIR, DEFAULt_VTK_FILE_NAME)
 
-        display_node.SetColor(0, 1, 0)  
-        display_node.SetOpacity(1.0)  
+        # Display straight from memory, the optional .vtk export is written in the background
+        streamline_node, display_node, _ = loadTrkAsModelNode(self.output_trk_path, exportPath=output_vtk_path)
 
         slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveVolumeID(streamline_node.GetID())
         slicer.app.applicationLogic().PropagateVolumeSelection()
         slicer.app.layoutManager().resetThreeDViews()   
         print("Done Visualization")
-        self.outputText.append(f' VTK Files Genererated Succesfully (location : {output_vtk_path}) \n Visualization Complete \n')
+        if output_vtk_path:
+            self.outputText.append(f' VTK File Export Started (location : {output_vtk_path}) \n')
+        self.outputText.append(' Visualization Complete \n')
     
     # Internal Functions
     def _get_b_matrix(self, order, sphere, sh_basis_type, return_all=False):
@@ -240,21 +220,26 @@ class Tractography:
             return b_matrix, m, n
         return b_matrix
 
-    def _create_binary_mask(self, threshold=0.5):
-        # Load the image
-        img = nib.load(self.approxMaskPath)
-
-        # Get the image data
-        data = img.get_fdata()
+    def _create_binary_mask(self, writer=None, threshold=0.5):
+        """Seeding mask (bool) and its image; saved to `seedingMaskPath` by `writer` when given."""
+        mask_data, mask_img = thresholdMask(nib.load(self.approxMaskPath), threshold)
+        if writer is not None:
+            writer.saveNifti(mask_img.dataobj, mask_img.affine, self.seedingMaskPath, header=mask_img.header)
+        return mask_data, mask_img
 
-        # Threshold the data to create a binary mask
-        mask_data = (data > threshold).astype(np.uint8)
+    def _get_direction_arrays(self):
+        """Arrays the tracking workers build their direction getter from (see parallelTracking)."""
+        if self.algo == 'eudx':
+            dg = self._get_direction_getter()
+            return {'peak_dirs': dg.peak_dirs, 'peak_values': dg.peak_values, 'peak_indices': dg.peak_indices}
 
-        # Create a new nibabel image with the binary mask
-        mask_img = nib.Nifti1Image(mask_data, img.affine, img.header)
-        mask_img.set_data_dtype(np.uint8)
-        # Save the new image
-        nib.save(mask_img, SEEDING_MASK_FILE_PATH)
+        odf_data = nib.load(self.fodfPath).get_fdata(dtype=np.float32)
+        non_zeros_count = np.count_nonzero(np.sum(odf_data, axis=-1))
+        non_first_val_count = np.count_nonzero(np.argmax(odf_data, axis=-1))
+        if non_first_val_count / non_zeros_count > 0.5:
+            logging.warning('Input detected as peaks. Input should be'
+                            'fodf for det/prob, verify input just in case.')
+        return {'odf': odf_data}
 
     def _get_direction_getter(self):
         odf_data = nib.load(self.fodfPath).get_fdata(dtype=np.float32)
@@ -279,7 +264,6 @@ class Tractography:
         elif self.algo == 'eudx':
             # Code for type EUDX. We don't use peaks_from_model
             # because we want the peaks from the provided sh.
-            odf_shape_3d = odf_data.shape[:-1]
             dg = PeaksAndMetrics()
             dg.sphere = sphere
             dg.ang_thr = theta
@@ -289,77 +273,19 @@ class Tractography:
             # fodf are always around 0.15 and peaks around 0.75
             if non_first_val_count / non_zeros_count > 0.5:
                 logging.info('Input detected as peaks.')
-                nb_peaks = odf_data.shape[-1] // 3
-                slices = np.arange(0, 15+1, 3)
-                peak_values = np.zeros(odf_shape_3d+(nb_peaks,))
-                peak_indices = np.zeros(odf_shape_3d+(nb_peaks,))
-
-                for idx in np.argwhere(np.sum(odf_data, axis=-1)):
-                    idx = tuple(idx)
-                    for i in range(nb_peaks):
-                        peak_values[idx][i] = np.linalg.norm(
-                            odf_data[idx][slices[i]:slices[i+1]], axis=-1)
-                        peak_indices[idx][i] = sphere.find_closest(
-                            odf_data[idx][slices[i]:slices[i+1]])
-
+                peak_values, peak_indices = peaksToIndices(odf_data, sphere)
                 dg.peak_dirs = odf_data
             else:
                 logging.info('Input detected as fodf.')
-                npeaks = 5
-                peak_dirs = np.zeros((odf_shape_3d + (npeaks, 3)))
-                peak_values = np.zeros((odf_shape_3d + (npeaks, )))
-                peak_indices = np.full((odf_shape_3d + (npeaks, )), -1, dtype='int')
                 b_matrix = self._get_b_matrix(
                     find_order_from_nb_coeff(odf_data), sphere, SH_BASIS)
-
-                for idx in np.argwhere(np.sum(odf_data, axis=-1)):
-                    idx = tuple(idx)
-                    directions, values, indices = get_maximas(odf_data[idx],
-                                                            sphere, b_matrix,
-                                                            SF_THRESHOLD, 0)
-                    if values.shape[0] != 0:
-                        n = min(npeaks, values.shape[0])
-                        peak_dirs[idx][:n] = directions[:n]
-                        peak_values[idx][:n] = values[:n]
-                        peak_indices[idx][:n] = indices[:n]
-
+                # All voxels at once: one SH to SF product per chunk of voxels
+                peak_dirs, peak_values, peak_indices = shToPeaks(
+                    odf_data, sphere, b_matrix, SF_THRESHOLD, 0, npeaks=5,
+                    nbThreads=NB_PROCESSES)
                 dg.peak_dirs = peak_dirs
 
             dg.peak_values = peak_values
             dg.peak_indices = peak_indices
 
             return dg
-    
-    def _saveStreamlinesVTK(self, streamlines, pStreamlines):
-        
-        polydata = vtk.vtkPolyData()
-
-        lines = vtk.vtkCellArray()
-        points = vtk.vtkPoints()
-
-        ptCtr = 0
-
-        for i, streamline in enumerate(streamlines):
-            if (i % 10000) == 0:
-                print(f"{i}/{len(streamlines)}")
-            
-            line = vtk.vtkLine()
-            line.GetPointIds().SetNumberOfIds(len(streamline))
-
-            for j, point in enumerate(streamline):
-                points.InsertNextPoint(point)
-                line.GetPointIds().SetId(j, ptCtr)
-                ptCtr += 1
-
-            lines.InsertNextCell(line)
-
-        polydata.SetLines(lines)
-        polydata.SetPoints(points)
-
-        writer = vtk.vtkPolyDataWriter()
-        writer.SetFileName(pStreamlines)
-        writer.SetInputData(polydata)
-        writer.Write()
-
-        print(f"Wrote streamlines to {writer.GetFileName()}")
-          
\ No newline at end of file
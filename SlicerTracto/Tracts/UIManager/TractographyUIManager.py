@@ -8,6 +8,10 @@ import vtk
 from dipy.io.stateful_tractogram import Space
 import qt
 import numpy as np
+from streamlineModels import loadTrkAsModelNode, exportPolyDataAsync, createProgressCallback
+from tractogramStreaming import loadStreamlinesChunked
+from streamlineConversion import streamlinesToPolyData
+from streamlineLOD import StreamlineLOD, LOD_MODES, DEFAULT_POINT_BUDGET
 
 class TractographyUIManager:
     def __init__(self, ui, layout, uiWidget):
@@ -29,6 +33,11 @@ class TractographyUIManager:
         self.display_nodes = []
         self.index= 0
         self.overlayFilePath = None
+        self.exportVtk = False
+        self.lod = False
+        self.lodMode = LOD_MODES[0]
+        self.lodPointBudget = DEFAULT_POINT_BUDGET
+        self.lodControllers = []
         
 
         # UI connections
@@ -36,6 +45,14 @@ class TractographyUIManager:
         self.ui.generateTrkButton.connect("clicked(bool)", self.generateTrk)
         self.ui.visualizeTrkButton.connect("clicked(bool)", self.visualizeTrk)
         self.ui.overlayButton.connect("clicked(bool)", self.displayOverlayFile)
+        self.ui.showFullTractogramButton.connect("clicked(bool)", self.showFullTractogram)
+
+        # Check Boxes
+        self.ui.exportVtkCheckBox.connect("toggled(bool)", self.setExportVtk)
+        self.ui.lodCheckBox.connect("toggled(bool)", self.setLod)
+
+        # Spin Box
+        self.ui.lodPointBudgetSpinBox.valueChanged.connect(self.setLodPointBudget)
 
 
         # Paths
@@ -48,13 +65,16 @@ class TractographyUIManager:
         self.ui.selectComputationMethod.currentIndexChanged.connect(self.setComputationMethod)
         self.ui.selectAlgorithmTractography.currentIndexChanged.connect(self.setAlgo)
         self.ui.selectTrks.currentIndexChanged.connect(self.setTrk)
+        self.ui.lodModeComboBox.currentIndexChanged.connect(self.setLodMode)
         
         self._loadTrks()
     
     def generateTrk(self):
         if self.folderPath:
             print("[SLICER TRACTO]RUNNING...")
-            self.computationManager.route_request(method=self.computationMethod, algo=self.algo, subjectName=self.subjectName, folderPath=self.folderPath)
+            # SSH runs are remote jobs: the new trks are listed when the job ends
+            self.computationManager.route_request(method=self.computationMethod, algo=self.algo, subjectName=self.subjectName, folderPath=self.folderPath,
+                                                  onFinished=lambda job: self._loadTrks())
             self._loadTrks()
         else:
             print("[SLICER TRACTO][ERROR]Cannot file FODF or MASK file")
@@ -73,6 +93,36 @@ class TractographyUIManager:
         self.algo = self.algos[index]
         print(f"[SLICER TRACTO]Algorithm set to: {self.algo}")
     
+    def setExportVtk(self, checked:bool):
+        self.exportVtk = checked
+        print(f"[SLICER TRACTO]Export VTK set to: {self.exportVtk}")
+
+    def setLod(self, checked:bool):
+        self.lod = checked
+        print(f"[SLICER TRACTO]Level of detail set to: {self.lod}")
+
+    def setLodMode(self, index:int):
+        self.lodMode = LOD_MODES[index]
+        print(f"[SLICER TRACTO]Level of detail subset set to: {self.lodMode}")
+
+    def setLodPointBudget(self, value:int):
+        self.lodPointBudget = value
+        # Controllers of the same view share one budget: setting it on one rebalances all of them
+        for controller in self.lodControllers:
+            controller.setPointBudget(value)
+        print(f"[SLICER TRACTO]Level of detail point budget set to: {self.lodPointBudget}")
+
+    def showFullTractogram(self):
+        if not self.lodControllers:
+            print("[SLICER TRACTO]No level of detail tractogram displayed")
+            return
+        self.lodControllers[-1].showFull()
+
+    def cleanup(self):
+        for controller in self.lodControllers:
+            controller.cleanup()
+        self.lodControllers = []
+
     def setTrk(self, index:int):
         self.trkPath = self.trkPathList[index]
         print(f"[SLICER TRACTO]TRK set to: {self.trkPath}")
@@ -93,33 +143,35 @@ class TractographyUIManager:
         print(f"[SLICER TRACTO]f{trkList} TRKS added.")
 
     def visualizeTrk(self):
-        print(f"[SLICER TRACTO]Visualizing... {self.trkPath}")
-        time.sleep(5)
         print(f"[SLICER TRACTO]Visualizing... {self.trkPath}")
         if self.trkPath == None:
             print("[SLICER TRACTO]Generate Trk First...")
             return
-        tractogram = load_tractogram(self.trkPath, reference='same', bbox_valid_check=False, to_space=Space.RASMM)
         print(" Tractography Visualization...")
         vtk_file_name, ext = os.path.splitext(os.path.basename(self.trkPath)) 
-        output_vtk_path = os.path.join(self.vtkFolderPath, vtk_file_name+"_vtk.vtk")
-        
-        
-        self._saveStreamlinesVTK(tractogram.streamlines, output_vtk_path )
-        reader = vtkPolyDataReader()
-        reader.SetFileName(output_vtk_path)
-        reader.Update()
-
-        polydata = reader.GetOutput()
-
-        streamline_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
-        streamline_node.SetAndObservePolyData(polydata)
-
-        display_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelDisplayNode")
-        streamline_node.SetAndObserveDisplayNodeID(display_node.GetID())
-
-        display_node.SetColor(0, 1, 0)  
-        display_node.SetOpacity(1.0)  
+        output_vtk_path = None
+        if self.exportVtk:
+            output_vtk_path = os.path.join(self.vtkFolderPath, vtk_file_name+"_vtk.vtk")
+
+        progressDialog, progressCallback = createProgressCallback(f"Loading {vtk_file_name}")
+        try:
+            if self.lod:
+                # Show a subset first, refined as the camera settles; the full geometry is uploaded on request only
+                streamlines = loadStreamlinesChunked(self.trkPath, progressCallback=progressCallback)
+                # All LOD tractograms go to the first 3D view and share its point budget
+                viewNode = slicer.app.layoutManager().threeDWidget(0).mrmlViewNode()
+                controller = StreamlineLOD(streamlines, name=vtk_file_name, mode=self.lodMode, pointBudget=self.lodPointBudget,
+                                           viewNode=viewNode)
+                streamline_node, display_node = controller.start()
+                self.lodControllers.append(controller)
+                if output_vtk_path:
+                    exportPolyDataAsync(streamlinesToPolyData(streamlines), output_vtk_path)
+            else:
+                # The model node observes the in-memory polydata; the .vtk export (if any) runs in the background
+                streamline_node, display_node, _ = loadTrkAsModelNode(self.trkPath, name=vtk_file_name, exportPath=output_vtk_path,
+                                                                      progressCallback=progressCallback)
+        finally:
+            progressDialog.close()
         self.display_nodes.append(display_node)
         slicer.app.applicationLogic().GetSelectionNode().SetReferenceActiveVolumeID(streamline_node.GetID())
         slicer.app.applicationLogic().PropagateVolumeSelection()
@@ -147,40 +199,6 @@ class TractographyUIManager:
             self.display_nodes[index].SetOpacity(0.0)
             print("[SLICER TRACTO] Model Hidden")
 
-    def _saveStreamlinesVTK(self, streamlines, pStreamlines):
-        
-        polydata = vtk.vtkPolyData()
-
-        lines = vtk.vtkCellArray()
-        points = vtk.vtkPoints()
-
-        ptCtr = 0
-
-        for i, streamline in enumerate(streamlines):
-            if (i % 10000) == 0:
-                print(f"[SLICER TRACTO]{i}/{len(streamlines)}")
-            
-            line = vtk.vtkLine()
-            line.GetPointIds().SetNumberOfIds(len(streamline))
-
-            for j, point in enumerate(streamline):
-                points.InsertNextPoint(point)
-                line.GetPointIds().SetId(j, ptCtr)
-                ptCtr += 1
-
-            lines.InsertNextCell(line)
-
-        polydata.SetLines(lines)
-        polydata.SetPoints(points)
-
-        writer = vtk.vtkPolyDataWriter()
-        writer.SetFileName(pStreamlines)
-        writer.SetInputData(polydata)
-        writer.Write()
-
-        print(f"[SLICER TRACTO]Wrote streamlines to {writer.GetFileName()}")
-    
-
     def setOverlayPath(self, path:str):
         if not os.path.isfile(path):
             print("[SLICER TRACTO] Input path is not a file.")